@@ -37,7 +37,7 @@ setup(
     keywords=["Click", "UCSD Cloud CLI"],
     install_requires=requirements,
     packages=find_packages(),
-    package_data={'': ['data/cloudformation/*']},
+    package_data={'': ['data/cloudformation/*/*', 'data/lambda/*']},
     include_package_data=True,
     license="Private",
     classifiers=[
@@ -1,11 +1,46 @@
-from .logs import logs
-from .sec import sec
+import time
+_import_started = time.perf_counter()
+
+from . import profiling
 import click
+import importlib
 import os
+import threading
 
 data_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
 cf_data_dir = os.path.join(data_dir, 'cloudformation')
 
-cli = click.CommandCollection(sources=[logs])
+# (module, command group) of every command source - imported on the first command lookup, so the thin client (see client.py) can forward a
+# command to a running `serve` daemon without importing troposphere, awacs and boto3 first
+SOURCES = [('.logs', 'logs'), ('.sec', 'sec'), ('.templates', 'cli'), ('.server', 'cli')]
+
+
+class LazyCommandCollection(click.CommandCollection):
+    """CommandCollection importing its sources when a command is first looked up, counting the time taken as imports in the profile"""
+
+    def __init__(self, source_modules, **kwargs):
+        click.CommandCollection.__init__(self, sources=[], **kwargs)
+        self.source_modules = source_modules
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if not self.sources:
+                started = time.perf_counter()
+                self.sources = [getattr(importlib.import_module(module, __name__), name) for module, name in self.source_modules]
+                profiling.import_seconds += time.perf_counter() - started
+
+    def get_command(self, ctx, cmd_name):
+        self.load()
+        return click.CommandCollection.get_command(self, ctx, cmd_name)
+
+    def list_commands(self, ctx):
+        self.load()
+        return click.CommandCollection.list_commands(self, ctx)
+
+
+cli = LazyCommandCollection(SOURCES, params=profiling.PARAMS, callback=profiling.profile_options)
+
+profiling.import_seconds = time.perf_counter() - _import_started
 
 VERSION = '0.1.0'
@@ -1,6 +1,15 @@
+import sys
+
 from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.client import forward
 
 def main():
+    result = forward(sys.argv[1:])
+    if result is not None:
+        exit_code, stdout, stderr = result
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+        sys.exit(exit_code)
     cli()
 
 if __name__ == '__main__':
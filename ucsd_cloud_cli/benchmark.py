@@ -0,0 +1,120 @@
+"""Scaling benchmarks for the template generators. The log target template grows with the child account list - bucket policy statements,
+destination policy principals and Glue partition projection values are generated per account and region - so each generator is timed and
+traced across account and region counts, and the results compared against saved baselines to catch regressions. The larger account counts
+render templates past the CloudFormation size limits, so the size checks are left out of the rendering measured."""
+import gc
+import platform
+import time
+import tracemalloc
+
+from .logs.source import source_template, flow_log_template
+from .logs.target import target_template
+from .validator import template_json
+
+ACCOUNT_COUNTS = [1, 10, 100, 1000, 5000]
+REGION_COUNTS = [1, 4, 16]
+REGIONS = ['us-west-1', 'us-west-2', 'us-east-1', 'us-east-2', 'ca-central-1', 'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-central-1', 'eu-north-1',
+           'ap-northeast-1', 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2', 'ap-south-1', 'sa-east-1']
+METRICS = ['Seconds', 'PeakBytes', 'Blocks', 'OutputBytes']
+
+# Wall time depends on the machine and its load, so it gets a looser threshold than the memory and size metrics, and timings too short to
+# measure reliably are never reported as regressions
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_TIME_THRESHOLD = 0.5
+MIN_SECONDS = 0.05
+
+
+def _target(accounts, regions):
+    return target_template(accounts, regions, glue_catalog=True, flow_logs_to_s3=True)
+
+
+def _source(accounts, regions):
+    return source_template()
+
+
+def _flow_log(accounts, regions):
+    return flow_log_template(destination='s3')
+
+
+# name: (template builder taking account and region lists, whether the template depends on them)
+GENERATORS = {'target': (_target, True),
+              'source': (_source, False),
+              'flow_log': (_flow_log, False)}
+
+
+def account_ids(count):
+    return ['%012d' % (100000000000 + n) for n in range(count)]
+
+
+def cases(generators=None, account_counts=None, region_counts=None):
+    """(generator, accounts, regions) for every benchmark run - generators that don't take accounts or regions run once"""
+    account_counts = account_counts or ACCOUNT_COUNTS
+    region_counts = region_counts or REGION_COUNTS
+    result = []
+    for name in generators or sorted(GENERATORS):
+        if GENERATORS[name][1]:
+            result.extend((name, accounts, regions) for accounts in account_counts for regions in region_counts)
+        else:
+            result.append((name, 1, 1))
+    return result
+
+
+def measure(generator, accounts, regions, repeat=3):
+    """Build and render one template - the best wall time of `repeat` runs, then one traced run for the peak traced memory, the memory blocks
+    the template and its JSON hold when rendering finishes and the size of the JSON"""
+    build = GENERATORS[generator][0]
+    account_list, region_list = account_ids(accounts), REGIONS[:regions]
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        template_json(build(account_list, region_list), limits=False)
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline_blocks = len(tracemalloc.take_snapshot().traces)
+        template = build(account_list, region_list)
+        body = template_json(template, limits=False)
+        blocks = len(tracemalloc.take_snapshot().traces) - baseline_blocks
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'Generator': generator,
+            'Accounts': accounts,
+            'Regions': regions,
+            'Resources': len(template.resources),
+            'Seconds': round(min(timings), 4),
+            'PeakBytes': peak,
+            'Blocks': blocks,
+            'OutputBytes': len(body.encode('utf-8'))}
+
+
+def run(case_list, repeat=3, on_result=None):
+    """Measure every case, returning the results in the format baselines are saved in"""
+    results = []
+    for generator, accounts, regions in case_list:
+        results.append(measure(generator, accounts, regions, repeat))
+        if on_result:
+            on_result(results[-1])
+    return {'Python': platform.python_version(), 'Results': results}
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD, time_threshold=DEFAULT_TIME_THRESHOLD):
+    """Regressions of `current` against `baseline` as (case, metric, baseline value, current value) - metrics more than `threshold` (a
+    fraction, `time_threshold` for wall time) above the baseline value for the same generator, account and region count"""
+    previous = dict(((r['Generator'], r['Accounts'], r['Regions']), r) for r in baseline['Results'])
+    regressions = []
+    for result in current['Results']:
+        key = (result['Generator'], result['Accounts'], result['Regions'])
+        if key not in previous:
+            continue
+        for metric in METRICS:
+            old, new = previous[key][metric], result[metric]
+            limit = time_threshold if metric == 'Seconds' else threshold
+            if metric == 'Seconds' and new < MIN_SECONDS:
+                continue
+            if new > old * (1 + limit):
+                regressions.append((key, metric, old, new))
+    return regressions
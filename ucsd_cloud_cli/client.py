@@ -0,0 +1,142 @@
+"""Thin client for a running `serve` daemon. Before `ccli` imports any command, the arguments are sent to the daemon at CCLI_SERVER - a
+unix:// socket path or an http:// loopback address - or, when that isn't set, at the daemon's default socket if one exists. The daemon runs
+the command in its warm process and the client prints its output and exits with its exit code. The command runs locally instead whenever
+the daemon can't be reached or refuses it: a different package version, working directory or AWS/ccli environment, `serve` itself, commands
+that set environment variables for the whole process or refresh their output until interrupted, the global --profile options and interactive prompts (CLI_PROMPT). Requests carry the
+token the daemon wrote to a file only the current user can read, and commands run locally when there is none. Set CCLI_SERVER=off to always
+run locally. Only the standard library is imported here."""
+import http.client
+import json
+import os
+import socket
+import sys
+import urllib.parse
+
+SERVER_VARIABLE = 'CCLI_SERVER'
+OFF = 'off'
+# common.py imports boto3, so the cache directory is worked out again here
+DEFAULT_SOCKET = os.path.join(os.path.expanduser(os.getenv('CCLI_CACHE_DIR', os.path.join('~', '.ccli'))), 'serve.sock')
+# environment variables that change what a command does - the daemon only runs commands for clients with the same values
+ENVIRONMENT_PREFIXES = ('AWS_', 'CCLI_')
+LOCAL_COMMANDS = set(['serve'])
+# commands that set os.environ while they run, which every other command running in the daemon process would see
+ENVIRONMENT_COMMANDS = set([('firehose', 'bench'), ('kinesis', 'simulate'), ('response', 'replay')])
+# options that keep a command refreshing its output until interrupted - the daemon only returns output once a command exits
+STREAMING_OPTIONS = {'status': ('--watch',)}
+TOKEN_HEADER = 'X-Ccli-Token'
+CONNECT_TIMEOUT = 1.0
+# status the daemon refuses commands it can't run like a local run with
+REFUSED = 409
+# status the daemon answers requests without its token, or for another host, with
+FORBIDDEN = 403
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(CONNECT_TIMEOUT)
+        self.sock.connect(self.socket_path)
+        self.sock.settimeout(self.timeout)
+
+
+def server_address():
+    """The daemon address to use - CCLI_SERVER, or the default socket if a daemon created it - None when commands should run locally"""
+    address = os.getenv(SERVER_VARIABLE)
+    if address is None:
+        return 'unix://' + DEFAULT_SOCKET if os.path.exists(DEFAULT_SOCKET) else None
+    return None if address.strip().lower() in ('', OFF) else address
+
+
+def connection(address, timeout=None):
+    """An HTTP connection to the daemon at `address` - unix:///path/to/socket (or just the path) or http://host:port"""
+    parsed = urllib.parse.urlparse(address)
+    if parsed.scheme == 'http':
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+    if parsed.scheme not in ('', 'unix'):
+        raise ValueError('%s is neither a unix:// socket nor an http:// address' % address)
+    return UnixHTTPConnection(parsed.path if parsed.scheme else address, timeout=timeout)
+
+
+def token_path(address):
+    """The file the daemon at `address` keeps its token in - next to its Unix socket, or in the ccli cache directory for a TCP port"""
+    parsed = urllib.parse.urlparse(address)
+    if parsed.scheme == 'http':
+        return os.path.join(os.path.dirname(DEFAULT_SOCKET), 'serve-%d.token' % (parsed.port or 80))
+    return (parsed.path if parsed.scheme else address) + '.token'
+
+
+def read_token(address):
+    """The token of the daemon at `address`, None when it can't be read"""
+    try:
+        with open(token_path(address)) as f:
+            return f.read().strip() or None
+    except (OSError, ValueError):
+        return None
+
+
+def headers(address):
+    """The headers of a request to the daemon at `address`"""
+    return {'Content-Type': 'application/json', TOKEN_HEADER: read_token(address) or ''}
+
+
+def request(address, method, path, body=None, timeout=None):
+    """Send a request to the daemon, returning the status code and the decoded JSON response"""
+    conn = connection(address, timeout)
+    try:
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers(address))
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        conn.close()
+
+
+def environment():
+    """The environment variables a forwarded command has to see the same values of"""
+    return dict((name, value) for name, value in os.environ.items() if name.startswith(ENVIRONMENT_PREFIXES) and name != SERVER_VARIABLE)
+
+
+def forwardable(args):
+    """Whether a command line can run on the daemon - not `serve`, commands that set environment variables or refresh their output, the global --profile options or interactive prompts"""
+    if not args or os.getenv('CLI_PROMPT'):
+        return False
+    for index, arg in enumerate(args):
+        if arg.startswith('--profile'):
+            return False
+        if not arg.startswith('-'):
+            streaming = any(option.split('=')[0] in STREAMING_OPTIONS.get(arg, ()) for option in args[index + 1:])
+            return arg not in LOCAL_COMMANDS and tuple(args[index:index + 2]) not in ENVIRONMENT_COMMANDS and not streaming
+    return True
+
+
+def forward(args, address=None):
+    """Run the command line `args` on the daemon, returning (exit code, stdout, stderr) - None when the command should run locally"""
+    from . import VERSION
+    address = address or server_address()
+    if address is None or not forwardable(args) or read_token(address) is None:
+        return None
+    body = {'args': list(args), 'prog': os.path.basename(sys.argv[0]) or 'ccli', 'cwd': os.getcwd(), 'version': VERSION, 'environment': environment()}
+    try:
+        conn = connection(address)
+        conn.connect()
+    except (OSError, ValueError):
+        return None
+    # once the request is sent the command may have run, so it isn't run again locally
+    try:
+        conn.request('POST', '/run', json.dumps(body), headers(address))
+        response = conn.getresponse()
+        status, result = response.status, json.loads(response.read().decode('utf-8'))
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        return 1, '', 'Error: lost the connection to the ccli daemon at %s: %s\n' % (address, e)
+    finally:
+        conn.close()
+    if status in (REFUSED, FORBIDDEN):
+        return None
+    if status != 200:
+        return 1, '', 'Error: the ccli daemon at %s failed the command: %s\n' % (address, result.get('Error'))
+    return result['ExitCode'], result['Stdout'], result['Stderr']
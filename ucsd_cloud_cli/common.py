@@ -1,28 +1,63 @@
 import boto3
 import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+
+from . import profiling
+
+DEFAULT_REGIONS = ['us-west-1', 'us-west-2', 'us-east-1', 'us-east-2']
+
+data_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+lambda_data_dir = os.path.join(data_dir, 'lambda')
+
+# Metadata key serialize_template stores the template hashes under
+TEMPLATE_HASHES = 'ccli::TemplateHashes'
+
+cache_dir = os.path.expanduser(os.getenv('CCLI_CACHE_DIR', os.path.join('~', '.ccli')))
 
 
 def _get_session(profile_name):
     """Centralized logic for handling getting a boto3 session for a given profile"""
-    return boto3.Session(profile_name=profile_name)
+    return profiling.instrument(boto3.Session(profile_name=profile_name))
+
+
+def get_boto3_client(client_name, profile_name='default', region_name=None):
+    """Helper method for getting Boto3 client for a given profile (and optionally a region other than the profile's default)"""
+    with profiling.phase(profiling.BOTO3_SETUP):
+        session = _get_session(profile_name)
+        return session.client(client_name, region_name=region_name)
 
 
-def get_boto3_client(client_name, profile_name='default'):
-    """Helper method for getting Boto3 client for a given profile"""
-    session = _get_session(profile_name)
-    return session.client(client_name)
+def get_boto3_resource(resource_name, profile_name='default', region_name=None):
+    """Helper method for getting Boto3 resource for a given profile (and optionally a region other than the profile's default)"""
+    with profiling.phase(profiling.BOTO3_SETUP):
+        session = _get_session(profile_name)
+        return session.resource(resource_name, region_name=region_name)
 
 
-def get_boto3_resource(resource_name, profile_name='default'):
-    """Helper method for getting Boto3 resource for a given profile"""
-    session = _get_session(profile_name)
-    return session.resource(resource_name)
+def get_profile_names():
+    """Helper method returning the names of all profiles configured in the local AWS config/credentials files"""
+    return boto3.Session().available_profiles
+
+
+def get_profile_region_keys(profile_list=(), region_list=(), default_profiles=None):
+    """Helper method pairing every profile with every region as the (profile, region) keys commands work across. Profiles default to `default_profiles`, or every configured profile when that isn't given, and regions to DEFAULT_REGIONS"""
+    profile_list = profile_list or default_profiles or get_profile_names()
+    region_list = region_list or DEFAULT_REGIONS
+    return [(profile, region) for profile in profile_list for region in region_list]
+
+
+def get_boto3_clients(client_name, keys):
+    """Helper method for getting a Boto3 client per (profile, region) key. boto3 sessions aren't thread safe, so all clients get created up front and handed to the worker pool"""
+    return dict((key, get_boto3_client(client_name, key[0], key[1])) for key in keys)
 
 
 def get_profile_collection(security_account_profile_name):
     """Helper method for dealing with multiple accounts where a profile name for the centralized security logging account is passed in and the available profiles for use are put in a collection marked as 'child accounts'"""
     ret_val = {'sec_account': None, 'child_accounts': []}
-    for profile in boto3.Session().get_profile_collection():
+    for profile in get_profile_names():
         if profile.lower() == security_account_profile_name.lower():
             ret_val['sec_account'] = profile
         else:
@@ -30,25 +65,91 @@ def get_profile_collection(security_account_profile_name):
     return ret_val
 
 
-def serialize_template(template, description):
-    """Commmon method for serializing a given template with the generator version, git sha and template md5 hash to validate consistency in debug scenarios."""
-    template_hash = hashlib.md5(json.dumps(template.to_json()).encode('utf-8')).hexdigest()
-    description += ' |' + VERSION + '|' + template_hash
-    template.description = description
+def read_lambda_source(file_name):
+    """Helper method returning the source of a Lambda function shipped in the package data directory, e.g. for inlining via Code(ZipFile=...)"""
+    with open(os.path.join(lambda_data_dir, file_name)) as f:
+        return f.read()
+
+
+def load_lambda_module(file_name):
+    """Helper method to import a Lambda function shipped in the package data directory so it can be exercised locally (test harnesses, benchmarks and simulations)"""
+    module_name = 'ccli_lambda_' + os.path.splitext(file_name)[0]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(lambda_data_dir, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_cache(cache_name):
+    """Helper method to read a JSON document previously stored via write_cache (below) - returns an empty dict if nothing has been cached yet"""
+    cache_path = os.path.join(cache_dir, cache_name)
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def write_cache(cache_name, data):
+    """Helper method to persist a JSON document to the local ccli cache directory (defaults to ~/.ccli, override via the CCLI_CACHE_DIR environment variable). Each write goes through its own temporary file, so concurrent writers (e.g. commands run by `serve`) each replace the cache whole."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, prefix=cache_name + '.', suffix='.tmp', delete=False) as f:
+        try:
+            json.dump(data, f, indent=2, sort_keys=True)
+        except Exception:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, os.path.join(cache_dir, cache_name))
+
+
+def _digest(value):
+    """SHA256 of a JSON value in canonical form - sorted keys, no whitespace"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def template_hashes(template):
+    """Merkle tree over a template dict - a hash per resource, a hash per top level section (Resources being the hash of its resource hashes)
+    and a root hash of the section hashes. The Description and the hashes stored in the Metadata by serialize_template are left out, so the
+    hashes of a serialized template are those of the template it was serialized from."""
+    resources = dict((name, _digest(resource)) for name, resource in template.get('Resources', {}).items())
+    sections = {}
+    for section, value in template.items():
+        if section == 'Description':
+            continue
+        if section == 'Metadata':
+            value = dict((key, item) for key, item in value.items() if key != TEMPLATE_HASHES)
+            if not value:
+                continue
+        sections[section] = _digest(resources) if section == 'Resources' else _digest(value)
+    return {'Algorithm': 'sha256', 'Root': _digest(sections), 'Sections': sections, 'Resources': resources}
+
+
+def stored_hashes(template):
+    """The hashes serialize_template stored in a template dict's Metadata, None for templates that weren't serialized"""
+    return template.get('Metadata', {}).get(TEMPLATE_HASHES)
+
+
+def serialize_template(template, description=None):
+    """Commmon method for serializing a given template (a troposphere Template or a template dict) with the generator version and the template
+    hashes (see template_hashes) to validate consistency in debug scenarios and detect drift of deployed stacks. The version and root hash are
+    appended to the description, the version and full tree are stored in the Metadata. Returns the template dict."""
+    from . import VERSION
+    template = template.to_dict() if hasattr(template, 'to_dict') else template
+    hashes = dict(template_hashes(template), Version=VERSION)
+    description = description if description is not None else template.get('Description', '')
+    template['Description'] = ('%s |%s|%s' % (description.split(' |')[0], VERSION, hashes['Root'])).strip()
+    template.setdefault('Metadata', {})[TEMPLATE_HASHES] = hashes
     return template
 
+
 def validate_tempalte(template_json):
     """Helper method to validate a given template if it was serialized via the serialize_template process (above). Intended to act as a means of validating a template's integrity from when it was first created"""
     template_dict = json.loads(template_json)
-    if 'Description' in template_dict.keys():
-        description = template_dict.pop('Description', None).split('|')
-        template_hash = description[-1]
-        version = description[-2]
-        doc_hash = hashlib.md5(json.dumps(template_dict).encode('utf-8')).hexdigest()
-        if doc_hash != template_hash:
-            raise Error('Provided template (hash: %s) does not validate via included template hash (%s)' % (doc_hash, template_hash))
-        else:
-            return True
-    else:
-        print('No description to derive template hash from.')
+    hashes = stored_hashes(template_dict)
+    if hashes is None:
+        print('No template hashes to validate against.')
         return False
+    doc_hash = template_hashes(template_dict)['Root']
+    if doc_hash != hashes['Root'] or template_dict.get('Description', '').split('|')[-1] != doc_hash:
+        raise ValueError('Provided template (hash: %s) does not validate via included template hash (%s)' % (doc_hash, hashes['Root']))
+    return True
@@ -0,0 +1,95 @@
+"""GuardDuty auto-isolation.
+
+Invoked by an EventBridge rule for GuardDuty instance findings. The finding type is matched against the POLICIES
+environment variable (a JSON list of {"pattern", "action", "min_severity"}, first match wins):
+  auto    - quarantine the instance and start forensic snapshots of its volumes right away
+  approve - publish an approval request to APPROVAL_TOPIC_ARN; invoking the function with the
+            payload from that message (source "ccli.approval") runs the isolation
+  ignore  - do nothing (also the default when no policy matches)
+Instances in other accounts are reached through the ISOLATION_ROLE_NAME role in that account.
+Packaged together with ucsd_cloud_cli/sec/quarantine.py and capture.py by `response generate`.
+"""
+import fnmatch
+import json
+import os
+import shlex
+import time
+
+try:
+    from quarantine import resolve_targets, isolate
+    from capture import capture
+except ImportError:
+    from ucsd_cloud_cli.sec.quarantine import resolve_targets, isolate
+    from ucsd_cloud_cli.sec.capture import capture
+
+AUTO = 'auto'
+APPROVE = 'approve'
+IGNORE = 'ignore'
+APPROVAL_SOURCE = 'ccli.approval'
+OPERATOR = 'auto-isolation'
+
+
+def policy_for(finding_type, severity, policies):
+    for policy in policies:
+        if fnmatch.fnmatchcase(finding_type, policy['pattern']) and severity >= policy.get('min_severity', 0):
+            return policy['action']
+    return IGNORE
+
+
+def get_clients(account_id, region, own_account_id):
+    import boto3
+    session = boto3.Session()
+    if account_id != own_account_id:
+        role_arn = 'arn:aws:iam::%s:role/%s' % (account_id, os.environ['ISOLATION_ROLE_NAME'])
+        credentials = session.client('sts').assume_role(RoleArn=role_arn, RoleSessionName=OPERATOR)['Credentials']
+        session = boto3.Session(aws_access_key_id=credentials['AccessKeyId'],
+                                aws_secret_access_key=credentials['SecretAccessKey'],
+                                aws_session_token=credentials['SessionToken'])
+    return session.client('ec2', region_name=region), session.client('autoscaling', region_name=region)
+
+
+def approval_command(finding, function_name):
+    # the finding is attacker-influenced, so the payload is shell-quoted rather than pasted between quotes
+    payload = json.dumps({'source': APPROVAL_SOURCE, 'detail-type': 'GuardDuty Finding', 'detail': finding})
+    return 'aws lambda invoke --function-name %s --cli-binary-format raw-in-base64-out --payload %s /dev/stdout' % (
+        shlex.quote(function_name), shlex.quote(payload))
+
+
+def notify(finding, function_name):
+    import boto3
+    boto3.client('sns').publish(TopicArn=os.environ['APPROVAL_TOPIC_ARN'],
+                                Subject=('Approve isolation of %s' % finding['resource']['instanceDetails']['instanceId'])[:100],
+                                Message='%s (severity %s) in %s/%s: %s\n\nTo isolate, run:\n%s\n' % (
+                                    finding['type'], finding['severity'], finding['accountId'], finding['region'], finding.get('title', ''),
+                                    approval_command(finding, function_name)))
+
+
+def contain(finding, ec2, autoscaling, snapshot=True, clock=time.time):
+    started = clock()
+    instance_id = finding['resource']['instanceDetails']['instanceId']
+    case_id = 'GD-%s' % finding['id']
+    instances = resolve_targets(ec2, [instance_id])
+    results = isolate(ec2, autoscaling, instances, case_id, os.environ.get('QUARANTINE_GROUP_NAME', 'ccli-quarantine'), operator=OPERATOR)
+    isolated = clock()
+    snapshots, errors = capture(ec2, instances, case_id, OPERATOR) if snapshot else ([], {})
+    return {'case': case_id,
+            'instance': instance_id,
+            'isolation': results,
+            'snapshots': [s['SnapshotId'] for s in snapshots],
+            'errors': [r['Error'] for r in results if r['Error']] + sorted(errors.values()) + ([] if instances else ['instance not found']),
+            'isolate_seconds': isolated - started,
+            'snapshot_seconds': clock() - started}
+
+
+def handler(event, context, clients=get_clients, notify=notify):
+    finding = event['detail']
+    approved = event.get('source') == APPROVAL_SOURCE
+    action = AUTO if approved else policy_for(finding['type'], finding['severity'], json.loads(os.environ.get('POLICIES', '[]')))
+    result = {'action': action, 'approved': approved, 'type': finding['type'], 'finding': finding['id']}
+    if action == APPROVE:
+        notify(finding, context.function_name)
+    elif action == AUTO:
+        ec2, autoscaling = clients(finding['accountId'], finding['region'], context.invoked_function_arn.split(':')[4])
+        result.update(contain(finding, ec2, autoscaling, os.environ.get('SNAPSHOT', 'true') == 'true'))
+    print(json.dumps(result, default=str))
+    return result
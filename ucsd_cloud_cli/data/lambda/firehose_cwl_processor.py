@@ -0,0 +1,87 @@
+"""Firehose record transformation for CloudWatch Logs subscription data.
+
+Unpacks each gzipped CloudWatch Logs envelope, drops CONTROL_MESSAGE records and emits
+newline-delimited log events (set OUTPUT_FORMAT=json to keep log group/stream metadata).
+Records that would push the response past the Lambda payload limit are put back on the
+source Kinesis stream and dropped from this batch, split in two when one is too big for
+any response. Deployed inline, keep under 4096 bytes.
+"""
+import base64
+import gzip
+import json
+import os
+
+MAX_RESPONSE_BYTES = 6000000
+
+
+def transform(data, json_format=False):
+    envelope = json.loads(gzip.decompress(data).decode('utf-8'))
+    if envelope.get('messageType') != 'DATA_MESSAGE':
+        return None
+    lines = []
+    for e in envelope['logEvents']:
+        if json_format:
+            lines.append(json.dumps({'owner': envelope['owner'],
+                                     'logGroup': envelope['logGroup'],
+                                     'logStream': envelope['logStream'],
+                                     'id': e['id'],
+                                     'timestamp': e['timestamp'],
+                                     'message': e['message']}))
+        else:
+            lines.append(e['message'])
+    return ''.join(line + '\n' for line in lines).encode('utf-8')
+
+
+def reingest(stream_arn, records):
+    import boto3
+    kinesis = boto3.client('kinesis', region_name=stream_arn.split(':')[3])
+    for i in range(0, len(records), 500):
+        batch = records[i:i + 500]
+        for _ in range(3):
+            response = kinesis.put_records(StreamName=stream_arn.split('/')[-1], Records=batch)
+            if not response['FailedRecordCount']:
+                break
+            batch = [r for r, s in zip(batch, response['Records']) if 'ErrorCode' in s]
+        else:
+            raise RuntimeError('Unable to re-ingest %d records' % len(batch))
+
+
+def split(data):
+    envelope = json.loads(gzip.decompress(data).decode('utf-8'))
+    events = envelope['logEvents']
+    if len(events) < 2:
+        return []
+    return [gzip.compress(json.dumps(dict(envelope, logEvents=part)).encode('utf-8')) for part in (events[:len(events) // 2], events[len(events) // 2:])]
+
+
+def handler(event, context, reingest=reingest):
+    json_format = os.environ.get('OUTPUT_FORMAT') == 'json'
+    # every record is answered, so room for each entry's ID and keys is set aside up front
+    output, overflow, size = [], [], sum(len(r['recordId']) + 64 for r in event['records'])
+    for record in event['records']:
+        data = base64.b64decode(record['data'])
+        key = record.get('kinesisRecordMetadata', {}).get('partitionKey', record['recordId'])
+        entry = {'recordId': record['recordId'], 'result': 'Dropped'}
+        try:
+            transformed = transform(data, json_format)
+        except (OSError, ValueError, KeyError):
+            transformed, entry['result'] = None, 'ProcessingFailed'
+        if transformed is not None:
+            encoded = base64.b64encode(transformed).decode('ascii')
+            if len(encoded) > MAX_RESPONSE_BYTES - len(record['recordId']) - 64:
+                # too big for any response, so its events go back as two smaller records
+                parts = split(data)
+                overflow.extend({'Data': part, 'PartitionKey': key} for part in parts)
+                if not parts:
+                    entry['result'] = 'ProcessingFailed'
+            elif size + len(encoded) > MAX_RESPONSE_BYTES:
+                overflow.append({'Data': data, 'PartitionKey': key})
+            else:
+                entry.update(result='Ok', data=encoded)
+        if entry['result'] == 'ProcessingFailed' and size + len(record['data']) <= MAX_RESPONSE_BYTES:
+            entry['data'] = record['data']
+        size += len(entry.get('data', ''))
+        output.append(entry)
+    if overflow:
+        reingest(event['sourceKinesisStreamArn'], overflow)
+    return {'records': output}
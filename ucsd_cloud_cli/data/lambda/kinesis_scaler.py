@@ -0,0 +1,79 @@
+"""Kinesis shard autoscaling for the log target stream.
+
+Invoked through SNS by the stream's CloudWatch alarms: alarms named *scale-out double the
+shard count and alarms named *scale-in halve it (rounding up), within MIN_SHARDS and MAX_SHARDS. Nothing
+changes within COOLDOWN_SECONDS of the last resharding (kept in a stream tag) or while the
+stream is updating - the alarm is reset instead so it fires again if it is still breaching.
+After resharding the IncomingBytes alarm thresholds follow the new capacity. Deployed
+inline, keep under 4096 bytes.
+"""
+import json
+import os
+import time
+
+SHARD_BYTES_PER_MINUTE = 60 * 1024 * 1024
+SCALE_OUT = 'scale-out'
+SCALE_IN = 'scale-in'
+# IncomingBytes alarm thresholds as a fraction of the stream's write capacity
+UTILIZATION = {SCALE_OUT: 0.8, SCALE_IN: 0.3}
+TAG = 'ccli:last-scaled'
+ALARM_KEYS = ['AlarmName', 'AlarmDescription', 'ActionsEnabled', 'OKActions', 'AlarmActions', 'InsufficientDataActions', 'MetricName',
+              'Namespace', 'Statistic', 'Dimensions', 'Period', 'EvaluationPeriods', 'ComparisonOperator', 'TreatMissingData']
+
+
+def direction(alarm_name):
+    return SCALE_IN if alarm_name.endswith(SCALE_IN) else SCALE_OUT
+
+
+def threshold(shards, scaling):
+    return float(shards * SHARD_BYTES_PER_MINUTE * UTILIZATION[scaling])
+
+
+def desired_shards(shards, scaling, min_shards, max_shards):
+    # UpdateShardCount takes 50% to 200% of the open shards, rounding half up
+    least = (shards + 1) // 2
+    wanted = shards * 2 if scaling == SCALE_OUT else least
+    return max(least, min(shards * 2, max(min_shards, min(max_shards, wanted))))
+
+
+def decide(shards, scaling, last_scaled, now, min_shards, max_shards, cooldown):
+    """The shard count to scale to, None while cooling down"""
+    if last_scaled is not None and now - last_scaled < cooldown:
+        return None
+    return desired_shards(shards, scaling, min_shards, max_shards)
+
+
+def reset(cloudwatch, alarm_name):
+    cloudwatch.set_alarm_state(AlarmName=alarm_name, StateValue='OK', StateReason='Re-evaluate after scaling')
+
+
+def handler(event, context, kinesis=None, cloudwatch=None, now=time.time):
+    if kinesis is None:
+        import boto3
+        kinesis, cloudwatch = boto3.client('kinesis'), boto3.client('cloudwatch')
+    alarm = json.loads(event['Records'][0]['Sns']['Message'])
+    if alarm.get('NewStateValue') != 'ALARM':
+        return None
+    stream = os.environ['STREAM_NAME']
+    summary = kinesis.describe_stream_summary(StreamName=stream)['StreamDescriptionSummary']
+    if summary['StreamStatus'] != 'ACTIVE':
+        reset(cloudwatch, alarm['AlarmName'])
+        return None
+    tags = kinesis.list_tags_for_stream(StreamName=stream)['Tags']
+    last = [float(tag['Value']) for tag in tags if tag['Key'] == TAG]
+    shards = summary['OpenShardCount']
+    target = decide(shards, direction(alarm['AlarmName']), last[0] if last else None, now(),
+                    int(os.environ['MIN_SHARDS']), int(os.environ['MAX_SHARDS']), int(os.environ['COOLDOWN_SECONDS']))
+    if target is None:
+        reset(cloudwatch, alarm['AlarmName'])
+        return None
+    if target == shards:
+        return None
+    kinesis.update_shard_count(StreamName=stream, TargetShardCount=target, ScalingType='UNIFORM_SCALING')
+    kinesis.add_tags_to_stream(StreamName=stream, Tags={TAG: str(int(now()))})
+    for existing in cloudwatch.describe_alarms(AlarmNamePrefix=os.environ['ALARM_PREFIX'])['MetricAlarms']:
+        if existing['MetricName'] == 'IncomingBytes':
+            args = dict((key, existing[key]) for key in ALARM_KEYS if key in existing)
+            cloudwatch.put_metric_alarm(Threshold=threshold(target, direction(existing['AlarmName'])), **args)
+        reset(cloudwatch, existing['AlarmName'])
+    return target
@@ -0,0 +1,114 @@
+"""Resource dependency analysis for CloudFormation templates. CloudFormation creates every resource whose dependencies are complete in
+parallel, so a stack's deploy time is the longest chain of dependent resources rather than the number of resources. This builds the resource
+graph from the validator, estimates the wall-clock deploy time from per-resource-type creation times and flags DependsOn entries that either
+order nothing or serialize creation without a known reason."""
+from .validator import dependency_graph
+
+REDUNDANT = 'redundant'
+REQUIRED = 'required'
+UNEXPLAINED = 'unexplained'
+
+# Typical creation times in seconds, read off CREATE_IN_PROGRESS to CREATE_COMPLETE in stack events for the resource types the generators
+# produce. Types not listed use DEFAULT_SECONDS.
+DEFAULT_SECONDS = 10
+CREATE_SECONDS = {
+    'AWS::CloudTrail::Trail': 5,
+    'AWS::CloudWatch::Alarm': 5,
+    'AWS::EC2::FlowLog': 5,
+    'AWS::Events::Rule': 60,
+    'AWS::Glue::Database': 2,
+    'AWS::Glue::Table': 2,
+    'AWS::IAM::AccessKey': 5,
+    'AWS::IAM::Policy': 15,
+    'AWS::IAM::Role': 15,
+    'AWS::IAM::User': 5,
+    'AWS::Kinesis::Stream': 70,
+    'AWS::KinesisFirehose::DeliveryStream': 90,
+    'AWS::Lambda::Function': 10,
+    'AWS::Lambda::Permission': 5,
+    'AWS::Logs::Destination': 5,
+    'AWS::Logs::LogGroup': 2,
+    'AWS::Logs::LogStream': 2,
+    'AWS::Logs::SubscriptionFilter': 5,
+    'AWS::S3::Bucket': 25,
+    'AWS::S3::BucketPolicy': 5,
+    'AWS::SNS::Topic': 10,
+    'AWS::SNS::TopicPolicy': 10,
+    'AWS::SQS::Queue': 5,
+    'AWS::SQS::QueuePolicy': 10,
+}
+
+# DependsOn entries CloudFormation can't infer from references but the service needs - (resource type, dependency type): reason
+ORDERING_RULES = {
+    ('AWS::S3::Bucket', 'AWS::SQS::QueuePolicy'): 'S3 sends a test event to notification queues when the bucket is configured',
+    ('AWS::S3::Bucket', 'AWS::SNS::TopicPolicy'): 'S3 sends a test event to notification topics when the bucket is configured',
+    ('AWS::S3::Bucket', 'AWS::Lambda::Permission'): 'S3 checks it can invoke notification functions when the bucket is configured',
+    ('AWS::KinesisFirehose::DeliveryStream', 'AWS::IAM::Policy'): 'Firehose checks the delivery role can read the source stream',
+    ('AWS::Logs::Destination', 'AWS::IAM::Policy'): 'CloudWatch Logs checks the role can write to the destination target',
+    ('AWS::Logs::SubscriptionFilter', 'AWS::IAM::Policy'): 'CloudWatch Logs checks the role can write to the filter destination',
+    ('AWS::Logs::SubscriptionFilter', 'AWS::Lambda::Permission'): 'CloudWatch Logs checks it can invoke the filter destination',
+    ('AWS::EC2::FlowLog', 'AWS::IAM::Policy'): 'flow log creation checks the delivery role permissions',
+    ('AWS::EC2::FlowLog', 'AWS::S3::BucketPolicy'): 'flow log creation checks it can write to the bucket',
+    ('AWS::CloudTrail::Trail', 'AWS::S3::BucketPolicy'): 'CloudTrail checks it can write to the bucket',
+    ('AWS::Lambda::Function', 'AWS::IAM::Policy'): 'Lambda checks the execution role can be assumed',
+    ('AWS::Glue::Table', 'AWS::Glue::Database'): 'tables name their database by parameter rather than by Ref',
+}
+
+
+def _finish_times(graph, seconds):
+    """Earliest finish time of every resource when each starts as soon as all of its dependencies are complete"""
+    finish = {}
+
+    def visit(node):
+        if node not in finish:
+            finish[node] = max([visit(child) for child in graph[node]] or [0]) + seconds[node]
+        return finish[node]
+
+    for node in sorted(graph):
+        visit(node)
+    return finish
+
+
+def analyze(template, estimates=None, spec=None):
+    """Analyze the resource graph of a template - a troposphere Template, a dict or a JSON string. `estimates` maps resource types to creation
+    seconds, overriding CREATE_SECONDS. Returns the serial and estimated wall-clock deploy time, the critical path with each resource's start
+    time and every DependsOn entry with its status and the seconds it adds to the deploy. Raises ValidationError for an invalid template."""
+    graph, types, depends_on, redundant = dependency_graph(template, spec)
+    durations = dict(CREATE_SECONDS, **(estimates or {}))
+    seconds = dict((name, durations.get(types[name], DEFAULT_SECONDS)) for name in graph)
+    finish = _finish_times(graph, seconds)
+    estimated = max(finish.values())
+
+    critical_path = []
+    node = max(sorted(finish), key=lambda name: finish[name])
+    while node is not None:
+        critical_path.append({'Resource': node, 'Type': types[node], 'Start': finish[node] - seconds[node], 'Seconds': seconds[node]})
+        children = sorted(graph[node])
+        node = max(children, key=lambda name: finish[name]) if children else None
+    critical_path.reverse()
+
+    edges = []
+    for name in sorted(depends_on):
+        for target in depends_on[name]:
+            edge = {'Resource': name, 'DependsOn': target, 'Seconds': 0}
+            if (name, target) in redundant:
+                edge.update(Status=REDUNDANT, Reason='already implied by references')
+            else:
+                rule = ORDERING_RULES.get((types[name], types[target]))
+                edge.update(Status=REQUIRED if rule else UNEXPLAINED, Reason=rule or 'no known ordering requirement')
+                pruned = dict(graph, **{name: graph[name] - set([target])})
+                edge['Seconds'] = estimated - max(_finish_times(pruned, seconds).values())
+            edges.append(edge)
+
+    serial = sum(seconds.values())
+    return {'Resources': len(graph),
+            'SerialSeconds': serial,
+            'EstimatedSeconds': estimated,
+            'Parallelism': round(float(serial) / estimated, 2) if estimated else 0.0,
+            'CriticalPath': critical_path,
+            'DependsOn': edges}
+
+
+def flagged(analysis):
+    """DependsOn entries from analyze() that add nothing - redundant ones and ones without a known ordering requirement"""
+    return [edge for edge in analysis['DependsOn'] if edge['Status'] != REQUIRED]
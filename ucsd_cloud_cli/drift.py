@@ -0,0 +1,83 @@
+"""Fleet-wide template drift detection. Compares the template hashes serialize_template stores in the Metadata of every deployed stack with
+the hashes of the template the current generator produces. Only the template summary (GetTemplateSummary, which carries the Metadata) is
+fetched per stack, for all accounts/regions in parallel. Stacks are compared by root hash and only the ones that differ are descended into, section
+by section and then resource by resource. Stacks deployed from templates without stored hashes, or all stacks with `verify`, have their full
+template fetched and hashed instead - stored hashes describe the template as generated, so verifying also catches templates edited by hand."""
+import fnmatch
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import template_hashes, stored_hashes
+
+IN_SYNC = 'in sync'
+DRIFTED = 'drifted'
+FAILED = 'error'
+
+METADATA = 'metadata'
+TEMPLATE = 'template'
+
+
+def list_stacks(cloudformation, stack_patterns):
+    """Names of the stacks matching any of the shell-style globs in `stack_patterns`"""
+    names = []
+    for page in cloudformation.get_paginator('describe_stacks').paginate():
+        names.extend(stack['StackName'] for stack in page.get('Stacks', []) if any(fnmatch.fnmatchcase(stack['StackName'], p) for p in stack_patterns))
+    return sorted(names)
+
+
+def deployed_hashes(cloudformation, stack_name, verify=False):
+    """The hashes of a deployed stack's template and where they came from - the stored hashes in the template summary's Metadata or, when the
+    template has none or `verify` is set, the full template"""
+    if not verify:
+        metadata = cloudformation.get_template_summary(StackName=stack_name).get('Metadata')
+        hashes = stored_hashes({'Metadata': json.loads(metadata)}) if metadata else None
+        if hashes:
+            return hashes, METADATA
+    body = cloudformation.get_template(StackName=stack_name, TemplateStage='Original')['TemplateBody']
+    return template_hashes(json.loads(body) if isinstance(body, str) else body), TEMPLATE
+
+
+def compare(expected, deployed):
+    """Descend the two hash trees from the root. Returns None when the templates are the same, otherwise the top level sections that differ
+    (other than Resources) and the resources the deployed stack would need added, removed or modified to match the expected template."""
+    if expected['Root'] == deployed['Root']:
+        return None
+    sections = sorted(set(expected['Sections']) | set(deployed['Sections']))
+    differing = [section for section in sections if expected['Sections'].get(section) != deployed['Sections'].get(section)]
+    diff = {'Sections': [section for section in differing if section != 'Resources'], 'Add': [], 'Remove': [], 'Modify': []}
+    if 'Resources' in differing:
+        wanted, actual = expected['Resources'], deployed['Resources']
+        diff['Add'] = sorted(set(wanted) - set(actual))
+        diff['Remove'] = sorted(set(actual) - set(wanted))
+        diff['Modify'] = sorted(name for name in set(wanted) & set(actual) if wanted[name] != actual[name])
+    return diff
+
+
+def detect(clients, template, stack_patterns, verify=False, workers=16):
+    """Check every stack matching `stack_patterns` in every (profile, region) pair of `clients` (a dict keyed by that pair) against the expected
+    `template` dict. Returns one result per stack - {Key, Stack, Status, Source, Version, Diff, Error} - sorted by account/region and name."""
+    expected = template_hashes(template)
+
+    def _list(key):
+        try:
+            return list_stacks(clients[key], stack_patterns), None
+        except Exception as e:
+            return [], str(e)
+
+    def _check(lookup):
+        key, stack_name = lookup
+        result = dict(Key=key, Stack=stack_name, Source=None, Version=None, Diff=None, Error=None)
+        try:
+            hashes, result['Source'] = deployed_hashes(clients[key], stack_name, verify)
+        except Exception as e:
+            return dict(result, Status=FAILED, Error=str(e))
+        result.update(Version=hashes.get('Version'), Diff=compare(expected, hashes))
+        return dict(result, Status=IN_SYNC if result['Diff'] is None else DRIFTED)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = dict(zip(clients, executor.map(_list, list(clients))))
+        lookups = [(key, name) for key in sorted(listings) for name in listings[key][0]]
+        results = list(executor.map(_check, lookups))
+    results.extend(dict(Key=key, Stack=None, Status=FAILED, Source=None, Version=None, Diff=None, Error=error)
+                   for key, (_, error) in sorted(listings.items()) if error)
+    return sorted(results, key=lambda result: (result['Key'], result['Stack'] or ''))
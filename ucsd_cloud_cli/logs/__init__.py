@@ -1,6 +1,14 @@
 import click
 from .target import cli as target
 from .source import cli as source
+from .coverage import cli as coverage
+from .filters import cli as filters
+from .firehose import cli as firehose
+from .cloudtrail import cli as cloudtrail
+from .registry import cli as registry
+from .kinesis import cli as kinesis
+from .status import cli as status
+from .pipeline import cli as pipeline
 import os
 
-logs = click.CommandCollection(sources=[target, source])
+logs = click.CommandCollection(sources=[target, source, coverage, filters, firehose, cloudtrail, registry, kinesis, status, pipeline])
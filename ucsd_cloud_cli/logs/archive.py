@@ -0,0 +1,259 @@
+import datetime
+import re
+
+from troposphere import Ref, Join, AccountId, Output, Parameter, If, Equals, Not
+import troposphere.glue as glue
+
+# Key layouts written into the log buckets by each part of the pipeline. The Glue partition projection templates generated below must resolve
+# to the same prefixes so Athena can prune partitions instead of listing the bucket.
+#  - CloudTrail (LogDeliveryBucket):   [prefix/]AWSLogs/<account>/CloudTrail/<region>/yyyy/MM/dd/<account>_CloudTrail_<region>_<yyyyMMddTHHmmZ>_<id>.json.gz
+#    with hourly digest files (log file validation) under [prefix/]AWSLogs/<account>/CloudTrail-Digest/<region>/yyyy/MM/dd/<account>_CloudTrail-Digest_<region>_<trail>_<home region>_<yyyyMMddTHHmmssZ>.json.gz
+#  - VPC flow logs (LogDeliveryBucket, S3 destination): AWSLogs/<account>/vpcflowlogs/<region>/yyyy/MM/dd[/HH]/<account>_vpcflowlogs_<region>_<flow log id>_<yyyyMMddTHHmmZ>_<hash>.log.gz|.log.parquet
+#    or with Hive-compatible partitions AWSLogs/aws-account-id=<account>/aws-service=vpcflowlogs/aws-region=<region>/year=yyyy/month=MM/day=dd[/hour=HH]/...
+#  - Firehose (LogS3DeliveryBucket):   firehose/yyyy/MM/dd/HH/LogToS3DeliveryStream-1-yyyy-MM-dd-HH-mm-ss-<uuid>
+
+FIREHOSE_PREFIX = 'firehose/'
+CLOUDTRAIL_PREFIX_CONDITION = 'HasCloudTrailKeyPrefix'
+FIREHOSE_STREAM_NAME = 'LogToS3DeliveryStream'
+
+# VPC flow log fields (version 2 default format) and their Athena column types
+FLOW_LOG_FIELDS = ['version', 'account-id', 'interface-id', 'srcaddr', 'dstaddr', 'srcport', 'dstport', 'protocol', 'packets', 'bytes', 'start', 'end', 'action', 'log-status']
+FLOW_LOG_FIELD_TYPES = {'version': 'int', 'account-id': 'string', 'interface-id': 'string', 'srcaddr': 'string', 'dstaddr': 'string',
+                        'srcport': 'int', 'dstport': 'int', 'protocol': 'bigint', 'packets': 'bigint', 'bytes': 'bigint', 'start': 'bigint',
+                        'end': 'bigint', 'action': 'string', 'log-status': 'string', 'vpc-id': 'string', 'subnet-id': 'string',
+                        'instance-id': 'string', 'tcp-flags': 'int', 'type': 'string', 'pkt-srcaddr': 'string', 'pkt-dstaddr': 'string',
+                        'region': 'string', 'az-id': 'string', 'sublocation-type': 'string', 'sublocation-id': 'string',
+                        'pkt-src-aws-service': 'string', 'pkt-dst-aws-service': 'string', 'flow-direction': 'string', 'traffic-path': 'int'}
+
+CLOUDTRAIL_COLUMNS = [('eventversion', 'string'),
+                      ('useridentity', 'struct<type:string,principalid:string,arn:string,accountid:string,invokedby:string,accesskeyid:string,username:string,'
+                                       'sessioncontext:struct<attributes:struct<mfaauthenticated:string,creationdate:string>,'
+                                       'sessionissuer:struct<type:string,principalid:string,arn:string,accountid:string,username:string>>>'),
+                      ('eventtime', 'string'),
+                      ('eventsource', 'string'),
+                      ('eventname', 'string'),
+                      ('awsregion', 'string'),
+                      ('sourceipaddress', 'string'),
+                      ('useragent', 'string'),
+                      ('errorcode', 'string'),
+                      ('errormessage', 'string'),
+                      ('requestparameters', 'string'),
+                      ('responseelements', 'string'),
+                      ('additionaleventdata', 'string'),
+                      ('requestid', 'string'),
+                      ('eventid', 'string'),
+                      ('resources', 'array<struct<arn:string,accountid:string,type:string>>'),
+                      ('eventtype', 'string'),
+                      ('apiversion', 'string'),
+                      ('readonly', 'string'),
+                      ('recipientaccountid', 'string'),
+                      ('serviceeventdetails', 'string'),
+                      ('sharedeventid', 'string'),
+                      ('vpcendpointid', 'string')]
+
+FIREHOSE_COLUMNS = {'message': [('message', 'string')],
+                    'json': [('owner', 'string'), ('loggroup', 'string'), ('logstream', 'string'), ('id', 'string'), ('timestamp', 'bigint'), ('message', 'string')]}
+
+_JAVA_TO_STRFTIME = [('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'), ('mm', '%M'), ('ss', '%S')]
+
+
+def cloudtrail_key(account, region, when, prefix=''):
+    """Object key CloudTrail writes a log file to for the given account, region and (UTC) datetime"""
+    return '%sAWSLogs/%s/CloudTrail/%s/%s/%s_CloudTrail_%s_%s_a1b2c3d4e5f6g7h8.json.gz' % (
+        prefix + '/' if prefix else '', account, region, when.strftime('%Y/%m/%d'), account, region, when.strftime('%Y%m%dT%H%MZ'))
+
+
+def cloudtrail_digest_key(account, region, when, trail, home_region=None, prefix=''):
+    """Object key CloudTrail writes a digest file to for the given account, region, trail and (UTC) datetime"""
+    return '%sAWSLogs/%s/CloudTrail-Digest/%s/%s/%s_CloudTrail-Digest_%s_%s_%s_%s.json.gz' % (
+        prefix + '/' if prefix else '', account, region, when.strftime('%Y/%m/%d'), account, region, trail, home_region or region, when.strftime('%Y%m%dT%H%M%SZ'))
+
+
+def flow_log_key(account, region, when, flow_log_id='fl-1234abcd', file_format='plain-text', hive_partitions=False, per_hour_partition=False):
+    """Object key VPC flow logs delivered straight to S3 are written to for the given account, region and (UTC) datetime and destination options"""
+    if hive_partitions:
+        prefix = 'AWSLogs/aws-account-id=%s/aws-service=vpcflowlogs/aws-region=%s/%s' % (account, region, when.strftime('year=%Y/month=%m/day=%d'))
+        prefix += when.strftime('/hour=%H') if per_hour_partition else ''
+    else:
+        prefix = 'AWSLogs/%s/vpcflowlogs/%s/%s' % (account, region, when.strftime('%Y/%m/%d'))
+        prefix += when.strftime('/%H') if per_hour_partition else ''
+    return '%s/%s_vpcflowlogs_%s_%s_%s_fe123456.%s' % (
+        prefix, account, region, flow_log_id, when.strftime('%Y%m%dT%H%MZ'), 'log.parquet' if file_format == 'parquet' else 'log.gz')
+
+
+def flow_log_layout(hive_partitions=False, per_hour_partition=False):
+    """Location template (relative to the bucket), projection date format and interval unit matching the S3 flow log destination options"""
+    if hive_partitions:
+        location = 'AWSLogs/aws-account-id=${account}/aws-service=vpcflowlogs/aws-region=${region}/${dt}'
+        date_format = "'year='yyyy'/month='MM'/day='dd" + ("'/hour='HH" if per_hour_partition else '')
+    else:
+        location = 'AWSLogs/${account}/vpcflowlogs/${region}/${dt}'
+        date_format = 'yyyy/MM/dd' + ('/HH' if per_hour_partition else '')
+    return location, date_format, 'HOURS' if per_hour_partition else 'DAYS'
+
+
+def firehose_key(when, stream_name=FIREHOSE_STREAM_NAME):
+    """Object key Firehose writes a delivery batch to for the given (UTC) datetime"""
+    return '%s%s/%s-1-%s-0f1e2d3c-4b5a-6978-8695-a4b3c2d1e0f9' % (FIREHOSE_PREFIX, when.strftime('%Y/%m/%d/%H'), stream_name, when.strftime('%Y-%m-%d-%H-%M-%S'))
+
+
+def format_projection_date(java_format, when):
+    """Render a datetime with a projection.<column>.format (Java date format, 'quoted' literals allowed) string"""
+    rendered = []
+    for index, part in enumerate(java_format.split("'")):
+        if index % 2:
+            rendered.append(part)
+            continue
+        for java, python in _JAVA_TO_STRFTIME:
+            part = part.replace(java, python)
+        rendered.append(when.strftime(part))
+    return ''.join(rendered)
+
+
+def resolve_location_template(location_template, values):
+    """Substitute ${column} placeholders in a storage.location.template with partition values, raising a KeyError for any that aren't supplied"""
+    return re.sub(r'\$\{([^}]+)\}', lambda match: values[match.group(1)], location_template)
+
+
+def render_value(value, refs):
+    """Resolve the Ref/Fn::Join/Fn::If intrinsics used in the generated table locations with the given values for the referenced parameters,
+    resources and conditions"""
+    if isinstance(value, dict) and 'Ref' in value:
+        return refs[value['Ref']]
+    if isinstance(value, dict) and 'Fn::If' in value:
+        condition, if_true, if_false = value['Fn::If']
+        return render_value(if_true if refs[condition] else if_false, refs)
+    if isinstance(value, dict) and 'Fn::Join' in value:
+        delimiter, parts = value['Fn::Join']
+        return delimiter.join(render_value(part, refs) for part in parts)
+    return value
+
+
+def cloudtrail_prefix_condition(t, ct_s3_key_prefix):
+    """Add (once) the condition that's true when the CloudTrailKeyPrefix parameter isn't empty and return its name"""
+    if CLOUDTRAIL_PREFIX_CONDITION not in t.conditions:
+        t.add_condition(CLOUDTRAIL_PREFIX_CONDITION, Not(Equals(Ref(ct_s3_key_prefix), '')))
+    return CLOUDTRAIL_PREFIX_CONDITION
+
+
+def cloudtrail_prefix_path(t, ct_s3_key_prefix):
+    """'/' + the CloudTrailKeyPrefix parameter, or nothing when it's empty - to follow a bucket name or ARN"""
+    return If(cloudtrail_prefix_condition(t, ct_s3_key_prefix), Join('', ['/', Ref(ct_s3_key_prefix)]), '')
+
+
+def _columns(columns):
+    return [glue.Column(Name=name, Type=column_type) for name, column_type in columns]
+
+
+def _projection_parameters(account_list, region_list, start_date, date_format, interval_unit, location_template, partition_keys=('account', 'region', 'dt')):
+    """Build the table parameters for Athena partition projection on account (enum of the configured accounts), region (enum) and date"""
+    parameters = {'projection.enabled': 'true',
+                  'projection.dt.type': 'date',
+                  'projection.dt.range': '%s,NOW' % format_projection_date(date_format, start_date),
+                  'projection.dt.format': date_format,
+                  'projection.dt.interval': '1',
+                  'projection.dt.interval.unit': interval_unit,
+                  'storage.location.template': location_template}
+    if 'account' in partition_keys:
+        # with no accounts to enumerate, Athena requires the account to be supplied in the query's WHERE clause
+        parameters.update({'projection.account.type': 'enum', 'projection.account.values': ','.join(account_list)} if account_list else {'projection.account.type': 'injected'})
+    if 'region' in partition_keys:
+        parameters.update({'projection.region.type': 'enum', 'projection.region.values': ','.join(region_list)})
+    return parameters
+
+
+def add_glue_catalog(t, bucket, firehose_bucket, ct_s3_key_prefix, account_list, region_list, start_date='2018/01/01', firehose_output_format=None,
+                     flow_log_file_format='plain-text', flow_log_hive_partitions=False, flow_log_per_hour_partition=False, flow_log_fields=None):
+    """Add a Glue database and partition-projected tables over the log archive to the target template. The Firehose table is only added when
+    `firehose_output_format` is given, as the raw gzipped CloudWatch Logs envelopes Firehose writes without the transform aren't readable by Athena.
+    The flow log options must match the destination options the flow logs were created with (see `source flow_log --destination s3`)."""
+    start_date = datetime.datetime.strptime(start_date, '%Y/%m/%d')
+    database_name = t.add_parameter(Parameter("GlueDatabaseName",
+                                    Description="Name of the Glue database holding the log archive table definitions.",
+                                    Type="String",
+                                    AllowedPattern="[a-z0-9_]+",
+                                    Default="security_logs"))
+
+    database = t.add_resource(glue.Database('LogArchiveDatabase',
+                              CatalogId=AccountId,
+                              DatabaseInput=glue.DatabaseInput(
+                                  Name=Ref(database_name),
+                                  Description="Security log archive tables with partition projection on account, region and date.")))
+
+    partition_keys = _columns([('account', 'string'), ('region', 'string'), ('dt', 'string')])
+
+    cloudtrail_prefix = cloudtrail_prefix_path(t, ct_s3_key_prefix)
+    cloudtrail_location = Join('', ['s3://', Ref(bucket), cloudtrail_prefix, '/AWSLogs/${account}/CloudTrail/${region}/${dt}'])
+    t.add_resource(glue.Table('CloudTrailTable',
+                   DependsOn=[database.title],
+                   CatalogId=AccountId,
+                   DatabaseName=Ref(database_name),
+                   TableInput=glue.TableInput(
+                       Name='cloudtrail',
+                       TableType='EXTERNAL_TABLE',
+                       PartitionKeys=partition_keys,
+                       Parameters=_projection_parameters(account_list, region_list, start_date, 'yyyy/MM/dd', 'DAYS', cloudtrail_location),
+                       StorageDescriptor=glue.StorageDescriptor(
+                           Columns=_columns(CLOUDTRAIL_COLUMNS),
+                           Location=Join('', ['s3://', Ref(bucket), cloudtrail_prefix, '/AWSLogs/']),
+                           InputFormat='com.amazon.emr.cloudtrail.CloudTrailInputFormat',
+                           OutputFormat='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+                           SerdeInfo=glue.SerdeInfo(SerializationLibrary='com.amazon.emr.hive.serde.CloudTrailSerde')))))
+
+    flow_log_path, flow_log_date_format, flow_log_interval = flow_log_layout(flow_log_hive_partitions, flow_log_per_hour_partition)
+    flow_log_location = Join('', ['s3://', Ref(bucket), '/', flow_log_path])
+    flow_log_parameters = _projection_parameters(account_list, region_list, start_date, flow_log_date_format, flow_log_interval, flow_log_location)
+    flow_log_columns = _columns([(field.replace('-', '_'), FLOW_LOG_FIELD_TYPES[field]) for field in (flow_log_fields or FLOW_LOG_FIELDS)])
+    if flow_log_file_format == 'parquet':
+        flow_log_storage = glue.StorageDescriptor(
+                               Columns=flow_log_columns,
+                               Location=Join('', ['s3://', Ref(bucket), '/AWSLogs/']),
+                               InputFormat='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+                               OutputFormat='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+                               SerdeInfo=glue.SerdeInfo(SerializationLibrary='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe'))
+    else:
+        flow_log_parameters['skip.header.line.count'] = '1'
+        flow_log_storage = glue.StorageDescriptor(
+                               Columns=flow_log_columns,
+                               Location=Join('', ['s3://', Ref(bucket), '/AWSLogs/']),
+                               InputFormat='org.apache.hadoop.mapred.TextInputFormat',
+                               OutputFormat='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+                               SerdeInfo=glue.SerdeInfo(
+                                   SerializationLibrary='org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe',
+                                   Parameters={'field.delim': ' ', 'serialization.format': ' '}))
+    t.add_resource(glue.Table('VPCFlowLogTable',
+                   DependsOn=[database.title],
+                   CatalogId=AccountId,
+                   DatabaseName=Ref(database_name),
+                   TableInput=glue.TableInput(
+                       Name='vpc_flow_logs',
+                       TableType='EXTERNAL_TABLE',
+                       PartitionKeys=partition_keys,
+                       Parameters=flow_log_parameters,
+                       StorageDescriptor=flow_log_storage)))
+
+    if firehose_output_format:
+        firehose_location = Join('', ['s3://', Ref(firehose_bucket), '/', FIREHOSE_PREFIX, '${dt}'])
+        serde = glue.SerdeInfo(SerializationLibrary='org.openx.data.jsonserde.JsonSerDe') if firehose_output_format == 'json' else \
+            glue.SerdeInfo(SerializationLibrary='org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe', Parameters={'serialization.format': '1'})
+        t.add_resource(glue.Table('FirehoseLogTable',
+                       DependsOn=[database.title],
+                       CatalogId=AccountId,
+                       DatabaseName=Ref(database_name),
+                       TableInput=glue.TableInput(
+                           Name='cloudwatch_logs',
+                           TableType='EXTERNAL_TABLE',
+                           # Firehose keys carry no account or region, only the delivery hour
+                           PartitionKeys=_columns([('dt', 'string')]),
+                           Parameters=_projection_parameters(account_list, region_list, start_date, 'yyyy/MM/dd/HH', 'HOURS', firehose_location, partition_keys=('dt',)),
+                           StorageDescriptor=glue.StorageDescriptor(
+                               Columns=_columns(FIREHOSE_COLUMNS[firehose_output_format]),
+                               Location=Join('', ['s3://', Ref(firehose_bucket), '/', FIREHOSE_PREFIX]),
+                               InputFormat='org.apache.hadoop.mapred.TextInputFormat',
+                               OutputFormat='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+                               SerdeInfo=serde))))
+
+    t.add_output(Output('GlueDatabaseName',
+                 Value=Ref(database_name),
+                 Description="Glue database with the partition-projected log archive tables (query via Athena)."))
+    return database
@@ -0,0 +1,87 @@
+import click
+import datetime
+import json
+import time
+
+from ..common import get_boto3_client
+from .integrity import discover, list_digests, public_keys, verify, DEFAULT_WORKERS, MISSING
+
+TIME_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d']
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def cloudtrail():
+    """Command group pertaining to the CloudTrail logs archived in the central log bucket - checking them against the trail's signed digest files."""
+    pass
+
+
+def parse_time(value, param_hint):
+    """Helper method to parse a UTC --start-time/--end-time value in one of the TIME_FORMATS"""
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise click.BadParameter('%s is not in a supported format (%s)' % (value, ', '.join(TIME_FORMATS)), param_hint=param_hint)
+
+
+def find_chains(s3, bucket, prefix='', account_list=(), region_list=(), start=None, end=None):
+    """Digest chains to verify as a dict of (account, region, trail) -> digest keys in chronological order"""
+    chains = {}
+    for account_id, region in discover(s3, bucket, prefix, account_list, region_list):
+        for trail, keys in list_digests(s3, bucket, prefix, account_id, region, start, end).items():
+            chains[(account_id, region, trail)] = keys
+    return chains
+
+
+@cloudtrail.command('verify')
+@click.option('--bucket', '-b', 'bucket', required=True, help="Bucket the trails deliver to (the LogDeliveryBucket of the log target).")
+@click.option('--prefix', 'prefix', default='', help="S3 key prefix the trails deliver under (CloudTrailKeyPrefix).")
+@click.option('-p', '--profile', 'profile_name', default='default', help="AWS profile with read access to the bucket.")
+@click.option('-a', '--account-id', 'account_list', multiple=True, help="Account(s) to verify. Defaults to every account with digest files in the bucket.")
+@click.option('-r', '--region', 'region_list', multiple=True, help="Region(s) to verify. Defaults to every region with digest files.")
+@click.option('--start-time', 'start_time', help="Start of the period to verify (UTC, e.g. 2018-02-24T00:00). Defaults to 24 hours before --end-time.")
+@click.option('--end-time', 'end_time', help="End of the period to verify (UTC). Defaults to now.")
+@click.option('--workers', type=int, default=DEFAULT_WORKERS, help="Number of log files read and hashed concurrently.")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. text")
+def verify_command(bucket, prefix='', profile_name='default', account_list=(), region_list=(), start_time=None, end_time=None, workers=DEFAULT_WORKERS, as_json=False):
+    """Verify the integrity of archived CloudTrail logs - walks each account/region's chain of digest files, checks their signatures against CloudTrail's public keys and hashes every log file they list, reporting missing or modified files."""
+    end = parse_time(end_time, '--end-time') if end_time else datetime.datetime.utcnow()
+    start = parse_time(start_time, '--start-time') if start_time else end - datetime.timedelta(days=1)
+    if start >= end:
+        raise click.BadParameter('must be before --end-time', param_hint='--start-time')
+
+    s3 = get_boto3_client('s3', profile_name)
+    chains = find_chains(s3, bucket, prefix, account_list, region_list, start, end)
+    if not chains:
+        raise click.ClickException('No digest files found in s3://%s between %s and %s' % (bucket, start, end))
+    # digests are signed with per-region keys, which rotate - fetch every key in use during the period for each region
+    keys = dict((region, public_keys(get_boto3_client('cloudtrail', profile_name, region), start, end + datetime.timedelta(hours=1)))
+                for region in sorted(set(chain[1] for chain in chains)))
+
+    def _progress(stats):
+        click.echo('%s %d/%d log files hashed' % (time.strftime('%H:%M:%S'), stats['LogFiles'], stats['TotalLogFiles']), err=True)
+
+    result = verify(s3, bucket, chains, keys, workers, None if as_json else _progress)
+    problems, stats = result['Problems'], result['Stats']
+    if as_json:
+        click.echo(json.dumps({'Chains': [dict(value, Account=chain[0], Region=chain[1], Trail=chain[2]) for chain, value in sorted(result['Chains'].items())],
+                               'Problems': [dict(problem, Chain='/'.join(problem['Chain'])) for problem in problems],
+                               'Stats': stats}, indent=4, sort_keys=True))
+    else:
+        click.echo('%-14s %-16s %-32s %8s %9s %9s %8s' % ('ACCOUNT', 'REGION', 'TRAIL', 'DIGESTS', 'LOGFILES', 'INVALID', 'MISSING'))
+        for (account_id, region, trail), value in sorted(result['Chains'].items()):
+            click.echo('%-14s %-16s %-32s %8d %9d %9d %8d' % (account_id, region, trail[:32], value['Digests'], value['LogFiles'],
+                       len([p for p in problems if p['Chain'] == (account_id, region, trail) and p['Status'] != MISSING]),
+                       value.get(MISSING, 0)))
+        for problem in problems:
+            click.echo('%-8s %-18s %s%s' % (problem['Kind'].upper(), problem['Status'], problem['Key'], ' (%s)' % problem['Detail'] if problem.get('Detail') else ''))
+        click.echo('Verified %d digest(s) and %d log file(s) in %.1fs - %.1f files/s, %.1f MB/s read, %.1f MB/s hashed' % (
+                   stats['Digests'], stats['LogFiles'], stats['Seconds'], stats['FilesPerSecond'], stats['ReadMBps'], stats['HashMBps']))
+    if problems:
+        raise click.ClickException('%d integrity problem(s) found' % len(problems))
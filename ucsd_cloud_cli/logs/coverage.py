@@ -0,0 +1,255 @@
+import click
+import fnmatch
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from troposphere import Ref, Template, Parameter
+import troposphere.logs as cwl
+
+from ..common import get_boto3_clients, get_profile_region_keys, read_cache, write_cache, DEFAULT_REGIONS
+from .source import security_log_shipping_group_name
+from .. import profiling
+from ..validator import template_json
+
+# Log groups that are considered security-relevant unless overridden via --include on the command line
+DEFAULT_INCLUDE_RULES = [security_log_shipping_group_name,
+                         '/aws/cloudtrail/*',
+                         'CloudTrail/*',
+                         'aws-cloudtrail-logs-*',
+                         '/aws/vpc/*',
+                         '*flow-log*',
+                         '/aws/guardduty/*',
+                         '/aws/route53/*',
+                         'aws-waf-logs-*',
+                         '/aws/eks/*/cluster',
+                         '/aws/rds/*/audit',
+                         '/var/log/secure',
+                         '/var/log/auth.log',
+                         '/var/log/audit/*']
+
+SUBSCRIPTION_FILTER_NAME = 'SecurityLogShippingFilter'
+COVERAGE_CACHE = 'coverage.json'
+MAX_RESOURCES_PER_TEMPLATE = 200
+
+STATUS_SUBSCRIBED = 'subscribed'
+STATUS_OTHER = 'other'
+STATUS_MISSING = 'missing'
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def coverage():
+    """Command group pertaining to discovering which CloudWatch Logs log groups in the log source accounts are (or are not) shipping to the centralized log destination and wiring up the ones that are missing."""
+    pass
+
+
+def match_rules(log_group_name, include_rules, exclude_rules=()):
+    """Helper method to determine whether a log group name is selected by the given include/exclude rules. Rules are shell-style globs; a group is selected when any include rule matches and no exclude rule does."""
+    if not any(fnmatch.fnmatchcase(log_group_name, rule) for rule in include_rules):
+        return False
+    return not any(fnmatch.fnmatchcase(log_group_name, rule) for rule in exclude_rules)
+
+
+def _list_log_groups(client):
+    """Page through DescribeLogGroups for a single account/region"""
+    log_groups = []
+    for page in client.get_paginator('describe_log_groups').paginate():
+        log_groups.extend(page.get('logGroups', []))
+    return log_groups
+
+
+def _list_subscription_filters(client, log_group_name):
+    """Page through DescribeSubscriptionFilters for a single log group"""
+    filters = []
+    for page in client.get_paginator('describe_subscription_filters').paginate(logGroupName=log_group_name):
+        filters.extend(page.get('subscriptionFilters', []))
+    return filters
+
+
+def _subscription_status(filters, destination_arn=None):
+    """Classify a log group by its subscription filters relative to the centralized destination. Without a destination ARN any subscription counts as shipping."""
+    if not filters:
+        return STATUS_MISSING
+    if destination_arn is None or any(f.get('destinationArn') == destination_arn for f in filters):
+        return STATUS_SUBSCRIBED
+    return STATUS_OTHER
+
+
+def _cache_key(destination_arn):
+    """Coverage cache entries are kept per destination, so scans against different destinations (or none, for `generate`) don't evict each other"""
+    return destination_arn or '*'
+
+
+def scan(clients, include_rules, exclude_rules=(), destination_arn=None, use_cache=True, workers=16):
+    """Discover log groups across every (profile, region) pair in `clients` (a dict keyed by that pair) and classify them relative to the central destination.
+
+    Log group listings for every account/region are paged in parallel, followed by a second parallel pass over DescribeSubscriptionFilters for the selected groups. Only groups found subscribed are recorded in the coverage cache, so missing or otherwise subscribed groups are looked up again on the next run (after an `apply` or a stack deploy) while subscribed ones aren't unless `use_cache` is False."""
+    cache = read_cache(COVERAGE_CACHE) if use_cache else {}
+    destinations = cache.get('destinations', {})
+    cached_accounts = destinations.get(_cache_key(destination_arn), {})
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = dict(zip(clients.keys(), executor.map(_list_log_groups, clients.values())))
+
+        results = {}
+        lookups = []
+        for key, log_groups in listings.items():
+            cached_groups = cached_accounts.get('/'.join(key), {})
+            selected = {}
+            for log_group in log_groups:
+                name = log_group['logGroupName']
+                if not match_rules(name, include_rules, exclude_rules):
+                    continue
+                if name in cached_groups and cached_groups[name]['creationTime'] == log_group.get('creationTime'):
+                    selected[name] = {'creationTime': log_group.get('creationTime'), 'status': STATUS_SUBSCRIBED}
+                else:
+                    selected[name] = {'creationTime': log_group.get('creationTime'), 'status': None}
+                    lookups.append((key, name))
+            results[key] = {'total': len(log_groups), 'groups': selected}
+
+        filters = executor.map(lambda lookup: _list_subscription_filters(clients[lookup[0]], lookup[1]), lookups)
+        for (key, name), group_filters in zip(lookups, filters):
+            results[key]['groups'][name]['status'] = _subscription_status(group_filters, destination_arn)
+
+    for key, value in results.items():
+        cached_accounts['/'.join(key)] = dict((name, {'creationTime': group['creationTime']})
+                                              for name, group in value['groups'].items() if group['status'] == STATUS_SUBSCRIBED)
+    destinations[_cache_key(destination_arn)] = cached_accounts
+    write_cache(COVERAGE_CACHE, {'destinations': destinations})
+    return results
+
+
+def _resource_name(log_group_name):
+    """Derive a stable, CloudFormation-safe logical resource name for a log group's subscription filter"""
+    digest = hashlib.md5(log_group_name.encode('utf-8')).hexdigest()[:8]
+    return 'Subscription%s%s' % (re.sub('[^A-Za-z0-9]', '', log_group_name)[:48], digest)
+
+
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def generate_templates(log_group_names, filter_pattern=''):
+    """Build one or more CloudFormation templates subscribing the given log groups to the central log destination. Templates are split so no single stack exceeds MAX_RESOURCES_PER_TEMPLATE subscription filters."""
+    templates = []
+    names = sorted(log_group_names)
+    for offset in range(0, len(names), MAX_RESOURCES_PER_TEMPLATE):
+        t = Template()
+        t.add_version("2010-09-09")
+        t.add_description("UCSD Log Source Coverage AWS CloudFormation Template - subscribes existing security-relevant CloudWatch Logs log groups to the centralized log destination.")
+
+        destination_arn = t.add_parameter(Parameter('LogDeliveryDestinationArn',
+                                          Type="String",
+                                          Description="ARN of the Log Destination to send logs to."))
+
+        for name in names[offset:offset + MAX_RESOURCES_PER_TEMPLATE]:
+            t.add_resource(cwl.SubscriptionFilter(_resource_name(name),
+                           DestinationArn=Ref(destination_arn),
+                           LogGroupName=name,
+                           FilterPattern=filter_pattern))
+        templates.append(t)
+    return templates
+
+
+def apply_subscriptions(clients, missing, destination_arn, filter_pattern='', workers=16):
+    """Create the subscription filter for every (key, log group name) pair in `missing` concurrently. Returns a list of (key, log group name, error) tuples for the ones that failed. Missing groups aren't in the coverage cache, so the next scan looks them up again either way."""
+    def _put(item):
+        key, name = item
+        try:
+            clients[key].put_subscription_filter(logGroupName=name,
+                                                 filterName=SUBSCRIPTION_FILTER_NAME,
+                                                 filterPattern=filter_pattern,
+                                                 destinationArn=destination_arn)
+        except Exception as e:
+            return (key, name, str(e))
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        failures = [failure for failure in executor.map(_put, missing) if failure]
+
+    return failures
+
+
+def _missing(results):
+    return [(key, name) for key, value in sorted(results.items()) for name, group in sorted(value['groups'].items()) if group['status'] == STATUS_MISSING]
+
+
+def _coverage_options(f):
+    """Options shared by all coverage commands"""
+    f = click.option('--workers', type=int, default=16, help="Number of concurrent AWS API calls.")(f)
+    f = click.option('--refresh', is_flag=True, help="Ignore the coverage cache and re-inspect every log group.")(f)
+    f = click.option('-x', '--exclude', 'exclude_rules', multiple=True, help="Glob rule for log groups to skip even when an include rule matches.")(f)
+    f = click.option('-i', '--include', 'include_rules', multiple=True, help="Glob rule selecting log groups to ship. Defaults to a built-in list of security-relevant log groups.")(f)
+    f = click.option('-r', '--region', 'region_list', multiple=True, help="Region(s) to inspect in each account. Defaults to %s." % ', '.join(DEFAULT_REGIONS))(f)
+    f = click.option('-p', '--profile', 'profile_list', multiple=True, help="AWS profile(s) for the log source accounts to inspect. Defaults to every configured profile.")(f)
+    return f
+
+
+@coverage.command('scan')
+@_coverage_options
+@click.option('--destination-arn', 'destination_arn', help="ARN of the central log destination. Log groups subscribed elsewhere are reported separately when given.")
+@click.option('--verbose', '-v', is_flag=True, help="List each log group that is not shipping to the destination.")
+def scan_command(profile_list, region_list, include_rules, exclude_rules, refresh, workers, destination_arn=None, verbose=False):
+    """Report how many security-relevant log groups in each account/region ship to the central log destination."""
+    results = scan(get_boto3_clients('logs', get_profile_region_keys(profile_list, region_list)), include_rules or DEFAULT_INCLUDE_RULES, exclude_rules, destination_arn, not refresh, workers)
+
+    click.echo('%-24s %-12s %8s %8s %10s %8s %8s' % ('PROFILE', 'REGION', 'GROUPS', 'MATCHED', 'SUBSCRIBED', 'OTHER', 'MISSING'))
+    for (profile, region), value in sorted(results.items()):
+        statuses = [group['status'] for group in value['groups'].values()]
+        click.echo('%-24s %-12s %8d %8d %10d %8d %8d' % (profile, region, value['total'], len(statuses),
+                   statuses.count(STATUS_SUBSCRIBED), statuses.count(STATUS_OTHER), statuses.count(STATUS_MISSING)))
+        if verbose:
+            for name, group in sorted(value['groups'].items()):
+                if group['status'] != STATUS_SUBSCRIBED:
+                    click.echo('    %-8s %s' % (group['status'], name))
+
+
+@coverage.command('generate')
+@_coverage_options
+@click.option('--dry-run', 'dry_run', is_flag=True, help="boolean indicates whether templates should be printed to screen vs. being saved to file")
+@click.option('--output-dir', '-o', 'output_dir', type=click.Path(file_okay=False), default='.', help="Directory to save the generated templates in, one per account/region.")
+def generate(profile_list, region_list, include_rules, exclude_rules, refresh, workers, dry_run=False, output_dir='.'):
+    """Generate CloudFormation templates that subscribe every missing log group to the central log destination, one per account/region."""
+    results = scan(get_boto3_clients('logs', get_profile_region_keys(profile_list, region_list)), include_rules or DEFAULT_INCLUDE_RULES, exclude_rules, None, not refresh, workers)
+
+    rendered = {}
+    for (profile, region), value in sorted(results.items()):
+        names = [name for name, group in value['groups'].items() if group['status'] == STATUS_MISSING]
+        for index, t in enumerate(generate_templates(names)):
+            rendered['coverage_%s_%s_%d.json' % (profile, region, index)] = template_json(t)
+
+    if dry_run:
+        click.echo(json.dumps(dict((name, json.loads(body)) for name, body in rendered.items()), indent=4, sort_keys=True))
+    else:
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        for name, body in sorted(rendered.items()):
+            with profiling.phase(profiling.FILE_WRITE), open(os.path.join(output_dir, name), 'w') as f:
+                f.write(body)
+            click.echo(os.path.join(output_dir, name))
+
+
+@coverage.command('apply')
+@_coverage_options
+@click.option('--destination-arn', 'destination_arn', required=True, help="ARN of the central log destination (the childAccountLogDeliveryDestinationArn output of the target template).")
+@click.option('--dry-run', 'dry_run', is_flag=True, help="boolean indicates whether to only list the subscription filters that would be created")
+def apply(profile_list, region_list, include_rules, exclude_rules, refresh, workers, destination_arn, dry_run=False):
+    """Subscribe every missing log group directly to the central log destination via PutSubscriptionFilter."""
+    clients = get_boto3_clients('logs', get_profile_region_keys(profile_list, region_list))
+    missing = _missing(scan(clients, include_rules or DEFAULT_INCLUDE_RULES, exclude_rules, destination_arn, not refresh, workers))
+
+    for (profile, region), name in missing:
+        click.echo('%-24s %-12s %s' % (profile, region, name))
+    if dry_run or not missing:
+        return
+
+    failures = apply_subscriptions(clients, missing, destination_arn, workers=workers)
+    for (profile, region), name, error in failures:
+        click.echo('FAILED %s %s %s: %s' % (profile, region, name, error), err=True)
+    click.echo('Subscribed %d of %d log groups.' % (len(missing) - len(failures), len(missing)))
+    if failures:
+        raise click.ClickException('%d subscription filter(s) could not be created' % len(failures))
@@ -0,0 +1,411 @@
+import click
+import gzip
+import json
+import re
+
+# Named CloudWatch Logs filter patterns per log type. The empty pattern ships every event, the others drop events that
+# aren't useful for security analysis before they use Kinesis shard capacity or Splunk license.
+VPC_FLOW_LOG_FIELDS = 'version, account_id, interface_id, srcaddr, dstaddr, srcport, dstport, protocol, packets, bytes, start, end'
+
+FILTER_PROFILES = {
+    'vpc_flow_logs': {
+        'all': '',
+        'reject': '[%s, action="REJECT", log_status]' % VPC_FLOW_LOG_FIELDS,
+        'no_nodata': '[%s, action, log_status="OK"]' % VPC_FLOW_LOG_FIELDS,
+        'admin_ports': '[version, account_id, interface_id, srcaddr, dstaddr, srcport, dstport=22 || dstport=3389 || dstport=23, protocol, packets, bytes, start, end, action, log_status]',
+    },
+    'cloudtrail': {
+        'all': '',
+        'writes': '{ $.readOnly IS FALSE }',
+        'errors': '{ ($.errorCode = "*UnauthorizedOperation") || ($.errorCode = "AccessDenied*") }',
+        'console_logins': '{ $.eventName = "ConsoleLogin" }',
+        'no_describe': '{ ($.eventName != "Describe*") && ($.eventName != "List*") && ($.eventName != "Get*") }',
+    },
+    'os_auth': {
+        'all': '',
+        'auth_events': '?sshd ?sudo ?su ?"authentication failure" ?"Failed password" ?"Accepted publickey"',
+        'failures': '?"authentication failure" ?"Failed password" ?"Invalid user"',
+    },
+    'application': {
+        'all': '',
+        'warnings': '?WARN ?WARNING ?ERROR ?CRITICAL ?FATAL ?Exception',
+        'errors': '?ERROR ?CRITICAL ?FATAL ?Exception',
+    },
+}
+
+
+class FilterPatternError(ValueError):
+    """Raised when a filter pattern can't be parsed"""
+    pass
+
+
+def get_filter_pattern(log_type, profile_name):
+    """Helper method to look up a named filter pattern from the library, raising a KeyError naming the available choices when it doesn't exist"""
+    if log_type not in FILTER_PROFILES:
+        raise KeyError('Unknown log type %s (choose from %s)' % (log_type, ', '.join(sorted(FILTER_PROFILES))))
+    if profile_name not in FILTER_PROFILES[log_type]:
+        raise KeyError('Unknown filter profile %s for %s (choose from %s)' % (profile_name, log_type, ', '.join(sorted(FILTER_PROFILES[log_type]))))
+    return FILTER_PROFILES[log_type][profile_name]
+
+
+#
+# Pattern compilation - term, JSON ({ ... }) and space-delimited ([ ... ]) patterns per
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/FilterAndPatternSyntax.html
+#
+
+_EXPRESSION_TOKEN_RE = re.compile(r'\s*(?:(&&|\|\|)|(!=|<=|>=|=|<|>)|([()])|("(?:[^"\\]|\\.)*")|([^\s()=!<>&|"]+))')
+_MESSAGE_FIELD_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\S+')
+_TERM_RE = re.compile(r'\s*([?-]?)(?:"((?:[^"\\]|\\.)*)"|(\S+))')
+
+
+def _unquote(value):
+    return re.sub(r'\\(.)', r'\1', value[1:-1])
+
+
+def _literal(token, quoted):
+    """Turn a value token into a float when it's numeric (and not a wildcard) or leave it as a string"""
+    if quoted:
+        return _unquote(token)
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def _tokenize_expression(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _EXPRESSION_TOKEN_RE.match(expression, position)
+        if not match or match.end() == position:
+            raise FilterPatternError('Unable to parse filter expression near: %s' % expression[position:])
+        logical, operator, paren, quoted, word = match.groups()
+        if logical:
+            tokens.append(('logical', logical))
+        elif operator:
+            tokens.append(('operator', operator))
+        elif paren:
+            tokens.append(('paren', paren))
+        elif quoted:
+            tokens.append(('value', _literal(quoted, True)))
+        else:
+            tokens.append(('word', word))
+        position = match.end()
+    return tokens
+
+
+class _ExpressionParser(object):
+    """Recursive descent parser for the comparison expressions shared by JSON and space-delimited patterns. Produces nested tuples:
+    ('or', [...]), ('and', [...]), ('cmp', selector, operator, value), ('is', selector, TRUE|FALSE|NULL), ('not_exists', selector)"""
+    def __init__(self, expression):
+        self.tokens = _tokenize_expression(expression)
+        self.position = 0
+
+    def parse(self):
+        node = self._or()
+        if self.position != len(self.tokens):
+            raise FilterPatternError('Unexpected token %s' % (self.tokens[self.position][1],))
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise FilterPatternError('Unexpected end of filter expression')
+        self.position += 1
+        return token
+
+    def _or(self):
+        nodes = [self._and()]
+        while self._peek() == ('logical', '||'):
+            self._next()
+            nodes.append(self._and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _and(self):
+        nodes = [self._atom()]
+        while self._peek() == ('logical', '&&'):
+            self._next()
+            nodes.append(self._atom())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def _atom(self):
+        kind, value = self._next()
+        if (kind, value) == ('paren', '('):
+            node = self._or()
+            if self._next() != ('paren', ')'):
+                raise FilterPatternError('Expected )')
+            return node
+        if kind != 'word':
+            raise FilterPatternError('Expected a selector, got %s' % (value,))
+        selector = value
+        kind, value = self._next()
+        if kind == 'operator':
+            kind, literal = self._next()
+            if kind == 'word':
+                literal = _literal(literal, False)
+            elif kind != 'value':
+                raise FilterPatternError('Expected a value after %s %s' % (selector, value))
+            return ('cmp', selector, value, literal)
+        if (kind, value) == ('word', 'IS'):
+            kind, literal = self._next()
+            if literal not in ('TRUE', 'FALSE', 'NULL'):
+                raise FilterPatternError('Expected TRUE, FALSE or NULL after IS')
+            return ('is', selector, literal)
+        if (kind, value) == ('word', 'NOT') and self._next() == ('word', 'EXISTS'):
+            return ('not_exists', selector)
+        raise FilterPatternError('Expected a comparison after %s' % selector)
+
+
+def _glob(value, pattern):
+    regex = '.*'.join(re.escape(part) for part in pattern.split('*'))
+    return re.match('(?s)%s\\Z' % regex, value) is not None
+
+
+def _compare(actual, operator, expected):
+    """Compare one field value with a pattern literal - numeric literals compare numerically, strings support * wildcards for = and !="""
+    if isinstance(expected, float):
+        if isinstance(actual, bool) or actual is None:
+            return False
+        try:
+            actual = float(actual)
+        except (TypeError, ValueError):
+            return operator == '!='
+        return {'=': actual == expected, '!=': actual != expected, '<': actual < expected,
+                '>': actual > expected, '<=': actual <= expected, '>=': actual >= expected}[operator]
+    if operator not in ('=', '!='):
+        return False
+    if actual is None or isinstance(actual, (dict, list)):
+        return operator == '!='
+    if isinstance(actual, bool):
+        actual = 'true' if actual else 'false'
+    matched = _glob(str(actual), expected) if '*' in expected else str(actual) == expected
+    return matched if operator == '=' else not matched
+
+
+def _evaluate(node, lookup):
+    """Evaluate a parsed expression, `lookup` maps a selector to the list of values it resolves to (empty when missing)"""
+    kind = node[0]
+    if kind == 'or':
+        return any(_evaluate(child, lookup) for child in node[1])
+    if kind == 'and':
+        return all(_evaluate(child, lookup) for child in node[1])
+    values = lookup(node[1])
+    if kind == 'not_exists':
+        return not values
+    if kind == 'is':
+        expected = {'TRUE': True, 'FALSE': False, 'NULL': None}[node[2]]
+        return any(value is expected for value in values)
+    return any(_compare(value, node[2], node[3]) for value in values)
+
+
+_SELECTOR_PART_RE = re.compile(r'\.([^.\[]+)|\[(\d+|\*)\]')
+
+
+def _select(document, selector):
+    """Resolve a JSON selector such as $.requestParameters.items[0].name (with * wildcards) against a decoded log event"""
+    if not selector.startswith('$'):
+        raise FilterPatternError('JSON selectors must start with $: %s' % selector)
+    values = [document]
+    position = 1
+    while position < len(selector):
+        match = _SELECTOR_PART_RE.match(selector, position)
+        if not match:
+            raise FilterPatternError('Unable to parse selector %s' % selector)
+        key, index = match.groups()
+        selected = []
+        for value in values:
+            if key is not None and isinstance(value, dict):
+                selected.extend(value.values() if key == '*' else [value[key]] if key in value else [])
+            elif index is not None and isinstance(value, list):
+                selected.extend(value if index == '*' else value[int(index):int(index) + 1])
+        values = selected
+        position = match.end()
+    return values
+
+
+def _compile_json(pattern):
+    expression = _ExpressionParser(pattern.strip()[1:-1]).parse()
+
+    def matches(message):
+        try:
+            document = json.loads(message)
+        except ValueError:
+            return False
+        return isinstance(document, dict) and _evaluate(expression, lambda selector: _select(document, selector))
+    return matches
+
+
+def _split_fields(body):
+    """Split a space-delimited field specification on the commas that aren't inside a quoted value"""
+    fields, current, quoted = [], [], False
+    for character in body:
+        if character == '"' and (not current or current[-1] != '\\'):
+            quoted = not quoted
+        if character == ',' and not quoted:
+            fields.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(character)
+    fields.append(''.join(current).strip())
+    return [field for field in fields if field]
+
+
+def _bind(specs, values):
+    """Yield every assignment of message fields to the named fields in `specs`, where ... absorbs any number of fields"""
+    if not specs:
+        if not values:
+            yield {}
+        return
+    if specs[0] is None:
+        for skip in range(len(values) + 1):
+            for binding in _bind(specs[1:], values[skip:]):
+                yield binding
+        return
+    if values:
+        for binding in _bind(specs[1:], values[1:]):
+            binding[specs[0]] = values[0]
+            yield binding
+
+
+def _compile_space_delimited(pattern):
+    specs, conditions = [], []
+    for field in _split_fields(pattern.strip()[1:-1]):
+        if field == '...':
+            specs.append(None)
+            continue
+        name = re.match(r'[^\s=!<>&|()]+', field)
+        if not name:
+            raise FilterPatternError('Unable to parse field %s' % field)
+        specs.append(name.group(0))
+        if field != name.group(0):
+            conditions.append(_ExpressionParser(field).parse())
+
+    def matches(message):
+        values = [value[1:-1] if value[0] in '"[' and len(value) > 1 else value for value in _MESSAGE_FIELD_RE.findall(message)]
+        for binding in _bind(specs, values):
+            if all(_evaluate(condition, lambda selector: [binding[selector]] if selector in binding else []) for condition in conditions):
+                return True
+        return False
+    return matches
+
+
+def _compile_terms(pattern):
+    required, optional, excluded = [], [], []
+    position = 0
+    while position < len(pattern.strip()):
+        match = _TERM_RE.match(pattern.strip(), position)
+        if not match or match.end() == position:
+            raise FilterPatternError('Unable to parse term pattern near: %s' % pattern.strip()[position:])
+        prefix, quoted, word = match.groups()
+        term = re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else word
+        {'': required, '?': optional, '-': excluded}[prefix].append(term)
+        position = match.end()
+
+    def matches(message):
+        return (all(term in message for term in required) and
+                (not optional or any(term in message for term in optional)) and
+                not any(term in message for term in excluded))
+    return matches
+
+
+def compile_pattern(pattern):
+    """Compile a CloudWatch Logs filter pattern into a predicate taking a single log event message. Raises FilterPatternError when the pattern can't be parsed."""
+    stripped = pattern.strip()
+    if not stripped:
+        return lambda message: True
+    if stripped.startswith('{'):
+        if not stripped.endswith('}'):
+            raise FilterPatternError('JSON filter patterns must be enclosed in { }')
+        return _compile_json(stripped)
+    if stripped.startswith('['):
+        if not stripped.endswith(']'):
+            raise FilterPatternError('Space-delimited filter patterns must be enclosed in [ ]')
+        return _compile_space_delimited(stripped)
+    return _compile_terms(stripped)
+
+
+def evaluate(pattern, messages):
+    """Run a filter pattern over an iterable of log event messages and report how many events (and bytes) would still be shipped"""
+    matches = compile_pattern(pattern)
+    stats = {'events': 0, 'matched': 0, 'bytes_in': 0, 'bytes_out': 0}
+    for message in messages:
+        size = len(message.encode('utf-8'))
+        stats['events'] += 1
+        stats['bytes_in'] += size
+        if matches(message):
+            stats['matched'] += 1
+            stats['bytes_out'] += size
+    stats['match_rate'] = float(stats['matched']) / stats['events'] if stats['events'] else 0.0
+    stats['byte_reduction'] = 1 - float(stats['bytes_out']) / stats['bytes_in'] if stats['bytes_in'] else 0.0
+    return stats
+
+
+def _read_messages(path):
+    """Sample log files contain one log event per line, optionally gzip compressed"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group('filter')
+def filter_patterns():
+    """Command group pertaining to the library of CloudWatch Logs filter patterns used to cut log volume at the source before it's shipped."""
+    pass
+
+
+@filter_patterns.command('list')
+def list_profiles():
+    """List the named filter pattern profiles available per log type."""
+    for log_type, profiles in sorted(FILTER_PROFILES.items()):
+        click.echo(log_type)
+        for profile_name, pattern in sorted(profiles.items()):
+            click.echo('    %-16s %s' % (profile_name, pattern if pattern else '(ship every event)'))
+
+
+@filter_patterns.command('evaluate')
+@click.argument('sample_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--pattern', 'pattern', help="Literal filter pattern to evaluate.")
+@click.option('--log-type', 'log_type', type=click.Choice(sorted(FILTER_PROFILES)), help="Log type whose filter profiles should be evaluated.")
+@click.option('--profile', 'profile_name', help="Single filter profile (of --log-type) to evaluate. Defaults to every profile of the log type.")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. a table")
+def evaluate_command(sample_files, pattern=None, log_type=None, profile_name=None, as_json=False):
+    """Evaluate filter patterns locally over sample log files (one event per line, optionally gzipped) and report match rate and byte reduction."""
+    if pattern is not None:
+        patterns = [('pattern', pattern)]
+    elif log_type:
+        try:
+            patterns = [(profile_name, get_filter_pattern(log_type, profile_name))] if profile_name else sorted(FILTER_PROFILES[log_type].items())
+        except KeyError as e:
+            raise click.BadParameter(e.args[0], param_hint='--profile')
+    else:
+        raise click.UsageError('Either --pattern or --log-type is required')
+
+    results = []
+    for name, filter_pattern in patterns:
+        for sample_file in sample_files:
+            try:
+                stats = evaluate(filter_pattern, _read_messages(sample_file))
+            except FilterPatternError as e:
+                raise click.ClickException('%s: %s' % (name, e))
+            stats.update({'profile': name, 'pattern': filter_pattern, 'file': sample_file})
+            results.append(stats)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=4, sort_keys=True))
+        return
+    click.echo('%-16s %-32s %10s %10s %8s %12s %12s %10s' % ('PROFILE', 'FILE', 'EVENTS', 'MATCHED', 'RATE', 'BYTES IN', 'BYTES OUT', 'REDUCTION'))
+    for stats in results:
+        click.echo('%-16s %-32s %10d %10d %7.1f%% %12d %12d %9.1f%%' % (stats['profile'], stats['file'][-32:], stats['events'], stats['matched'],
+                   stats['match_rate'] * 100, stats['bytes_in'], stats['bytes_out'], stats['byte_reduction'] * 100))
@@ -0,0 +1,153 @@
+import click
+import base64
+import gzip
+import json
+import os
+import random
+import time
+
+from ..common import load_lambda_module
+
+PROCESSOR_LAMBDA = 'firehose_cwl_processor.py'
+SOURCE_STREAM_ARN = 'arn:aws:kinesis:us-west-2:123456789012:stream/LogStream'
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def firehose():
+    """Command group pertaining to the Firehose record transformation Lambda - local harness for replaying recorded batches and benchmarking the transform."""
+    pass
+
+
+def build_envelope(log_group, log_stream, messages, owner='123456789012', message_type='DATA_MESSAGE', timestamp=1518000000000):
+    """Helper method to build a gzipped CloudWatch Logs subscription envelope the same way CloudWatch Logs puts it on the Kinesis stream"""
+    envelope = {'messageType': message_type,
+                'owner': owner,
+                'logGroup': log_group,
+                'logStream': log_stream,
+                'subscriptionFilters': ['SecurityLogShippingFilter'],
+                'logEvents': [{'id': str(36000000000000000000000000000000000000000000000000000000 + i),
+                               'timestamp': timestamp + i,
+                               'message': message} for i, message in enumerate(messages)]}
+    return gzip.compress(json.dumps(envelope).encode('utf-8'))
+
+
+def build_batch(envelopes, stream_arn=SOURCE_STREAM_ARN):
+    """Helper method to wrap raw Kinesis record payloads in the event Firehose hands to a transformation Lambda"""
+    return {'invocationId': 'local-harness',
+            'deliveryStreamArn': 'arn:aws:firehose:us-west-2:123456789012:deliverystream/LogToS3DeliveryStream',
+            'sourceKinesisStreamArn': stream_arn,
+            'region': 'us-west-2',
+            'records': [{'recordId': '%08d' % i,
+                         'approximateArrivalTimestamp': 1518000000000,
+                         'data': base64.b64encode(envelope).decode('ascii'),
+                         'kinesisRecordMetadata': {'partitionKey': 'partition-%d' % i,
+                                                   'shardId': 'shardId-000000000000',
+                                                   'sequenceNumber': str(i)}} for i, envelope in enumerate(envelopes)]}
+
+
+def synthesize_batches(batches=10, records=100, events_per_record=50, control_ratio=0.01, seed=0):
+    """Generate Firehose batches of synthetic VPC flow log envelopes, mixing in the occasional CONTROL_MESSAGE like CloudWatch Logs does"""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(batches):
+        envelopes = []
+        for _ in range(records):
+            if rng.random() < control_ratio:
+                envelopes.append(build_envelope('', '', ['CWL CONTROL MESSAGE: Checking health of destination Kinesis stream.'], owner='CloudwatchLogs', message_type='CONTROL_MESSAGE'))
+                continue
+            messages = ['2 123456789012 eni-%08x 10.0.%d.%d 10.0.%d.%d %d %d 6 %d %d 1518000000 1518000060 %s OK' % (
+                        rng.getrandbits(32), rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255),
+                        rng.randint(1024, 65535), rng.choice([22, 80, 443, 3389]), rng.randint(1, 100), rng.randint(40, 100000),
+                        rng.choice(['ACCEPT', 'REJECT'])) for _ in range(events_per_record)]
+            envelopes.append(build_envelope('SecurityLogShippingGroup', 'eni-%08x-all' % rng.getrandbits(32), messages))
+        result.append(build_batch(envelopes))
+    return result
+
+
+def replay(batches, output_format='message', iterations=1):
+    """Run the transformation Lambda over recorded batches in-process and report throughput, result counts and the output/input byte ratio. Re-ingested records are counted rather than sent anywhere."""
+    processor = load_lambda_module(PROCESSOR_LAMBDA)
+    reingested = []
+    previous_format = os.environ.get('OUTPUT_FORMAT')
+    os.environ['OUTPUT_FORMAT'] = output_format
+
+    stats = {'batches': 0, 'records': 0, 'ok': 0, 'dropped': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0, 'max_response_bytes': 0}
+    try:
+        started = time.time()
+        for _ in range(iterations):
+            for batch in batches:
+                response = processor.handler(batch, None, reingest=lambda arn, records: reingested.extend(records))
+                stats['batches'] += 1
+                stats['records'] += len(batch['records'])
+                stats['bytes_in'] += sum(len(base64.b64decode(r['data'])) for r in batch['records'])
+                stats['max_response_bytes'] = max(stats['max_response_bytes'], len(json.dumps(response)))
+                for record in response['records']:
+                    if record['result'] == 'Ok':
+                        stats['ok'] += 1
+                        stats['bytes_out'] += len(base64.b64decode(record['data']))
+                    elif record['result'] == 'Dropped':
+                        stats['dropped'] += 1
+                    else:
+                        stats['failed'] += 1
+        elapsed = time.time() - started
+    finally:
+        if previous_format is None:
+            os.environ.pop('OUTPUT_FORMAT', None)
+        else:
+            os.environ['OUTPUT_FORMAT'] = previous_format
+
+    stats['reingested'] = len(reingested)
+    stats['seconds'] = elapsed
+    stats['records_per_second'] = stats['records'] / elapsed if elapsed else 0.0
+    stats['output_input_ratio'] = float(stats['bytes_out']) / stats['bytes_in'] if stats['bytes_in'] else 0.0
+    return stats
+
+
+@firehose.command('synthesize')
+@click.option('--output-dir', '-o', 'output_dir', type=click.Path(file_okay=False), default='.', help="Directory to write the recorded batch files to.")
+@click.option('--batches', type=int, default=10, help="Number of batch files to write.")
+@click.option('--records', type=int, default=100, help="Number of Kinesis records per batch.")
+@click.option('--events-per-record', type=int, default=50, help="Number of log events in each CloudWatch Logs envelope.")
+@click.option('--seed', type=int, default=0, help="Random seed, for reproducible batches.")
+def synthesize(output_dir='.', batches=10, records=100, events_per_record=50, seed=0):
+    """Write synthetic Firehose transformation batches (VPC flow log envelopes) to use with `firehose bench`."""
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    for i, batch in enumerate(synthesize_batches(batches, records, events_per_record, seed=seed)):
+        path = os.path.join(output_dir, 'firehose_batch_%04d.json' % i)
+        with open(path, 'w') as f:
+            json.dump(batch, f)
+        click.echo(path)
+
+
+@firehose.command('bench')
+@click.argument('batch_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output-format', 'output_format', type=click.Choice(['message', 'json']), default='message', help="OUTPUT_FORMAT the transform runs with.")
+@click.option('--iterations', type=int, default=1, help="Number of times to replay the batches.")
+@click.option('--synthetic', type=int, default=0, help="Number of synthetic batches to generate in memory instead of (or in addition to) batch files.")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. text")
+def bench(batch_files, output_format='message', iterations=1, synthetic=0, as_json=False):
+    """Replay recorded Firehose batches (the event JSON Firehose passes to the transformation Lambda) through the bundled transform and report records per second and the output/input byte ratio."""
+    batches = []
+    for batch_file in batch_files:
+        with open(batch_file) as f:
+            batches.append(json.load(f))
+    batches.extend(synthesize_batches(synthetic) if synthetic else [])
+    if not batches:
+        raise click.UsageError('Provide batch files or --synthetic N')
+
+    stats = replay(batches, output_format, iterations)
+    if as_json:
+        click.echo(json.dumps(stats, indent=4, sort_keys=True))
+        return
+    click.echo('batches:            %d' % stats['batches'])
+    click.echo('records:            %d (ok %d, dropped %d, failed %d, re-ingested %d)' % (stats['records'], stats['ok'], stats['dropped'], stats['failed'], stats['reingested']))
+    click.echo('records/second:     %.1f' % stats['records_per_second'])
+    click.echo('bytes in/out:       %d / %d' % (stats['bytes_in'], stats['bytes_out']))
+    click.echo('output/input ratio: %.2f' % stats['output_input_ratio'])
+    click.echo('largest response:   %d bytes' % stats['max_response_bytes'])
@@ -0,0 +1,263 @@
+"""CloudTrail log file integrity validation engine - walks the chain of digest files CloudTrail writes next to the logs, checks each digest's
+SHA256withRSA signature and hashes the log files it lists while streaming them out of S3. Only depends on the standard library and the boto3
+clients handed in; signatures are checked with plain modular exponentiation so no crypto library is needed."""
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MB = 1000.0 ** 2
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 32
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# <account>_CloudTrail-Digest_<region>_<trail name>_<trail home region>_<yyyyMMddTHHmmssZ>.json.gz
+DIGEST_NAME = re.compile(r'^(?P<account>\d{12})_CloudTrail-Digest_(?P<region>[a-z0-9-]+)_(?P<trail>.+)_(?P<home_region>[a-z0-9-]+)_(?P<timestamp>\d{8}T\d{6}Z)\.json\.gz$')
+ACCOUNT_ID = re.compile(r'^\d{12}$')
+
+# DER encoded DigestInfo header for SHA-256, prepended to the hash in an EMSA-PKCS1-v1_5 encoded message
+SHA256_DIGEST_INFO = bytes(bytearray([0x30, 0x31, 0x30, 0x0d, 0x06, 0x09, 0x60, 0x86, 0x48, 0x01, 0x65, 0x03, 0x04, 0x02, 0x01, 0x05, 0x00, 0x04, 0x20]))
+
+MODIFIED = 'modified'
+MISSING = 'missing'
+INVALID_SIGNATURE = 'invalid signature'
+UNKNOWN_KEY = 'unknown public key'
+BROKEN_CHAIN = 'broken chain'
+
+
+def _root(prefix):
+    return '%sAWSLogs/' % (prefix.rstrip('/') + '/' if prefix else '')
+
+
+def digest_prefix(prefix, account_id, region):
+    """Key prefix CloudTrail writes an account/region's digest files under, for a trail delivering with the given S3 key prefix"""
+    return '%s%s/CloudTrail-Digest/%s/' % (_root(prefix), account_id, region)
+
+
+def _is_missing(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', 'NotFound', '404')
+
+
+def _sub_prefixes(s3, bucket, prefix):
+    names = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        names.extend(p['Prefix'][len(prefix):].rstrip('/') for p in page.get('CommonPrefixes', []))
+    return names
+
+
+def _objects(s3, **kwargs):
+    for page in s3.get_paginator('list_objects_v2').paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+def discover(s3, bucket, prefix='', account_list=(), region_list=()):
+    """(account, region) pairs that have digest files in the bucket, optionally narrowed down to the given accounts and regions"""
+    pairs = []
+    accounts = account_list or [a for a in _sub_prefixes(s3, bucket, _root(prefix)) if ACCOUNT_ID.match(a)]
+    for account_id in accounts:
+        for region in _sub_prefixes(s3, bucket, '%s%s/CloudTrail-Digest/' % (_root(prefix), account_id)):
+            if not region_list or region in region_list:
+                pairs.append((account_id, region))
+    return pairs
+
+
+def list_digests(s3, bucket, prefix, account_id, region, start=None, end=None):
+    """Digest file keys for one account/region whose timestamps fall within [start, end] (naive UTC datetimes), as a dict of trail name -> keys
+    in chronological order. Listing starts at the first day of the range and stops after its last, rather than walking the whole prefix."""
+    base = digest_prefix(prefix, account_id, region)
+    kwargs = {'Bucket': bucket, 'Prefix': base}
+    if start:
+        kwargs['StartAfter'] = base + start.strftime('%Y/%m/%d/')
+    stop_at = base + (end + datetime.timedelta(days=1)).strftime('%Y/%m/%d/') if end else None
+
+    trails = {}
+    for obj in _objects(s3, **kwargs):
+        if stop_at and obj['Key'] >= stop_at:
+            break
+        match = DIGEST_NAME.match(obj['Key'].rsplit('/', 1)[-1])
+        if not match:
+            continue
+        when = datetime.datetime.strptime(match.group('timestamp'), TIMESTAMP_FORMAT)
+        if (start and when < start) or (end and when > end):
+            continue
+        trails.setdefault(match.group('trail'), []).append((when, obj['Key']))
+    return dict((trail, [key for _, key in sorted(keys)]) for trail, keys in trails.items())
+
+
+def _der_read(data, offset, tag):
+    """Read one DER element of the expected tag starting at `offset`, returning its contents and the offset just past it"""
+    if data[offset] != tag:
+        raise ValueError('Expected DER tag 0x%02x at offset %d' % (tag, offset))
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return data[offset:offset + length], offset + length
+
+
+def parse_public_key(der):
+    """(modulus, exponent) of a DER encoded PKCS#1 RSAPublicKey - the format ListPublicKeys returns key values in"""
+    body, _ = _der_read(bytearray(der), 0, 0x30)
+    modulus, offset = _der_read(body, 0, 0x02)
+    exponent, _ = _der_read(body, offset, 0x02)
+    return int.from_bytes(bytes(modulus), 'big'), int.from_bytes(bytes(exponent), 'big')
+
+
+def verify_signature(public_key, message, signature):
+    """RSASSA-PKCS1-v1_5 verification of a SHA256withRSA signature over `message`"""
+    modulus, exponent = public_key
+    size = (modulus.bit_length() + 7) // 8
+    value = int.from_bytes(signature, 'big')
+    if len(signature) != size or value >= modulus:
+        return False
+    suffix = SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    expected = b'\x00\x01' + b'\xff' * (size - len(suffix) - 3) + b'\x00' + suffix
+    return hmac.compare_digest(pow(value, exponent, modulus).to_bytes(size, 'big'), expected)
+
+
+def signing_string(digest, raw):
+    """The string CloudTrail signs for a digest file: end time, S3 path, SHA256 of the uncompressed digest and the previous digest's signature"""
+    return ('%s\n%s/%s\n%s\n%s' % (digest['digestEndTime'], digest['digestS3Bucket'], digest['digestS3Object'], hashlib.sha256(raw).hexdigest(),
+                                   digest.get('previousDigestSignature') or 'null')).encode('utf-8')
+
+
+def public_keys(cloudtrail, start=None, end=None):
+    """Public keys a region's digests were signed with during [start, end], as a dict of fingerprint -> (modulus, exponent)"""
+    kwargs = dict((name, value) for name, value in [('StartTime', start), ('EndTime', end)] if value)
+    keys = {}
+    while True:
+        response = cloudtrail.list_public_keys(**kwargs)
+        for key in response.get('PublicKeyList', []):
+            keys[key['Fingerprint']] = parse_public_key(key['Value'])
+        if not response.get('NextToken'):
+            return keys
+        kwargs['NextToken'] = response['NextToken']
+
+
+def fetch_digest(s3, bucket, key):
+    """Download and parse a digest file. Returns the digest, its uncompressed bytes and the hex signature from the object metadata, or None when
+    the object doesn't exist."""
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        if _is_missing(e):
+            return None
+        raise
+    raw = gzip.decompress(response['Body'].read())
+    return json.loads(raw.decode('utf-8')), raw, response.get('Metadata', {}).get('signature', '')
+
+
+def hash_log_file(s3, bucket, key):
+    """SHA256 of a log file's uncompressed content, inflated and hashed a chunk at a time as it streams in. Returns the hex digest with the
+    compressed and uncompressed byte counts, or None when the object doesn't exist."""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    except Exception as e:
+        if _is_missing(e):
+            return None
+        raise
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    digest = hashlib.sha256()
+    read = hashed = 0
+    while True:
+        chunk = body.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        read += len(chunk)
+        data = inflater.decompress(chunk)
+        hashed += len(data)
+        digest.update(data)
+    data = inflater.flush()
+    digest.update(data)
+    return digest.hexdigest(), read, hashed + len(data)
+
+
+def _signature_ok(public_key, digest, raw, signature):
+    try:
+        signature = bytes(bytearray.fromhex(signature))
+    except ValueError:
+        return False
+    return verify_signature(public_key, signing_string(digest, raw), signature)
+
+
+def _check_digests(bucket, chain, keys, fetched, region_keys, problems):
+    """Signature and chain checks for one trail's digests, in order. Returns the digests that could be read."""
+    digests = []
+    for index, key in enumerate(keys):
+        result = fetched[(bucket, key)]
+        if result is None:
+            problems.append({'Status': MISSING, 'Kind': 'digest', 'Key': key, 'Chain': chain})
+            continue
+        digest, raw, signature = result
+        digests.append(digest)
+        public_key = region_keys.get(digest.get('digestPublicKeyFingerprint'))
+        if public_key is None:
+            problems.append({'Status': UNKNOWN_KEY, 'Kind': 'digest', 'Key': key, 'Chain': chain, 'Detail': digest.get('digestPublicKeyFingerprint')})
+        elif digest.get('digestS3Object') != key or not _signature_ok(public_key, digest, raw, signature):
+            problems.append({'Status': INVALID_SIGNATURE, 'Kind': 'digest', 'Key': key, 'Chain': chain})
+
+        if index == 0:
+            continue
+        previous_key = keys[index - 1]
+        if digest.get('previousDigestS3Object') != previous_key:
+            # a digest between this one and the one before it in the listing has been removed
+            problems.append({'Status': MISSING, 'Kind': 'digest', 'Key': digest.get('previousDigestS3Object') or '-', 'Chain': chain,
+                             'Detail': 'referenced by %s' % key})
+            continue
+        previous = fetched[(bucket, previous_key)]
+        if previous and (digest.get('previousDigestSignature') != previous[2] or digest.get('previousDigestHashValue') != hashlib.sha256(previous[1]).hexdigest()):
+            problems.append({'Status': BROKEN_CHAIN, 'Kind': 'digest', 'Key': previous_key, 'Chain': chain,
+                             'Detail': 'does not match the previous digest recorded in %s' % key})
+    return digests
+
+
+def verify(s3, bucket, chains, keys, workers=DEFAULT_WORKERS, on_progress=None):
+    """Verify digest chains and every log file they list. `chains` maps (account, region, trail) -> chronologically ordered digest keys and `keys`
+    maps region -> public keys (see public_keys). Digests are fetched and log files streamed and hashed with up to `workers` concurrent reads;
+    `on_progress(stats)` is called every 100 log files. Returns per-chain counts, the list of problems found and throughput figures."""
+    started = time.time()
+    problems = []
+    stats = {'Digests': 0, 'LogFiles': 0, 'BytesRead': 0, 'BytesHashed': 0}
+    summary = dict((chain, {'Digests': len(digest_keys), 'LogFiles': 0}) for chain, digest_keys in chains.items())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        wanted = [(bucket, key) for chain in sorted(chains) for key in chains[chain]]
+        fetched = dict(zip(wanted, executor.map(lambda item: fetch_digest(s3, item[0], item[1]), wanted)))
+        stats['Digests'] = len(wanted)
+
+        futures = {}
+        for chain in sorted(chains):
+            for digest in _check_digests(bucket, chain, chains[chain], fetched, keys.get(chain[1], {}), problems):
+                for log_file in digest.get('logFiles', []):
+                    future = executor.submit(hash_log_file, s3, log_file['s3Bucket'], log_file['s3Object'])
+                    futures[future] = (chain, log_file)
+                    summary[chain]['LogFiles'] += 1
+
+        for future in as_completed(futures):
+            chain, log_file = futures[future]
+            result = future.result()
+            stats['LogFiles'] += 1
+            if result is None:
+                problems.append({'Status': MISSING, 'Kind': 'log', 'Key': log_file['s3Object'], 'Chain': chain})
+            else:
+                stats['BytesRead'] += result[1]
+                stats['BytesHashed'] += result[2]
+                if result[0] != log_file['hashValue']:
+                    problems.append({'Status': MODIFIED, 'Kind': 'log', 'Key': log_file['s3Object'], 'Chain': chain})
+            if on_progress and stats['LogFiles'] % 100 == 0:
+                on_progress(dict(stats, Seconds=time.time() - started, TotalLogFiles=len(futures)))
+
+    elapsed = max(time.time() - started, 1e-6)
+    for problem in problems:
+        summary[problem['Chain']][problem['Status']] = summary[problem['Chain']].get(problem['Status'], 0) + 1
+    stats.update(Seconds=elapsed, ReadMBps=stats['BytesRead'] / MB / elapsed, HashMBps=stats['BytesHashed'] / MB / elapsed,
+                 FilesPerSecond=stats['LogFiles'] / elapsed)
+    return {'Chains': summary, 'Problems': sorted(problems, key=lambda p: (p['Chain'], p['Key'])), 'Stats': stats}
@@ -0,0 +1,361 @@
+"""Write capacity for the log target's Kinesis stream. CloudWatch Logs puts every subscription delivery on the stream with PutRecord, and a
+shard takes 1 MB/s or 1000 records/s, so a burst across many accounts (a VPC flow log storm) is throttled and delayed unless the stream grows
+with it. The target template can either provision a fixed number of shards, autoscale them - CloudWatch alarms on IncomingBytes and
+WriteProvisionedThroughputExceeded notify a bundled resharding Lambda through SNS - or use on-demand capacity mode. The simulation replays a
+traffic curve against each mode, running the same Lambda against a simulated stream, and counts the records throttled."""
+import click
+import contextlib
+import json
+import os
+
+from troposphere import GetAtt, Ref, Join, FindInMap, Parameter, StackName, AccountId, Region
+import troposphere.awslambda as awslambda
+import troposphere.cloudwatch as cw
+import troposphere.iam as iam
+import troposphere.sns as sns
+
+from awacs.aws import Allow, Statement, Principal, Policy
+from awacs.sts import AssumeRole
+import awacs.cloudwatch as acw
+import awacs.kinesis as akinesis
+import awacs.logs as alogs
+
+from ..common import read_lambda_source, load_lambda_module
+
+FIXED = 'fixed'
+AUTOSCALE = 'autoscale'
+ON_DEMAND = 'on-demand'
+STREAM_SCALING = [FIXED, AUTOSCALE, ON_DEMAND]
+
+SCALER_LAMBDA = 'kinesis_scaler.py'
+
+SHARD_BYTES_PER_SECOND = 1024 * 1024
+SHARD_RECORDS_PER_SECOND = 1000
+# On-demand streams start at 4 MB/s of write capacity and grow to double the peak they have seen, taking about 15 minutes to adapt
+ON_DEMAND_MIN_BYTES_PER_SECOND = 4 * SHARD_BYTES_PER_SECOND
+ON_DEMAND_ADAPT_MINUTES = 15
+SCALE_IN_PERIODS = 15
+# (alarm name suffix, metric, comparison, evaluation periods, missing data) - the suffix tells the scaling function which way to scale
+ALARMS = [('scale-out', 'IncomingBytes', 'GreaterThanThreshold', 1, 'notBreaching'),
+          ('throttled-scale-out', 'WriteProvisionedThroughputExceeded', 'GreaterThanThreshold', 1, 'notBreaching'),
+          ('scale-in', 'IncomingBytes', 'LessThanThreshold', SCALE_IN_PERIODS, 'breaching')]
+
+
+def add_stream_autoscaling(t, log_stream, shard_count):
+    """Add the alarms, SNS topic and resharding Lambda that autoscale `log_stream` to the target template. The stream's `shard_count`
+    parameter is the initial shard count - the alarm thresholds for it are looked up from a mapping, and moved by the function as it reshards.
+    Returns the names of the parameters added."""
+    scaler = load_lambda_module(SCALER_LAMBDA)
+    min_shards = t.add_parameter(Parameter("LogStreamMinShardCount",
+                                 Description="Fewest shards the autoscaling function scales the Kinesis stream in to.",
+                                 Type="Number",
+                                 MinValue=1,
+                                 Default=1))
+
+    max_shards = t.add_parameter(Parameter("LogStreamMaxShardCount",
+                                 Description="Most shards the autoscaling function scales the Kinesis stream out to - keep within the account's shard limit.",
+                                 Type="Number",
+                                 MinValue=1,
+                                 Default=16))
+
+    cooldown = t.add_parameter(Parameter("LogStreamScalingCooldown",
+                               Description="Seconds after resharding the Kinesis stream before it is resharded again.",
+                               Type="Number",
+                               MinValue=60,
+                               Default=600))
+
+    runtime = t.add_parameter(Parameter("LogStreamScalerRuntime",
+                              Description="Lambda runtime for the Kinesis stream autoscaling function.",
+                              Type="String",
+                              Default="python3.12"))
+
+    t.add_mapping('LogStreamCapacity', dict((str(shards), {'ScaleOutBytes': int(scaler.threshold(shards, scaler.SCALE_OUT)),
+                                                          'ScaleInBytes': int(scaler.threshold(shards, scaler.SCALE_IN))})
+                                            for shards in range(1, shard_count.MaxValue + 1)))
+
+    alarm_prefix = Join('-', [StackName, 'LogStream'])
+    scaler_role = t.add_resource(iam.Role('LogStreamScalerRole',
+                                 AssumeRolePolicyDocument=Policy(
+                                     Statement=[Statement(
+                                         Effect=Allow,
+                                         Action=[AssumeRole],
+                                         Principal=Principal('Service', 'lambda.amazonaws.com'))]),
+                                 Policies=[iam.Policy(
+                                     PolicyName='LogStreamScalerPolicy',
+                                     PolicyDocument=Policy(
+                                         Statement=[
+                                             Statement(
+                                                 Effect=Allow,
+                                                 Action=[alogs.CreateLogGroup, alogs.CreateLogStream, alogs.PutLogEvents],
+                                                 Resource=['arn:aws:logs:*:*:*']),
+                                             Statement(
+                                                 Effect=Allow,
+                                                 Action=[akinesis.Action('DescribeStreamSummary'), akinesis.UpdateShardCount, akinesis.ListTagsForStream,
+                                                         akinesis.AddTagsToStream],
+                                                 Resource=[GetAtt(log_stream, 'Arn')]),
+                                             Statement(
+                                                 Effect=Allow,
+                                                 Action=[acw.DescribeAlarms],
+                                                 Resource=['*']),
+                                             Statement(
+                                                 Effect=Allow,
+                                                 Action=[acw.PutMetricAlarm, acw.SetAlarmState],
+                                                 Resource=[Join('', ['arn:aws:cloudwatch:', Region, ':', AccountId, ':alarm:', alarm_prefix, '-*'])])]))]))
+
+    scaler_function = t.add_resource(awslambda.Function('LogStreamScalerFunction',
+                                     Description='Reshards the log Kinesis stream when its CloudWatch alarms fire.',
+                                     Code=awslambda.Code(ZipFile=read_lambda_source(SCALER_LAMBDA)),
+                                     Handler='index.handler',
+                                     Runtime=Ref(runtime),
+                                     Role=GetAtt(scaler_role, 'Arn'),
+                                     MemorySize=128,
+                                     Timeout=60,
+                                     Environment=awslambda.Environment(Variables={'STREAM_NAME': Ref(log_stream),
+                                                                                  'ALARM_PREFIX': alarm_prefix,
+                                                                                  'MIN_SHARDS': Ref(min_shards),
+                                                                                  'MAX_SHARDS': Ref(max_shards),
+                                                                                  'COOLDOWN_SECONDS': Ref(cooldown)})))
+
+    scaling_topic = t.add_resource(sns.Topic('LogStreamScalingTopic',
+                                   Subscription=[sns.Subscription(Endpoint=GetAtt(scaler_function, 'Arn'), Protocol='lambda')]))
+
+    t.add_resource(awslambda.Permission('LogStreamScalerInvokePermission',
+                   Action='lambda:InvokeFunction',
+                   FunctionName=Ref(scaler_function),
+                   Principal='sns.amazonaws.com',
+                   SourceArn=Ref(scaling_topic)))
+
+    thresholds = {'scale-out': FindInMap('LogStreamCapacity', Ref(shard_count), 'ScaleOutBytes'),
+                  'throttled-scale-out': '0',
+                  'scale-in': FindInMap('LogStreamCapacity', Ref(shard_count), 'ScaleInBytes')}
+    for suffix, metric, comparison, periods, missing_data in ALARMS:
+        t.add_resource(cw.Alarm('LogStream%sAlarm' % ''.join(word.capitalize() for word in suffix.split('-')),
+                       AlarmName=Join('-', [alarm_prefix, suffix]),
+                       AlarmDescription='Reshards the log Kinesis stream (%s on %s).' % (suffix, metric),
+                       AlarmActions=[Ref(scaling_topic)],
+                       Namespace='AWS/Kinesis',
+                       MetricName=metric,
+                       Dimensions=[cw.MetricDimension(Name='StreamName', Value=Ref(log_stream))],
+                       Statistic='Sum',
+                       Period=60,
+                       EvaluationPeriods=periods,
+                       ComparisonOperator=comparison,
+                       Threshold=thresholds[suffix],
+                       TreatMissingData=missing_data))
+
+    return [min_shards.title, max_shards.title, cooldown.title, runtime.title]
+
+
+def storm_curve(minutes=240, baseline=0.5, peak=6.0, start=60, duration=60, ramp=10):
+    """Traffic in bytes per second for each minute - `baseline` MB/s with a storm ramping up to `peak` MB/s at minute `start`, holding for
+    `duration` minutes and ramping back down"""
+    curve = []
+    for minute in range(minutes):
+        if minute < start or minute >= start + duration + 2 * ramp:
+            rate = baseline
+        elif minute < start + ramp:
+            rate = baseline + (peak - baseline) * (minute - start + 1) / float(ramp)
+        elif minute < start + ramp + duration:
+            rate = peak
+        else:
+            rate = peak - (peak - baseline) * (minute - start - ramp - duration + 1) / float(ramp)
+        curve.append(rate * SHARD_BYTES_PER_SECOND)
+    return curve
+
+
+def load_curve(path):
+    """Traffic in bytes per second for each minute from a file with one value per line - the last column of CSV lines, blank lines and
+    lines starting with # are skipped"""
+    curve = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                curve.append(float(line.split(',')[-1]))
+            except ValueError:
+                raise ValueError('line %d: %r is not a number of bytes per second' % (number, line))
+    return curve
+
+
+class SimulatedStream(object):
+    """Stands in for both the Kinesis and the CloudWatch client the scaling function is handed, keeping the stream's shard count, tags and
+    alarms. Resharding completes `reshard_minutes` after UpdateShardCount, the stream is UPDATING until then."""
+
+    def __init__(self, shards, alarm_prefix, reshard_minutes=2):
+        self.shards = shards
+        self.reshard_minutes = reshard_minutes
+        self.pending = None
+        self.minute = 0
+        self.reshards = 0
+        self.tags = {}
+        self.alarms = {}
+        for suffix, metric, comparison, periods, missing_data in ALARMS:
+            self.alarms['%s-%s' % (alarm_prefix, suffix)] = {'AlarmName': '%s-%s' % (alarm_prefix, suffix), 'MetricName': metric,
+                                                              'ComparisonOperator': comparison, 'EvaluationPeriods': periods, 'StateValue': 'OK'}
+
+    def tick(self, minute):
+        self.minute = minute
+        if self.pending and minute >= self.pending[1]:
+            self.shards, self.pending = self.pending[0], None
+
+    def describe_stream_summary(self, StreamName):
+        return {'StreamDescriptionSummary': {'StreamName': StreamName, 'StreamStatus': 'UPDATING' if self.pending else 'ACTIVE', 'OpenShardCount': self.shards}}
+
+    def list_tags_for_stream(self, StreamName):
+        return {'Tags': [{'Key': key, 'Value': value} for key, value in sorted(self.tags.items())]}
+
+    def add_tags_to_stream(self, StreamName, Tags):
+        self.tags.update(Tags)
+
+    def update_shard_count(self, StreamName, TargetShardCount, ScalingType):
+        if not (self.shards + 1) // 2 <= TargetShardCount <= self.shards * 2:
+            raise ValueError('UpdateShardCount from %d open shards only accepts %d to %d, not %d'
+                             % (self.shards, (self.shards + 1) // 2, self.shards * 2, TargetShardCount))
+        self.pending = (TargetShardCount, self.minute + self.reshard_minutes)
+        self.reshards += 1
+
+    def describe_alarms(self, AlarmNamePrefix):
+        return {'MetricAlarms': [dict(alarm) for name, alarm in sorted(self.alarms.items()) if name.startswith(AlarmNamePrefix)]}
+
+    def put_metric_alarm(self, **kwargs):
+        self.alarms[kwargs['AlarmName']].update(kwargs)
+
+    def set_alarm_state(self, AlarmName, StateValue, StateReason):
+        self.alarms[AlarmName]['StateValue'] = StateValue
+
+
+@contextlib.contextmanager
+def _environment(variables):
+    previous = dict((name, os.environ.get(name)) for name in variables)
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _breaching(alarm, datapoints):
+    if alarm['ComparisonOperator'] == 'GreaterThanThreshold':
+        return all(value > alarm['Threshold'] for value in datapoints)
+    return all(value < alarm['Threshold'] for value in datapoints)
+
+
+def simulate(curve, mode, shards=1, min_shards=1, max_shards=16, cooldown=600, record_bytes=4096, reshard_minutes=2):
+    """Replay `curve` (bytes per second for each minute) against the stream in one of the STREAM_SCALING modes. Records beyond the write
+    capacity in a minute are counted as throttled rather than retried. In autoscale mode the alarms are evaluated at the end of every minute
+    and the bundled scaling function is invoked, with the simulated stream as its clients, whenever one goes into ALARM."""
+    scaler = load_lambda_module(SCALER_LAMBDA)
+    alarm_prefix = 'simulation-LogStream'
+    stream = SimulatedStream(shards, alarm_prefix, reshard_minutes)
+    for alarm in stream.alarms.values():
+        alarm['Threshold'] = scaler.threshold(shards, scaler.direction(alarm['AlarmName'])) if alarm['MetricName'] == 'IncomingBytes' else 0
+    environment = {'STREAM_NAME': 'LogStream', 'ALARM_PREFIX': alarm_prefix, 'MIN_SHARDS': str(min_shards), 'MAX_SHARDS': str(max_shards),
+                   'COOLDOWN_SECONDS': str(cooldown)}
+
+    metrics = {'IncomingBytes': [], 'WriteProvisionedThroughputExceeded': []}
+    on_demand_capacity, peak = ON_DEMAND_MIN_BYTES_PER_SECOND, 0.0
+    offered_records = throttled_records = shard_minutes = peak_capacity = 0.0
+    timeline = []
+    with _environment(environment):
+        for minute, rate in enumerate(curve):
+            stream.tick(minute)
+            if mode == ON_DEMAND:
+                if minute % ON_DEMAND_ADAPT_MINUTES == 0:
+                    on_demand_capacity = max(ON_DEMAND_MIN_BYTES_PER_SECOND, 2 * peak)
+                capacity = on_demand_capacity
+            else:
+                capacity = stream.shards * SHARD_BYTES_PER_SECOND
+                shard_minutes += stream.shards
+            record_rate = rate / record_bytes
+            accepted = min(1.0, capacity / rate if rate else 1.0, capacity / SHARD_BYTES_PER_SECOND * SHARD_RECORDS_PER_SECOND / record_rate if record_rate else 1.0)
+            peak = max(peak, rate * accepted)
+            peak_capacity = max(peak_capacity, capacity)
+            offered_records += record_rate * 60
+            throttled_records += record_rate * 60 * (1 - accepted)
+            metrics['IncomingBytes'].append(rate * 60 * accepted)
+            metrics['WriteProvisionedThroughputExceeded'].append(record_rate * 60 * (1 - accepted))
+            timeline.append({'Minute': minute, 'BytesPerSecond': rate, 'CapacityBytesPerSecond': capacity, 'ThrottledRecords': int(round(record_rate * 60 * (1 - accepted)))})
+
+            if mode != AUTOSCALE:
+                continue
+            for name in sorted(stream.alarms):
+                alarm = stream.alarms[name]
+                datapoints = metrics[alarm['MetricName']][-alarm['EvaluationPeriods']:]
+                if len(datapoints) < alarm['EvaluationPeriods'] or not _breaching(alarm, datapoints):
+                    alarm['StateValue'] = 'OK'
+                elif alarm['StateValue'] != 'ALARM':
+                    alarm['StateValue'] = 'ALARM'
+                    message = json.dumps({'AlarmName': name, 'NewStateValue': 'ALARM'})
+                    scaler.handler({'Records': [{'Sns': {'Message': message}}]}, None, kinesis=stream, cloudwatch=stream, now=lambda: stream.minute * 60.0)
+
+    return {'Mode': mode,
+            'Minutes': len(curve),
+            'OfferedRecords': int(round(offered_records)),
+            'ThrottledRecords': int(round(throttled_records)),
+            'ThrottledPercent': round(throttled_records * 100 / offered_records, 3) if offered_records else 0.0,
+            'PeakCapacityMBps': round(peak_capacity / SHARD_BYTES_PER_SECOND, 2),
+            'ShardHours': round(shard_minutes / 60, 2) if mode != ON_DEMAND else None,
+            'Reshards': stream.reshards,
+            'Timeline': timeline}
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def kinesis():
+    """Command group pertaining to the write capacity of the log target Kinesis stream - local simulation of the `target generate --stream-scaling` modes."""
+    pass
+
+
+@kinesis.command('simulate')
+@click.option('--curve', 'curve_file', type=click.Path(exists=True, dir_okay=False), help="File of traffic in bytes per second, one line per minute (the last column of CSV lines is used). Defaults to a synthetic storm shaped by the options below.")
+@click.option('--minutes', type=click.IntRange(1), default=240, help="Length of the synthetic traffic curve in minutes.")
+@click.option('--baseline', type=float, default=0.5, help="Synthetic traffic outside the storm, in MB/s.")
+@click.option('--peak', type=float, default=6.0, help="Synthetic traffic at the height of the storm, in MB/s.")
+@click.option('--storm-start', type=click.IntRange(0), default=60, help="Minute the synthetic storm starts ramping up.")
+@click.option('--storm-minutes', type=click.IntRange(0), default=60, help="Minutes the synthetic storm holds at its peak.")
+@click.option('--mode', '-m', 'mode_list', multiple=True, type=click.Choice(STREAM_SCALING), help="Scaling mode to simulate. Can be repeated, defaults to all of them.")
+@click.option('--shards', type=click.IntRange(1), default=1, help="Shard count of the stream (the initial shard count when autoscaling), as the LogStreamShardCount parameter.")
+@click.option('--min-shards', type=click.IntRange(1), default=1, help="As the LogStreamMinShardCount parameter.")
+@click.option('--max-shards', type=click.IntRange(1), default=16, help="As the LogStreamMaxShardCount parameter.")
+@click.option('--cooldown', type=click.IntRange(60), default=600, help="As the LogStreamScalingCooldown parameter, in seconds.")
+@click.option('--record-bytes', type=click.IntRange(1), default=4096, help="Average size of a CloudWatch Logs delivery (one PutRecord) in bytes - smaller records hit the per-shard record limit first.")
+@click.option('--reshard-minutes', type=click.IntRange(0), default=2, help="Minutes UpdateShardCount takes to complete.")
+@click.option('--timeline', is_flag=True, help="boolean indicates whether the capacity and throttled records for every minute should be printed too")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether the results should be printed as JSON")
+def simulate_command(curve_file=None, minutes=240, baseline=0.5, peak=6.0, storm_start=60, storm_minutes=60, mode_list=None, shards=1, min_shards=1,
+                     max_shards=16, cooldown=600, record_bytes=4096, reshard_minutes=2, timeline=False, as_json=False):
+    """Replay a traffic curve against the log Kinesis stream with fixed shards, autoscaling and on-demand capacity, reporting the records throttled in each mode."""
+    if curve_file:
+        try:
+            curve = load_curve(curve_file)
+        except ValueError as e:
+            raise click.BadParameter('%s: %s' % (curve_file, e), param_hint='--curve')
+    else:
+        curve = storm_curve(minutes, baseline, peak, storm_start, storm_minutes)
+
+    results = [simulate(curve, mode, shards, min_shards, max_shards, cooldown, record_bytes, reshard_minutes) for mode in mode_list or STREAM_SCALING]
+    if as_json:
+        click.echo(json.dumps([result if timeline else dict((key, value) for key, value in result.items() if key != 'Timeline') for result in results], indent=4, sort_keys=True))
+        return
+
+    click.echo('%-10s %12s %12s %10s %13s %12s %9s' % ('mode', 'records', 'throttled', '%', 'peak MB/s', 'shard hours', 'reshards'))
+    for result in results:
+        click.echo('%-10s %12d %12d %10.3f %13.2f %12s %9d' % (result['Mode'], result['OfferedRecords'], result['ThrottledRecords'], result['ThrottledPercent'],
+                                                              result['PeakCapacityMBps'], '-' if result['ShardHours'] is None else '%.2f' % result['ShardHours'],
+                                                              result['Reshards']))
+    for result in results if timeline else []:
+        click.echo('\n%s' % result['Mode'])
+        click.echo('%6s %12s %12s %12s' % ('minute', 'MB/s', 'capacity', 'throttled'))
+        for point in result['Timeline']:
+            click.echo('%6d %12.2f %12.2f %12d' % (point['Minute'], point['BytesPerSecond'] / SHARD_BYTES_PER_SECOND,
+                                                  point['CapacityBytesPerSecond'] / SHARD_BYTES_PER_SECOND, point['ThrottledRecords']))
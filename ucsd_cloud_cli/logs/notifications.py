@@ -0,0 +1,193 @@
+"""Object-created notifications from the log bucket to the Splunk SQS-based S3 inputs. By default the bucket notifies a single queue directly;
+with fan-out the bucket notifies an SNS topic instead, and the topic delivers to N long-polling queues, each with its own dead letter queue,
+so heavy forwarders can read them in parallel. Queues are partitioned by account or by key prefix with SNS message body filter policies on the
+object key, and an alarm counts the notifications no queue's filter policy matched. The Splunk input stanzas for the queues are derived from
+the expected object rate."""
+import math
+from urllib.parse import quote_plus
+
+from troposphere import GetAtt, Ref, Join, Output, If
+import troposphere.s3 as s3
+import troposphere.sns as sns
+import troposphere.sqs as sqs
+
+from awacs.aws import Allow, Statement, Principal, Policy, Condition, ArnLike, ArnEquals
+import awacs.sns as asns
+import awacs.sqs as asqs
+
+from .. import resources
+from .archive import cloudtrail_prefix_condition
+
+ACCOUNT = 'account'
+PREFIX = 'prefix'
+PARTITIONS = [ACCOUNT, PREFIX]
+
+# Longest ReceiveMessage wait SQS allows - a long poll returns as soon as messages arrive, so consumers never spin on an empty queue
+LONG_POLL_SECONDS = 20
+MESSAGE_RETENTION_SECONDS = 14 * 24 * 60 * 60
+# 5 m * 60 s per Splunk docs here: http://docs.splunk.com/Documentation/AddOns/released/AWS/ConfigureAWS#Configure_SQS
+VISIBILITY_TIMEOUT_SECONDS = 5 * 60
+MAX_RECEIVE_COUNT = 10
+# SNS counts every value in a filter policy towards a limit of 150
+FILTER_POLICY_MAX_VALUES = 150
+
+SQS_MAX_BATCH_SIZE = 10
+SPLUNK_MIN_INTERVAL = 30
+SPLUNK_MAX_INTERVAL = 300
+SPLUNK_DECODERS = {'CloudTrail': 'aws:cloudtrail',
+                   'VPCFlowLogs': 'aws:cloudwatchlogs:vpcflow',
+                   'Config': 'aws:config',
+                   'S3AccessLogs': 'aws:s3:accesslogs',
+                   'CustomLogs': 'aws:s3'}
+
+
+def account_prefixes(account_id, hive_partitions=False):
+    """Key prefixes the objects of one account are written under - CloudTrail (with an empty CloudTrailKeyPrefix) and flow logs delivered
+    straight to S3 below AWSLogs/, with Hive-compatible partitions when `hive_partitions`"""
+    prefixes = ['AWSLogs/%s/' % account_id]
+    if hive_partitions:
+        prefixes.append(event_key('AWSLogs/aws-account-id=%s/' % account_id))
+    return prefixes
+
+
+def _key_filter_policy(prefixes):
+    return {'Records': {'s3': {'object': {'key': [{'prefix': prefix} for prefix in prefixes]}}}}
+
+
+def event_key(prefix):
+    """A key prefix as it appears in S3 event notifications, which carry object keys URL-encoded"""
+    return quote_plus(prefix, safe='/')
+
+
+def partition(queue_count, partition_by, account_list=(), prefix_list=()):
+    """Split the accounts (sorted) or key prefixes (in the order given) round robin over `queue_count` queues. Raises ValueError when there
+    are fewer accounts or prefixes than queues."""
+    values = sorted(account_list) if partition_by == ACCOUNT else list(prefix_list)
+    if len(values) < queue_count:
+        raise ValueError('%d queue(s) need at least as many %ss to partition by, got %d' % (queue_count, partition_by, len(values)))
+    return [values[index::queue_count] for index in range(queue_count)]
+
+
+def add_notification_fanout(t, bucket_name, ct_s3_key_prefix, queue_count, partition_by=ACCOUNT, account_list=(), prefix_list=(),
+                            queue_name_prefix='s3DeliveryQueue', hive_partitions=False):
+    """Add the SNS topic, queues, dead letter queues and filtered subscriptions for notification fan-out to the target template. Queues are
+    named `queue_name_prefix`-<n> so the Splunk inputs can be written before the stack exists. Returns the bucket's NotificationConfiguration
+    and the name of the resource the bucket has to depend on."""
+    partitions = partition(queue_count, partition_by, account_list, prefix_list) if queue_count > 1 else [None]
+
+    topic = t.add_resource(sns.Topic('s3DeliveryTopic'))
+    topic_policy = t.add_resource(sns.TopicPolicy('s3DeliveryTopicPolicy',
+                                  PolicyDocument=Policy(
+                                      Statement=[Statement(
+                                          Effect=Allow,
+                                          Principal=Principal("Service", "s3.amazonaws.com"),
+                                          Action=[asns.Publish],
+                                          Resource=[Ref(topic)],
+                                          Condition=Condition(ArnLike("aws:SourceArn", Join('', ["arn:aws:s3:*:*:", Ref(bucket_name)]))))]),
+                                  Topics=[Ref(topic)]))
+
+    queues = []
+    for index, values in enumerate(partitions):
+        dead_letter_queue = t.add_resource(sqs.Queue('deadLetterQueue%d' % index,
+                                           QueueName='%s-%d-dlq' % (queue_name_prefix, index),
+                                           MessageRetentionPeriod=MESSAGE_RETENTION_SECONDS))
+
+        queue = t.add_resource(sqs.Queue('s3DeliveryQueue%d' % index,
+                               QueueName='%s-%d' % (queue_name_prefix, index),
+                               MessageRetentionPeriod=MESSAGE_RETENTION_SECONDS,
+                               ReceiveMessageWaitTimeSeconds=LONG_POLL_SECONDS,
+                               VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS,
+                               RedrivePolicy=sqs.RedrivePolicy(
+                                   deadLetterTargetArn=GetAtt(dead_letter_queue, 'Arn'),
+                                   maxReceiveCount=MAX_RECEIVE_COUNT)))
+        queues.append(queue)
+
+        subscription_args = dict(TopicArn=Ref(topic), Protocol='sqs', Endpoint=GetAtt(queue, 'Arn'), RawMessageDelivery=True)
+        if values is not None and partition_by == ACCOUNT:
+            prefixes = [prefix for account_id in values for prefix in account_prefixes(account_id, hive_partitions)]
+            # CloudTrail logs are below <CloudTrailKeyPrefix>/AWSLogs/<account>/ when the prefix is set
+            trail_prefixes = prefixes + [Join('', [Ref(ct_s3_key_prefix), '/AWSLogs/%s/' % account_id]) for account_id in values]
+            filter_policy = If(cloudtrail_prefix_condition(t, ct_s3_key_prefix), _key_filter_policy(trail_prefixes), _key_filter_policy(prefixes))
+        elif values is not None:
+            trail_prefixes = [event_key(value) for value in values]
+            filter_policy = _key_filter_policy(trail_prefixes)
+        if values is not None:
+            if len(trail_prefixes) > FILTER_POLICY_MAX_VALUES:
+                raise ValueError('queue %d filters on %d key prefixes, SNS allows %d - use more queues' % (index, len(trail_prefixes), FILTER_POLICY_MAX_VALUES))
+            subscription_args.update(FilterPolicyScope='MessageBody', FilterPolicy=filter_policy)
+        t.add_resource(resources.Subscription('s3DeliverySubscription%d' % index, **subscription_args))
+
+        t.add_output(Output('SplunkS3Queue%d' % index,
+                     Value=GetAtt(queue, 'Arn'),
+                     Description='Queue %d for Splunk SQS S3 ingest' % index))
+
+        t.add_output(Output('SplunkS3DeadLetterQueue%d' % index,
+                     Value=GetAtt(dead_letter_queue, 'Arn'),
+                     Description='Dead letter queue for Splunk SQS S3 ingest queue %d' % index))
+
+    t.add_resource(sqs.QueuePolicy('s3DeliveryQueuePolicy',
+                   PolicyDocument=Policy(
+                       Statement=[Statement(
+                           Effect=Allow,
+                           Principal=Principal("Service", "sns.amazonaws.com"),
+                           Action=[asqs.SendMessage],
+                           Resource=[GetAtt(queue, 'Arn') for queue in queues],
+                           Condition=Condition(ArnEquals("aws:SourceArn", Ref(topic))))]),
+                   Queues=[Ref(queue) for queue in queues]))
+
+    if partitions != [None]:
+        # every notification is filtered out by all queues but the one it's for - anything over that matched no queue and was dropped
+        t.add_resource(resources.Alarm('s3DeliveryUnmatchedAlarm',
+                       AlarmDescription='Log bucket object notifications that matched no notification queue filter policy and were dropped.',
+                       Metrics=[_topic_metric('filtered', 'NumberOfNotificationsFilteredOut-MessageBody', topic),
+                                _topic_metric('published', 'NumberOfMessagesPublished', topic),
+                                {'Id': 'unmatched', 'Label': 'Unmatched notifications', 'ReturnData': True,
+                                 'Expression': 'filtered - %d * published' % (len(partitions) - 1)}],
+                       ComparisonOperator='GreaterThanThreshold',
+                       Threshold=0,
+                       EvaluationPeriods=1,
+                       TreatMissingData='notBreaching'))
+
+    notification_configuration = s3.NotificationConfiguration(
+                                     TopicConfigurations=[s3.TopicConfigurations(
+                                         Event="s3:ObjectCreated:*",
+                                         Topic=Ref(topic))])
+    return notification_configuration, topic_policy.title
+
+
+def _topic_metric(metric_id, metric_name, topic):
+    return {'Id': metric_id, 'ReturnData': False,
+            'MetricStat': {'Metric': {'Namespace': 'AWS/SNS', 'MetricName': metric_name, 'Dimensions': [{'Name': 'TopicName', 'Value': GetAtt(topic, 'TopicName')}]},
+                           'Period': 300,
+                           'Stat': 'Sum'}}
+
+
+def input_settings(objects_per_minute, queue_count):
+    """Splunk SQS-based S3 input batch size and interval for each queue - the batch is the notifications expected to arrive during one long
+    poll, the interval the time one batch takes to arrive, both within the bounds the add-on accepts"""
+    per_second = float(objects_per_minute) / 60 / queue_count
+    batch_size = min(SQS_MAX_BATCH_SIZE, max(1, int(math.ceil(per_second * LONG_POLL_SECONDS))))
+    interval = min(SPLUNK_MAX_INTERVAL, max(SPLUNK_MIN_INTERVAL, int(round(batch_size / per_second)))) if per_second else SPLUNK_MAX_INTERVAL
+    return batch_size, interval
+
+
+def splunk_inputs(queue_count, deploy_account_id, deploy_region, objects_per_minute, queue_name_prefix='s3DeliveryQueue', aws_account='seimLogAggregationStack',
+                  decoder='CloudTrail', index='main'):
+    """inputs.conf stanzas for the Splunk Add-on for AWS reading each fan-out queue"""
+    batch_size, interval = input_settings(objects_per_minute, queue_count)
+    lines = ['# Splunk Add-on for AWS SQS-based S3 inputs for the log target notification queues',
+             '# %g object(s)/min over %d queue(s): sqs_batch_size %d, interval %d s' % (objects_per_minute, queue_count, batch_size, interval)]
+    for number in range(queue_count):
+        queue_name = '%s-%d' % (queue_name_prefix, number)
+        lines.extend(['',
+                      '[aws_sqs_based_s3://%s]' % queue_name,
+                      'aws_account = %s' % aws_account,
+                      'sqs_queue_region = %s' % deploy_region,
+                      'sqs_queue_url = https://sqs.%s.amazonaws.com/%s/%s' % (deploy_region, deploy_account_id, queue_name),
+                      's3_file_decoder = %s' % decoder,
+                      'sourcetype = %s' % SPLUNK_DECODERS[decoder],
+                      'index = %s' % index,
+                      'interval = %d' % interval,
+                      'sqs_batch_size = %d' % batch_size,
+                      'using_dlq = 1'])
+    return '\n'.join(lines) + '\n'
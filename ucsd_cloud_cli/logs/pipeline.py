@@ -0,0 +1,499 @@
+"""End-to-end simulation of the log pipeline a target template deploys. The topology is read from the template itself: the Kinesis stream behind
+the CloudWatch Logs destination and its shard count or capacity mode, the Firehose buffering hints and destination bucket, the buckets' object
+notifications (straight to a queue, or through an SNS topic and the subscriptions' filter policies) and every queue's visibility timeout, long
+polling and redrive policy - so the result follows whatever `target generate` options produced the template. Synthetic CloudWatch Logs traffic
+(a `kinesis simulate` traffic curve) and the five-minute CloudTrail log files of every account are stepped through it a second at a time.
+Deliveries beyond the stream's write capacity are throttled and retried, Firehose writes an object once either buffering hint is reached, and
+consumers receive, process and delete the notifications. Failed messages reappear after the visibility timeout until the redrive policy moves
+them to the dead letter queue. The latency of an event runs until the notification of the object holding it is processed or, for buckets
+without notifications, until the object is written."""
+import click
+import collections
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+
+from ..common import data_dir
+from .kinesis import simulate as simulate_stream, storm_curve, load_curve, FIXED, AUTOSCALE, ON_DEMAND, SHARD_BYTES_PER_SECOND, SHARD_RECORDS_PER_SECOND
+
+DEFAULT_TEMPLATE = os.path.join(data_dir, 'cloudformation', 'log_aggregation', 'log_targets.json')
+
+CLOUDWATCH_LOGS = 'CloudWatchLogs'
+CLOUDTRAIL = 'CloudTrail'
+
+# Firehose reads a shard at twice the rate it can be written to
+SHARD_READ_BYTES_PER_SECOND = 2 * SHARD_BYTES_PER_SECOND
+# CloudTrail writes each trail's log file every 5 minutes
+CLOUDTRAIL_INTERVAL_SECONDS = 300
+# Seconds for S3 to notify a queue or topic, and for SNS to deliver to a subscribed queue
+NOTIFICATION_SECONDS = 1
+MAX_RECEIVE_MESSAGES = 10
+# Service defaults for settings the template leaves out
+FIREHOSE_INTERVAL_SECONDS = 300
+FIREHOSE_SIZE_MBS = 5
+VISIBILITY_TIMEOUT = 30
+
+
+def resolve(value, parameters, conditions=None):
+    """Evaluate the intrinsic functions the target template uses - a Ref to a parameter gives its value, a Ref to a resource (or a pseudo
+    parameter) and Fn::GetAtt give the logical name, Fn::Join joins, Fn::Equals and Fn::Not evaluate conditions and Fn::If picks by the
+    evaluated `conditions`"""
+    if isinstance(value, list):
+        return [resolve(item, parameters, conditions) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if 'Ref' in value:
+        return parameters.get(value['Ref'], value['Ref'])
+    if 'Fn::GetAtt' in value:
+        return value['Fn::GetAtt'][0]
+    if 'Fn::Join' in value:
+        delimiter, items = value['Fn::Join']
+        return delimiter.join('%s' % item for item in resolve(items, parameters, conditions))
+    if 'Fn::If' in value:
+        condition, if_true, if_false = value['Fn::If']
+        return resolve(if_true if conditions[condition] else if_false, parameters, conditions)
+    if 'Fn::Equals' in value:
+        first, second = resolve(value['Fn::Equals'], parameters, conditions)
+        return '%s' % first == '%s' % second
+    if 'Fn::Not' in value:
+        return not resolve(value['Fn::Not'][0], parameters, conditions)
+    return dict((key, resolve(item, parameters, conditions)) for key, item in value.items())
+
+
+def topology(template, overrides=None, buffer_interval=None, buffer_size=None):
+    """The pipeline described by a target `template` dict, with its parameter defaults replaced by `overrides` and, if given, the Firehose
+    buffering hints by `buffer_interval` (seconds) and `buffer_size` (MB). Raises ValueError when the template has no stream feeding Firehose."""
+    parameters = dict((name, parameter.get('Default')) for name, parameter in template.get('Parameters', {}).items())
+    unknown = sorted(set(overrides or {}) - set(parameters))
+    if unknown:
+        raise ValueError('unknown parameter(s) %s' % ', '.join(unknown))
+    parameters.update(overrides or {})
+    conditions = dict((name, resolve(condition, parameters)) for name, condition in template.get('Conditions', {}).items())
+    resources = dict((name, (resource['Type'], resolve(resource.get('Properties', {}), parameters, conditions)))
+                     for name, resource in template.get('Resources', {}).items())
+
+    def of_type(resource_type):
+        return [(name, properties) for name, (type_name, properties) in sorted(resources.items()) if type_name == resource_type]
+
+    firehoses = [(name, properties) for name, properties in of_type('AWS::KinesisFirehose::DeliveryStream')
+                 if properties.get('KinesisStreamSourceConfiguration', {}).get('KinesisStreamARN') in dict(of_type('AWS::Kinesis::Stream'))]
+    if not firehoses:
+        raise ValueError('no Firehose delivery stream reading from a Kinesis stream')
+    firehose, firehose_properties = firehoses[0]
+    stream = firehose_properties['KinesisStreamSourceConfiguration']['KinesisStreamARN']
+    stream_properties = resources[stream][1]
+    destination = firehose_properties.get('ExtendedS3DestinationConfiguration') or firehose_properties.get('S3DestinationConfiguration', {})
+    hints = destination.get('BufferingHints', {})
+
+    # the autoscaling function is the one handed the stream's name
+    scalers = [properties['Environment']['Variables'] for _, properties in of_type('AWS::Lambda::Function')
+               if properties.get('Environment', {}).get('Variables', {}).get('STREAM_NAME') == stream]
+    if stream_properties.get('StreamModeDetails', {}).get('StreamMode') == 'ON_DEMAND':
+        mode = ON_DEMAND
+    else:
+        mode = AUTOSCALE if scalers else FIXED
+    scaler = scalers[0] if scalers else {}
+
+    queues = {}
+    for name, properties in of_type('AWS::SQS::Queue'):
+        redrive = properties.get('RedrivePolicy')
+        redrive = json.loads(redrive) if isinstance(redrive, str) else redrive
+        queues[name] = {'Name': properties.get('QueueName', name),
+                        'VisibilityTimeout': int(properties.get('VisibilityTimeout', VISIBILITY_TIMEOUT)),
+                        'WaitSeconds': int(properties.get('ReceiveMessageWaitTimeSeconds', 0)),
+                        'MaxReceiveCount': int(redrive['maxReceiveCount']) if redrive else None,
+                        'DeadLetterQueue': redrive['deadLetterTargetArn'] if redrive else None}
+
+    topics = dict((name, [(subscription['Endpoint'], None) for subscription in properties.get('Subscription', []) if subscription.get('Protocol') == 'sqs'])
+                  for name, properties in of_type('AWS::SNS::Topic'))
+    for _, properties in of_type('AWS::SNS::Subscription'):
+        if properties.get('Protocol') == 'sqs':
+            topics.setdefault(properties['TopicArn'], []).append((properties['Endpoint'], properties.get('FilterPolicy')))
+
+    notifications = {}
+    for name, properties in of_type('AWS::S3::Bucket'):
+        configuration = properties.get('NotificationConfiguration')
+        if configuration is not None:
+            notifications[name] = ([('queue', c['Queue'], c.get('Filter')) for c in configuration.get('QueueConfigurations', [])] +
+                                   [('topic', c['Topic'], c.get('Filter')) for c in configuration.get('TopicConfigurations', [])])
+
+    # CloudTrail writes to the bucket whose policy lets it put objects, under <prefix>/AWSLogs/<account>/
+    cloudtrail_bucket, cloudtrail_prefixes = None, []
+    for _, properties in of_type('AWS::S3::BucketPolicy'):
+        for statement in properties.get('PolicyDocument', {}).get('Statement', []):
+            if statement.get('Principal', {}).get('Service') == 'cloudtrail.amazonaws.com' and 's3:PutObject' in statement.get('Action', []):
+                cloudtrail_bucket = properties['Bucket']
+                for arn in statement.get('Resource', []):
+                    match = re.match(r'^%s(.*AWSLogs/\d{12}/)' % re.escape(cloudtrail_bucket), arn)
+                    if match:
+                        cloudtrail_prefixes.append(match.group(1).lstrip('/'))
+
+    return {'Stream': stream,
+            'Mode': mode,
+            'Shards': int(stream_properties.get('ShardCount', 1)),
+            'MinShards': int(scaler.get('MIN_SHARDS', 1)),
+            'MaxShards': int(scaler.get('MAX_SHARDS', 16)),
+            'Cooldown': int(scaler.get('COOLDOWN_SECONDS', 600)),
+            'Firehose': firehose,
+            'BufferInterval': buffer_interval or int(hints.get('IntervalInSeconds', FIREHOSE_INTERVAL_SECONDS)),
+            'BufferSize': buffer_size or int(hints.get('SizeInMBs', FIREHOSE_SIZE_MBS)),
+            'FirehoseBucket': destination.get('BucketARN'),
+            'FirehosePrefix': destination.get('Prefix', ''),
+            'CloudTrailBucket': cloudtrail_bucket,
+            'CloudTrailPrefixes': sorted(set(cloudtrail_prefixes)),
+            'Queues': queues,
+            'Topics': topics,
+            'Notifications': notifications}
+
+
+def _key_filter(notification_filter, key):
+    for rule in (notification_filter or {}).get('S3Key', {}).get('Rules', []):
+        if rule['Name'].lower() == 'prefix' and not key.startswith(rule['Value']):
+            return False
+        if rule['Name'].lower() == 'suffix' and not key.endswith(rule['Value']):
+            return False
+    return True
+
+
+def _filter_policy(policy, key):
+    policy = json.loads(policy) if isinstance(policy, str) else policy
+    conditions = (policy or {}).get('Records', {}).get('s3', {}).get('object', {}).get('key')
+    if conditions is None:
+        return True
+    return any(key.startswith(c['prefix']) if isinstance(c, dict) and 'prefix' in c else c == key for c in conditions)
+
+
+def route(pipeline, bucket, key):
+    """The queues an object written to `bucket` under `key` is notified to, with the seconds each notification takes to get there. None when
+    the bucket sends no notifications, an empty list when it does but no filter matches the key."""
+    if bucket not in pipeline['Notifications']:
+        return None
+    routes = []
+    for kind, target, notification_filter in pipeline['Notifications'][bucket]:
+        if not _key_filter(notification_filter, key):
+            continue
+        if kind == 'queue':
+            routes.append((target, NOTIFICATION_SECONDS))
+        else:
+            routes.extend((queue, 2 * NOTIFICATION_SECONDS) for queue, policy in pipeline['Topics'].get(target, []) if _filter_policy(policy, key))
+    return routes
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Percentiles of (value, weight) `samples`, None for each point when there are none"""
+    samples = sorted(samples)
+    total = sum(weight for _, weight in samples)
+    results = []
+    for point in points:
+        threshold, running, result = total * point / 100.0, 0.0, None
+        for value, weight in samples:
+            running += weight
+            if running >= threshold:
+                result = value
+                break
+        results.append(result if samples else None)
+    return results
+
+
+def simulate(pipeline, curve, cloudtrail_regions=1, cloudtrail_events=5.0, event_bytes=512, cloudtrail_event_bytes=1500, record_bytes=4096, consumers=2,
+             batch_size=MAX_RECEIVE_MESSAGES, poll_interval=30, object_seconds=1.0, consumer_mbps=10.0, failure_rate=0.0, seed=0):
+    """Step CloudWatch Logs traffic following `curve` (bytes per second for each minute) and the CloudTrail log files of `cloudtrail_regions`
+    trails per account, each with `cloudtrail_events` events a second, through the `pipeline` (see topology) one second at a time.
+
+    The stream's write capacity each minute comes from the `kinesis simulate` model of its mode. Every notified queue gets `consumers`
+    consumers that receive up to `batch_size` messages and process each in `object_seconds` plus its size at `consumer_mbps`. A
+    `failure_rate` share of messages fail and aren't deleted. Consumers that find nothing wait out the long poll (if any) and then
+    `poll_interval` seconds before polling again. Throttled records are the ones whose first PutRecord was rejected - behind a backlog of retries, that's all of them."""
+    rng = random.Random(seed)
+    seconds = len(curve) * 60
+    capacity = [point['CapacityBytesPerSecond'] for point in
+                simulate_stream(curve, pipeline['Mode'], pipeline['Shards'], pipeline['MinShards'], pipeline['MaxShards'], pipeline['Cooldown'], record_bytes)['Timeline']]
+    event_sizes = {CLOUDWATCH_LOGS: float(event_bytes), CLOUDTRAIL: float(cloudtrail_event_bytes)}
+    samples = {CLOUDWATCH_LOGS: [], CLOUDTRAIL: []}
+    offered = dict((source, 0.0) for source in samples)
+
+    trails = [(prefix, 'region%d' % region) for prefix in pipeline['CloudTrailPrefixes'] for region in range(cloudtrail_regions)]
+    trails_by_offset = collections.defaultdict(list)
+    for index, trail in enumerate(trails):
+        trails_by_offset[index * CLOUDTRAIL_INTERVAL_SECONDS // len(trails)].append(trail)
+
+    consumed = set(queue for routes in pipeline['Notifications'].values() for kind, target, _ in routes
+                   for queue in ([target] if kind == 'queue' else [q for q, _ in pipeline['Topics'].get(target, [])]))
+    queues = dict((name, dict(settings, Heap=[], Received=0, Deleted=0, Duplicates=0, Failures=0, EmptyReceives=0, DeadLettered=0, MaxVisible=0,
+                              MaxAgeSeconds=0, Consumers=[{'Batch': None, 'BusyUntil': 0, 'NextPoll': 0, 'WaitingUntil': None} for _ in range(consumers if name in consumed else 0)]))
+                  for name, settings in pipeline['Queues'].items())
+    sequence = itertools.count()
+
+    pending, stream, buffer = collections.deque(), collections.deque(), []
+    pending_bytes = stream_bytes = buffered = 0.0
+    opened = None
+    notifications = []
+    totals = {'ThrottledRecords': 0.0, 'OfferedRecords': 0.0, 'Objects': 0, 'FirehoseObjects': 0, 'Unrouted': 0}
+    timeline = []
+
+    def finish(written, at):
+        if written['Done']:
+            return
+        written['Done'] = True
+        samples[written['Source']].extend((at - event_time, size / event_sizes[written['Source']]) for event_time, size in written['Cohorts'])
+
+    def write(source, bucket, key, cohorts, now):
+        written = {'Source': source, 'Key': key, 'Cohorts': cohorts, 'Bytes': sum(size for _, size in cohorts), 'Done': False}
+        totals['Objects'] += 1
+        routes = route(pipeline, bucket, key)
+        if routes is None:
+            finish(written, now)
+        elif not routes:
+            totals['Unrouted'] += 1
+        for queue, delay in routes or []:
+            heapq.heappush(notifications, (now + delay, next(sequence), queue, written))
+
+    def receive(queue, now):
+        batch = []
+        while queue['Heap'] and queue['Heap'][0][0] <= now and len(batch) < batch_size:
+            _, _, message, receipt = heapq.heappop(queue['Heap'])
+            if message['Deleted'] or receipt != message['Receipt']:
+                continue
+            message['Receives'] += 1
+            if queue['MaxReceiveCount'] and message['Receives'] > queue['MaxReceiveCount']:
+                message['Deleted'] = True
+                queue['DeadLettered'] += 1
+                continue
+            message['Receipt'] += 1
+            message['VisibleAt'] = now + queue['VisibilityTimeout']
+            heapq.heappush(queue['Heap'], (message['VisibleAt'], next(sequence), message, message['Receipt']))
+            batch.append((message, message['Receipt']))
+        queue['Received'] += len(batch)
+        return batch
+
+    for now in range(seconds):
+        minute = now // 60
+
+        # CloudWatch Logs puts each second's events on the stream, retrying what is throttled
+        rate = curve[minute]
+        if rate:
+            pending.append([now, rate])
+            pending_bytes += rate
+            offered[CLOUDWATCH_LOGS] += rate / event_bytes
+            totals['OfferedRecords'] += rate / record_bytes
+        allowance = min(capacity[minute], capacity[minute] / SHARD_BYTES_PER_SECOND * SHARD_RECORDS_PER_SECOND * record_bytes)
+        while pending and allowance > 0:
+            taken = min(pending[0][1], allowance)
+            stream.append([pending[0][0], taken])
+            stream_bytes += taken
+            pending_bytes -= taken
+            allowance -= taken
+            pending[0][1] -= taken
+            if pending[0][1] <= 0:
+                pending.popleft()
+        if pending and pending[-1][0] == now:
+            totals['ThrottledRecords'] += pending[-1][1] / record_bytes
+
+        # Firehose reads the stream into its buffer and writes an object once either hint is reached
+        allowance = capacity[minute] / SHARD_BYTES_PER_SECOND * SHARD_READ_BYTES_PER_SECOND
+        while stream and allowance > 0:
+            taken = min(stream[0][1], allowance)
+            buffer.append((stream[0][0], taken))
+            buffered += taken
+            stream_bytes -= taken
+            allowance -= taken
+            stream[0][1] -= taken
+            if stream[0][1] <= 0:
+                stream.popleft()
+            opened = now if opened is None else opened
+        if buffer and (buffered >= pipeline['BufferSize'] * SHARD_BYTES_PER_SECOND or now - opened >= pipeline['BufferInterval']):
+            totals['FirehoseObjects'] += 1
+            write(CLOUDWATCH_LOGS, pipeline['FirehoseBucket'], '%s%s-%d' % (pipeline['FirehosePrefix'], pipeline['Firehose'], now), buffer, now)
+            buffer, buffered, opened = [], 0.0, None
+
+        # each trail's log file holds the events of the last five minutes
+        for prefix, region in trails_by_offset.get(now % CLOUDTRAIL_INTERVAL_SECONDS, []):
+            size = cloudtrail_events * CLOUDTRAIL_INTERVAL_SECONDS * cloudtrail_event_bytes
+            offered[CLOUDTRAIL] += size / cloudtrail_event_bytes
+            cohorts = [(now - 30 - 60 * n, size / 5.0) for n in range(5)]
+            write(CLOUDTRAIL, pipeline['CloudTrailBucket'], '%sCloudTrail/%s/%d.json.gz' % (prefix, region, now), cohorts, now)
+
+        while notifications and notifications[0][0] <= now:
+            _, _, name, written = heapq.heappop(notifications)
+            message = {'Object': written, 'Sent': now, 'VisibleAt': now, 'Receives': 0, 'Receipt': 0, 'Deleted': False, 'Processed': False}
+            heapq.heappush(queues[name]['Heap'], (now, next(sequence), message, 0))
+
+        for queue in queues.values():
+            for consumer in queue['Consumers']:
+                if consumer['Batch'] is not None:
+                    if now < consumer['BusyUntil']:
+                        continue
+                    for message, receipt in consumer['Batch']:
+                        if rng.random() < failure_rate:
+                            queue['Failures'] += 1
+                            continue
+                        queue['Duplicates'] += message['Processed']
+                        message['Processed'] = True
+                        finish(message['Object'], now)
+                        # a receipt from before the message became visible again no longer deletes it
+                        if receipt == message['Receipt'] and now < message['VisibleAt']:
+                            message['Deleted'] = True
+                            queue['Deleted'] += 1
+                    consumer['Batch'] = None
+                if now < consumer['NextPoll']:
+                    continue
+                batch = receive(queue, now)
+                if batch:
+                    consumer['Batch'], consumer['WaitingUntil'] = batch, None
+                    consumer['BusyUntil'] = now + sum(object_seconds + message['Object']['Bytes'] / (consumer_mbps * SHARD_BYTES_PER_SECOND) for message, _ in batch)
+                elif queue['WaitSeconds'] and consumer['WaitingUntil'] is None:
+                    consumer['WaitingUntil'] = now + queue['WaitSeconds']
+                elif not queue['WaitSeconds'] or now >= consumer['WaitingUntil']:
+                    queue['EmptyReceives'] += 1
+                    consumer['WaitingUntil'] = None
+                    consumer['NextPoll'] = now + poll_interval
+
+        if now % 60 == 59:
+            visible = in_flight = 0
+            for queue in queues.values():
+                live = [(visible_at, message) for visible_at, _, message, receipt in queue['Heap'] if not message['Deleted'] and receipt == message['Receipt']]
+                ready = [message for visible_at, message in live if visible_at <= now]
+                queue['MaxVisible'] = max(queue['MaxVisible'], len(ready))
+                queue['MaxAgeSeconds'] = max([queue['MaxAgeSeconds']] + [now - message['Sent'] for message in ready])
+                visible += len(ready)
+                in_flight += len(live) - len(ready)
+            timeline.append({'Minute': minute, 'BytesPerSecond': rate, 'CapacityBytesPerSecond': capacity[minute], 'PendingBytes': pending_bytes,
+                             'IteratorAgeSeconds': now - stream[0][0] if stream else 0, 'BufferedBytes': buffered, 'Visible': visible, 'InFlight': in_flight,
+                             'DeadLettered': sum(queue['DeadLettered'] for queue in queues.values())})
+
+    latency = {}
+    for source, source_samples in sorted(samples.items()):
+        p50, p90, p99 = percentiles(source_samples)
+        delivered = sum(weight for _, weight in source_samples)
+        latency[source] = {'Events': int(round(offered[source])), 'Delivered': int(round(delivered)), 'P50': p50, 'P90': p90, 'P99': p99,
+                           'Max': max(value for value, _ in source_samples) if source_samples else None}
+    growth = (timeline[-1]['Visible'] - timeline[0]['Visible']) / float(len(timeline) - 1) if len(timeline) > 1 else 0.0
+    return {'Mode': pipeline['Mode'],
+            'Shards': pipeline['Shards'] if pipeline['Mode'] != ON_DEMAND else None,
+            'BufferInterval': pipeline['BufferInterval'],
+            'BufferSize': pipeline['BufferSize'],
+            'Minutes': len(curve),
+            'Latency': latency,
+            'OfferedRecords': int(round(totals['OfferedRecords'])),
+            'ThrottledRecords': int(round(totals['ThrottledRecords'])),
+            'ThrottledPercent': round(totals['ThrottledRecords'] * 100 / totals['OfferedRecords'], 3) if totals['OfferedRecords'] else 0.0,
+            'MaxPendingBytes': max([0] + [point['PendingBytes'] for point in timeline]),
+            'MaxIteratorAgeSeconds': max([0] + [point['IteratorAgeSeconds'] for point in timeline]),
+            'Objects': totals['Objects'],
+            'FirehoseObjects': totals['FirehoseObjects'],
+            'Unrouted': totals['Unrouted'],
+            'MaxVisible': max([0] + [point['Visible'] for point in timeline]),
+            'BacklogGrowthPerMinute': round(growth, 3),
+            'DeadLettered': sum(queue['DeadLettered'] for queue in queues.values()),
+            'Queues': [dict((key, value) for key, value in queue.items() if key not in ('Heap', 'Consumers')) for name, queue in sorted(queues.items()) if name in consumed],
+            'Timeline': timeline}
+
+
+def _variants(parameter_list):
+    values = collections.OrderedDict()
+    for parameter in parameter_list:
+        name, separator, value = parameter.partition('=')
+        if not separator or not name:
+            raise click.BadParameter('%r is not Name=Value' % parameter, param_hint='-P/--parameter')
+        values.setdefault(name, [])
+        if value not in values[name]:
+            values[name].append(value)
+    return [collections.OrderedDict(zip(values, combination)) for combination in itertools.product(*values.values())]
+
+
+def _seconds(value):
+    return '-' if value is None else '%d' % value
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def pipeline():
+    """Command group pertaining to the end-to-end behaviour of the log target pipeline - local load testing of generated target templates."""
+    pass
+
+
+@pipeline.command('simulate')
+@click.argument('template_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('-P', '--parameter', 'parameter_list', multiple=True, help="Template parameter override as Name=Value, e.g. LogStreamShardCount=4. Repeat a name with different values to compare them - every combination is simulated.")
+@click.option('--buffer-interval', 'buffer_interval_list', multiple=True, type=click.IntRange(60, 900), help="Firehose IntervalInSeconds buffering hint to simulate instead of the template's. Can be repeated to compare.")
+@click.option('--buffer-size', 'buffer_size_list', multiple=True, type=click.IntRange(1, 128), help="Firehose SizeInMBs buffering hint to simulate instead of the template's. Can be repeated to compare.")
+@click.option('--curve', 'curve_file', type=click.Path(exists=True, dir_okay=False), help="File of CloudWatch Logs traffic in bytes per second, one line per minute (the last column of CSV lines is used). Defaults to a synthetic storm shaped by the options below.")
+@click.option('--minutes', type=click.IntRange(1), default=120, help="Length of the synthetic traffic curve in minutes.")
+@click.option('--baseline', type=float, default=0.5, help="Synthetic CloudWatch Logs traffic outside the storm, in MB/s.")
+@click.option('--peak', type=float, default=6.0, help="Synthetic CloudWatch Logs traffic at the height of the storm, in MB/s.")
+@click.option('--storm-start', type=click.IntRange(0), default=30, help="Minute the synthetic storm starts ramping up.")
+@click.option('--storm-minutes', type=click.IntRange(0), default=30, help="Minutes the synthetic storm holds at its peak.")
+@click.option('--event-bytes', type=click.IntRange(1), default=512, help="Average size of a CloudWatch Logs event in bytes.")
+@click.option('--record-bytes', type=click.IntRange(1), default=4096, help="Average size of a CloudWatch Logs delivery (one PutRecord) in bytes.")
+@click.option('--cloudtrail-regions', type=click.IntRange(0), default=1, help="Trails writing log files for each account in the template's CloudTrail bucket policy.")
+@click.option('--cloudtrail-events', type=float, default=5.0, help="CloudTrail events per second of each trail.")
+@click.option('--cloudtrail-event-bytes', type=click.IntRange(1), default=1500, help="Average size of a CloudTrail event in bytes.")
+@click.option('--consumers', type=click.IntRange(1), default=2, help="Consumers (e.g. Splunk SQS-based S3 inputs) reading each notification queue.")
+@click.option('--batch-size', type=click.IntRange(1, MAX_RECEIVE_MESSAGES), default=MAX_RECEIVE_MESSAGES, help="Messages a consumer receives at once.")
+@click.option('--poll-interval', type=click.IntRange(0), default=30, help="Seconds a consumer waits after an empty receive.")
+@click.option('--object-seconds', type=float, default=1.0, help="Seconds a consumer takes per object, on top of reading it.")
+@click.option('--consumer-mbps', type=float, default=10.0, help="Rate a consumer reads objects at, in MB/s.")
+@click.option('--failure-rate', type=float, default=0.0, help="Share (0 to 1) of messages a consumer fails to process and leaves on the queue.")
+@click.option('--seed', type=int, default=0, help="Seed of the consumer failures.")
+@click.option('--timeline', is_flag=True, help="boolean indicates whether the backlog of every stage for every minute should be printed too")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether the results should be printed as JSON")
+def simulate_command(template_files=None, parameter_list=None, buffer_interval_list=None, buffer_size_list=None, curve_file=None, minutes=120, baseline=0.5, peak=6.0,
+                     storm_start=30, storm_minutes=30, event_bytes=512, record_bytes=4096, cloudtrail_regions=1, cloudtrail_events=5.0, cloudtrail_event_bytes=1500,
+                     consumers=2, batch_size=MAX_RECEIVE_MESSAGES, poll_interval=30, object_seconds=1.0, consumer_mbps=10.0, failure_rate=0.0, seed=0, timeline=False,
+                     as_json=False):
+    """Drive synthetic CloudWatch Logs and CloudTrail traffic through an in-process model of each target template (default: the bundled log_targets.json) and every combination of overrides, reporting end-to-end latency percentiles, throttling and backlog growth."""
+    if not 0 <= failure_rate <= 1:
+        raise click.BadParameter('%s is not between 0 and 1' % failure_rate, param_hint='--failure-rate')
+    if curve_file:
+        try:
+            curve = load_curve(curve_file)
+        except ValueError as e:
+            raise click.BadParameter('%s: %s' % (curve_file, e), param_hint='--curve')
+    else:
+        curve = storm_curve(minutes, baseline, peak, storm_start, storm_minutes)
+
+    results = []
+    for template_file in template_files or [DEFAULT_TEMPLATE]:
+        try:
+            with open(template_file) as f:
+                template = json.load(f)
+        except ValueError as e:
+            raise click.BadParameter('%s: %s' % (template_file, e), param_hint='TEMPLATE_FILES')
+        for overrides, buffer_interval, buffer_size in itertools.product(_variants(parameter_list or []), buffer_interval_list or [None], buffer_size_list or [None]):
+            try:
+                model = topology(template, overrides, buffer_interval, buffer_size)
+            except ValueError as e:
+                raise click.BadParameter('%s: %s' % (template_file, e), param_hint='TEMPLATE_FILES')
+            result = simulate(model, curve, cloudtrail_regions, cloudtrail_events, event_bytes, cloudtrail_event_bytes, record_bytes, consumers, batch_size,
+                              poll_interval, object_seconds, consumer_mbps, failure_rate, seed)
+            label = ' '.join([os.path.basename(template_file)] + ['%s=%s' % item for item in overrides.items()] +
+                             (['buffer=%ds/%dMB' % (model['BufferInterval'], model['BufferSize'])] if buffer_interval or buffer_size else []))
+            results.append(dict(result, Variant=label))
+
+    if as_json:
+        click.echo(json.dumps([result if timeline else dict((key, value) for key, value in result.items() if key != 'Timeline') for result in results], indent=4, sort_keys=True))
+        return
+
+    click.echo('%-48s %9s %9s %9s %9s %10s %9s %8s %9s %5s' % ('variant', 'logs p50', 'logs p99', 'trail p50', 'trail p99', 'throttled%', 'iter age', 'queued', 'growth/m', 'dlq'))
+    for result in results:
+        logs, trail = result['Latency'][CLOUDWATCH_LOGS], result['Latency'][CLOUDTRAIL]
+        click.echo('%-48s %9s %9s %9s %9s %10.3f %9d %8d %9.2f %5d' % (result['Variant'], _seconds(logs['P50']), _seconds(logs['P99']), _seconds(trail['P50']),
+                                                                     _seconds(trail['P99']), result['ThrottledPercent'], result['MaxIteratorAgeSeconds'],
+                                                                     result['MaxVisible'], result['BacklogGrowthPerMinute'], result['DeadLettered']))
+        if result['Unrouted']:
+            click.echo('  %d object(s) matched no notification filter' % result['Unrouted'])
+    for result in results if timeline else []:
+        click.echo('\n%s' % result['Variant'])
+        click.echo('%6s %9s %9s %11s %9s %12s %8s %9s %5s' % ('minute', 'MB/s', 'capacity', 'pending MB', 'iter age', 'buffered MB', 'queued', 'in flight', 'dlq'))
+        for point in result['Timeline']:
+            click.echo('%6d %9.2f %9.2f %11.2f %9d %12.2f %8d %9d %5d' % (point['Minute'], point['BytesPerSecond'] / SHARD_BYTES_PER_SECOND,
+                                                                        point['CapacityBytesPerSecond'] / SHARD_BYTES_PER_SECOND, point['PendingBytes'] / SHARD_BYTES_PER_SECOND,
+                                                                        point['IteratorAgeSeconds'], point['BufferedBytes'] / SHARD_BYTES_PER_SECOND, point['Visible'],
+                                                                        point['InFlight'], point['DeadLettered']))
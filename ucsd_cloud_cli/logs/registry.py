@@ -0,0 +1,274 @@
+"""YAML-backed registry of the child accounts shipping logs to the log target account - their names, organizational units, regions and
+onboarding state. Every change bumps the registry revision, and the accounts and regions the target stack was last deployed with are recorded
+against the revision they came from, so `target generate --registry` can work out what changed since and how much of the stack it touches."""
+import click
+import collections
+import json
+import os
+import re
+import yaml
+
+PENDING = 'pending'
+ONBOARDING = 'onboarding'
+ACTIVE = 'active'
+OFFBOARDED = 'offboarded'
+STATES = [PENDING, ONBOARDING, ACTIVE, OFFBOARDED]
+
+# accounts in these states are granted access by the target stack's policies
+TARGET_STATES = [ONBOARDING, ACTIVE]
+
+DEFAULT_REGISTRY = 'accounts.yaml'
+ACCOUNT_ID = re.compile(r'^[0-9]{12}$')
+
+
+class RegistryError(ValueError):
+    """Raised when a registry file or a change to it is invalid"""
+    pass
+
+
+class _RegistryLoader(yaml.SafeLoader):
+    """SafeLoader that only reads plain decimal numbers as integers. YAML 1.1 reads unquoted numbers starting with 0 as octal (or leaves them
+    as strings when they hold an 8 or 9), which would turn an account ID like 012345670123 into a different number."""
+    pass
+
+
+_RegistryLoader.yaml_implicit_resolvers = dict((first, [(tag, regexp) for tag, regexp in resolvers if tag != 'tag:yaml.org,2002:int'])
+                                               for first, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items())
+_RegistryLoader.add_implicit_resolver('tag:yaml.org,2002:int', re.compile(r'^[-+]?(?:0|[1-9][0-9]*)$'), list('-+0123456789'))
+
+
+def new_registry():
+    return {'revision': 0, 'accounts': {}, 'deployed': None}
+
+
+def _account_id(value):
+    account_id = str(value)
+    if not ACCOUNT_ID.match(account_id):
+        raise RegistryError('%s is not a 12 digit AWS account ID' % value)
+    return account_id
+
+
+def load_registry(path):
+    """Read a registry file, returning an empty registry if it doesn't exist yet. Unquoted account IDs keep their leading zeros and come back
+    as 12 digit strings."""
+    if not os.path.exists(path):
+        return new_registry()
+    with open(path) as f:
+        document = yaml.load(f, Loader=_RegistryLoader) or {}
+    registry = new_registry()
+    registry['revision'] = int(document.get('revision', 0))
+    registry['deployed'] = document.get('deployed')
+    for key, account in (document.get('accounts') or {}).items():
+        account = dict(account or {})
+        account.setdefault('state', ONBOARDING)
+        account['regions'] = sorted(account.get('regions') or [])
+        if account['state'] not in STATES:
+            raise RegistryError('account %s has unknown state %s' % (key, account['state']))
+        registry['accounts'][_account_id(key)] = account
+    if registry['deployed']:
+        registry['deployed']['accounts'] = [_account_id(a) for a in registry['deployed'].get('accounts', [])]
+    return registry
+
+
+def save_registry(registry, path):
+    """Write a registry file, replacing the previous one atomically"""
+    with open(path + '.tmp', 'w') as f:
+        f.write('# Account registry maintained by `ccli registry`, read by `ccli target generate --registry`\n')
+        yaml.safe_dump(registry, f, default_flow_style=False)
+    os.replace(path + '.tmp', path)
+
+
+def update_accounts(registry, account_ids, name=None, ou=None, regions=None, state=None):
+    """Add or update accounts, bumping the registry revision if anything changed. Returns the IDs of the accounts that changed."""
+    if state is not None and state not in STATES:
+        raise RegistryError('unknown state %s' % state)
+    changed = []
+    for account_id in [_account_id(a) for a in account_ids]:
+        current = registry['accounts'].get(account_id, {'state': ONBOARDING, 'regions': []})
+        account = dict(current)
+        for key, value in [('name', name), ('ou', ou), ('state', state)]:
+            if value is not None:
+                account[key] = value
+        if regions:
+            account['regions'] = sorted(set(regions))
+        if account != current or account_id not in registry['accounts']:
+            changed.append(account_id)
+            registry['accounts'][account_id] = account
+    if changed:
+        registry['revision'] += 1
+        for account_id in changed:
+            registry['accounts'][account_id]['revision'] = registry['revision']
+    return changed
+
+
+def target_inputs(registry):
+    """Sorted account IDs and regions the target stack should be generated for"""
+    accounts = sorted(a for a, account in registry['accounts'].items() if account['state'] in TARGET_STATES)
+    regions = sorted(set(r for a in accounts for r in registry['accounts'][a]['regions']))
+    return accounts, regions
+
+
+def mark_deployed(registry):
+    """Record the registry's current target inputs as what the target stack is deployed with"""
+    accounts, regions = target_inputs(registry)
+    registry['deployed'] = {'revision': registry['revision'], 'accounts': accounts, 'regions': regions}
+
+
+def delta(registry):
+    """Accounts and regions added to and removed from the target inputs since the deployed revision"""
+    accounts, regions = target_inputs(registry)
+    deployed = registry['deployed'] or {'revision': None, 'accounts': [], 'regions': []}
+    return {'Revision': registry['revision'],
+            'DeployedRevision': deployed['revision'],
+            'AddedAccounts': sorted(set(accounts) - set(deployed['accounts'])),
+            'RemovedAccounts': sorted(set(deployed['accounts']) - set(accounts)),
+            'AddedRegions': sorted(set(regions) - set(deployed['regions'])),
+            'RemovedRegions': sorted(set(deployed['regions']) - set(regions))}
+
+
+def _is_intrinsic(value):
+    return isinstance(value, dict) and len(value) == 1 and (next(iter(value)) == 'Ref' or next(iter(value)).startswith('Fn::'))
+
+
+def _has_list(value):
+    if isinstance(value, list):
+        return True
+    return isinstance(value, dict) and not _is_intrinsic(value) and any(_has_list(item) for item in value.values())
+
+
+def _fragments(value, path, counter):
+    """Count the pieces of a resource - statements, resource ARNs, principals, property values - keyed by where they sit. List items holding
+    lists of their own are broken down further, intrinsic functions are kept whole."""
+    if isinstance(value, dict) and not _is_intrinsic(value):
+        for key, item in value.items():
+            _fragments(item, path + (key,), counter)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if _has_list(item):
+                _fragments(item, path + (index,), counter)
+            else:
+                counter[(path, json.dumps(item, sort_keys=True))] += 1
+    else:
+        counter[(path, json.dumps(value, sort_keys=True))] += 1
+
+
+def resource_changes(old, new):
+    """Expected CloudFormation change set between two template dicts - resources to add, remove and modify, with the number of fragments
+    added and removed in each modified resource"""
+    old_resources, new_resources = old.get('Resources', {}), new.get('Resources', {})
+    modified = []
+    for name in sorted(set(old_resources) & set(new_resources)):
+        if old_resources[name] != new_resources[name]:
+            before, after = collections.Counter(), collections.Counter()
+            _fragments(old_resources[name], (), before)
+            _fragments(new_resources[name], (), after)
+            modified.append({'Resource': name, 'Added': sum((after - before).values()), 'Removed': sum((before - after).values())})
+    return {'Add': sorted(set(new_resources) - set(old_resources)),
+            'Remove': sorted(set(old_resources) - set(new_resources)),
+            'Modify': modified}
+
+
+def format_changes(registry_delta, changes):
+    """Summary of the registry delta and the expected change set for printing"""
+    lines = ['Registry revision %d, deployed revision %s: %d account(s) added, %d removed, %d region(s) added, %d removed' % (
+             registry_delta['Revision'], registry_delta['DeployedRevision'] if registry_delta['DeployedRevision'] is not None else 'none',
+             len(registry_delta['AddedAccounts']), len(registry_delta['RemovedAccounts']), len(registry_delta['AddedRegions']), len(registry_delta['RemovedRegions']))]
+    lines.append('Expected change set: %d resource(s) - %d to add, %d to remove, %d to modify' % (
+                 len(changes['Add']) + len(changes['Remove']) + len(changes['Modify']), len(changes['Add']), len(changes['Remove']), len(changes['Modify'])))
+    for change in changes['Modify']:
+        lines.append('  Modify %s: +%d/-%d fragment(s)' % (change['Resource'], change['Added'], change['Removed']))
+    for action in ['Add', 'Remove']:
+        for name in changes[action]:
+            lines.append('  %s %s' % (action, name))
+    return '\n'.join(lines)
+
+
+@click.group()
+def cli():
+    pass
+
+
+def _registry_option(f):
+    return click.option('--file', '-f', 'registry_file', envvar='CCLI_REGISTRY', default=DEFAULT_REGISTRY, type=click.Path(dir_okay=False),
+                        help="Account registry file, defaults to $CCLI_REGISTRY or accounts.yaml in the current directory.")(f)
+
+
+def _load(registry_file):
+    try:
+        return load_registry(registry_file)
+    except RegistryError as e:
+        raise click.ClickException('%s: %s' % (registry_file, e))
+
+
+@cli.group()
+def registry():
+    """Command group pertaining to the registry of child accounts shipping logs to the log target account."""
+    pass
+
+
+@registry.command('add')
+@click.argument('account_ids', nargs=-1, required=True)
+@_registry_option
+@click.option('--name', '-n', help="Display name for the account(s).")
+@click.option('--ou', help="Organizational unit the account(s) belong to.")
+@click.option('-r', '--region', 'region_list', multiple=True, help="Region the account ships logs from. Can be repeated, replaces the account's regions.")
+@click.option('--state', type=click.Choice(STATES), help="Onboarding state - new accounts default to onboarding. Accounts that are onboarding or active are granted access by the target stack.")
+def add(account_ids, registry_file, name=None, ou=None, region_list=None, state=None):
+    """Add accounts to the registry or update the details of registered ones."""
+    registry = _load(registry_file)
+    try:
+        changed = update_accounts(registry, account_ids, name, ou, region_list, state)
+    except RegistryError as e:
+        raise click.BadParameter(str(e))
+    if changed:
+        save_registry(registry, registry_file)
+    click.echo('%d account(s) changed, registry revision %d' % (len(changed), registry['revision']))
+
+
+@registry.command('remove')
+@click.argument('account_ids', nargs=-1, required=True)
+@_registry_option
+def remove(account_ids, registry_file):
+    """Mark accounts offboarded so the target stack stops granting them access - they stay in the registry for the record."""
+    registry = _load(registry_file)
+    unknown = [a for a in account_ids if a not in registry['accounts']]
+    if unknown:
+        raise click.BadParameter('not in the registry: %s' % ', '.join(unknown))
+    changed = update_accounts(registry, account_ids, state=OFFBOARDED)
+    if changed:
+        save_registry(registry, registry_file)
+    click.echo('%d account(s) changed, registry revision %d' % (len(changed), registry['revision']))
+
+
+@registry.command('list')
+@_registry_option
+@click.option('--state', type=click.Choice(STATES), help="Only list accounts in this state.")
+@click.option('--ou', help="Only list accounts in this organizational unit.")
+def list_accounts(registry_file, state=None, ou=None):
+    """List the registered accounts."""
+    registry = _load(registry_file)
+    click.echo('%-12s %-11s %-16s %-24s %s' % ('account', 'state', 'ou', 'name', 'regions'))
+    for account_id, account in sorted(registry['accounts'].items()):
+        if (state and account['state'] != state) or (ou and account.get('ou') != ou):
+            continue
+        click.echo('%-12s %-11s %-16s %-24s %s' % (account_id, account['state'], account.get('ou') or '', account.get('name') or '', ','.join(account['regions'])))
+
+
+@registry.command('status')
+@_registry_option
+def status(registry_file):
+    """Show the accounts and regions added or removed since the target stack was last deployed."""
+    registry_delta = delta(_load(registry_file))
+    click.echo('Registry revision %d, deployed revision %s' % (registry_delta['Revision'], registry_delta['DeployedRevision'] if registry_delta['DeployedRevision'] is not None else 'none'))
+    for key, label in [('AddedAccounts', 'accounts to add'), ('RemovedAccounts', 'accounts to remove'), ('AddedRegions', 'regions to add'), ('RemovedRegions', 'regions to remove')]:
+        click.echo('  %-18s %s' % (label, ', '.join(registry_delta[key]) or '-'))
+
+
+@registry.command('deployed')
+@_registry_option
+def deployed(registry_file):
+    """Record the registry's current accounts and regions as deployed - run once the target stack has been updated from `target generate --registry`."""
+    registry = _load(registry_file)
+    mark_deployed(registry)
+    save_registry(registry, registry_file)
+    click.echo('Recorded revision %d as deployed: %d account(s), %d region(s)' % (registry['revision'], len(registry['deployed']['accounts']), len(registry['deployed']['regions'])))
@@ -1,5 +1,4 @@
 import click
-import yaml
 import os
 
 data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data')
@@ -10,7 +9,6 @@ import troposphere.iam as iam
 import troposphere.cloudtrail as ct
 import troposphere.logs as cwl
 import troposphere.s3 as s3
-import troposphere.ec2 as ec2
 
 from awacs.aws import Allow, Statement, Principal, Policy
 from awacs.logs import CreateLogGroup, CreateLogStream, PutLogEvents, DescribeLogGroups, DescribeLogStreams, GetLogEvents
@@ -25,6 +23,12 @@ import awacs.s3 as as3
 import awacs.sqs as asqs
 import awacs.sns as asns
 
+from .filters import FILTER_PROFILES, get_filter_pattern
+from .archive import FLOW_LOG_FIELD_TYPES
+from .. import resources
+from .. import profiling
+from ..validator import template_json
+
 
 log_aggregation_cf = os.path.join(cf_data_dir, 'log_aggregation')
 SUPPORTED_SERVICES = ['cloudtrail', 'cloudwatch', 'vpc_flow_logs']
@@ -41,27 +45,13 @@ def source():
     pass
 
 
-@source.command()
-@click.option('--dry-run', 'dry_run', is_flag=True, prompt='Dry Run' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should be printed to screen vs. being saved to file")
-@click.option('--file', '-f', 'file_location', type=click.Path(), prompt="Save file path" if os.getenv('CLI_PROMPT') else None, help="Specific path to save the generated template in. If not specifies, defaults to package data directory.")
-def flow_log(dry_run, file_location):
-    """Method generates a mini-template for use in configuring VPC Flow Log configuration within an account. This template should apply to all VPCs in all regions for any account that's configured as a log 'sender' and aggregates logs via the previously created CloudWatch Logs group (to be supplied as a Parameter)."""
-
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def flow_log_template(destination='cloud-watch-logs', file_format='plain-text', hive_partitions=False, per_hour_partition=False, field_list=None):
+    """Build the VPC flow log Template - see `source flow_log` for the options."""
     t = Template()
     t.add_version("2010-09-09")
     t.add_description("UCSD VPC Flow Log AWS CloudFormation Template - on a per-VPC basis within an account that has been configured with the 'UCSD Log Source AWS CloudFormation Template', this template will ensure VPC Flow logs are forwarded to to the preconfigured Log Groups for aggregation to the central logging setup.")
 
-    delivery_logs_permission_arn = t.add_parameter(Parameter('DeliveryLogsPermissionArn',
-                                    Type="String",
-                                    Description="The Amazon Resource Name (ARN) of an AWS Identity and Access Management (IAM) role that permits Amazon EC2 to publish flow logs to a CloudWatch Logs log group in your account. - log_sources output name: VPCFlowLogDeliveryLogsPermissionArn"))
-
-    # This parameter should be mapped to the 'CloudWatchLogGroupName' output in the template created by the generate() method below
-    # we've abstracted the name to a variable and set the default here consistent with what the parent CFn template is setting in the child account configuration
-    log_group_name = t.add_parameter(Parameter('LogGroupName',
-                                    Type="String",
-                                    Default=security_log_shipping_group_name,
-                                    Description="The name of a new or existing CloudWatch Logs log group where Amazon EC2 publishes your flow logs. - Provided by the outputs of the child account-level central configuration - log_sources output name: CloudWatchLogGroupName."))
-
     vpc_id = t.add_parameter(Parameter('VPCId',
                              Type="AWS::EC2::VPC::Id",
                              Description="The ID of an existing VPC within the region *this* CloudFormation template is being deployed within that should have its corresponding VPC Flow Logs transmitted to the Log Group identified by LogGroupName."))
@@ -72,25 +62,74 @@ def flow_log(dry_run, file_location):
                                    AllowedValues=["ACCEPT", "REJECT", "ALL"],
                                    Description="The type of traffic to log."))
 
-    vpc_flow_log = t.add_resource(ec2.FlowLog('VPCFlowLog',
+    log_format = ' '.join('${%s}' % field for field in field_list) if field_list else None
+
+    if destination == 's3':
+        # Flow logs delivered to S3 skip the log group, subscription, Kinesis and Firehose hops entirely, the target template's bucket policy
+        # (target generate --flow-logs-to-s3) grants delivery.logs.amazonaws.com write access for each source account
+        log_destination_arn = t.add_parameter(Parameter('LogDestinationArn',
+                                              Type="String",
+                                              Description="ARN of the central log bucket flow logs are delivered to. - log_targets output name: LogDeliveryBucketArn"))
+
+        flow_log_args = dict(LogDestinationType='s3',
+                             LogDestination=Ref(log_destination_arn),
+                             DestinationOptions={'FileFormat': file_format,
+                                                 'HiveCompatiblePartitions': hive_partitions,
+                                                 'PerHourPartition': per_hour_partition})
+    else:
+        delivery_logs_permission_arn = t.add_parameter(Parameter('DeliveryLogsPermissionArn',
+                                        Type="String",
+                                        Description="The Amazon Resource Name (ARN) of an AWS Identity and Access Management (IAM) role that permits Amazon EC2 to publish flow logs to a CloudWatch Logs log group in your account. - log_sources output name: VPCFlowLogDeliveryLogsPermissionArn"))
+
+        # This parameter should be mapped to the 'CloudWatchLogGroupName' output in the template created by the generate() method below
+        # we've abstracted the name to a variable and set the default here consistent with what the parent CFn template is setting in the child account configuration
+        log_group_name = t.add_parameter(Parameter('LogGroupName',
+                                        Type="String",
+                                        Default=security_log_shipping_group_name,
+                                        Description="The name of a new or existing CloudWatch Logs log group where Amazon EC2 publishes your flow logs. - Provided by the outputs of the child account-level central configuration - log_sources output name: CloudWatchLogGroupName."))
+
+        flow_log_args = dict(DeliverLogsPermissionArn=Ref(delivery_logs_permission_arn),
+                             LogGroupName=Ref(log_group_name))
+
+    if log_format:
+        flow_log_args['LogFormat'] = log_format
+
+    vpc_flow_log = t.add_resource(resources.FlowLog('VPCFlowLog',
                                   ResourceId=Ref(vpc_id),
-                                  DeliverLogsPermissionArn=Ref(delivery_logs_permission_arn),
                                   ResourceType="VPC",
-                                  LogGroupName=Ref(log_group_name),
-                                  TrafficType=Ref(traffic_type)))
+                                  TrafficType=Ref(traffic_type),
+                                  **flow_log_args))
 
-    if dry_run:
-        print(t.to_json())
-    else:
-        save_path = file_location if file_location else os.path.join(log_aggregation_cf, 'vpc_flow_log.json')
-        with open (save_path, 'w') as f:
-            f.write(t.to_json())
+    return t
 
-@source.command('generate')
+
+@source.command()
 @click.option('--dry-run', 'dry_run', is_flag=True, prompt='Dry Run' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should be printed to screen vs. being saved to file")
 @click.option('--file', '-f', 'file_location', type=click.Path(), prompt="Save file path" if os.getenv('CLI_PROMPT') else None, help="Specific path to save the generated template in. If not specifies, defaults to package data directory.")
-def generate(dry_run, file_location=None):
-    """CloudFormation template generator to apply to all accounts which configures log sources to publish to the centralized log target(s) specified"""
+@click.option('--destination', 'destination', type=click.Choice(['cloud-watch-logs', 's3']), default='cloud-watch-logs', help="Where flow logs are delivered - the in-account CloudWatch Logs group (forwarded through Kinesis/Firehose) or straight to the central log bucket in S3.")
+@click.option('--file-format', 'file_format', type=click.Choice(['plain-text', 'parquet']), default='plain-text', help="Format of the flow log files written to S3 (S3 destination only).")
+@click.option('--hive-partitions', 'hive_partitions', is_flag=True, help="boolean indicates whether S3 keys should use Hive-compatible (key=value) prefixes (S3 destination only)")
+@click.option('--per-hour-partition', 'per_hour_partition', is_flag=True, help="boolean indicates whether S3 keys should be partitioned per hour rather than per day (S3 destination only)")
+@click.option('--field', 'field_list', multiple=True, type=click.Choice(sorted(FLOW_LOG_FIELD_TYPES)), help="Flow log record field to include, in order. Defaults to the default (version 2) record format.")
+def flow_log(dry_run, file_location, destination='cloud-watch-logs', file_format='plain-text', hive_partitions=False, per_hour_partition=False, field_list=None):
+    """Method generates a mini-template for use in configuring VPC Flow Log configuration within an account. This template should apply to all VPCs in all regions for any account that's configured as a log 'sender' and aggregates logs via the previously created CloudWatch Logs group (to be supplied as a Parameter) or, with `--destination s3`, delivers them straight to the central log bucket."""
+    if destination != 's3' and (file_format != 'plain-text' or hive_partitions or per_hour_partition):
+        raise click.UsageError('--file-format, --hive-partitions and --per-hour-partition require --destination s3')
+
+    t = flow_log_template(destination, file_format, hive_partitions, per_hour_partition, field_list)
+
+    if dry_run:
+        print(template_json(t))
+    else:
+        save_path = file_location if file_location else os.path.join(log_aggregation_cf, 'vpc_flow_log_s3.json' if destination == 's3' else 'vpc_flow_log.json')
+        with profiling.phase(profiling.FILE_WRITE), open(save_path, 'w') as f:
+            f.write(template_json(t))
+
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def source_template(log_type='vpc_flow_logs', filter_profile='all'):
+    """Build the log source Template - see `source generate` for the options. Raises KeyError for an unknown filter profile."""
+    filter_pattern = get_filter_pattern(log_type, filter_profile)
+
     t = Template()
     t.add_version("2010-09-09")
     t.add_description("UCSD Log Source AWS CloudFormation Template - this template is meant to be applied to pre-approved accounts and configures CloudWatch Logs to forward to the UCSD log aggregation process.")
@@ -117,10 +156,15 @@ def generate(dry_run, file_location=None):
                                LogGroupName=security_log_shipping_group_name,
                                RetentionInDays=Ref(cwl_group_retention)))
 
+    cwl_filter_pattern = t.add_parameter(Parameter("LogShippingFilterPattern",
+                                         Type="String",
+                                         Default=filter_pattern,
+                                         Description="CloudWatch Logs filter pattern for events to forward to the centralized logging stream - defaults to the '%s' profile for %s logs, leave empty to forward every event." % (filter_profile, log_type)))
+
     cwl_subscription = t.add_resource(cwl.SubscriptionFilter('SecurityLogShippingFilter',
                                       DestinationArn=Ref(delivery_stream_arn),
                                       LogGroupName=Ref(cwl_group),
-                                      FilterPattern=""))
+                                      FilterPattern=Ref(cwl_filter_pattern)))
 
     cwl_primary_stream = t.add_resource(cwl.LogStream('PrimaryLogStream',
                                         LogGroupName=Ref(cwl_group),
@@ -187,6 +231,12 @@ def generate(dry_run, file_location=None):
                                      Type='String',
                                      Default='',
                                      Description='Name of the S3 Bucket for delivery of CloudTrail logs'))
+
+    ct_log_file_validation = t.add_parameter(Parameter('CloudTrailLogFileValidation',
+                                             Type="String",
+                                             Default="true",
+                                             AllowedValues=["true", "false"],
+                                             Description="Flag indicating that CloudTrail should deliver signed digest files alongside the logs so they can be checked with `cloudtrail verify`."))
         # resources
 
     ct_trail = t.add_resource(ct.Trail(
@@ -196,6 +246,7 @@ def generate(dry_run, file_location=None):
                               S3KeyPrefix=Ref(ct_s3_key_prefix),
                               IncludeGlobalServiceEvents=Ref(ct_include_global),
                               IsMultiRegionTrail=Ref(ct_multi_region),
+                              EnableLogFileValidation=Ref(ct_log_file_validation),
                               IsLogging=Ref(ct_is_logging)))
 
         # outputs
@@ -242,10 +293,24 @@ def generate(dry_run, file_location=None):
                                                            asns.Action("List*")],
                                                    Resource=['*'])])))
 
+    return t
+
+
+@source.command('generate')
+@click.option('--dry-run', 'dry_run', is_flag=True, prompt='Dry Run' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should be printed to screen vs. being saved to file")
+@click.option('--file', '-f', 'file_location', type=click.Path(), prompt="Save file path" if os.getenv('CLI_PROMPT') else None, help="Specific path to save the generated template in. If not specifies, defaults to package data directory.")
+@click.option('--log-type', 'log_type', type=click.Choice(sorted(FILTER_PROFILES)), default='vpc_flow_logs', help="Type of logs shipped through the SecurityLogShippingGroup - selects the filter profile library to use.")
+@click.option('--filter-profile', 'filter_profile', default='all', help="Named filter pattern profile (see `filter list`) used as the default subscription filter pattern.")
+def generate(dry_run, file_location=None, log_type='vpc_flow_logs', filter_profile='all'):
+    """CloudFormation template generator to apply to all accounts which configures log sources to publish to the centralized log target(s) specified"""
+    try:
+        t = source_template(log_type, filter_profile)
+    except KeyError as e:
+        raise click.BadParameter(e.args[0], param_hint='--filter-profile')
 
     if dry_run:
-        print(t.to_json())
+        print(template_json(t))
     else:
         save_path = file_location if file_location else os.path.join(log_aggregation_cf, 'log_sources.json')
-        with open (save_path, 'w') as f:
-            f.write(t.to_json())
+        with profiling.phase(profiling.FILE_WRITE), open(save_path, 'w') as f:
+            f.write(template_json(t))
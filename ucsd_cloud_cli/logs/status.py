@@ -0,0 +1,252 @@
+"""Pipeline health for `status` - finds the log pipeline resources from the target and source stack outputs and reports lag, throughput and
+errors for each stage: CloudWatch Logs forwarding in the source accounts, the Kinesis stream, the Firehose delivery to S3 and the S3 notification
+queues with their dead letter queues. Every metric of an account/region is fetched with one batched GetMetricData request (split at the API's
+500 queries per request), all accounts/regions in parallel, and the results are cached for a short TTL so a refreshing table doesn't fetch
+more often than CloudWatch publishes."""
+import click
+import datetime
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..common import get_boto3_clients, get_profile_names, read_cache, write_cache, DEFAULT_REGIONS
+from .source import security_log_shipping_group_name
+
+STATUS_CACHE = 'status.json'
+MAX_QUERIES_PER_REQUEST = 500
+PERIOD_SECONDS = 60
+DEFAULT_TTL_SECONDS = 60
+
+SOURCE = 'source'
+STREAM = 'stream'
+FIREHOSE = 'firehose'
+QUEUE = 'queue'
+DEAD_LETTER = 'dead-letter'
+STAGES = [SOURCE, STREAM, FIREHOSE, QUEUE, DEAD_LETTER]
+
+LAG = 'Lag'
+PER_MINUTE = 'PerMinute'
+BACKLOG = 'Backlog'
+ERRORS = 'Errors'
+
+STATE_OK = 'ok'
+STATE_LAGGING = 'lagging'
+STATE_ERRORS = 'errors'
+STATE_NO_DATA = 'no data'
+
+# Stacks deployed before the target template had a FirehoseDeliveryStream output still use the fixed delivery stream name
+FIREHOSE_DELIVERY_STREAM_NAME = 'LogToS3DeliveryStream'
+
+# stage: (namespace, dimension, [(metric, statistic, column, scale)]) - lag is reported in seconds, throughput per minute. Maximum statistics are
+# gauges reported from the newest datapoint, Sum statistics are totals over the window.
+STAGE_METRICS = {SOURCE: ('AWS/Logs', 'LogGroupName', [('ForwardedLogEvents', 'Sum', PER_MINUTE, 1),
+                                                       ('DeliveryErrors', 'Sum', ERRORS, 1),
+                                                       ('DeliveryThrottling', 'Sum', ERRORS, 1)]),
+                 STREAM: ('AWS/Kinesis', 'StreamName', [('GetRecords.IteratorAgeMilliseconds', 'Maximum', LAG, 0.001),
+                                                        ('IncomingRecords', 'Sum', PER_MINUTE, 1),
+                                                        ('WriteProvisionedThroughputExceeded', 'Sum', ERRORS, 1)]),
+                 FIREHOSE: ('AWS/Firehose', 'DeliveryStreamName', [('DeliveryToS3.DataFreshness', 'Maximum', LAG, 1),
+                                                                   ('DeliveryToS3.Records', 'Sum', PER_MINUTE, 1),
+                                                                   ('ThrottledGetRecords', 'Sum', ERRORS, 1)]),
+                 QUEUE: ('AWS/SQS', 'QueueName', [('ApproximateAgeOfOldestMessage', 'Maximum', LAG, 1),
+                                                  ('NumberOfMessagesSent', 'Sum', PER_MINUTE, 1),
+                                                  ('ApproximateNumberOfMessagesVisible', 'Maximum', BACKLOG, 1)]),
+                 DEAD_LETTER: ('AWS/SQS', 'QueueName', [('ApproximateAgeOfOldestMessage', 'Maximum', LAG, 1),
+                                                        ('ApproximateNumberOfMessagesVisible', 'Maximum', ERRORS, 1)])}
+# The subscription filter metrics carry the CloudFormation generated filter name as a dimension, so they are searched for by log group
+SOURCE_SEARCH = "SUM(SEARCH('{AWS/Logs,DestinationType,FilterName,LogGroupName} MetricName=\"%s\" LogGroupName=\"%s\"', '%s', %d))"
+
+
+@click.group()
+def cli():
+    pass
+
+
+def stack_outputs(cloudformation, stack_name):
+    """Output key -> value of a deployed stack"""
+    stack = cloudformation.describe_stacks(StackName=stack_name)['Stacks'][0]
+    return dict((output['OutputKey'], output['OutputValue']) for output in stack.get('Outputs', []))
+
+
+def target_resources(outputs):
+    """(stage, resource name) pairs for the stream, delivery stream and queues of a target stack, from its outputs"""
+    resources = [(STREAM, outputs['SplunkKinesisLogStream'].split('/')[-1]),
+                 (FIREHOSE, outputs.get('FirehoseDeliveryStream', FIREHOSE_DELIVERY_STREAM_NAME))]
+    for key, value in sorted(outputs.items()):
+        if key.startswith('SplunkS3DeadLetterQueue'):
+            resources.append((DEAD_LETTER, value.split(':')[-1]))
+        elif key.startswith('SplunkS3Queue'):
+            resources.append((QUEUE, value.split(':')[-1]))
+    return resources
+
+
+def source_resources(outputs):
+    """(stage, resource name) pairs for a source stack - the log group forwarding to the log destination"""
+    return [(SOURCE, outputs.get('CloudWatchLogGroupName', security_log_shipping_group_name))]
+
+
+def discover(cloudformation_clients, target_key, target_stack, source_keys=(), source_stack=None, workers=16):
+    """Find the pipeline resources from the stack outputs of the target stack (in the `target_key` account/region) and the source stack in every
+    `source_keys` account/region. Returns a list of {Stage, Key, Resource} dicts and a list of (key, stack, error) tuples for the stacks that
+    could not be described - source stacks are commonly not deployed in every region."""
+    lookups = [(target_key, target_stack, target_resources)] + [(key, source_stack, source_resources) for key in source_keys]
+
+    def _describe(lookup):
+        key, stack_name, parse = lookup
+        try:
+            return [dict(Stage=stage, Key=key, Resource=name) for stage, name in parse(stack_outputs(cloudformation_clients[key], stack_name))], None
+        except Exception as e:
+            return [], (key, stack_name, str(e))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        described = list(executor.map(_describe, lookups))
+    resources = [resource for found, _ in described for resource in found]
+    resources.sort(key=lambda resource: (STAGES.index(resource['Stage']), resource['Key'], resource['Resource']))
+    return resources, [error for _, error in described if error]
+
+
+def metric_queries(resources):
+    """GetMetricData queries for every resource, grouped by the account/region they are fetched from. Returns key -> list of (query,
+    resource index, column, whether the newest datapoint is reported, scale)."""
+    queries = {}
+    for index, resource in enumerate(resources):
+        namespace, dimension, metrics = STAGE_METRICS[resource['Stage']]
+        batch = queries.setdefault(resource['Key'], [])
+        for metric, statistic, column, scale in metrics:
+            query = {'Id': 'm%d' % len(batch)}
+            if resource['Stage'] == SOURCE:
+                query.update(Expression=SOURCE_SEARCH % (metric, resource['Resource'], statistic, PERIOD_SECONDS), Label=metric)
+            else:
+                query['MetricStat'] = {'Metric': {'Namespace': namespace, 'MetricName': metric, 'Dimensions': [{'Name': dimension, 'Value': resource['Resource']}]},
+                                       'Period': PERIOD_SECONDS,
+                                       'Stat': statistic}
+            batch.append((query, index, column, statistic == 'Maximum', scale))
+    return queries
+
+
+def get_metric_data(cloudwatch, queries, start, end):
+    """Fetch `queries` in as few GetMetricData requests as the API allows. Returns query Id -> values, newest first."""
+    values = {}
+    for offset in range(0, len(queries), MAX_QUERIES_PER_REQUEST):
+        pages = cloudwatch.get_paginator('get_metric_data').paginate(MetricDataQueries=queries[offset:offset + MAX_QUERIES_PER_REQUEST],
+                                                                     StartTime=start,
+                                                                     EndTime=end,
+                                                                     ScanBy='TimestampDescending')
+        for page in pages:
+            for result in page['MetricDataResults']:
+                values.setdefault(result['Id'], []).extend(result['Values'])
+    return values
+
+
+def _cache_key(key):
+    return '/'.join(key)
+
+
+def _signature(queries, window_minutes):
+    return hashlib.md5(json.dumps([queries, window_minutes], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def collect(cloudwatch_clients, resources, window_minutes=5, ttl=DEFAULT_TTL_SECONDS, now=time.time, workers=16):
+    """Fetch the metrics of every resource and summarize them into one row per resource. Values fetched for an account/region less than `ttl`
+    seconds ago (for the same resources and window) are taken from the status cache instead."""
+    queries = metric_queries(resources)
+    cache = read_cache(STATUS_CACHE) if ttl else {}
+    fetched_at = now()
+    end = datetime.datetime.utcfromtimestamp(fetched_at - fetched_at % PERIOD_SECONDS)
+    start = end - datetime.timedelta(minutes=window_minutes)
+
+    def _fetch(key):
+        batch = [query[0] for query in queries[key]]
+        signature = _signature(batch, window_minutes)
+        cached = cache.get(_cache_key(key))
+        if cached and cached['Signature'] == signature and fetched_at - cached['FetchedAt'] < ttl:
+            return cached
+        return {'Signature': signature, 'FetchedAt': fetched_at, 'Values': get_metric_data(cloudwatch_clients[key], batch, start, end)}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(queries, executor.map(_fetch, list(queries))))
+    if ttl:
+        cache.update((_cache_key(key), result) for key, result in results.items())
+        write_cache(STATUS_CACHE, cache)
+
+    rows = [dict(resource, **{LAG: None, PER_MINUTE: None, BACKLOG: None, ERRORS: None}) for resource in resources]
+    for key, batch in queries.items():
+        for query, index, column, latest, scale in batch:
+            values = results[key]['Values'].get(query['Id'])
+            if not values:
+                continue
+            value = (values[0] if latest else sum(values) / (window_minutes if column == PER_MINUTE else 1)) * scale
+            rows[index][column] = value if rows[index][column] is None else rows[index][column] + value
+    return rows
+
+
+def state(row, max_lag_seconds):
+    """Health of a pipeline stage - errors take precedence over lag"""
+    if all(row[column] is None for column in [LAG, PER_MINUTE, BACKLOG, ERRORS]):
+        return STATE_NO_DATA
+    if row[ERRORS]:
+        return STATE_ERRORS
+    if row[LAG] is not None and row[LAG] > max_lag_seconds:
+        return STATE_LAGGING
+    return STATE_OK
+
+
+def _format(value, pattern):
+    return '-' if value is None else pattern % value
+
+
+def format_rows(rows, max_lag_seconds):
+    lines = ['%-12s %-20s %-12s %-36s %10s %12s %10s %8s  %s' % ('STAGE', 'PROFILE', 'REGION', 'RESOURCE', 'LAG (s)', 'PER MINUTE', 'BACKLOG', 'ERRORS', 'STATE')]
+    for row in rows:
+        profile, region = row['Key']
+        lines.append('%-12s %-20s %-12s %-36s %10s %12s %10s %8s  %s' % (row['Stage'], profile, region, row['Resource'], _format(row[LAG], '%.1f'),
+                                                                        _format(row[PER_MINUTE], '%.1f'), _format(row[BACKLOG], '%d'),
+                                                                        _format(row[ERRORS], '%d'), state(row, max_lag_seconds)))
+    return '\n'.join(lines)
+
+
+@cli.command('status')
+@click.option('--target-stack', 'target_stack', required=True, help="Name of the log target stack in the log aggregation account.")
+@click.option('--target-profile', 'target_profile', default='default', help="AWS profile for the log aggregation account.")
+@click.option('--target-region', 'target_region', default='us-west-2', help="Region the log target stack is deployed in.")
+@click.option('--source-stack', 'source_stack', help="Name of the log source stack in the log source accounts. Without it, only the target stages are reported.")
+@click.option('-p', '--profile', 'profile_list', multiple=True, help="AWS profile(s) for the log source accounts. Defaults to every configured profile other than the target profile.")
+@click.option('-r', '--region', 'region_list', multiple=True, help="Region(s) the source stack is deployed in. Defaults to %s." % ', '.join(DEFAULT_REGIONS))
+@click.option('--window', 'window_minutes', type=click.IntRange(1, 180), default=5, help="Minutes of metrics to summarize - throughput and errors are totals over the window, lag and backlog the latest datapoint.")
+@click.option('--max-lag', 'max_lag_seconds', type=int, default=300, help="Lag in seconds above which a stage is reported as lagging.")
+@click.option('--ttl', type=int, default=DEFAULT_TTL_SECONDS, help="Seconds fetched metrics are reused for, across refreshes and runs. 0 always fetches.")
+@click.option('--watch', 'watch_seconds', type=int, help="Refresh the table every this many seconds until interrupted.")
+@click.option('--count', type=int, default=0, help="Number of refreshes with --watch before exiting. 0 refreshes until interrupted.")
+@click.option('--json', 'as_json', is_flag=True, help="Print the rows as JSON instead of a table.")
+@click.option('--workers', type=int, default=16, help="Number of concurrent AWS API calls.")
+def status(target_stack, target_profile='default', target_region='us-west-2', source_stack=None, profile_list=None, region_list=None, window_minutes=5, max_lag_seconds=300,
+           ttl=DEFAULT_TTL_SECONDS, watch_seconds=None, count=0, as_json=False, workers=16):
+    """Show lag, throughput and errors for each stage of the log pipeline - CloudWatch Logs forwarding in the source accounts, the Kinesis stream, Firehose delivery to S3 and the notification queues Splunk reads - with the resources found from the target and source stack outputs and the metrics of every account/region fetched in one batched GetMetricData request."""
+    target_key = (target_profile, target_region)
+    source_keys = []
+    if source_stack:
+        profiles = profile_list or [profile for profile in get_profile_names() if profile != target_profile]
+        source_keys = [(profile, region) for profile in profiles for region in (region_list or DEFAULT_REGIONS)]
+    keys = sorted(set([target_key] + source_keys))
+
+    resources, problems = discover(get_boto3_clients('cloudformation', keys), target_key, target_stack, source_keys, source_stack, workers)
+    for (profile, region), stack_name, error in problems:
+        click.echo('%s %s %s: %s' % (profile, region, stack_name, error), err=True)
+    if not resources:
+        raise click.ClickException('no pipeline resources found in the %s stack outputs' % target_stack)
+
+    cloudwatch_clients = get_boto3_clients('cloudwatch', sorted(set(resource['Key'] for resource in resources)))
+    refreshes = 0
+    while True:
+        rows = collect(cloudwatch_clients, resources, window_minutes, ttl, workers=workers)
+        if as_json:
+            click.echo(json.dumps([dict(row, Key=list(row['Key']), State=state(row, max_lag_seconds)) for row in rows], indent=4, sort_keys=True))
+        else:
+            if watch_seconds:
+                click.clear()
+            click.echo(format_rows(rows, max_lag_seconds))
+        refreshes += 1
+        if not watch_seconds or refreshes == count:
+            break
+        time.sleep(watch_seconds)
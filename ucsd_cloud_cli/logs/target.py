@@ -14,12 +14,13 @@ import troposphere.kinesis as k
 import troposphere.sqs as sqs
 import troposphere.sns as sns
 import troposphere.firehose as fh
+import troposphere.awslambda as awslambda
 
 from awacs.aws import Allow, Statement, Principal, Policy, Condition, StringEquals, ArnLike
 from awacs.kinesis import PutRecord as KinesisPutRecord
 from awacs.iam import PassRole as IAMPassRole
 from awacs.sts import AssumeRole
-from awacs.s3 import GetBucketAcl, PutObject
+from awacs.s3 import GetBucketAcl, PutObject, ListBucket
 import awacs.sqs as asqs
 import awacs.ec2 as aec2
 import awacs.awslambda as al
@@ -38,6 +39,16 @@ import awacs.s3 as as3
 import awacs.iam as aiam
 import awacs.autoscaling as aas
 
+from ..common import DEFAULT_REGIONS, read_lambda_source
+from .archive import add_glue_catalog, FLOW_LOG_FIELD_TYPES
+from .kinesis import add_stream_autoscaling, STREAM_SCALING, FIXED, AUTOSCALE, ON_DEMAND
+from .notifications import add_notification_fanout, splunk_inputs, PARTITIONS, ACCOUNT, SPLUNK_DECODERS, LONG_POLL_SECONDS, MESSAGE_RETENTION_SECONDS, \
+    VISIBILITY_TIMEOUT_SECONDS, MAX_RECEIVE_COUNT
+from .registry import load_registry, target_inputs, delta, resource_changes, format_changes, RegistryError
+from .. import profiling
+from ..validator import template_json
+from .. import resources
+
 log_aggregation_cf = os.path.join(cf_data_dir, 'log_aggregation')
 SUPPORTED_SERVICES = ['cloudtrail', 'cloudwatch', 'vpc_flow_logs']
 
@@ -81,32 +92,22 @@ def _generate_splunk_policy(policy_name='splunkAllAccessPolicy', roles=[], users
                     Resource=["*"])]))
 
 
-@target.command()
-@click.option('-r', '--region', 'region_list', multiple=True, prompt='Child Account Region List' if os.getenv('CLI_PROMPT') else None, help="list of accounts that are to be allowed tgit so publish logs into 'this' account (where the template is installed)")
-@click.option('-a', '--account', 'account_list', multiple=True, prompt='Child Account ID List' if os.getenv('CLI_PROMPT') else None, help="list of regions that are being used to deploy into - affects policies created to allow cross-account communciation")
-@click.option('--file', '-f', 'file_location', type=click.Path(), prompt="Save file path" if os.getenv('CLI_PROMPT') else None, help="Specific path to save the generated template in. If not specifies, defaults to package data directory.")
-@click.option('--output-keys', 'output_keys', is_flag=True, prompt='Output Keys' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should include AWS IAM User access and secret key in the outputs of the template.")
-@click.option('--dry-run', 'dry_run', is_flag=True, prompt='Dry Run' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should be printed to screen vs. being saved to file")
-def generate(account_list=None, region_list=None, file_location=None, output_keys=False, dry_run=False):
-    """CloudFormation template generator for use in creating the resources required to capture logs in a centrally managed account per UCSD standards."""
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def target_template(account_list=None, region_list=None, output_keys=False, firehose_transform=False, firehose_output_format='message', glue_catalog=False, archive_start_date='2018/01/01',
+                    flow_logs_to_s3=False, flow_log_file_format='plain-text', flow_log_hive_partitions=False, flow_log_per_hour_partition=False, flow_log_field_list=(),
+                    stream_scaling=FIXED, notification_queues=None, queue_partition=ACCOUNT, queue_prefix_list=(), queue_name_prefix='s3DeliveryQueue'):
+    """Build the log target Template for the child accounts in `account_list` - see `target generate` for the options."""
     if type(account_list) == tuple:
         account_list = list(account_list)
 
     parameter_groups = []
 
-    region_list = region_list if region_list else ['us-west-1', 'us-west-2', 'us-east-1', 'us-east-2']
+    region_list = region_list if region_list else DEFAULT_REGIONS
     t = Template()
     t.add_version("2010-09-09")
     t.add_description("UCSD Log Target AWS CloudFormation Template - this CFn template configures a given account to receive logs from other accounts so as to aggregate and then optionally forward those logs on to the UCSD Splunk installation.")
 
     # Create Kinesis and IAM Roles
-    log_stream_shard_count = t.add_parameter(Parameter("LogStreamShardCount",
-                                             Description="Number of shards to create within the AWS Kinesis stream created to handle CloudWatch Logs.",
-                                             Type="Number",
-                                             MinValue=1,
-                                             MaxValue=64,
-                                             Default=1))
-
     log_stream_retention_period = t.add_parameter(Parameter("LogStreamRetentionPeriod",
                                                   Description = "Number of hours to retain logs in the Kinesis stream.",
                                                   Type="Number",
@@ -114,13 +115,30 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
                                                   MaxValue=120,
                                                   Default=24))
 
-    parameter_groups.append({'Label': {'default': 'Log Stream Inputs'},
-                         'Parameters': [log_stream_shard_count.name, log_stream_retention_period.name]})
+    if stream_scaling == ON_DEMAND:
+        # on-demand streams follow the write throughput on their own, billed per GB instead of per shard hour
+        log_stream = t.add_resource(resources.Stream("LogStream",
+                                    RetentionPeriodHours=Ref(log_stream_retention_period),
+                                    StreamModeDetails={'StreamMode': 'ON_DEMAND'}))
+        log_stream_parameters = [log_stream_retention_period.name]
+    else:
+        log_stream_shard_count = t.add_parameter(Parameter("LogStreamShardCount",
+                                                 Description="Number of shards to create within the AWS Kinesis stream created to handle CloudWatch Logs.",
+                                                 Type="Number",
+                                                 MinValue=1,
+                                                 MaxValue=64,
+                                                 Default=1))
+
+        log_stream = t.add_resource(k.Stream("LogStream",
+                                    RetentionPeriodHours=Ref(log_stream_retention_period),
+                                    ShardCount=Ref(log_stream_shard_count)))
+        log_stream_parameters = [log_stream_shard_count.name, log_stream_retention_period.name]
 
+    if stream_scaling == AUTOSCALE:
+        log_stream_parameters.extend(add_stream_autoscaling(t, log_stream, log_stream_shard_count))
 
-    log_stream = t.add_resource(k.Stream("LogStream",
-                                RetentionPeriodHours=Ref(log_stream_retention_period),
-                                ShardCount=Ref(log_stream_shard_count)))
+    parameter_groups.append({'Label': {'default': 'Log Stream Inputs'},
+                             'Parameters': log_stream_parameters})
 
     firehose_bucket = t.add_resource(s3.Bucket('LogS3DeliveryBucket'))
 
@@ -132,51 +150,119 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
                                                 Principal=Principal('Service', 'firehose.amazonaws.com'),
                                                 Condition=Condition(StringEquals('sts:ExternalId', AccountId)))])))
 
+    log_s3_delivery_statements = [Statement(
+                                      Effect=Allow,
+                                      Action=[as3.AbortMultipartUpload,
+                                              as3.GetBucketLocation,
+                                              as3.GetObject,
+                                              as3.ListBucket,
+                                              as3.ListBucketMultipartUploads,
+                                              as3.PutObject],
+                                      Resource=[
+                                           Join('', ['arn:aws:s3:::', Ref(firehose_bucket)]),
+                                           Join('', ['arn:aws:s3:::', Ref(firehose_bucket), '*'])]),
+                                  Statement(
+                                      Effect=Allow,
+                                      Action=[akinesis.Action('Get*'), akinesis.DescribeStream, akinesis.ListStreams],
+                                      Resource=[
+                                          GetAtt(log_stream, 'Arn')
+                                      ])]
+
+    firehose_destination_args = dict(BucketARN=GetAtt(firehose_bucket, 'Arn'),
+                                     BufferingHints=fh.BufferingHints(
+                                         IntervalInSeconds=300,
+                                         SizeInMBs=50
+                                     ),
+                                     CompressionFormat='UNCOMPRESSED',
+                                     Prefix='firehose/',
+                                     RoleARN=GetAtt(firehose_delivery_role, 'Arn'))
+
+    if firehose_transform:
+        # Lambda record transformation per https://docs.aws.amazon.com/firehose/latest/dev/data-transformation.html - unpacks the CloudWatch Logs
+        # envelopes so everything downstream of the bucket reads plain newline-delimited events
+        log_processor_runtime = t.add_parameter(Parameter("LogProcessorRuntime",
+                                                Description="Lambda runtime for the Firehose CloudWatch Logs record transformation function.",
+                                                Type="String",
+                                                Default="python3.12"))
+
+        parameter_groups.append({'Label': {'default': 'Log Processing Inputs'},
+                                 'Parameters': [log_processor_runtime.name]})
+
+        log_processor_role = t.add_resource(iam.Role('LogProcessorRole',
+                                            AssumeRolePolicyDocument=Policy(
+                                                Statement=[Statement(
+                                                    Effect=Allow,
+                                                    Action=[AssumeRole],
+                                                    Principal=Principal('Service', 'lambda.amazonaws.com'))]),
+                                            Policies=[iam.Policy(
+                                                PolicyName='LogProcessorPolicy',
+                                                PolicyDocument=Policy(
+                                                    Statement=[
+                                                        Statement(
+                                                            Effect=Allow,
+                                                            Action=[alogs.CreateLogGroup, alogs.CreateLogStream, alogs.PutLogEvents],
+                                                            Resource=['arn:aws:logs:*:*:*']),
+                                                        Statement(
+                                                            Effect=Allow,
+                                                            Action=[akinesis.PutRecords],
+                                                            Resource=[GetAtt(log_stream, 'Arn')])]))]))
+
+        log_processor = t.add_resource(awslambda.Function('LogProcessorFunction',
+                                       Description='Unpacks CloudWatch Logs subscription envelopes delivered through Firehose into newline-delimited events.',
+                                       Code=awslambda.Code(ZipFile=read_lambda_source('firehose_cwl_processor.py')),
+                                       Handler='index.handler',
+                                       Runtime=Ref(log_processor_runtime),
+                                       Role=GetAtt(log_processor_role, 'Arn'),
+                                       MemorySize=512,
+                                       Timeout=300,
+                                       Environment=awslambda.Environment(Variables={'OUTPUT_FORMAT': firehose_output_format})))
+
+        log_s3_delivery_statements.append(Statement(
+                                          Effect=Allow,
+                                          Action=[al.InvokeFunction, al.GetFunctionConfiguration],
+                                          Resource=[GetAtt(log_processor, 'Arn')]))
+
+        # CloudWatch Logs data typically expands 5-10x when decompressed, a 1 MB processing buffer keeps the transformed batch well inside the 6 MB
+        # Lambda response limit; anything over that limit is re-ingested into the Kinesis stream by the function itself
+        firehose_destination_args['ProcessingConfiguration'] = fh.ProcessingConfiguration(
+                                                                    Enabled=True,
+                                                                    Processors=[fh.Processor(
+                                                                        Type='Lambda',
+                                                                        Parameters=[
+                                                                            fh.ProcessorParameter(ParameterName='LambdaArn', ParameterValue=GetAtt(log_processor, 'Arn')),
+                                                                            fh.ProcessorParameter(ParameterName='BufferSizeInMBs', ParameterValue='1'),
+                                                                            fh.ProcessorParameter(ParameterName='BufferIntervalInSeconds', ParameterValue='60'),
+                                                                            fh.ProcessorParameter(ParameterName='NumberOfRetries', ParameterValue='3')])])
+        firehose_destination_args['S3BackupMode'] = 'Disabled'
+
     log_s3_delivery_policy = t.add_resource(iam.PolicyType('LogS3DeliveryPolicy',
                                            Roles=[Ref(firehose_delivery_role)],
                                            PolicyName='LogS3DeliveryPolicy',
                                            PolicyDocument=Policy(
-                                               Statement=[Statement(
-                                                   Effect=Allow,
-                                                   Action=[as3.AbortMultipartUpload,
-                                                           as3.GetBucketLocation,
-                                                           as3.GetObject,
-                                                           as3.ListBucket,
-                                                           as3.ListBucketMultipartUploads,
-                                                           as3.PutObject],
-                                                   Resource=[
-                                                        Join('', ['arn:aws:s3:::', Ref(firehose_bucket)]),
-                                                        Join('', ['arn:aws:s3:::', Ref(firehose_bucket), '*'])]),
-                                                Statement(
-                                                    Effect=Allow,
-                                                    Action=[akinesis.Action('Get*'), akinesis.DescribeStream, akinesis.ListStreams],
-                                                    Resource=[
-                                                        GetAtt(log_stream, 'Arn')
-                                                    ])])))
-
-    s3_firehose = t.add_resource(fh.DeliveryStream('LogToS3DeliveryStream',
-                                 DependsOn=[log_s3_delivery_policy.name],
-                                 DeliveryStreamName='LogToS3DeliveryStream',
-                                 DeliveryStreamType='KinesisStreamAsSource',
-                                 KinesisStreamSourceConfiguration=fh.KinesisStreamSourceConfiguration(
-                                    KinesisStreamARN=GetAtt(log_stream, 'Arn'),
-                                    RoleARN=GetAtt(firehose_delivery_role, 'Arn')
-                                 ),
-                                 S3DestinationConfiguration=fh.S3DestinationConfiguration(
-                                    BucketARN=GetAtt(firehose_bucket, 'Arn'),
-                                    BufferingHints=fh.BufferingHints(
-                                        IntervalInSeconds=300,
-                                        SizeInMBs=50
-                                    ) ,
-                                    CompressionFormat='UNCOMPRESSED',
-                                    Prefix='firehose/' ,
-                                    RoleARN=GetAtt(firehose_delivery_role, 'Arn'),
-                                 )))
+                                               Statement=log_s3_delivery_statements)))
+
+    firehose_delivery_stream_args = dict(DependsOn=[log_s3_delivery_policy.name],
+                                         DeliveryStreamName='LogToS3DeliveryStream',
+                                         DeliveryStreamType='KinesisStreamAsSource',
+                                         KinesisStreamSourceConfiguration=fh.KinesisStreamSourceConfiguration(
+                                            KinesisStreamARN=GetAtt(log_stream, 'Arn'),
+                                            RoleARN=GetAtt(firehose_delivery_role, 'Arn')
+                                         ))
+    if firehose_transform:
+        firehose_delivery_stream_args['ExtendedS3DestinationConfiguration'] = fh.ExtendedS3DestinationConfiguration(**firehose_destination_args)
+    else:
+        firehose_delivery_stream_args['S3DestinationConfiguration'] = fh.S3DestinationConfiguration(**firehose_destination_args)
+
+    s3_firehose = t.add_resource(fh.DeliveryStream('LogToS3DeliveryStream', **firehose_delivery_stream_args))
 
     t.add_output(Output('SplunkKinesisLogStream',
                  Value=GetAtt(log_stream, 'Arn'),
                  Description='ARN of the kinesis stream for log aggregation.'))
 
+    t.add_output(Output('FirehoseDeliveryStream',
+                 Value=Ref(s3_firehose),
+                 Description='Name of the Firehose delivery stream archiving the kinesis stream to S3.'))
+
 
     # Generate Bucket with Lifecycle Policies
 
@@ -205,43 +291,52 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
     parameter_groups.append({'Label': {'default': 'S3 Log Destination Parameters'},
                              'Parameters': [bucket_name.name, ct_s3_key_prefix.name, glacier_migration_days.name, glacier_deletion_days.name]})
 
-    dead_letter_queue = t.add_resource(sqs.Queue('deadLetterQueue'))
-
-    queue = t.add_resource(sqs.Queue('s3DeliveryQueue',
-                           MessageRetentionPeriod=14*24*60*60, # 14 d * 24 h * 60 m * 60 s
-                           VisibilityTimeout=5*60,
-                           RedrivePolicy=sqs.RedrivePolicy(
-                               deadLetterTargetArn=GetAtt(dead_letter_queue, 'Arn'),
-                               maxReceiveCount=10
-                           ))) # 5 m * 60 s per Splunk docs here: http://docs.splunk.com/Documentation/AddOns/released/AWS/ConfigureAWS#Configure_SQS
-
-    t.add_output(Output('SplunkS3Queue',
-                 Value=GetAtt(queue, 'Arn'),
-                 Description='Queue for Splunk SQS S3 ingest'))
-
-    t.add_output(Output('SplunkS3DeadLetterQueue',
-                Value=GetAtt(dead_letter_queue, 'Arn'),
-                Description="Dead letter queue for Splunk SQS S3 ingest"))
-
-
-    t.add_resource(sqs.QueuePolicy('s3DeliveryQueuePolicy',
-                   PolicyDocument=Policy(
-                   Statement=[Statement(
-                       Effect=Allow,
-                       Principal=Principal("AWS", "*"),
-                       Action=[asqs.SendMessage],
-                       Resource=[GetAtt(queue, 'Arn')],
-                       Condition=Condition(ArnLike("aws:SourceArn", Join('', ["arn:aws:s3:*:*:", Ref(bucket_name)]))))]),
-                   Queues=[Ref(queue)]))
+    if notification_queues:
+        notification_configuration, notification_dependency = add_notification_fanout(t, bucket_name, ct_s3_key_prefix, notification_queues, queue_partition,
+                                                                                      account_list, queue_prefix_list, queue_name_prefix,
+                                                                                      flow_logs_to_s3 and flow_log_hive_partitions)
+    else:
+        dead_letter_queue = t.add_resource(sqs.Queue('deadLetterQueue'))
+
+        queue = t.add_resource(sqs.Queue('s3DeliveryQueue',
+                               MessageRetentionPeriod=MESSAGE_RETENTION_SECONDS,
+                               ReceiveMessageWaitTimeSeconds=LONG_POLL_SECONDS,
+                               VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS,
+                               RedrivePolicy=sqs.RedrivePolicy(
+                                   deadLetterTargetArn=GetAtt(dead_letter_queue, 'Arn'),
+                                   maxReceiveCount=MAX_RECEIVE_COUNT
+                               )))
+
+        t.add_output(Output('SplunkS3Queue',
+                     Value=GetAtt(queue, 'Arn'),
+                     Description='Queue for Splunk SQS S3 ingest'))
+
+        t.add_output(Output('SplunkS3DeadLetterQueue',
+                    Value=GetAtt(dead_letter_queue, 'Arn'),
+                    Description="Dead letter queue for Splunk SQS S3 ingest"))
+
+
+        queue_policy = t.add_resource(sqs.QueuePolicy('s3DeliveryQueuePolicy',
+                       PolicyDocument=Policy(
+                       Statement=[Statement(
+                           Effect=Allow,
+                           Principal=Principal("AWS", "*"),
+                           Action=[asqs.SendMessage],
+                           Resource=[GetAtt(queue, 'Arn')],
+                           Condition=Condition(ArnLike("aws:SourceArn", Join('', ["arn:aws:s3:*:*:", Ref(bucket_name)]))))]),
+                       Queues=[Ref(queue)]))
+
+        notification_configuration = s3.NotificationConfiguration(
+                                         QueueConfigurations=[s3.QueueConfigurations(
+                                             Event="s3:ObjectCreated:*",
+                                             Queue=GetAtt(queue, 'Arn'))])
+        notification_dependency = queue_policy.name
 
     bucket = t.add_resource(s3.Bucket("LogDeliveryBucket",
-                            DependsOn=[log_stream.name, queue.name],
+                            DependsOn=[notification_dependency], # S3 sends the queue or topic a test event when the notification is configured
                             BucketName=Ref(bucket_name),
                             AccessControl="LogDeliveryWrite",
-                            NotificationConfiguration=s3.NotificationConfiguration(
-                                QueueConfigurations=[s3.QueueConfigurations(
-                                    Event="s3:ObjectCreated:*",
-                                    Queue=GetAtt(queue, 'Arn'))]),
+                            NotificationConfiguration=notification_configuration,
                             LifecycleConfiguration=s3.LifecycleConfiguration(Rules=[
                                 s3.LifecycleRule(
                                     Id="S3ToGlacierTransition",
@@ -251,21 +346,33 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
                                         StorageClass="Glacier",
                                         TransitionInDays=Ref(glacier_migration_days)))])))
 
+    bucket_policy_statements = [
+        Statement(
+            Effect="Allow",
+            Principal=Principal("Service", "cloudtrail.amazonaws.com"),
+            Action=[GetBucketAcl],
+            Resource=[GetAtt(bucket, 'Arn')]),
+        Statement(
+            Effect="Allow",
+            Principal=Principal("Service", "cloudtrail.amazonaws.com"),
+            Action=[PutObject],
+            Condition=Condition(StringEquals({"s3:x-amz-acl": "bucket-owner-full-control"})),
+            Resource=[Join('', [GetAtt(bucket, "Arn"), Ref(ct_s3_key_prefix), "/AWSLogs/", acct_id, "/*"]) for acct_id in account_list])]
+
+    if flow_logs_to_s3:
+        bucket_policy_statements.extend(_generate_flow_log_delivery_statements(bucket, account_list))
+
     bucket_policy = t.add_resource(s3.BucketPolicy("LogDeliveryBucketPolicy",
                                     Bucket=Ref(bucket),
                                     PolicyDocument=Policy(
-                                        Statement=[
-                                            Statement(
-                                                Effect="Allow",
-                                                Principal=Principal("Service", "cloudtrail.amazonaws.com"),
-                                                Action=[GetBucketAcl],
-                                                Resource=[GetAtt(bucket, 'Arn')]),
-                                            Statement(
-                                                Effect="Allow",
-                                                Principal=Principal("Service", "cloudtrail.amazonaws.com"),
-                                                Action=[PutObject],
-                                                Condition=Condition(StringEquals({"s3:x-amz-acl": "bucket-owner-full-control"})),
-                                                Resource=[Join('', [GetAtt(bucket, "Arn"), Ref(ct_s3_key_prefix), "/AWSLogs/", acct_id, "/*"]) for acct_id in account_list])])))
+                                        Statement=bucket_policy_statements)))
+
+    if glue_catalog:
+        add_glue_catalog(t, bucket, firehose_bucket, ct_s3_key_prefix, account_list, region_list, archive_start_date,
+                         firehose_output_format if firehose_transform else None,
+                         flow_log_file_format, flow_log_hive_partitions, flow_log_per_hour_partition, list(flow_log_field_list) or None)
+        parameter_groups.append({'Label': {'default': 'Log Archive Catalog Inputs'},
+                                 'Parameters': ['GlueDatabaseName']})
 
     splunk_sqs_s3_user = t.add_resource(iam.User('splunkS3SQSUser',
                                         Path='/',
@@ -277,6 +384,11 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
                  Description="Name of the bucket for CloudTrail log delivery",
                  Value=Ref(bucket)))
 
+    if flow_logs_to_s3:
+        t.add_output(Output('LogDeliveryBucketArn',
+                     Description="ARN of the bucket for VPC flow log delivery",
+                     Value=GetAtt(bucket, 'Arn')))
+
     # Log destination setup
 
     cwl_to_kinesis_role = t.add_resource(iam.Role('CWLtoKinesisRole',
@@ -334,12 +446,93 @@ def generate(account_list=None, region_list=None, file_location=None, output_key
 
     t.add_metadata({"AWS::CloudFormation::Interface": {"ParameterGroups": parameter_groups}})
 
+    return t
+
+
+@target.command()
+@click.option('-r', '--region', 'region_list', multiple=True, prompt='Child Account Region List' if os.getenv('CLI_PROMPT') else None, help="list of accounts that are to be allowed tgit so publish logs into 'this' account (where the template is installed)")
+@click.option('-a', '--account', 'account_list', multiple=True, prompt='Child Account ID List' if os.getenv('CLI_PROMPT') else None, help="list of regions that are being used to deploy into - affects policies created to allow cross-account communciation")
+@click.option('--file', '-f', 'file_location', type=click.Path(), prompt="Save file path" if os.getenv('CLI_PROMPT') else None, help="Specific path to save the generated template in. If not specifies, defaults to package data directory.")
+@click.option('--output-keys', 'output_keys', is_flag=True, prompt='Output Keys' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should include AWS IAM User access and secret key in the outputs of the template.")
+@click.option('--dry-run', 'dry_run', is_flag=True, prompt='Dry Run' if os.getenv('CLI_PROMPT') else None, help="boolean indicates whether template should be printed to screen vs. being saved to file")
+@click.option('--firehose-transform', 'firehose_transform', is_flag=True, help="boolean indicates whether Firehose should unpack CloudWatch Logs envelopes into newline-delimited events (via a bundled Lambda) before writing to S3")
+@click.option('--firehose-output-format', 'firehose_output_format', type=click.Choice(['message', 'json']), default='message', help="Format of the events written by the Firehose transform - raw log messages or JSON including log group/stream metadata")
+@click.option('--glue-catalog', 'glue_catalog', is_flag=True, help="boolean indicates whether Glue tables with partition projection (account, region, date) should be created over the CloudTrail, VPC flow log and Firehose archives")
+@click.option('--archive-start-date', 'archive_start_date', default='2018/01/01', help="Earliest date (yyyy/MM/dd) covered by the Glue partition projection")
+@click.option('--flow-logs-to-s3', 'flow_logs_to_s3', is_flag=True, help="boolean indicates whether the bucket policy should allow child accounts to deliver VPC flow logs straight to the log bucket (see `source flow_log --destination s3`)")
+@click.option('--flow-log-file-format', 'flow_log_file_format', type=click.Choice(['plain-text', 'parquet']), default='plain-text', help="File format the flow logs are delivered in - used by the Glue flow log table")
+@click.option('--flow-log-hive-partitions', 'flow_log_hive_partitions', is_flag=True, help="boolean indicates whether flow logs are delivered with Hive-compatible S3 prefixes - used by the Glue flow log table")
+@click.option('--flow-log-per-hour', 'flow_log_per_hour_partition', is_flag=True, help="boolean indicates whether flow logs are delivered with hourly S3 prefixes - used by the Glue flow log table")
+@click.option('--flow-log-field', 'flow_log_field_list', multiple=True, type=click.Choice(sorted(FLOW_LOG_FIELD_TYPES)), help="Flow log record field, in order, matching the --field options the flow logs were created with - used by the Glue flow log table")
+@click.option('--stream-scaling', 'stream_scaling', type=click.Choice(STREAM_SCALING), default=FIXED, help="How the Kinesis stream's write capacity is managed - a fixed LogStreamShardCount, autoscaled shards (CloudWatch alarms trigger a bundled resharding Lambda, see `kinesis simulate`) or on-demand capacity mode")
+@click.option('--registry', 'registry_file', type=click.Path(exists=True, dir_okay=False), help="Account registry (see `registry`) to take the onboarding and active accounts and their regions from, in addition to any -a/-r. The expected change set since the deployed registry revision is printed to stderr.")
+@click.option('-d', '--deploy-account-id', 'deploy_account_id', help="ID of the account the target stack is deployed in - used for the queue URLs in the Splunk inputs")
+@click.option('-n', '--deploy-region-name', 'deploy_region_name', help="Region the target stack is deployed in - used for the queue URLs in the Splunk inputs")
+@click.option('--notification-queues', 'notification_queues', type=click.IntRange(1, 50), help="Number of long-polling queues (each with its own dead letter queue) the log bucket's object notifications fan out to through SNS. Without it, the bucket notifies a single queue directly.")
+@click.option('--queue-partition', 'queue_partition', type=click.Choice(PARTITIONS), default=ACCOUNT, help="How notifications are split over the queues - by account (the -a accounts, round robin) or by the --queue-prefix key prefixes")
+@click.option('--queue-prefix', 'queue_prefix_list', multiple=True, help="Object key prefix to partition notifications by with --queue-partition prefix, e.g. cloudtrail/AWSLogs/. Can be repeated, prefixes are spread round robin over the queues.")
+@click.option('--queue-name-prefix', 'queue_name_prefix', default='s3DeliveryQueue', help="Name prefix of the fan-out queues, which are named <prefix>-<n> and <prefix>-<n>-dlq")
+@click.option('--splunk-inputs', 'splunk_inputs_file', type=click.Path(dir_okay=False), help="Path to write Splunk Add-on for AWS SQS-based S3 input stanzas (inputs.conf) for the fan-out queues to. Needs --notification-queues, -d and -n.")
+@click.option('--objects-per-minute', 'objects_per_minute', type=float, default=60.0, help="Expected rate of objects written to the log bucket - the Splunk input batch size and interval are derived from it")
+@click.option('--splunk-decoder', 'splunk_decoder', type=click.Choice(sorted(SPLUNK_DECODERS)), default='CloudTrail', help="S3 file decoder of the Splunk inputs")
+def generate(account_list=None, region_list=None, file_location=None, output_keys=False, dry_run=False, firehose_transform=False, firehose_output_format='message', glue_catalog=False, archive_start_date='2018/01/01',
+             flow_logs_to_s3=False, flow_log_file_format='plain-text', flow_log_hive_partitions=False, flow_log_per_hour_partition=False, flow_log_field_list=None, stream_scaling=FIXED, registry_file=None,
+             deploy_account_id=None, deploy_region_name=None, notification_queues=None, queue_partition=ACCOUNT, queue_prefix_list=None, queue_name_prefix='s3DeliveryQueue',
+             splunk_inputs_file=None, objects_per_minute=60.0, splunk_decoder='CloudTrail'):
+    """CloudFormation template generator for use in creating the resources required to capture logs in a centrally managed account per UCSD standards."""
+    if splunk_inputs_file and not (notification_queues and deploy_account_id and deploy_region_name):
+        raise click.UsageError('--splunk-inputs needs --notification-queues, --deploy-account-id and --deploy-region-name')
+    options = (output_keys, firehose_transform, firehose_output_format, glue_catalog, archive_start_date, flow_logs_to_s3, flow_log_file_format, flow_log_hive_partitions,
+               flow_log_per_hour_partition, flow_log_field_list, stream_scaling, notification_queues, queue_partition, queue_prefix_list, queue_name_prefix)
+    if registry_file:
+        try:
+            registry = load_registry(registry_file)
+        except RegistryError as e:
+            raise click.ClickException('%s: %s' % (registry_file, e))
+        accounts, regions = target_inputs(registry)
+        deployed = registry['deployed']
+        previous = _build(sorted(set(account_list or []) | set(deployed['accounts'])), sorted(set(region_list or []) | set(deployed['regions'])), options) if deployed else None
+        account_list, region_list = sorted(set(account_list or []) | set(accounts)), sorted(set(region_list or []) | set(regions))
+
+    t = _build(account_list, region_list, options)
+
+    if registry_file:
+        changes = resource_changes(previous.to_dict() if previous else {}, t.to_dict())
+        click.echo(format_changes(delta(registry), changes), err=True)
+
     if dry_run:
-        print(t.to_json())
+        print(template_json(t))
     else:
         save_path = file_location if file_location else os.path.join(log_aggregation_cf, 'log_targets.json')
-        with open (save_path, 'w') as f:
-            f.write(t.to_json())
+        with profiling.phase(profiling.FILE_WRITE), open(save_path, 'w') as f:
+            f.write(template_json(t))
+
+    if splunk_inputs_file:
+        with profiling.phase(profiling.FILE_WRITE), open(splunk_inputs_file, 'w') as f:
+            f.write(splunk_inputs(notification_queues, deploy_account_id, deploy_region_name, objects_per_minute, queue_name_prefix, decoder=splunk_decoder))
+
+
+def _build(account_list, region_list, options):
+    try:
+        return target_template(account_list, region_list, *options)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--notification-queues')
+
+
+def _generate_flow_log_delivery_statements(bucket, account_list=[]):
+    """Helper method to generate the bucket policy statements that let the log delivery service write VPC flow logs from each child account into the log bucket. Flow logs are written under AWSLogs/<account>/ or, with Hive-compatible partitions, AWSLogs/aws-account-id=<account>/"""
+    return [Statement(
+                Effect="Allow",
+                Principal=Principal("Service", "delivery.logs.amazonaws.com"),
+                Action=[GetBucketAcl, ListBucket],
+                Resource=[GetAtt(bucket, 'Arn')]),
+            Statement(
+                Effect="Allow",
+                Principal=Principal("Service", "delivery.logs.amazonaws.com"),
+                Action=[PutObject],
+                Condition=Condition(StringEquals({"s3:x-amz-acl": "bucket-owner-full-control",
+                                                  "aws:SourceAccount": list(account_list)})),
+                Resource=[Join('', [GetAtt(bucket, "Arn"), path, acct_id, "/*"]) for acct_id in account_list for path in ["/AWSLogs/", "/AWSLogs/aws-account-id="]])]
 
 
 def _generate_log_destination_policy_test(log_destination_name, account_list=[]):
@@ -0,0 +1,196 @@
+"""Run instrumentation behind the global `--profile` options. Records the time spent in each phase of a command - importing the package and
+its dependencies, boto3 session and client setup, AWS API calls, troposphere template construction, template rendering and file writes -
+counts the AWS API calls made per operation and optionally captures a cProfile dump and the top allocation sites from tracemalloc. Phases are
+timed by self time, so a phase nested in another (rendering inside a file write) isn't counted twice. Nothing is recorded unless profiling was
+turned on for the run."""
+import cProfile
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+import click
+
+IMPORTS = 'imports'
+BOTO3_SETUP = 'boto3 setup'
+AWS_CALLS = 'aws calls'
+TEMPLATE_BUILD = 'template build'
+TEMPLATE_RENDER = 'template render'
+FILE_WRITE = 'file write'
+OTHER = 'other'
+PHASES = [IMPORTS, BOTO3_SETUP, AWS_CALLS, TEMPLATE_BUILD, TEMPLATE_RENDER, FILE_WRITE, OTHER]
+
+import_seconds = 0.0
+_active = None
+
+
+class Profile(object):
+    """Timings and counters for one run, threadsafe so commands fanning work out to a thread pool are recorded in full"""
+
+    def __init__(self, memory_top=0):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phases = dict((name, 0.0) for name in PHASES)
+        self.api_calls = {}
+        self.memory_top = memory_top
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def enter(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        started, nested = self.local.stack.pop()
+        elapsed = time.perf_counter() - started
+        if self.local.stack:
+            self.local.stack[-1][1] += elapsed
+        with self.lock:
+            self.phases[name] += elapsed - nested
+
+    def count_call(self, operation, seconds):
+        with self.lock:
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + 1
+            self.phases[AWS_CALLS] += seconds
+
+    def report(self):
+        """The run as a JSON-serializable dict - phase self times, command and total wall time and the AWS API calls made"""
+        command_seconds = (self.finished or time.perf_counter()) - self.started
+        phases = dict(self.phases, **{IMPORTS: import_seconds})
+        phases[OTHER] = max(command_seconds - sum(seconds for name, seconds in phases.items() if name not in (IMPORTS, OTHER)), 0.0)
+        return {'Phases': dict((name, round(seconds, 6)) for name, seconds in phases.items()),
+                'CommandSeconds': round(command_seconds, 6),
+                'TotalSeconds': round(command_seconds + import_seconds, 6),
+                'ApiCalls': dict(self.api_calls),
+                'ApiCallCount': sum(self.api_calls.values())}
+
+
+class phase(object):
+    """Context manager timing a block as the named phase of the active profile - a no-op when profiling is off"""
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = _active
+        if self.profile is not None:
+            self.profile.enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.exit(self.name)
+        return False
+
+
+def timed(name):
+    """Decorator timing every call of a function as the named phase"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_call(context=None, **kwargs):
+    context['ccli_profile_started'] = time.perf_counter()
+    # a before-call handler returning anything but None would short circuit the request with that value as the response
+
+
+def _after_call(event_name=None, context=None, **kwargs):
+    # every call is counted, but only timed when the before-call hook ran - another handler answering the call first (e.g. a Stubber) skips it
+    profile = _active
+    if profile is not None:
+        started = context.pop('ccli_profile_started', None)
+        profile.count_call(event_name.split('.', 1)[1], time.perf_counter() - started if started is not None else 0.0)
+
+
+def instrument(session):
+    """Register the API call hooks on a boto3 session when profiling is on - clients created from the session afterwards are counted"""
+    if _active is not None:
+        session.events.register('before-call', _before_call, unique_id='ccli-profile-before-call')
+        session.events.register('after-call', _after_call, unique_id='ccli-profile-after-call')
+    return session
+
+
+def start(memory_top=0):
+    """Turn profiling on for the rest of the process, returning the Profile being recorded"""
+    global _active
+    _active = Profile(memory_top)
+    if memory_top:
+        tracemalloc.start()
+    return _active
+
+
+def stop():
+    """Turn profiling off, returning the report of the Profile that was recorded - with the top allocation sites if they were traced"""
+    global _active
+    profile, _active = _active, None
+    profile.finished = time.perf_counter()
+    report = profile.report()
+    if profile.memory_top and tracemalloc.is_tracing():
+        report['PeakBytes'] = tracemalloc.get_traced_memory()[1]
+        report['TopAllocations'] = [{'Location': '%s:%d' % (stat.traceback[0].filename, stat.traceback[0].lineno), 'Bytes': stat.size, 'Blocks': stat.count}
+                                    for stat in tracemalloc.take_snapshot().statistics('lineno')[:profile.memory_top]]
+        tracemalloc.stop()
+    return report
+
+
+def format_report(report):
+    """The report as a summary table"""
+    total = report['TotalSeconds'] or 1.0
+    lines = ['%-16s %10s %7s' % ('phase', 'seconds', '%')]
+    for name in PHASES:
+        seconds = report['Phases'][name]
+        lines.append('%-16s %10.4f %6.1f%%' % (name, seconds, seconds * 100 / total))
+    lines.append('%-16s %10.4f' % ('total', report['TotalSeconds']))
+    lines.append('%d AWS API call(s)' % report['ApiCallCount'])
+    for operation, count in sorted(report['ApiCalls'].items(), key=lambda item: (-item[1], item[0])):
+        lines.append('  %6d %s' % (count, operation))
+    if 'TopAllocations' in report:
+        lines.append('Peak traced memory %d bytes, top allocation sites:' % report['PeakBytes'])
+        for allocation in report['TopAllocations']:
+            lines.append('  %10d bytes %7d blocks %s' % (allocation['Bytes'], allocation['Blocks'], allocation['Location']))
+    if 'CProfile' in report:
+        lines.append('cProfile stats written to %s' % report['CProfile'])
+    return '\n'.join(lines)
+
+
+def profile_options(profile=False, profile_json=None, profile_cprofile=None, profile_memory=0):
+    """Callback of the top level command - starts profiling when any of the options is given and reports it when the command's context closes"""
+    if not (profile or profile_json or profile_cprofile or profile_memory):
+        return
+    ctx = click.get_current_context()
+    start(profile_memory)
+    profiler = None
+    if profile_cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def _finish():
+        if profiler is not None:
+            profiler.disable()
+        report = stop()
+        if profiler is not None:
+            profiler.dump_stats(profile_cprofile)
+            report['CProfile'] = profile_cprofile
+        report['Command'] = ctx.invoked_subcommand
+        if profile_json:
+            with open(profile_json, 'w') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+        else:
+            click.echo(format_report(report), err=True)
+
+    ctx.call_on_close(_finish)
+
+
+PARAMS = [click.Option(['--profile'], is_flag=True, help="boolean indicates whether per-phase timings and AWS API call counts for the command should be printed to stderr. Options of the same name on commands are unrelated."),
+          click.Option(['--profile-json'], type=click.Path(dir_okay=False), help="path to write the profile to as JSON instead of printing it"),
+          click.Option(['--profile-cprofile'], type=click.Path(dir_okay=False), help="path to write cProfile stats for the command to, readable with pstats or snakeviz"),
+          click.Option(['--profile-memory'], type=click.IntRange(0), default=0, help="number of top allocation sites (by size, from tracemalloc) to include in the profile")]
@@ -0,0 +1,80 @@
+"""CloudFormation resource definitions for properties added to AWS after the troposphere release pinned in requirements/prod.txt. Each class
+mirrors the troposphere class of the same name with the newer properties added, so generators can switch back once troposphere is upgraded."""
+from troposphere import AWSObject, Tags
+from troposphere.cloudwatch import MetricDimension
+from troposphere.kinesis import StreamEncryption
+from troposphere.validators import boolean, integer, positive_integer
+
+
+class Alarm(AWSObject):
+    """AWS::CloudWatch::Alarm with metric math"""
+    resource_type = "AWS::CloudWatch::Alarm"
+
+    props = {
+        'ActionsEnabled': (boolean, False),
+        'AlarmActions': ([str], False),
+        'AlarmDescription': (str, False),
+        'AlarmName': (str, False),
+        'ComparisonOperator': (str, True),
+        'DatapointsToAlarm': (positive_integer, False),
+        'Dimensions': ([MetricDimension], False),
+        'EvaluationPeriods': (positive_integer, True),
+        'InsufficientDataActions': ([str], False),
+        'MetricName': (str, False),
+        'Metrics': ([dict], False),
+        'Namespace': (str, False),
+        'OKActions': ([str], False),
+        'Period': (positive_integer, False),
+        'Statistic': (str, False),
+        'Threshold': (integer, True),
+        'TreatMissingData': (str, False),
+    }
+
+
+class FlowLog(AWSObject):
+    """AWS::EC2::FlowLog with S3 destinations, custom log formats and destination options"""
+    resource_type = "AWS::EC2::FlowLog"
+
+    props = {
+        'DeliverLogsPermissionArn': (str, False),
+        'DestinationOptions': (dict, False),
+        'LogDestination': (str, False),
+        'LogDestinationType': (str, False),
+        'LogFormat': (str, False),
+        'LogGroupName': (str, False),
+        'MaxAggregationInterval': (integer, False),
+        'ResourceId': (str, True),
+        'ResourceType': (str, True),
+        'Tags': ((Tags, list), False),
+        'TrafficType': (str, True),
+    }
+
+
+class Stream(AWSObject):
+    """AWS::Kinesis::Stream with on-demand capacity mode"""
+    resource_type = "AWS::Kinesis::Stream"
+
+    props = {
+        'Name': (str, False),
+        'RetentionPeriodHours': (integer, False),
+        'ShardCount': (integer, False),
+        'StreamEncryption': (StreamEncryption, False),
+        'StreamModeDetails': (dict, False),
+        'Tags': ((Tags, list), False),
+    }
+
+
+class Subscription(AWSObject):
+    """AWS::SNS::Subscription with message body filter policies and raw message delivery"""
+    resource_type = "AWS::SNS::Subscription"
+
+    props = {
+        'Endpoint': (str, False),
+        'FilterPolicy': (dict, False),
+        'FilterPolicyScope': (str, False),
+        'Protocol': (str, True),
+        'RawMessageDelivery': (boolean, False),
+        'RedrivePolicy': (dict, False),
+        'Region': (str, False),
+        'TopicArn': (str, True),
+    }
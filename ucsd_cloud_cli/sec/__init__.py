@@ -1,5 +1,6 @@
 import click
-from .isolate import isolate
-from .snapshot import snapshot
+from .isolate import cli as isolate
+from .snapshot import cli as snapshot
+from .response import cli as response
 
-sec = click.CommandCollection(sources=[isolate, snapshot])
+sec = click.CommandCollection(sources=[isolate, snapshot, response])
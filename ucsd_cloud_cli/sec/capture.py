@@ -0,0 +1,128 @@
+"""Forensic EBS snapshot engine used by `snapshot create` and the auto-isolation Lambda. Only depends on the standard library and the boto3 clients
+handed in, so it can be bundled into a Lambda deployment package as-is."""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TAG_PREFIX = 'ccli:evidence:'
+
+# DescribeSnapshots filters accept at most 200 values, so that many snapshots are covered by each progress poll
+MAX_FILTER_VALUES = 200
+# error codes CreateSnapshots fails with where multi-volume snapshots aren't available - anything else (throttling, access denied) is an error
+MULTI_VOLUME_UNSUPPORTED = ('UnsupportedOperation',)
+
+
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _timestamp(when=None):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(when if when is not None else time.time()))
+
+
+def instance_volumes(instance):
+    """Helper method returning a dict of volume ID -> device name for every EBS volume attached to an instance description"""
+    return dict((mapping['Ebs']['VolumeId'], mapping['DeviceName']) for mapping in instance.get('BlockDeviceMappings', []) if 'Ebs' in mapping)
+
+
+def evidence_tags(case_id, instance_id, operator=None):
+    """Tags applied to every evidence snapshot so it can be traced back to the case and the instance it was taken from"""
+    return [{'Key': TAG_PREFIX + 'case', 'Value': case_id},
+            {'Key': TAG_PREFIX + 'instance', 'Value': instance_id},
+            {'Key': TAG_PREFIX + 'operator', 'Value': operator or ''}]
+
+
+def snapshot_instance(ec2, instance, case_id, operator=None):
+    """Start snapshots of every EBS volume attached to an instance. A single crash-consistent multi-volume CreateSnapshots call is used, falling back to
+    one CreateSnapshot per volume where it isn't available (e.g. instance store backed instances or partitions without multi-volume snapshots)."""
+    devices = instance_volumes(instance)
+    tags = evidence_tags(case_id, instance['InstanceId'], operator)
+    description = 'Forensic snapshot for case %s of %s' % (case_id, instance['InstanceId'])
+    try:
+        snapshots = ec2.create_snapshots(InstanceSpecification={'InstanceId': instance['InstanceId'], 'ExcludeBootVolume': False},
+                                         Description=description,
+                                         TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': tags}],
+                                         CopyTagsFromSource='volume')['Snapshots']
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') not in MULTI_VOLUME_UNSUPPORTED:
+            raise
+        snapshots = [ec2.create_snapshot(VolumeId=volume_id, Description=description,
+                                         TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': tags}]) for volume_id in sorted(devices)]
+    return [{'SnapshotId': s['SnapshotId'],
+             'VolumeId': s['VolumeId'],
+             'VolumeSize': s.get('VolumeSize'),
+             'InstanceId': instance['InstanceId'],
+             'DeviceName': devices.get(s['VolumeId']),
+             'State': s.get('State', 'pending'),
+             'Progress': s.get('Progress', '0%'),
+             'StartTime': _timestamp(),
+             'CompletionTime': None} for s in snapshots]
+
+
+def poll_snapshots(ec2, snapshots):
+    """Refresh the state and progress of the given snapshot records in place with as few DescribeSnapshots calls as possible. Records that reach a final
+    state get their CompletionTime set to the time of the poll that first saw it. Returns the records that are still pending."""
+    by_id = dict((s['SnapshotId'], s) for s in snapshots)
+    pending = [s['SnapshotId'] for s in snapshots if s['State'] == 'pending']
+    now = _timestamp()
+    for chunk in _chunks(pending, MAX_FILTER_VALUES):
+        for page in ec2.get_paginator('describe_snapshots').paginate(Filters=[{'Name': 'snapshot-id', 'Values': chunk}]):
+            for description in page.get('Snapshots', []):
+                record = by_id[description['SnapshotId']]
+                record['State'] = description['State']
+                record['Progress'] = description.get('Progress', record['Progress'])
+                if record['State'] != 'pending' and record['CompletionTime'] is None:
+                    record['CompletionTime'] = now
+    return [s for s in snapshots if s['State'] == 'pending']
+
+
+def wait_for_snapshots(ec2, snapshots, poll_interval=15, timeout=None, on_progress=None, sleep=time.sleep):
+    """Poll until every snapshot has completed (or errored), calling `on_progress(snapshots)` after each poll. Returns True if all finished before
+    `timeout` seconds passed."""
+    started = time.time()
+    while True:
+        pending = poll_snapshots(ec2, snapshots)
+        if on_progress:
+            on_progress(snapshots)
+        if not pending:
+            return True
+        if timeout is not None and time.time() - started >= timeout:
+            return False
+        sleep(poll_interval)
+
+
+def capture(ec2, instances, case_id, operator=None, workers=32):
+    """Start snapshots of every volume on the given instances (a dict of instance ID -> DescribeInstances description) concurrently. Returns a list of
+    snapshot records and a dict of instance ID -> error for instances whose snapshots could not be started."""
+    def _run(instance):
+        try:
+            return snapshot_instance(ec2, instance, case_id, operator), None
+        except Exception as e:
+            return [], str(e)
+
+    snapshots, errors = [], {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for instance_id, (records, error) in zip(sorted(instances), executor.map(_run, [instances[i] for i in sorted(instances)])):
+            snapshots.extend(records)
+            if error:
+                errors[instance_id] = error
+    return snapshots, errors
+
+
+def build_manifest(case_id, snapshots, errors=None, operator=None, started=None):
+    """Evidence manifest recording which snapshots were taken of which volumes, when they started and when they were seen to complete"""
+    return {'Case': case_id,
+            'Operator': operator,
+            'Started': _timestamp(started),
+            'Written': _timestamp(),
+            'Snapshots': sorted(snapshots, key=lambda s: (s.get('Profile', ''), s.get('Region', ''), s['InstanceId'], s['DeviceName'] or '', s['SnapshotId'])),
+            'Errors': errors or {}}
+
+
+def write_manifest(path, manifest):
+    """Write the manifest atomically, so a manifest on disk is always complete even if the capture is interrupted while it's being rewritten"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,223 @@
+"""Evidence copy scheduler - moves forensic snapshots into the security account, re-encrypted with a security account KMS key, while keeping the number
+of in-flight CopySnapshot operations per destination region at (but never over) the limit AWS enforces. Jobs live in a local sqlite database, so an
+interrupted run picks up where it left off."""
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .capture import TAG_PREFIX
+
+# AWS allows 20 concurrent snapshot copies into a single destination region
+DEFAULT_MAX_CONCURRENT = 20
+MAX_ATTEMPTS = 3
+MAX_FILTER_VALUES = 200
+
+# Errors that mean "try again later" rather than "this job is broken"
+RETRYABLE_ERRORS = ['ResourceLimitExceeded', 'SnapshotCopyLimitExceeded', 'RequestLimitExceeded', 'Throttling', 'PendingSnapshotLimitExceeded']
+
+QUEUED = 'queued'
+STARTING = 'starting'
+COPYING = 'copying'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    snapshot_id TEXT NOT NULL,
+    source_profile TEXT NOT NULL,
+    source_region TEXT NOT NULL,
+    destination_region TEXT NOT NULL,
+    kms_key_id TEXT NOT NULL,
+    case_id TEXT,
+    volume_size INTEGER,
+    state TEXT NOT NULL,
+    destination_snapshot_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at REAL,
+    started_at REAL,
+    completed_at REAL,
+    PRIMARY KEY (snapshot_id, destination_region))"""
+
+_COLUMNS = ['snapshot_id', 'source_profile', 'source_region', 'destination_region', 'kms_key_id', 'case_id', 'volume_size', 'state',
+            'destination_snapshot_id', 'attempts', 'error', 'queued_at', 'started_at', 'completed_at']
+
+
+def _is_retryable(error):
+    return any(code in str(error) for code in RETRYABLE_ERRORS)
+
+
+class EvidenceQueue(object):
+    """Persistent job queue, one row per (source snapshot, destination region). Only the scheduler thread touches the database."""
+
+    def __init__(self, path):
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.db = sqlite3.connect(path)
+        self.db.execute(_SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def enqueue(self, snapshot_id, source_profile, source_region, destination_region, kms_key_id, case_id=None, volume_size=None):
+        """Add a copy job, returning False if the snapshot is already queued for that destination region"""
+        cursor = self.db.execute('INSERT OR IGNORE INTO jobs (snapshot_id, source_profile, source_region, destination_region, kms_key_id, case_id, volume_size, '
+                                 'state, queued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (snapshot_id, source_profile, source_region, destination_region, kms_key_id, case_id, volume_size, QUEUED, time.time()))
+        self.db.commit()
+        return cursor.rowcount == 1
+
+    def jobs(self, state=None, destination_region=None, limit=None):
+        query, args = 'SELECT %s FROM jobs WHERE 1 = 1' % ', '.join(_COLUMNS), []
+        if state:
+            query += ' AND state = ?'
+            args.append(state)
+        if destination_region:
+            query += ' AND destination_region = ?'
+            args.append(destination_region)
+        query += ' ORDER BY queued_at, snapshot_id'
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        return [dict(zip(_COLUMNS, row)) for row in self.db.execute(query, args)]
+
+    def update(self, job, **values):
+        job.update(values)
+        self.db.execute('UPDATE jobs SET %s WHERE snapshot_id = ? AND destination_region = ?' % ', '.join('%s = ?' % k for k in sorted(values)),
+                        [values[k] for k in sorted(values)] + [job['snapshot_id'], job['destination_region']])
+        self.db.commit()
+
+    def counts(self):
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+
+def _find_copy(ec2, snapshot_id):
+    """Look for a copy started by an earlier (interrupted) run via the source snapshot tag every copy is created with"""
+    for page in ec2.get_paginator('describe_snapshots').paginate(OwnerIds=['self'], Filters=[{'Name': 'tag:%ssource-snapshot' % TAG_PREFIX, 'Values': [snapshot_id]}]):
+        for snapshot in page.get('Snapshots', []):
+            if snapshot['State'] != 'error':
+                return snapshot['SnapshotId']
+    return None
+
+
+def start_copy(source_ec2, destination_ec2, job, security_account_id):
+    """Share the source snapshot with the security account and start the re-encrypting copy from the security account side. Returns the copy's ID."""
+    source_ec2.modify_snapshot_attribute(SnapshotId=job['snapshot_id'], Attribute='createVolumePermission', OperationType='add', UserIds=[security_account_id])
+    return destination_ec2.copy_snapshot(SourceSnapshotId=job['snapshot_id'],
+                                         SourceRegion=job['source_region'],
+                                         Encrypted=True,
+                                         KmsKeyId=job['kms_key_id'],
+                                         Description='Evidence copy of %s for case %s' % (job['snapshot_id'], job['case_id']),
+                                         TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': [
+                                             {'Key': TAG_PREFIX + 'case', 'Value': job['case_id'] or ''},
+                                             {'Key': TAG_PREFIX + 'source-snapshot', 'Value': job['snapshot_id']},
+                                             {'Key': TAG_PREFIX + 'source-region', 'Value': job['source_region']}]}])['SnapshotId']
+
+
+class Scheduler(object):
+    """Drives the queue: keeps each destination region's in-flight copies at `max_concurrent`, polls them in batches and records completions.
+
+    `source_clients` maps (profile, region) to an EC2 client in the account owning the evidence, `destination_clients` maps region to an EC2 client in
+    the security account."""
+
+    def __init__(self, queue, source_clients, destination_clients, security_account_id, max_concurrent=DEFAULT_MAX_CONCURRENT, sleep=time.sleep):
+        self.queue = queue
+        self.source_clients = source_clients
+        self.destination_clients = destination_clients
+        self.security_account_id = security_account_id
+        self.max_concurrent = max_concurrent
+        self.sleep = sleep
+        self.started = time.time()
+        self.completed = []
+        self.peak_in_flight = {}
+
+    def recover(self):
+        """Reconcile jobs left in STARTING by a crash - the copy may or may not have been started before the run died"""
+        for job in self.queue.jobs(STARTING):
+            copy_id = _find_copy(self.destination_clients[job['destination_region']], job['snapshot_id'])
+            if copy_id:
+                self.queue.update(job, state=COPYING, destination_snapshot_id=copy_id)
+            else:
+                self.queue.update(job, state=QUEUED)
+
+    def _start(self, region, executor):
+        in_flight = len(self.queue.jobs(COPYING, region)) + len(self.queue.jobs(STARTING, region))
+        jobs = self.queue.jobs(QUEUED, region, limit=max(0, self.max_concurrent - in_flight))
+        for job in jobs:
+            self.queue.update(job, state=STARTING, started_at=time.time(), attempts=job['attempts'] + 1)
+
+        def _run(job):
+            try:
+                return job, start_copy(self.source_clients[(job['source_profile'], job['source_region'])], self.destination_clients[region], job,
+                                       self.security_account_id), None
+            except Exception as e:
+                return job, None, e
+
+        for job, copy_id, error in executor.map(_run, jobs):
+            if copy_id:
+                self.queue.update(job, state=COPYING, destination_snapshot_id=copy_id, error=None)
+            elif _is_retryable(error):
+                self.queue.update(job, state=QUEUED, attempts=job['attempts'] - 1, error=str(error))
+            elif job['attempts'] < MAX_ATTEMPTS:
+                self.queue.update(job, state=QUEUED, error=str(error))
+            else:
+                self.queue.update(job, state=FAILED, error=str(error))
+        in_flight = len(self.queue.jobs(COPYING, region))
+        self.peak_in_flight[region] = max(self.peak_in_flight.get(region, 0), in_flight)
+
+    def _poll(self, region):
+        jobs = dict((job['destination_snapshot_id'], job) for job in self.queue.jobs(COPYING, region))
+        ids = sorted(jobs)
+        for i in range(0, len(ids), MAX_FILTER_VALUES):
+            for page in self.destination_clients[region].get_paginator('describe_snapshots').paginate(
+                    OwnerIds=['self'], Filters=[{'Name': 'snapshot-id', 'Values': ids[i:i + MAX_FILTER_VALUES]}]):
+                for snapshot in page.get('Snapshots', []):
+                    job = jobs[snapshot['SnapshotId']]
+                    if snapshot['State'] == 'completed':
+                        self.queue.update(job, state=COMPLETED, completed_at=time.time())
+                        self.completed.append(job)
+                        self._unshare(job)
+                    elif snapshot['State'] == 'error':
+                        self.queue.update(job, state=QUEUED if job['attempts'] < MAX_ATTEMPTS else FAILED, error=snapshot.get('StateMessage', 'copy failed'))
+
+    def _unshare(self, job):
+        """The security account has its own copy now, so the share on the source snapshot is no longer needed"""
+        try:
+            self.source_clients[(job['source_profile'], job['source_region'])].modify_snapshot_attribute(
+                SnapshotId=job['snapshot_id'], Attribute='createVolumePermission', OperationType='remove', UserIds=[self.security_account_id])
+        except Exception:
+            pass
+
+    def step(self, executor):
+        """Run one scheduling round across every destination region. Returns the number of jobs not yet finished."""
+        for region in sorted(self.destination_clients):
+            self._poll(region)
+            self._start(region, executor)
+        counts = self.queue.counts()
+        return sum(counts.get(state, 0) for state in [QUEUED, STARTING, COPYING])
+
+    def run(self, poll_interval=30, timeout=None, on_progress=None):
+        """Run until the queue drains (or `timeout` seconds pass), calling `on_progress(scheduler)` after every round. Returns True if it drained."""
+        self.recover()
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            while True:
+                remaining = self.step(executor)
+                if on_progress:
+                    on_progress(self)
+                if not remaining:
+                    return True
+                if timeout is not None and time.time() - self.started >= timeout:
+                    return False
+                self.sleep(poll_interval)
+
+    def throughput(self):
+        """Jobs and GiB completed by this run, and the rates they were completed at"""
+        elapsed = max(time.time() - self.started, 1e-6)
+        gib = sum(job['volume_size'] or 0 for job in self.completed)
+        return {'completed': len(self.completed),
+                'gib': gib,
+                'seconds': elapsed,
+                'snapshots_per_hour': len(self.completed) * 3600.0 / elapsed,
+                'gib_per_hour': gib * 3600.0 / elapsed,
+                'peak_in_flight': dict(self.peak_in_flight),
+                'states': self.queue.counts()}
@@ -0,0 +1,169 @@
+"""Evidence export engine - streams a snapshot's blocks through the EBS direct APIs, hashing the volume image in order as blocks arrive and optionally
+writing it out as a sparse local image or a multipart S3 object. Only depends on the standard library and the boto3 clients handed in."""
+import base64
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+GIB = 1024 ** 3
+MB = 1000.0 ** 2
+
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_WORKERS = 16
+# 16 blocks of 512 KiB = 8 MiB parts, comfortably over the 5 MiB S3 minimum part size - larger for volumes over MAX_PARTS parts of that
+DEFAULT_PART_BLOCKS = 16
+MAX_PARTS = 10000
+MAX_PART_BYTES = 5 * GIB
+MAX_UPLOADS_IN_FLIGHT = 4
+MAX_BLOCK_ATTEMPTS = 3
+
+
+class ChecksumError(Exception):
+    """Raised when a block's data keeps failing to match the checksum the EBS direct API returned for it"""
+    pass
+
+
+def list_blocks(ebs, snapshot_id):
+    """Generator over the snapshot's written blocks in block index order, fetched a page at a time. The first value yielded is a (volume size in GiB,
+    block size in bytes) tuple, the rest are (block index, block token) tuples."""
+    kwargs = {'SnapshotId': snapshot_id, 'MaxResults': 10000}
+    first = True
+    while True:
+        page = ebs.list_snapshot_blocks(**kwargs)
+        if first:
+            yield page['VolumeSize'], page['BlockSize']
+            first = False
+        for block in page.get('Blocks', []):
+            yield block['BlockIndex'], block['BlockToken']
+        if not page.get('NextToken'):
+            return
+        kwargs['NextToken'] = page['NextToken']
+
+
+def read_block(ebs, snapshot_id, block_index, block_token):
+    """Fetch one block and verify it against the SHA256 checksum the service sends with it, retrying a couple of times on a mismatch"""
+    for _ in range(MAX_BLOCK_ATTEMPTS):
+        response = ebs.get_snapshot_block(SnapshotId=snapshot_id, BlockIndex=block_index, BlockToken=block_token)
+        data = response['BlockData'].read()
+        if base64.b64encode(hashlib.sha256(data).digest()).decode('ascii') == response['Checksum']:
+            return data
+    raise ChecksumError('Block %d of %s failed checksum verification %d times' % (block_index, snapshot_id, MAX_BLOCK_ATTEMPTS))
+
+
+class _S3Writer(object):
+    """Collects the image into parts and uploads them in the background, keeping at most MAX_UPLOADS_IN_FLIGHT parts in memory"""
+
+    def __init__(self, s3, bucket, key, part_size, metadata=None):
+        self.s3, self.bucket, self.key, self.part_size = s3, bucket, key, part_size
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, Metadata=metadata or {})['UploadId']
+        self.executor = ThreadPoolExecutor(max_workers=MAX_UPLOADS_IN_FLIGHT)
+        self.buffer = bytearray()
+        self.uploads = deque()
+        self.parts = []
+
+    def _upload(self, part_number, body):
+        return {'PartNumber': part_number,
+                'ETag': self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body)['ETag']}
+
+    def _flush(self):
+        while len(self.uploads) >= MAX_UPLOADS_IN_FLIGHT:
+            self.parts.append(self.uploads.popleft().result())
+        self.uploads.append(self.executor.submit(self._upload, len(self.parts) + len(self.uploads) + 1, bytes(self.buffer)))
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.part_size:
+            self._flush()
+
+    def close(self):
+        if self.buffer or not (self.parts or self.uploads):
+            self._flush()
+        while self.uploads:
+            self.parts.append(self.uploads.popleft().result())
+        self.executor.shutdown()
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        self.executor.shutdown()
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def part_blocks_for(total_blocks, block_size, part_blocks=DEFAULT_PART_BLOCKS):
+    """Blocks per multipart upload part - at least `part_blocks`, and enough that the volume fits in S3's MAX_PARTS parts"""
+    blocks = max(part_blocks, -(-total_blocks // MAX_PARTS))
+    if blocks * block_size > MAX_PART_BYTES:
+        raise ValueError('%d blocks of %d bytes need parts over the 5 GiB S3 maximum part size' % (total_blocks, block_size))
+    return blocks
+
+
+def export_snapshot(ebs, snapshot_id, image_path=None, s3=None, bucket=None, key=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, workers=DEFAULT_WORKERS,
+                    part_blocks=DEFAULT_PART_BLOCKS, on_progress=None):
+    """Read every written block of a snapshot with up to `max_in_flight` GetSnapshotBlock calls outstanding and SHA256 the full volume image in block
+    order, counting unwritten blocks as zeros so the digest matches a `dd` of the restored volume. The image is optionally written to `image_path`
+    (only written blocks are written, so the file stays sparse) and/or uploaded to s3://bucket/key as a multipart object. `on_progress(stats)` is
+    called every 256 blocks. Returns the digest with byte counts, elapsed seconds and MB/s."""
+    started = time.time()
+    blocks = list_blocks(ebs, snapshot_id)
+    volume_size, block_size = next(blocks)
+    total_blocks = volume_size * GIB // block_size
+    zeros = bytes(block_size)
+
+    part_size = part_blocks_for(total_blocks, block_size, part_blocks) * block_size if s3 else None
+
+    digest = hashlib.sha256()
+    image = open(image_path, 'wb') if image_path else None
+    writer = _S3Writer(s3, bucket, key, part_size, {'snapshot-id': snapshot_id}) if s3 else None
+    stats = {'SnapshotId': snapshot_id, 'VolumeBytes': total_blocks * block_size, 'BlockSize': block_size, 'BlocksRead': 0, 'BytesRead': 0}
+
+    def _emit(data):
+        digest.update(data)
+        if writer:
+            writer.write(data)
+
+    try:
+        if image:
+            image.truncate(total_blocks * block_size)
+        next_index = 0
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def _fill():
+                while len(window) < max_in_flight:
+                    try:
+                        block_index, block_token = next(blocks)
+                    except StopIteration:
+                        return
+                    window.append((block_index, executor.submit(read_block, ebs, snapshot_id, block_index, block_token)))
+
+            _fill()
+            while window:
+                block_index, future = window.popleft()
+                data = future.result()
+                _fill()
+                for _ in range(next_index, block_index):
+                    _emit(zeros)
+                _emit(data)
+                if image:
+                    image.seek(block_index * block_size)
+                    image.write(data)
+                next_index = block_index + 1
+                stats['BlocksRead'] += 1
+                stats['BytesRead'] += len(data)
+                if on_progress and stats['BlocksRead'] % 256 == 0:
+                    on_progress(dict(stats, Seconds=time.time() - started, BlocksHashed=next_index, TotalBlocks=total_blocks))
+        for _ in range(next_index, total_blocks):
+            _emit(zeros)
+        if writer:
+            writer.close()
+    except Exception:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        if image:
+            image.close()
+
+    elapsed = max(time.time() - started, 1e-6)
+    stats.update(Sha256=digest.hexdigest(), Seconds=elapsed, ReadMBps=stats['BytesRead'] / MB / elapsed, VolumeMBps=stats['VolumeBytes'] / MB / elapsed)
+    return stats
@@ -1,6 +1,80 @@
 import click
-from .snapshot import snapshot
+import getpass
+import json
+from concurrent.futures import ThreadPoolExecutor
 
-@click.command()
-def isolate():
+from ..common import get_boto3_clients, get_profile_region_keys, DEFAULT_REGIONS
+from .quarantine import resolve_targets, isolate as isolate_instances, parse_tags, QUARANTINE_GROUP_NAME
+
+
+@click.group()
+def cli():
     pass
+
+
+def run_isolation(clients, instance_ids=(), tags=(), eni_ids=(), case_id=None, group_name=QUARANTINE_GROUP_NAME, detach=True, dry_run=False, workers=32, operator=None):
+    """Resolve and isolate targets in every (profile, region) pair of `clients` concurrently. Returns a list of (key, result) tuples, where results
+    for a dry run only carry the resolved instance and VPC IDs. A (profile, region) pair that fails outright gets a single result with no
+    InstanceId and the error, the other pairs' results are still returned."""
+    def _run(item):
+        key, (ec2, autoscaling) = item
+        try:
+            instances = resolve_targets(ec2, instance_ids, tags, eni_ids)
+            if dry_run:
+                return [(key, {'InstanceId': instance_id, 'VpcId': instance.get('VpcId'), 'Error': None}) for instance_id, instance in sorted(instances.items())]
+            return [(key, result) for result in isolate_instances(ec2, autoscaling, instances, case_id, group_name, detach, workers, operator)]
+        except Exception as e:
+            return [(key, {'InstanceId': None, 'VpcId': None, 'GroupId': None, 'NetworkInterfaces': [], 'AutoScalingGroupName': None,
+                           'Error': str(e), 'Seconds': None})]
+
+    with ThreadPoolExecutor(max_workers=max(1, len(clients))) as executor:
+        return [result for results in executor.map(_run, sorted(clients.items())) for result in results]
+
+
+@cli.command()
+@click.option('-p', '--profile', 'profile_list', multiple=True, help="AWS profile(s) for the accounts the instances live in. Defaults to the default profile.")
+@click.option('-r', '--region', 'region_list', multiple=True, help="Region(s) to look for the instances in. Defaults to %s." % ', '.join(DEFAULT_REGIONS))
+@click.option('-i', '--instance-id', 'instance_ids', multiple=True, help="ID of an instance to isolate.")
+@click.option('-t', '--tag', 'tag_list', multiple=True, help="Key=Value tag selecting instances to isolate.")
+@click.option('-e', '--eni', 'eni_ids', multiple=True, help="ID of a network interface whose instance should be isolated.")
+@click.option('--case', 'case_id', required=True, help="Incident/case identifier recorded in the audit tags.")
+@click.option('--group-name', 'group_name', default=QUARANTINE_GROUP_NAME, help="Name of the quarantine security group created (or reused) in each VPC.")
+@click.option('--no-detach', 'no_detach', is_flag=True, help="boolean indicates whether instances should be left in their Auto Scaling groups")
+@click.option('--workers', type=int, default=32, help="Number of concurrent AWS API calls per account/region.")
+@click.option('--dry-run', 'dry_run', is_flag=True, help="boolean indicates whether to only list the instances the targets resolve to")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. text")
+def isolate(profile_list, region_list, instance_ids, tag_list, eni_ids, case_id, group_name=QUARANTINE_GROUP_NAME, no_detach=False, workers=32, dry_run=False, as_json=False):
+    """Quarantine instances by moving every network interface onto a no-ingress/no-egress security group in its VPC, detaching them from Auto Scaling groups and tagging them (and the interfaces' previous groups) for audit."""
+    if not (instance_ids or tag_list or eni_ids):
+        raise click.UsageError('Provide at least one --instance-id, --tag or --eni')
+    try:
+        tags = parse_tags(tag_list)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--tag')
+
+    keys = get_profile_region_keys(profile_list, region_list, ['default'])
+    ec2_clients, autoscaling_clients = get_boto3_clients('ec2', keys), get_boto3_clients('autoscaling', keys)
+    clients = dict((key, (ec2_clients[key], autoscaling_clients[key])) for key in keys)
+    results = run_isolation(clients, instance_ids, tags, eni_ids, case_id, group_name, not no_detach, dry_run, workers, getpass.getuser())
+
+    if as_json:
+        click.echo(json.dumps([dict(result, Profile=key[0], Region=key[1]) for key, result in results], indent=4, sort_keys=True))
+    elif dry_run:
+        for (profile, region), result in results:
+            click.echo('%-24s %-12s %-20s %s' % (profile, region, result['InstanceId'] or '-', result['Error'] or result['VpcId']))
+    else:
+        click.echo('%-24s %-12s %-20s %-21s %-20s %4s %-24s %8s %s' % ('PROFILE', 'REGION', 'INSTANCE', 'VPC', 'GROUP', 'ENIS', 'ASG', 'SECONDS', 'STATUS'))
+        for (profile, region), result in results:
+            click.echo('%-24s %-12s %-20s %-21s %-20s %4d %-24s %8s %s' % (profile, region, result['InstanceId'] or '-', result['VpcId'] or '-',
+                       result['GroupId'] or '-', len(result['NetworkInterfaces']), result['AutoScalingGroupName'] or '-',
+                       '%.2f' % result['Seconds'] if result['Seconds'] is not None else '-', result['Error'] or 'isolated'))
+
+    failed_keys = ['%s/%s' % key for key, result in results if result['InstanceId'] is None]
+    instance_results = [result for _, result in results if result['InstanceId'] is not None]
+    if not (failed_keys or instance_results):
+        raise click.ClickException('No instances matched the given targets')
+    failures = [result for result in instance_results if result['Error']]
+    problems = (['%d of %d instance(s) could not be isolated' % (len(failures), len(instance_results))] if failures else []) + \
+               (['targets could not be resolved or isolated in %s' % ', '.join(failed_keys)] if failed_keys else [])
+    if problems:
+        raise click.ClickException('; '.join(problems))
@@ -0,0 +1,168 @@
+"""Instance isolation engine used by `isolate` and the auto-isolation Lambda. Only depends on the standard library and the boto3 clients handed
+in, so it can be bundled into a Lambda deployment package as-is."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+QUARANTINE_GROUP_NAME = 'ccli-quarantine'
+TAG_PREFIX = 'ccli:isolation:'
+
+# DescribeInstances accepts at most 200 values per filter, DescribeAutoScalingInstances 50 instance IDs and DetachInstances 20
+MAX_FILTER_VALUES = 200
+MAX_ASG_DESCRIBE = 50
+MAX_ASG_DETACH = 20
+
+
+def _chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def parse_tags(tag_list):
+    """Helper method to turn Key=Value strings (as given on the command line) into a list of (key, value) pairs"""
+    tags = []
+    for tag in tag_list:
+        if '=' not in tag:
+            raise ValueError('Tag %r is not of the form Key=Value' % tag)
+        tags.append(tuple(tag.split('=', 1)))
+    return tags
+
+
+def resolve_targets(ec2, instance_ids=(), tags=(), eni_ids=()):
+    """Resolve instance IDs, (key, value) tag pairs and ENI IDs to the running/stopped instances they identify, returned as a dict of instance ID ->
+    DescribeInstances instance description. Lookups are batched into as few DescribeInstances calls as the per-filter value limit allows."""
+    filter_sets = [[{'Name': 'instance-id', 'Values': chunk}] for chunk in _chunks(instance_ids, MAX_FILTER_VALUES)]
+    filter_sets.extend([{'Name': 'network-interface.network-interface-id', 'Values': chunk}] for chunk in _chunks(eni_ids, MAX_FILTER_VALUES))
+    tag_values = {}
+    for key, value in tags:
+        tag_values.setdefault(key, []).append(value)
+    for key, values in sorted(tag_values.items()):
+        filter_sets.extend([{'Name': 'tag:%s' % key, 'Values': chunk}] for chunk in _chunks(values, MAX_FILTER_VALUES))
+
+    instances = {}
+    for filters in filter_sets:
+        filters = filters + [{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}]
+        for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for reservation in page.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    instances[instance['InstanceId']] = instance
+    return instances
+
+
+def _security_group(ec2, vpc_id, group_name):
+    groups = ec2.describe_security_groups(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]},
+                                                   {'Name': 'group-name', 'Values': [group_name]}]).get('SecurityGroups', [])
+    return groups[0] if groups else None
+
+
+def ensure_quarantine_group(ec2, vpc_id, group_name=QUARANTINE_GROUP_NAME, case_id=None):
+    """Return the ID of the quarantine security group in a VPC, creating it if needed. The group has no ingress rules and every egress rule it is
+    created with (allow-all IPv4, and IPv6 in dual-stack VPCs) is revoked, so attaching it as the only group cuts an instance off from the network.
+    Raises ValueError when an existing group of that name has rules, as it wouldn't isolate anything."""
+    existing = _security_group(ec2, vpc_id, group_name)
+    if existing:
+        if existing.get('IpPermissions') or existing.get('IpPermissionsEgress'):
+            raise ValueError('Security group %s (%s) in %s has ingress or egress rules and cannot be used for quarantine'
+                             % (existing['GroupId'], group_name, vpc_id))
+        return existing['GroupId']
+
+    group_id = ec2.create_security_group(GroupName=group_name, VpcId=vpc_id,
+                                         Description='Quarantine group for isolated instances - no ingress or egress')['GroupId']
+    egress = (_security_group(ec2, vpc_id, group_name) or {}).get('IpPermissionsEgress', [])
+    if egress:
+        ec2.revoke_security_group_egress(GroupId=group_id, IpPermissions=egress)
+    ec2.create_tags(Resources=[group_id], Tags=[{'Key': 'Name', 'Value': group_name},
+                                                {'Key': TAG_PREFIX + 'case', 'Value': case_id or ''}])
+    return group_id
+
+
+def auto_scaling_groups(autoscaling, instance_ids):
+    """Look up which Auto Scaling group (if any) each instance belongs to, returned as a dict of instance ID -> group name"""
+    groups = {}
+    for chunk in _chunks(instance_ids, MAX_ASG_DESCRIBE):
+        for page in autoscaling.get_paginator('describe_auto_scaling_instances').paginate(InstanceIds=chunk):
+            for instance in page.get('AutoScalingInstances', []):
+                groups[instance['InstanceId']] = instance['AutoScalingGroupName']
+    return groups
+
+
+def detach_from_auto_scaling_groups(autoscaling, groups):
+    """Detach instances from their Auto Scaling groups without decrementing desired capacity, so the group replaces them rather than terminating
+    the isolated instance once it fails its load balancer health checks. `groups` is a dict of instance ID -> group name. Returns a dict of
+    instance ID -> error for the instances that couldn't be detached."""
+    by_group = {}
+    for instance_id, group_name in groups.items():
+        by_group.setdefault(group_name, []).append(instance_id)
+    errors = {}
+    for group_name, instance_ids in sorted(by_group.items()):
+        for chunk in _chunks(sorted(instance_ids), MAX_ASG_DETACH):
+            try:
+                autoscaling.detach_instances(InstanceIds=chunk, AutoScalingGroupName=group_name, ShouldDecrementDesiredCapacity=False)
+            except Exception as e:
+                errors.update((instance_id, str(e)) for instance_id in chunk)
+    return errors
+
+
+def _isolate_instance(ec2, instance, group_id, audit_tags):
+    """Swap every network interface of one instance onto the quarantine group, recording the groups it had on the interface for the audit trail"""
+    enis = []
+    for eni in instance.get('NetworkInterfaces', []):
+        previous = [g['GroupId'] for g in eni.get('Groups', [])]
+        if previous != [group_id]:
+            ec2.create_tags(Resources=[eni['NetworkInterfaceId']], Tags=audit_tags + [{'Key': TAG_PREFIX + 'previous-groups', 'Value': ','.join(previous)}])
+            ec2.modify_network_interface_attribute(NetworkInterfaceId=eni['NetworkInterfaceId'], Groups=[group_id])
+        enis.append({'NetworkInterfaceId': eni['NetworkInterfaceId'], 'PreviousGroups': previous})
+    ec2.create_tags(Resources=[instance['InstanceId']], Tags=audit_tags)
+    return enis
+
+
+def isolate(ec2, autoscaling, instances, case_id=None, group_name=QUARANTINE_GROUP_NAME, detach=True, workers=32, operator=None):
+    """Isolate already resolved instances (see resolve_targets) within a single account/region.
+
+    One quarantine group is created or reused per VPC up front, instances are detached from their Auto Scaling groups, then every instance has its
+    network interfaces swapped onto the quarantine group and is tagged for audit concurrently. Returns one result per instance with the VPC, quarantine
+    group, interfaces touched, Auto Scaling group, error (if any) and seconds spent isolating it (measured from the start of the run). A quarantine
+    group or Auto Scaling failure is reported against the instances it affects, the other instances are still isolated."""
+    started = time.time()
+    audit_tags = [{'Key': TAG_PREFIX + 'case', 'Value': case_id or ''},
+                  {'Key': TAG_PREFIX + 'time', 'Value': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started))},
+                  {'Key': TAG_PREFIX + 'operator', 'Value': operator or ''}]
+    results = dict((instance_id, {'InstanceId': instance_id, 'VpcId': instance.get('VpcId'), 'GroupId': None, 'NetworkInterfaces': [],
+                                  'AutoScalingGroupName': None, 'Error': None, 'Seconds': None}) for instance_id, instance in instances.items())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def _group(vpc_id):
+            try:
+                return ensure_quarantine_group(ec2, vpc_id, group_name, case_id)
+            except Exception as e:
+                return e
+
+        vpc_ids = sorted(set(instance['VpcId'] for instance in instances.values() if instance.get('VpcId')))
+        groups = dict(zip(vpc_ids, executor.map(_group, vpc_ids)))
+
+        detach_errors = {}
+        if detach and instances:
+            try:
+                asg_groups = auto_scaling_groups(autoscaling, sorted(instances))
+            except Exception as e:
+                asg_groups, detach_errors = {}, dict((instance_id, str(e)) for instance_id in instances)
+            detach_errors.update(detach_from_auto_scaling_groups(autoscaling, asg_groups))
+            for instance_id, asg_name in asg_groups.items():
+                results[instance_id]['AutoScalingGroupName'] = asg_name
+
+        def _run(instance):
+            result = results[instance['InstanceId']]
+            try:
+                if not instance.get('VpcId'):
+                    raise ValueError('Instance is not in a VPC')
+                if isinstance(groups[instance['VpcId']], Exception):
+                    raise groups[instance['VpcId']]
+                result['GroupId'] = groups[instance['VpcId']]
+                result['NetworkInterfaces'] = _isolate_instance(ec2, instance, result['GroupId'], audit_tags)
+                if instance['InstanceId'] in detach_errors:
+                    raise RuntimeError('Isolated, but not detached from its Auto Scaling group: %s' % detach_errors[instance['InstanceId']])
+            except Exception as e:
+                result['Error'] = str(e)
+            result['Seconds'] = time.time() - started
+            return result
+
+        return list(executor.map(_run, [instances[instance_id] for instance_id in sorted(instances)]))
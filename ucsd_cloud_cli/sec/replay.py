@@ -0,0 +1,205 @@
+"""Local replay harness for the auto-isolation Lambda - runs recorded GuardDuty finding events through the bundled handler against an EC2/Auto Scaling
+stand-in built from each finding's instance details, with a configurable per-call API latency, and measures the time from the event to containment."""
+import contextlib
+import copy
+import io
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from ..common import load_lambda_module
+
+AUTO_ISOLATION_LAMBDA = 'auto_isolation.py'
+
+
+class _Paginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return iter(self.pages(**kwargs))
+
+
+class StandInEC2(object):
+    """Just enough of EC2 for the isolation and capture engines, holding the single instance described by a GuardDuty finding"""
+
+    def __init__(self, finding, latency=0.0, volumes=1):
+        details = finding['resource']['instanceDetails']
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.instance = {'InstanceId': details['instanceId'],
+                         'VpcId': details['networkInterfaces'][0]['vpcId'] if details.get('networkInterfaces') else None,
+                         'State': {'Name': details.get('instanceState', 'running')},
+                         'Tags': [{'Key': t['key'], 'Value': t['value']} for t in details.get('tags', [])],
+                         'NetworkInterfaces': [{'NetworkInterfaceId': eni['networkInterfaceId'],
+                                                'Groups': [{'GroupId': g['groupId']} for g in eni.get('securityGroups', [])]}
+                                               for eni in details.get('networkInterfaces', [])],
+                         'BlockDeviceMappings': [{'DeviceName': '/dev/xvd%s' % 'abcdefghijklmnop'[n], 'Ebs': {'VolumeId': 'vol-%s%d' % (details['instanceId'][2:10], n)}}
+                                                 for n in range(volumes)]}
+        self.security_groups = []
+        self.snapshots = 0
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def get_paginator(self, operation_name):
+        return _Paginator(getattr(self, '_pages_' + operation_name))
+
+    def _pages_describe_instances(self, Filters, **kwargs):
+        self._call()
+        ids = [f['Values'] for f in Filters if f['Name'] == 'instance-id']
+        return [{'Reservations': [{'Instances': [self.instance]}] if not ids or self.instance['InstanceId'] in ids[0] else []}]
+
+    def describe_security_groups(self, Filters, **kwargs):
+        self._call()
+        return {'SecurityGroups': [g for g in self.security_groups if g['VpcId'] in Filters[0]['Values']]}
+
+    def create_security_group(self, GroupName, VpcId, Description, **kwargs):
+        self._call()
+        self.security_groups.append({'GroupId': 'sg-quarantine%d' % len(self.security_groups), 'GroupName': GroupName, 'VpcId': VpcId,
+                                     'IpPermissionsEgress': [{'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}]})
+        return {'GroupId': self.security_groups[-1]['GroupId']}
+
+    def revoke_security_group_egress(self, GroupId, IpPermissions, **kwargs):
+        self._call()
+        for group in self.security_groups:
+            if group['GroupId'] == GroupId:
+                group['IpPermissionsEgress'] = [p for p in group['IpPermissionsEgress'] if p not in IpPermissions]
+
+    def modify_network_interface_attribute(self, NetworkInterfaceId, Groups, **kwargs):
+        self._call()
+        for eni in self.instance['NetworkInterfaces']:
+            if eni['NetworkInterfaceId'] == NetworkInterfaceId:
+                eni['Groups'] = [{'GroupId': g} for g in Groups]
+
+    def create_tags(self, **kwargs):
+        self._call()
+
+    def create_snapshots(self, **kwargs):
+        self._call()
+        snapshots = []
+        for mapping in self.instance['BlockDeviceMappings']:
+            self.snapshots += 1
+            snapshots.append({'SnapshotId': 'snap-%08d' % self.snapshots, 'VolumeId': mapping['Ebs']['VolumeId'], 'State': 'pending', 'Progress': '0%'})
+        return {'Snapshots': snapshots}
+
+
+class StandInAutoScaling(object):
+    """Auto Scaling stand-in - instances tagged aws:autoscaling:groupName in the finding are treated as group members"""
+
+    def __init__(self, finding, latency=0.0):
+        details = finding['resource']['instanceDetails']
+        self.latency = latency
+        self.groups = dict((details['instanceId'], t['value']) for t in details.get('tags', []) if t['key'] == 'aws:autoscaling:groupName')
+
+    def get_paginator(self, operation_name):
+        def _pages(InstanceIds, **kwargs):
+            time.sleep(self.latency)
+            return [{'AutoScalingInstances': [{'InstanceId': i, 'AutoScalingGroupName': self.groups[i]} for i in InstanceIds if i in self.groups]}]
+        return _Paginator(_pages)
+
+    def detach_instances(self, InstanceIds, **kwargs):
+        time.sleep(self.latency)
+        for instance_id in InstanceIds:
+            self.groups.pop(instance_id, None)
+
+
+class _Context(object):
+    function_name = 'AutoIsolationFunction'
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:802640662990:function:AutoIsolationFunction'
+
+
+def sample_event(finding_type='Backdoor:EC2/C&CActivity.B!DNS', severity=8.0, account_id='969379222189', region='us-west-2', seed=0, asg=None):
+    """Build a GuardDuty finding event the way EventBridge delivers it, for a single instance with one or two network interfaces"""
+    rng = random.Random(seed)
+    instance_id = 'i-%017x' % rng.getrandbits(68)
+    vpc_id = 'vpc-%08x' % rng.getrandbits(32)
+    tags = [{'key': 'Name', 'value': 'web-%d' % seed}] + ([{'key': 'aws:autoscaling:groupName', 'value': asg}] if asg else [])
+    return {'version': '0',
+            'id': '%08x-0000-0000-0000-%012x' % (rng.getrandbits(32), rng.getrandbits(48)),
+            'detail-type': 'GuardDuty Finding',
+            'source': 'aws.guardduty',
+            'account': account_id,
+            'time': '2018-02-24T17:42:05Z',
+            'region': region,
+            'detail': {'schemaVersion': '2.0',
+                       'accountId': account_id,
+                       'region': region,
+                       'id': '%032x' % rng.getrandbits(128),
+                       'type': finding_type,
+                       'severity': severity,
+                       'title': '%s on %s' % (finding_type, instance_id),
+                       'createdAt': '2018-02-24T17:41:50.000Z',
+                       'updatedAt': '2018-02-24T17:41:50.000Z',
+                       'resource': {'resourceType': 'Instance',
+                                    'instanceDetails': {'instanceId': instance_id,
+                                                        'instanceState': 'running',
+                                                        'tags': tags,
+                                                        'networkInterfaces': [{'networkInterfaceId': 'eni-%017x' % rng.getrandbits(68),
+                                                                               'vpcId': vpc_id,
+                                                                               'securityGroups': [{'groupId': 'sg-%08x' % rng.getrandbits(32), 'groupName': 'web'}]}
+                                                                              for _ in range(rng.randint(1, 2))]}}}}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, min(len(ordered), int(math.ceil(pct / 100.0 * len(ordered))))) - 1]
+
+
+def replay(events, policies, api_latency=0.05, delivery_latency=0.0, approve_all=False, snapshot=True):
+    """Run finding events through the auto-isolation handler in-process. Returns a result per event (action taken and, for contained instances, the
+    seconds from the event reaching EventBridge to the instance being isolated and to its snapshots being started) and a summary with latency percentiles.
+    `delivery_latency` models the EventBridge to Lambda delivery delay; approvals are counted as pending unless `approve_all` is set."""
+    handler_module = load_lambda_module(AUTO_ISOLATION_LAMBDA)
+    previous = dict((k, os.environ.get(k)) for k in ['POLICIES', 'SNAPSHOT'])
+    os.environ['POLICIES'] = json.dumps(policies)
+    os.environ['SNAPSHOT'] = 'true' if snapshot else 'false'
+
+    results = []
+    try:
+        for event in events:
+            finding = event['detail']
+            ec2, autoscaling = StandInEC2(finding, api_latency), StandInAutoScaling(finding, api_latency)
+            notified = []
+            started = time.time()
+            # the handler logs its result to stdout for CloudWatch Logs, which would drown out the report here
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = handler_module.handler(copy.deepcopy(event), _Context(), clients=lambda *args: (ec2, autoscaling),
+                                                notify=lambda finding, function_name: notified.append(finding))
+                if result['action'] == handler_module.APPROVE and approve_all:
+                    result = handler_module.handler({'source': handler_module.APPROVAL_SOURCE, 'detail': copy.deepcopy(finding)}, _Context(),
+                                                    clients=lambda *args: (ec2, autoscaling))
+                    result['action'] = handler_module.APPROVE
+            record = {'finding': finding['id'], 'type': finding['type'], 'severity': finding['severity'], 'action': result['action'],
+                      'notified': len(notified), 'handler_seconds': time.time() - started, 'api_calls': ec2.calls, 'errors': result.get('errors', [])}
+            if 'isolate_seconds' in result:
+                record['time_to_isolate'] = delivery_latency + result['isolate_seconds']
+                record['time_to_snapshot'] = delivery_latency + result['snapshot_seconds']
+                record['quarantined'] = bool(ec2.security_groups) and all(eni['Groups'] == [{'GroupId': ec2.security_groups[0]['GroupId']}] for eni in ec2.instance['NetworkInterfaces'])
+            results.append(record)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    isolate_times = [r['time_to_isolate'] for r in results if 'time_to_isolate' in r]
+    snapshot_times = [r['time_to_snapshot'] for r in results if 'time_to_snapshot' in r]
+    summary = {'events': len(results),
+               'actions': dict((action, len([r for r in results if r['action'] == action])) for action in set(r['action'] for r in results)),
+               'contained': len(isolate_times),
+               'pending_approval': len([r for r in results if r['notified'] and 'time_to_isolate' not in r]),
+               'errors': len([r for r in results if r['errors']])}
+    for name, values in [('time_to_isolate', isolate_times), ('time_to_snapshot', snapshot_times)]:
+        summary[name] = {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'max': max(values) if values else None}
+    return results, summary
@@ -0,0 +1,320 @@
+import click
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+from troposphere import GetAtt, Ref, Join, Template, Output, Parameter
+import troposphere.iam as iam
+import troposphere.sns as sns
+import troposphere.events as events
+import troposphere.awslambda as awslambda
+
+from awacs.aws import Action, Allow, Statement, Principal, Policy
+from awacs.sts import AssumeRole
+import awacs.ec2 as aec2
+import awacs.autoscaling as aas
+import awacs.logs as alogs
+import awacs.sns as asns
+
+from ..common import lambda_data_dir
+from .. import profiling
+from ..validator import template_json
+from .quarantine import QUARANTINE_GROUP_NAME
+from .replay import replay, sample_event, AUTO_ISOLATION_LAMBDA
+
+sec_dir = os.path.dirname(os.path.realpath(__file__))
+
+AUTO = 'auto'
+APPROVE = 'approve'
+IGNORE = 'ignore'
+DEFAULT_MIN_SEVERITY = 7.0
+
+# Finding types that indicate an instance is already under an attacker's control are isolated straight away, ones that are more likely to be noise
+# (scanning, unusual behaviour) wait for a human
+DEFAULT_POLICIES = [{'pattern': 'Backdoor:EC2/*', 'action': AUTO},
+                    {'pattern': 'CryptoCurrency:EC2/*', 'action': AUTO},
+                    {'pattern': 'Trojan:EC2/*', 'action': AUTO},
+                    {'pattern': 'UnauthorizedAccess:EC2/*', 'action': APPROVE},
+                    {'pattern': 'Recon:EC2/*', 'action': APPROVE},
+                    {'pattern': 'Behavior:EC2/*', 'action': APPROVE}]
+
+# The auto-isolation function zip - the handler plus the isolation and capture engines it shares with `isolate` and `snapshot create`
+PACKAGE_FILES = [(os.path.join(lambda_data_dir, AUTO_ISOLATION_LAMBDA), AUTO_ISOLATION_LAMBDA),
+                 (os.path.join(sec_dir, 'quarantine.py'), 'quarantine.py'),
+                 (os.path.join(sec_dir, 'capture.py'), 'capture.py')]
+
+ISOLATION_ACTIONS = [aec2.DescribeInstances, aec2.DescribeSecurityGroups, aec2.CreateSecurityGroup, aec2.RevokeSecurityGroupEgress,
+                     aec2.ModifyNetworkInterfaceAttribute, aec2.CreateTags, aec2.CreateSnapshot, Action('ec2', 'CreateSnapshots'),
+                     aas.DescribeAutoScalingInstances, aas.DetachInstances]
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def response():
+    """Command group pertaining to automated incident response - the GuardDuty auto-isolation stack and its local replay harness."""
+    pass
+
+
+def build_policies(ignore_patterns=(), auto_patterns=(), approve_patterns=(), min_severity=DEFAULT_MIN_SEVERITY):
+    """Helper method to turn finding type patterns into the ordered policy list the Lambda evaluates (first match wins) - ignore rules are checked
+    first so they can carve exceptions out of broader auto/approve patterns. Without any patterns the DEFAULT_POLICIES apply."""
+    if not (ignore_patterns or auto_patterns or approve_patterns):
+        return [dict(policy, min_severity=min_severity) for policy in DEFAULT_POLICIES]
+    return ([{'pattern': p, 'action': IGNORE, 'min_severity': min_severity} for p in ignore_patterns] +
+            [{'pattern': p, 'action': AUTO, 'min_severity': min_severity} for p in auto_patterns] +
+            [{'pattern': p, 'action': APPROVE, 'min_severity': min_severity} for p in approve_patterns])
+
+
+def event_pattern(policies, min_severity=DEFAULT_MIN_SEVERITY):
+    """EventBridge pattern matching GuardDuty instance findings at or above the severity threshold. Finding types are filtered too when every auto/approve
+    pattern is an exact type or a simple prefix, otherwise the Lambda's own policy evaluation does the type filtering."""
+    detail = {'resource': {'resourceType': ['Instance']},
+              'severity': [{'numeric': ['>=', min_severity]}]}
+    types = []
+    for policy in policies:
+        if policy['action'] == IGNORE:
+            continue
+        pattern = policy['pattern']
+        if not any(c in pattern for c in '*?['):
+            types.append(pattern)
+        elif pattern.endswith('*') and not any(c in pattern[:-1] for c in '*?['):
+            types.append({'prefix': pattern[:-1]})
+        else:
+            types = None
+            break
+    if types:
+        detail['type'] = types
+    return {'source': ['aws.guardduty'], 'detail-type': ['GuardDuty Finding'], 'detail': detail}
+
+
+def build_package():
+    """Build the function zip deterministically (fixed timestamps and permissions) so its hash, and the S3 key derived from it, only change with the code"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+        for path, name in PACKAGE_FILES:
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as f:
+                package.writestr(info, f.read())
+    return buffer.getvalue()
+
+
+def package_key(package):
+    return 'ccli/auto_isolation-%s.zip' % hashlib.sha256(package).hexdigest()[:16]
+
+
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def generate_template(policies, min_severity=DEFAULT_MIN_SEVERITY, code_key=None, snapshot=True):
+    """CloudFormation template for the security account: an EventBridge rule for GuardDuty instance findings, the auto-isolation function it invokes and,
+    when any policy requires approval, the SNS topic approval requests are sent to."""
+    t = Template()
+    t.add_version("2010-09-09")
+    t.add_description("UCSD GuardDuty Auto-Isolation AWS CloudFormation Template - routes GuardDuty instance findings to a Lambda function that quarantines the instance and starts forensic snapshots of its volumes, automatically or after approval depending on the finding type.")
+
+    code_bucket = t.add_parameter(Parameter('LambdaCodeBucket',
+                                  Type="String",
+                                  Description="Bucket holding the auto-isolation function package written by `response generate`."))
+
+    code_key_parameter = t.add_parameter(Parameter('LambdaCodeKey',
+                                         Type="String",
+                                         Default=code_key or package_key(build_package()),
+                                         Description="Key of the auto-isolation function package in LambdaCodeBucket."))
+
+    runtime = t.add_parameter(Parameter('LambdaRuntime',
+                              Type="String",
+                              Default="python3.12",
+                              Description="Lambda runtime for the auto-isolation function."))
+
+    isolation_role_name = t.add_parameter(Parameter('IsolationRoleName',
+                                          Type="String",
+                                          Default="ccli-isolation",
+                                          Description="Name of the role (created by the member role template) the function assumes in accounts other than this one."))
+
+    quarantine_group_name = t.add_parameter(Parameter('QuarantineGroupName',
+                                            Type="String",
+                                            Default=QUARANTINE_GROUP_NAME,
+                                            Description="Name of the quarantine security group created (or reused) in each VPC."))
+
+    statements = [Statement(Effect=Allow,
+                            Action=[alogs.CreateLogGroup, alogs.CreateLogStream, alogs.PutLogEvents],
+                            Resource=['arn:aws:logs:*:*:*']),
+                  Statement(Effect=Allow,
+                            Action=[AssumeRole],
+                            Resource=[Join('', ['arn:aws:iam::*:role/', Ref(isolation_role_name)])]),
+                  Statement(Effect=Allow,
+                            Action=ISOLATION_ACTIONS,
+                            Resource=['*'])]
+
+    variables = {'POLICIES': json.dumps(policies, sort_keys=True),
+                 'QUARANTINE_GROUP_NAME': Ref(quarantine_group_name),
+                 'ISOLATION_ROLE_NAME': Ref(isolation_role_name),
+                 'SNAPSHOT': 'true' if snapshot else 'false'}
+
+    if any(policy['action'] == APPROVE for policy in policies):
+        approval_email = t.add_parameter(Parameter('ApprovalEmail',
+                                         Type="String",
+                                         Description="Email address approval requests for findings that aren't isolated automatically are sent to."))
+
+        approval_topic = t.add_resource(sns.Topic('ApprovalTopic',
+                                        DisplayName='GuardDuty isolation approvals',
+                                        Subscription=[sns.Subscription(Endpoint=Ref(approval_email), Protocol='email')]))
+
+        statements.append(Statement(Effect=Allow, Action=[asns.Publish], Resource=[Ref(approval_topic)]))
+        variables['APPROVAL_TOPIC_ARN'] = Ref(approval_topic)
+
+        t.add_output(Output('ApprovalTopicArn',
+                     Description="SNS topic isolation approval requests are published to",
+                     Value=Ref(approval_topic)))
+
+    role = t.add_resource(iam.Role('AutoIsolationRole',
+                          AssumeRolePolicyDocument=Policy(
+                              Statement=[Statement(
+                                  Effect=Allow,
+                                  Action=[AssumeRole],
+                                  Principal=Principal('Service', 'lambda.amazonaws.com'))]),
+                          Policies=[iam.Policy(
+                              PolicyName='AutoIsolationPolicy',
+                              PolicyDocument=Policy(Statement=statements))]))
+
+    function = t.add_resource(awslambda.Function('AutoIsolationFunction',
+                              Description='Quarantines instances named in GuardDuty findings and starts forensic snapshots of their volumes.',
+                              Code=awslambda.Code(S3Bucket=Ref(code_bucket), S3Key=Ref(code_key_parameter)),
+                              Handler='auto_isolation.handler',
+                              Runtime=Ref(runtime),
+                              Role=GetAtt(role, 'Arn'),
+                              MemorySize=256,
+                              Timeout=300,
+                              Environment=awslambda.Environment(Variables=variables)))
+
+    rule = t.add_resource(events.Rule('GuardDutyFindingRule',
+                          Description='GuardDuty instance findings handled by the auto-isolation function',
+                          EventPattern=event_pattern(policies, min_severity),
+                          State='ENABLED',
+                          Targets=[events.Target(Arn=GetAtt(function, 'Arn'), Id='AutoIsolationFunction')]))
+
+    t.add_resource(awslambda.Permission('AutoIsolationInvokePermission',
+                   Action='lambda:InvokeFunction',
+                   FunctionName=Ref(function),
+                   Principal='events.amazonaws.com',
+                   SourceArn=GetAtt(rule, 'Arn')))
+
+    t.add_output(Output('AutoIsolationFunctionName',
+                 Description="Name of the auto-isolation function - invoke it with an approval request payload to approve an isolation",
+                 Value=Ref(function)))
+    return t
+
+
+@profiling.timed(profiling.TEMPLATE_BUILD)
+def generate_member_template():
+    """CloudFormation template for each member account: the role the auto-isolation function assumes to isolate and snapshot instances there"""
+    t = Template()
+    t.add_version("2010-09-09")
+    t.add_description("UCSD GuardDuty Auto-Isolation Member Role AWS CloudFormation Template - lets the auto-isolation function in the security account quarantine and snapshot instances in this account.")
+
+    security_account_id = t.add_parameter(Parameter('SecurityAccountId',
+                                          Type="String",
+                                          AllowedPattern="[0-9]{12}",
+                                          Description="ID of the security account the auto-isolation stack is deployed in."))
+
+    isolation_role_name = t.add_parameter(Parameter('IsolationRoleName',
+                                          Type="String",
+                                          Default="ccli-isolation",
+                                          Description="Name of the role - must match IsolationRoleName in the auto-isolation stack."))
+
+    role = t.add_resource(iam.Role('IsolationRole',
+                          RoleName=Ref(isolation_role_name),
+                          AssumeRolePolicyDocument=Policy(
+                              Statement=[Statement(
+                                  Effect=Allow,
+                                  Action=[AssumeRole],
+                                  Principal=Principal('AWS', Join('', ['arn:aws:iam::', Ref(security_account_id), ':root'])))]),
+                          Policies=[iam.Policy(
+                              PolicyName='IsolationPolicy',
+                              PolicyDocument=Policy(
+                                  Statement=[Statement(Effect=Allow, Action=ISOLATION_ACTIONS, Resource=['*'])]))]))
+
+    t.add_output(Output('IsolationRoleArn',
+                 Description="ARN of the role the auto-isolation function assumes in this account",
+                 Value=GetAtt(role, 'Arn')))
+    return t
+
+
+def _policy_options(f):
+    """Options shared by the response commands to build the per-finding-type policies"""
+    f = click.option('--min-severity', 'min_severity', type=float, default=DEFAULT_MIN_SEVERITY, help="Lowest GuardDuty severity acted on.")(f)
+    f = click.option('--ignore', 'ignore_patterns', multiple=True, help="Finding type pattern (glob) that is never acted on - checked before --auto and --approve.")(f)
+    f = click.option('--approve', 'approve_patterns', multiple=True, help="Finding type pattern (glob) for which isolation waits for approval.")(f)
+    f = click.option('--auto', 'auto_patterns', multiple=True, help="Finding type pattern (glob) isolated automatically. Without any patterns a built-in policy set is used.")(f)
+    return f
+
+
+@response.command('generate')
+@_policy_options
+@click.option('--no-snapshot', 'no_snapshot', is_flag=True, help="boolean indicates whether forensic snapshots should not be started after isolating")
+@click.option('--output-dir', '-o', 'output_dir', type=click.Path(file_okay=False), default='.', help="Directory to write the templates and function package to.")
+@click.option('--dry-run', 'dry_run', is_flag=True, help="boolean indicates whether the security account template should be printed to screen vs. being saved to file")
+def generate(auto_patterns, approve_patterns, ignore_patterns, min_severity=DEFAULT_MIN_SEVERITY, no_snapshot=False, output_dir='.', dry_run=False):
+    """Generate the GuardDuty auto-isolation stack for the security account, the role template for member accounts and the function package to upload to LambdaCodeBucket."""
+    policies = build_policies(ignore_patterns, auto_patterns, approve_patterns, min_severity)
+    package = build_package()
+    t = generate_template(policies, min_severity, package_key(package), not no_snapshot)
+    if dry_run:
+        print(template_json(t))
+        return
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    files = [('auto_isolation.json', template_json(t).encode('utf-8')),
+             ('auto_isolation_member_role.json', template_json(generate_member_template()).encode('utf-8')),
+             (os.path.basename(package_key(package)), package)]
+    for name, body in files:
+        with profiling.phase(profiling.FILE_WRITE), open(os.path.join(output_dir, name), 'wb') as f:
+            f.write(body)
+        click.echo(os.path.join(output_dir, name))
+    click.echo('Upload the package to s3://<LambdaCodeBucket>/%s before deploying auto_isolation.json.' % package_key(package))
+
+
+@response.command('replay')
+@click.argument('event_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@_policy_options
+@click.option('--synthetic', type=int, default=0, help="Number of synthetic findings (a mix of finding types) to replay instead of (or in addition to) event files.")
+@click.option('--api-latency-ms', 'api_latency_ms', type=float, default=50.0, help="Simulated latency of each EC2/Auto Scaling API call.")
+@click.option('--delivery-ms', 'delivery_ms', type=float, default=0.0, help="Modelled delay between a finding reaching EventBridge and the function starting.")
+@click.option('--approve-all', 'approve_all', is_flag=True, help="boolean indicates whether findings requiring approval should be treated as approved immediately")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. text")
+def replay_command(event_files, auto_patterns, approve_patterns, ignore_patterns, min_severity=DEFAULT_MIN_SEVERITY, synthetic=0, api_latency_ms=50.0, delivery_ms=0.0,
+                   approve_all=False, as_json=False):
+    """Replay recorded GuardDuty finding events (as EventBridge delivers them) through the auto-isolation function against a local EC2 stand-in and report the time from detection to isolation."""
+    events_list = []
+    for event_file in event_files:
+        with open(event_file) as f:
+            loaded = json.load(f)
+        events_list.extend(loaded if isinstance(loaded, list) else [loaded])
+    types = [policy['pattern'].replace('*', 'Sample') for policy in DEFAULT_POLICIES]
+    events_list.extend(sample_event(types[i % len(types)], 5.0 + (i % 4), seed=i) for i in range(synthetic))
+    if not events_list:
+        raise click.UsageError('Provide event files or --synthetic N')
+
+    results, summary = replay(events_list, build_policies(ignore_patterns, auto_patterns, approve_patterns, min_severity),
+                              api_latency_ms / 1000.0, delivery_ms / 1000.0, approve_all)
+    if as_json:
+        click.echo(json.dumps({'results': results, 'summary': summary}, indent=4, sort_keys=True))
+        return
+
+    click.echo('%-40s %5s %-8s %10s %10s %s' % ('TYPE', 'SEV', 'ACTION', 'ISOLATED', 'SNAPSHOT', 'ERRORS'))
+    for r in results:
+        click.echo('%-40s %5.1f %-8s %10s %10s %s' % (r['type'][:40], r['severity'], r['action'],
+                   '%.3fs' % r['time_to_isolate'] if 'time_to_isolate' in r else '-',
+                   '%.3fs' % r['time_to_snapshot'] if 'time_to_snapshot' in r else '-', '; '.join(r['errors'])))
+    click.echo('')
+    click.echo('events: %d, contained: %d, pending approval: %d, errors: %d' % (summary['events'], summary['contained'], summary['pending_approval'], summary['errors']))
+    for name in ['time_to_isolate', 'time_to_snapshot']:
+        if summary[name]['p50'] is not None:
+            click.echo('%-17s p50 %.3fs  p95 %.3fs  max %.3fs' % (name + ':', summary[name]['p50'], summary[name]['p95'], summary[name]['max']))
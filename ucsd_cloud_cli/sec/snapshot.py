@@ -1,5 +1,231 @@
 import click
+import getpass
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-@click.command()
+from ..common import get_boto3_client, get_boto3_clients, get_profile_region_keys, get_profile_collection, cache_dir, DEFAULT_REGIONS
+from .quarantine import resolve_targets, parse_tags
+from .capture import capture, poll_snapshots, build_manifest, write_manifest
+from .evidence import EvidenceQueue, Scheduler, DEFAULT_MAX_CONCURRENT
+from .export import export_snapshot, DEFAULT_MAX_IN_FLIGHT, DEFAULT_WORKERS
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
 def snapshot():
+    """Command group pertaining to forensic EBS snapshots of suspect instances - capture, evidence handling and export."""
     pass
+
+
+def run_capture(clients, instance_ids=(), tags=(), eni_ids=(), case_id=None, operator=None, workers=32):
+    """Resolve targets and start snapshots of all their volumes in every (profile, region) pair of `clients` concurrently. Returns a dict of
+    (profile, region) -> snapshot records (each labelled with its Profile and Region) and a dict of errors keyed by 'profile/region/instance',
+    or by 'profile/region' where the targets couldn't be resolved."""
+    def _run(item):
+        key, ec2 = item
+        try:
+            snapshots, errors = capture(ec2, resolve_targets(ec2, instance_ids, tags, eni_ids), case_id, operator, workers)
+        except Exception as e:
+            return key, [], {'/'.join(key): str(e)}
+        for record in snapshots:
+            record.update(Profile=key[0], Region=key[1])
+        return key, snapshots, dict(('/'.join(key + (instance_id,)), error) for instance_id, error in errors.items())
+
+    snapshots, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, len(clients))) as executor:
+        for key, records, key_errors in executor.map(_run, sorted(clients.items())):
+            if records:
+                snapshots[key] = records
+            errors.update(key_errors)
+    return snapshots, errors
+
+
+def wait_for_capture(clients, snapshots, poll_interval=15, timeout=None, on_progress=None, sleep=time.sleep):
+    """Poll every account/region's snapshots (one batched DescribeSnapshots per 200 snapshots) in parallel until all have finished, calling
+    `on_progress(records)` after each round. Returns True if all finished before `timeout` seconds passed."""
+    started = time.time()
+    records = [record for key in sorted(snapshots) for record in snapshots[key]]
+    with ThreadPoolExecutor(max_workers=max(1, len(snapshots))) as executor:
+        while True:
+            pending = sum(len(p) for p in executor.map(lambda key: poll_snapshots(clients[key], snapshots[key]), sorted(snapshots)))
+            if on_progress:
+                on_progress(records)
+            if not pending:
+                return True
+            if timeout is not None and time.time() - started >= timeout:
+                return False
+            sleep(poll_interval)
+
+
+@snapshot.command('create')
+@click.option('-p', '--profile', 'profile_list', multiple=True, help="AWS profile(s) for the accounts the instances live in. Defaults to the default profile.")
+@click.option('-r', '--region', 'region_list', multiple=True, help="Region(s) to look for the instances in. Defaults to %s." % ', '.join(DEFAULT_REGIONS))
+@click.option('-i', '--instance-id', 'instance_ids', multiple=True, help="ID of an instance to snapshot.")
+@click.option('-t', '--tag', 'tag_list', multiple=True, help="Key=Value tag selecting instances to snapshot.")
+@click.option('-e', '--eni', 'eni_ids', multiple=True, help="ID of a network interface whose instance should be snapshot.")
+@click.option('--case', 'case_id', required=True, help="Incident/case identifier recorded in the evidence tags and manifest.")
+@click.option('--manifest', '-m', 'manifest_path', type=click.Path(dir_okay=False), help="Path to write the evidence manifest to. Defaults to <case>-snapshots.json.")
+@click.option('--no-wait', 'no_wait', is_flag=True, help="boolean indicates whether to return once the snapshots have been started rather than waiting for them to complete")
+@click.option('--poll-interval', 'poll_interval', type=int, default=15, help="Seconds between progress polls.")
+@click.option('--timeout', type=int, help="Seconds to wait for the snapshots to complete before giving up.")
+@click.option('--workers', type=int, default=32, help="Number of concurrent AWS API calls per account/region.")
+def create(profile_list, region_list, instance_ids, tag_list, eni_ids, case_id, manifest_path=None, no_wait=False, poll_interval=15, timeout=None, workers=32):
+    """Snapshot every EBS volume attached to the target instances concurrently, tag the snapshots with the case and write an evidence manifest with start and completion times."""
+    if not (instance_ids or tag_list or eni_ids):
+        raise click.UsageError('Provide at least one --instance-id, --tag or --eni')
+    try:
+        tags = parse_tags(tag_list)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--tag')
+
+    manifest_path = manifest_path or '%s-snapshots.json' % case_id
+    operator = getpass.getuser()
+    started = time.time()
+    clients = get_boto3_clients('ec2', get_profile_region_keys(profile_list, region_list, ['default']))
+    snapshots, errors = run_capture(clients, instance_ids, tags, eni_ids, case_id, operator, workers)
+
+    def _progress(records):
+        write_manifest(manifest_path, build_manifest(case_id, records, errors, operator, started))
+        completed = [r for r in records if r['State'] != 'pending']
+        click.echo('%s %d/%d snapshots finished' % (time.strftime('%H:%M:%S'), len(completed), len(records)))
+
+    records = [record for key in sorted(snapshots) for record in snapshots[key]]
+    for instance_key, error in sorted(errors.items()):
+        click.echo('FAILED %s: %s' % (instance_key, error), err=True)
+    if not records:
+        write_manifest(manifest_path, build_manifest(case_id, records, errors, operator, started))
+        raise click.ClickException('No snapshots were started')
+    click.echo('Started %d snapshots of %d instances, manifest: %s' % (len(records), len(set(r['InstanceId'] for r in records)), manifest_path))
+
+    if no_wait:
+        write_manifest(manifest_path, build_manifest(case_id, records, errors, operator, started))
+        if errors:
+            raise click.ClickException('%d instance(s) or profile/region(s) failed, see %s' % (len(errors), manifest_path))
+        return
+    if not wait_for_capture(clients, snapshots, poll_interval, timeout, _progress):
+        raise click.ClickException('Timed out waiting for snapshots to complete, see %s for progress' % manifest_path)
+
+    failed = [r for r in records if r['State'] != 'completed']
+    for record in failed:
+        click.echo('FAILED %s %s %s (%s): %s' % (record['Profile'], record['Region'], record['SnapshotId'], record['VolumeId'], record['State']), err=True)
+    if failed or errors:
+        raise click.ClickException('%d snapshot(s) and %d instance(s) or profile/region(s) failed' % (len(failed), len(errors)))
+
+
+@snapshot.command('copy')
+@click.option('--security-profile', '-s', 'security_profile', required=True, help="Name of the AWS profile for the security account the evidence is copied into.")
+@click.option('--kms-key-id', '-k', 'kms_key_id', required=True, help="Security account KMS key (ID, alias or ARN) the copies are re-encrypted with.")
+@click.option('--manifest', '-m', 'manifest_paths', multiple=True, type=click.Path(exists=True, dir_okay=False), help="Evidence manifest written by `snapshot create` - every completed snapshot in it is queued.")
+@click.option('--snapshot', 'snapshot_list', multiple=True, help="Additional snapshot to queue, as profile/region/snapshot-id.")
+@click.option('--destination-region', '-d', 'destination_region', help="Region in the security account to copy into. Defaults to each snapshot's own region.")
+@click.option('--max-concurrent', 'max_concurrent', type=int, default=DEFAULT_MAX_CONCURRENT, help="Maximum in-flight copies per destination region.")
+@click.option('--poll-interval', 'poll_interval', type=int, default=30, help="Seconds between scheduling rounds.")
+@click.option('--timeout', type=int, help="Seconds to run before leaving the remaining jobs for the next run.")
+@click.option('--queue', 'queue_path', type=click.Path(dir_okay=False), help="Path of the job queue database. Defaults to evidence_queue.db in the ccli cache directory.")
+def copy_command(security_profile, kms_key_id, manifest_paths, snapshot_list, destination_region=None, max_concurrent=DEFAULT_MAX_CONCURRENT, poll_interval=30, timeout=None, queue_path=None):
+    """Queue evidence snapshots for copy into the security account and run the queue - snapshots are shared with the security account, copied and re-encrypted with its KMS key, keeping each destination region at the concurrent copy limit. Run without snapshots to resume an interrupted queue."""
+    sec_account = get_profile_collection(security_profile)['sec_account']
+    if not sec_account:
+        raise click.BadParameter('No AWS profile named %s' % security_profile, param_hint='--security-profile')
+
+    queue = EvidenceQueue(queue_path or os.path.join(cache_dir, 'evidence_queue.db'))
+    try:
+        for manifest_path in manifest_paths:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            for record in manifest['Snapshots']:
+                if record['State'] == 'completed':
+                    queue.enqueue(record['SnapshotId'], record['Profile'], record['Region'], destination_region or record['Region'], kms_key_id,
+                                  manifest['Case'], record.get('VolumeSize'))
+        for item in snapshot_list:
+            try:
+                profile, region, snapshot_id = item.split('/')
+            except ValueError:
+                raise click.BadParameter('%s is not of the form profile/region/snapshot-id' % item, param_hint='--snapshot')
+            queue.enqueue(snapshot_id, profile, region, destination_region or region, kms_key_id)
+
+        jobs = queue.jobs()
+        if not jobs:
+            raise click.UsageError('Nothing queued - provide --manifest or --snapshot')
+        source_clients = get_boto3_clients('ec2', set((j['source_profile'], j['source_region']) for j in jobs))
+        destination_clients = dict((region, get_boto3_client('ec2', sec_account, region)) for region in set(j['destination_region'] for j in jobs))
+        security_account_id = get_boto3_client('sts', sec_account).get_caller_identity()['Account']
+
+        scheduler = Scheduler(queue, source_clients, destination_clients, security_account_id, max_concurrent)
+        drained = scheduler.run(poll_interval, timeout, _copy_progress)
+        _copy_report(scheduler.throughput())
+        for job in queue.jobs('failed'):
+            click.echo('FAILED %s/%s/%s -> %s: %s' % (job['source_profile'], job['source_region'], job['snapshot_id'], job['destination_region'], job['error']), err=True)
+        if not drained:
+            raise click.ClickException('Timed out with jobs still queued - run `snapshot copy` again to resume')
+    finally:
+        queue.close()
+
+
+def _copy_progress(scheduler):
+    counts = scheduler.queue.counts()
+    click.echo('%s queued %d, copying %d, completed %d, failed %d' % (time.strftime('%H:%M:%S'), counts.get('queued', 0) + counts.get('starting', 0),
+               counts.get('copying', 0), counts.get('completed', 0), counts.get('failed', 0)))
+
+
+def _copy_report(stats):
+    click.echo('completed this run: %d snapshots, %d GiB in %.0f seconds' % (stats['completed'], stats['gib'], stats['seconds']))
+    click.echo('throughput:         %.1f snapshots/hour, %.1f GiB/hour' % (stats['snapshots_per_hour'], stats['gib_per_hour']))
+    for region, peak in sorted(stats['peak_in_flight'].items()):
+        click.echo('peak in flight:     %s %d' % (region, peak))
+
+
+@snapshot.command('export')
+@click.argument('snapshot_ids', nargs=-1, required=True)
+@click.option('-p', '--profile', 'profile', default='default', help="AWS profile for the account owning the snapshots.")
+@click.option('-r', '--region', 'region', help="Region the snapshots are in. Defaults to the profile's region.")
+@click.option('--image-dir', 'image_dir', type=click.Path(file_okay=False), help="Directory to write a sparse raw image (<snapshot-id>.img) of each snapshot to.")
+@click.option('--s3-uri', 's3_uri', help="s3://bucket/prefix to upload each image to as <prefix>/<snapshot-id>.img.")
+@click.option('--max-in-flight', 'max_in_flight', type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Maximum blocks requested but not yet hashed - bounds memory use to this many 512 KiB blocks.")
+@click.option('--workers', type=int, default=DEFAULT_WORKERS, help="Number of concurrent GetSnapshotBlock calls.")
+@click.option('--manifest', '-m', 'manifest_path', type=click.Path(exists=True, dir_okay=False), help="Evidence manifest to record each snapshot's SHA256 in.")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether results should be printed as JSON vs. text")
+def export(snapshot_ids, profile='default', region=None, image_dir=None, s3_uri=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, workers=DEFAULT_WORKERS, manifest_path=None, as_json=False):
+    """Hash (and optionally image) snapshots by streaming their blocks through the EBS direct APIs - no volume needs restoring. The SHA256 matches a `dd` of the restored volume."""
+    bucket, prefix = None, None
+    if s3_uri:
+        if not s3_uri.startswith('s3://'):
+            raise click.BadParameter('%s is not an s3:// URI' % s3_uri, param_hint='--s3-uri')
+        bucket, _, prefix = s3_uri[5:].partition('/')
+    if image_dir and not os.path.isdir(image_dir):
+        os.makedirs(image_dir)
+
+    ebs = get_boto3_client('ebs', profile, region)
+    s3 = get_boto3_client('s3', profile, region) if s3_uri else None
+
+    def _progress(stats):
+        if not as_json:
+            click.echo('%s %d/%d blocks, %.1f MB/s read' % (stats['SnapshotId'], stats['BlocksHashed'], stats['TotalBlocks'], stats['BytesRead'] / 1000000.0 / max(stats['Seconds'], 1e-6)))
+
+    results = []
+    for snapshot_id in snapshot_ids:
+        key = '/'.join(part for part in [prefix.rstrip('/') if prefix else None, snapshot_id + '.img'] if part)
+        results.append(export_snapshot(ebs, snapshot_id, os.path.join(image_dir, snapshot_id + '.img') if image_dir else None,
+                                       s3, bucket, key if s3 else None, max_in_flight, workers, on_progress=_progress))
+        if not as_json:
+            stats = results[-1]
+            click.echo('%s sha256 %s' % (snapshot_id, stats['Sha256']))
+            click.echo('%s %d blocks (%d MB) read in %.1f seconds: %.1f MB/s read, %.1f MB/s of volume hashed' % (
+                       snapshot_id, stats['BlocksRead'], stats['BytesRead'] // 1000000, stats['Seconds'], stats['ReadMBps'], stats['VolumeMBps']))
+
+    if manifest_path:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        digests = dict((stats['SnapshotId'], stats['Sha256']) for stats in results)
+        for record in manifest['Snapshots']:
+            if record['SnapshotId'] in digests:
+                record['Sha256'] = digests[record['SnapshotId']]
+        write_manifest(manifest_path, manifest)
+    if as_json:
+        click.echo(json.dumps(results, indent=4, sort_keys=True))
@@ -0,0 +1,395 @@
+"""Long-lived render daemon for CI and automation. A `ccli` run spends most of its time starting Python and importing troposphere, awacs and
+boto3 rather than rendering, so `serve` keeps one process warm - the builders imported, the resource specification loaded and the rendered
+templates cached by builder and options - and answers JSON requests over HTTP on a local Unix socket (or a loopback TCP port), each on its
+own thread:
+
+    GET  /health    version, working directory, uptime, request counts and template cache statistics
+    POST /render    {"generator": "target", "options": {"account_list": [...], ...}} - the template as `generate` writes it
+    POST /validate  {"template": <template or render request>, "strict": false} - the problems `validate` reports
+    POST /diff      {"template": ..., "against": ...} - the sections and resources that differ and the expected change set
+    POST /run       {"args": [...], "cwd": ..., "version": ..., "environment": {...}} - a command line run as `ccli` would, see client.py
+
+Commands run concurrently, with each thread's stdout and stderr captured separately. The daemon writes a random token to a file only the current
+user can read (see client.token_path) and only answers requests that send it in the X-Ccli-Token header with a loopback Host, so neither other
+local users nor web pages the user visits (a form POST to localhost, DNS rebinding) can run commands with the user's AWS credentials."""
+import click
+import collections
+import contextlib
+import hmac
+import http.server
+import io
+import json
+import os
+import secrets
+import signal
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+
+from . import VERSION
+from .client import DEFAULT_SOCKET, REFUSED, FORBIDDEN, TOKEN_HEADER, connection, environment, forwardable, token_path
+from .common import template_hashes
+from .drift import compare
+from .logs.registry import resource_changes
+from .logs.source import source_template, flow_log_template
+from .logs.target import target_template
+from .validator import validate, load_spec, template_json
+
+# builders render requests name, called with the request's options as keyword arguments
+BUILDERS = {'target': target_template, 'source': source_template, 'flow_log': flow_log_template}
+# options each builder is rendered with at startup, so the first requests don't pay for troposphere's first use
+WARM_OPTIONS = {'target': {'account_list': ['123456789012'], 'region_list': ['us-west-2']}}
+CACHE_SIZE = 128
+# Host headers a request may carry - anything else is a browser that was pointed at the daemon by a name it doesn't answer to
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+class RequestError(Exception):
+    """A request the daemon can't answer, with the HTTP status to answer it with"""
+
+    def __init__(self, status, message):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+class TemplateCache(object):
+    """Rendered templates by builder and options, the least recently used dropped first"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, rendered):
+        with self.lock:
+            self.entries[key] = rendered
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'Entries': len(self.entries), 'Size': self.size, 'Hits': self.hits, 'Misses': self.misses}
+
+
+class _ThreadStream(object):
+    """Stands in for sys.stdin/stdout/stderr while commands are run - the stream set for the current thread, the real one otherwise"""
+
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+
+    def _target(self):
+        return getattr(_local, self.name, None) or self.stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+_local = threading.local()
+_streams_lock = threading.Lock()
+_streams_users = [0]
+
+
+@contextlib.contextmanager
+def thread_streams():
+    """Replace sys.stdin/stdout/stderr with per-thread streams for the duration - nested and concurrent uses share one replacement"""
+    with _streams_lock:
+        if not _streams_users[0]:
+            sys.stdin, sys.stdout, sys.stderr = [_ThreadStream(name, getattr(sys, name)) for name in ('stdin', 'stdout', 'stderr')]
+        _streams_users[0] += 1
+    try:
+        yield
+    finally:
+        with _streams_lock:
+            _streams_users[0] -= 1
+            if not _streams_users[0]:
+                sys.stdin, sys.stdout, sys.stderr = sys.stdin.stream, sys.stdout.stream, sys.stderr.stream
+
+
+def run_command(args, prog_name='ccli'):
+    """Run a command line in this process as `ccli` would, returning (exit code, stdout, stderr). There is no input - prompts abort."""
+    from . import cli
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with thread_streams():
+        _local.stdin, _local.stdout, _local.stderr = io.StringIO(), stdout, stderr
+        try:
+            cli.main(args=list(args), prog_name=prog_name)
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                stderr.write('%s\n' % e.code)
+                exit_code = 1
+        except Exception:
+            traceback.print_exc(file=stderr)
+            exit_code = 1
+        finally:
+            _local.stdin = _local.stdout = _local.stderr = None
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+class Daemon(object):
+    """What a `serve` process keeps warm - the resource specification and the rendered templates - and the request handlers"""
+
+    def __init__(self, cache_size=CACHE_SIZE, verbose=False):
+        self.spec = load_spec()
+        self.cache = TemplateCache(cache_size)
+        self.verbose = verbose
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.routes = {('GET', '/health'): self.health,
+                       ('POST', '/render'): self.render,
+                       ('POST', '/validate'): self.validate,
+                       ('POST', '/diff'): self.diff,
+                       ('POST', '/run'): self.run}
+
+    def warm(self):
+        """Render every builder once"""
+        for name in sorted(BUILDERS):
+            self._render(name, WARM_OPTIONS.get(name, {}))
+
+    def handle(self, method, path, body):
+        """Answer a request, returning the HTTP status and the JSON-serializable response"""
+        handler = self.routes.get((method, path))
+        if handler is None:
+            return 404, {'Error': 'no %s %s, expected one of %s' % (method, path, ', '.join('%s %s' % route for route in sorted(self.routes)))}
+        with self.lock:
+            self.requests[path] += 1
+        try:
+            return 200, handler(body if body is not None else {})
+        except RequestError as e:
+            return e.status, {'Error': str(e)}
+
+    def health(self, body):
+        with self.lock:
+            requests = dict(self.requests)
+        return {'Version': VERSION, 'Pid': os.getpid(), 'Cwd': os.getcwd(), 'UptimeSeconds': round(time.time() - self.started, 3),
+                'Requests': requests, 'Cache': self.cache.stats()}
+
+    def _render(self, generator, options):
+        if generator not in BUILDERS:
+            raise RequestError(400, 'unknown generator %r, expected one of %s' % (generator, ', '.join(sorted(BUILDERS))))
+        if not isinstance(options, dict):
+            raise RequestError(400, 'options must be an object of %s keyword arguments' % generator)
+        key = json.dumps([generator, options], sort_keys=True)
+        rendered = self.cache.get(key)
+        if rendered is not None:
+            return rendered, True
+        try:
+            rendered = template_json(BUILDERS[generator](**options))
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, '%s: %s' % (generator, e))
+        self.cache.put(key, rendered)
+        return rendered, False
+
+    def _template(self, body, key):
+        """The template dict a request passes as `key` - a template, its JSON or a render request"""
+        value = body.get(key)
+        if isinstance(value, dict) and 'generator' in value:
+            return json.loads(self._render(value['generator'], value.get('options', {}))[0])
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError as e:
+                raise RequestError(400, '%s is not valid JSON: %s' % (key, e))
+        if not isinstance(value, dict):
+            raise RequestError(400, '%s must be a template or a render request' % key)
+        return value
+
+    def render(self, body):
+        rendered, cached = self._render(body.get('generator'), body.get('options', {}))
+        return {'Template': rendered, 'Cached': cached}
+
+    def validate(self, body):
+        return {'Errors': validate(self._template(body, 'template'), self.spec, bool(body.get('strict')))}
+
+    def diff(self, body):
+        template, against = self._template(body, 'template'), self._template(body, 'against')
+        return {'Diff': compare(template_hashes(template), template_hashes(against)), 'Changes': resource_changes(against, template)}
+
+    def run(self, body):
+        args = body.get('args')
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            raise RequestError(400, 'args must be a list of strings')
+        # a command only runs here when it would do the same as a local run
+        if body.get('version') != VERSION:
+            raise RequestError(REFUSED, 'daemon runs version %s, not %s' % (VERSION, body.get('version')))
+        if body.get('cwd') != os.getcwd():
+            raise RequestError(REFUSED, 'daemon runs in %s, not %s' % (os.getcwd(), body.get('cwd')))
+        if body.get('environment') != environment():
+            raise RequestError(REFUSED, 'daemon runs with different AWS_/CCLI_ environment variables')
+        if not forwardable(args):
+            raise RequestError(REFUSED, 'command has to run locally')
+        exit_code, stdout, stderr = run_command(args, body.get('prog') or 'ccli')
+        return {'ExitCode': exit_code, 'Stdout': stdout, 'Stderr': stderr}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = 'ccli/%s' % VERSION
+
+    def _forbidden(self):
+        """Why the request isn't allowed - None when it sent the daemon's token with a loopback Host"""
+        try:
+            host = urllib.parse.urlsplit('//' + (self.headers.get('Host') or '')).hostname
+        except ValueError:
+            host = None
+        if host not in LOOPBACK_HOSTS:
+            return 'Host %r is not a loopback address' % self.headers.get('Host')
+        if not hmac.compare_digest((self.headers.get(TOKEN_HEADER) or '').encode('utf-8'), self.server.token.encode('utf-8')):
+            return 'missing or wrong %s header, send the token in %s' % (TOKEN_HEADER, self.server.token_path)
+        return None
+
+    def _answer(self, method):
+        # the body is read either way, so clients still sending it see the answer rather than a closed connection
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        except ValueError as e:
+            body, error = None, 'request is not valid JSON: %s' % e
+        else:
+            error = None
+        forbidden = self._forbidden()
+        if forbidden:
+            status, response = FORBIDDEN, {'Error': forbidden}
+        elif error:
+            status, response = 400, {'Error': error}
+        else:
+            status, response = self._handle(method, body)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method, body):
+        try:
+            return self.server.daemon.handle(method, self.path, body)
+        except Exception as e:
+            traceback.print_exc(file=sys.__stderr__)
+            return 500, {'Error': '%s: %s' % (type(e).__name__, e)}
+
+    def do_GET(self):
+        self._answer('GET')
+
+    def do_POST(self):
+        self._answer('POST')
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.daemon.verbose:
+            sys.__stderr__.write('%s - [%s] %s\n' % (self.address_string(), self.log_date_time_string(), format % args))
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def make_server(daemon, socket_path=DEFAULT_SOCKET, host='127.0.0.1', port=None):
+    """A threaded HTTP server for `daemon` on `host`:`port` when a port is given, otherwise on the Unix socket at `socket_path` - only
+    accessible to the current user. A socket left behind by a daemon that's gone is replaced, raises ValueError if one is still serving on it.
+    A new token is written to the daemon's token file either way."""
+    if port is not None:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    else:
+        if os.path.exists(socket_path):
+            try:
+                conn = connection(socket_path)
+                conn.connect()
+                conn.close()
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise ValueError('a daemon is already serving on %s' % socket_path)
+        if not os.path.isdir(os.path.dirname(os.path.abspath(socket_path))):
+            os.makedirs(os.path.dirname(os.path.abspath(socket_path)))
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixHTTPServer(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+    server.daemon = daemon
+    server.token_path = token_path('http://%s:%d' % (host, server.server_address[1]) if port is not None else socket_path)
+    server.token = write_token(server.token_path)
+    return server
+
+
+def write_token(path):
+    """Write a new random token to `path`, readable by the current user only, and return it"""
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    if os.path.exists(path):
+        os.unlink(path)
+    token = secrets.token_hex(32)
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+        f.write(token)
+    return token
+
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('serve')
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), default=DEFAULT_SOCKET, help="Unix socket to listen on. `ccli` commands use a daemon on the default socket without any configuration, other sockets need CCLI_SERVER=unix://<path>.")
+@click.option('--port', type=click.IntRange(1, 65535), help="TCP port to listen for HTTP on instead of a Unix socket (CCLI_SERVER=http://<host>:<port>). Requests need the token written to serve-<port>.token in the ccli cache directory and a loopback Host.")
+@click.option('--host', default='127.0.0.1', help="Address to listen on with --port.")
+@click.option('--cache-size', type=click.IntRange(1), default=CACHE_SIZE, help="Number of rendered templates to keep cached.")
+@click.option('--no-warm', 'no_warm', is_flag=True, help="boolean indicates whether rendering every template once at startup should be skipped")
+@click.option('--verbose', '-v', is_flag=True, help="boolean indicates whether every request should be logged to stderr")
+def serve(socket_path=DEFAULT_SOCKET, port=None, host='127.0.0.1', cache_size=CACHE_SIZE, no_warm=False, verbose=False):
+    """Run a long-lived daemon for CI and automation that keeps the template builders imported, the resource specification loaded and rendered templates cached, answering render, validate, diff and command requests concurrently over a local Unix socket or HTTP - `ccli` commands are forwarded to it by the thin client."""
+    daemon = Daemon(cache_size, verbose)
+    if not no_warm:
+        daemon.warm()
+    try:
+        server = make_server(daemon, socket_path, host, port)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('Serving ccli %s on %s (pid %d)' % (VERSION, 'http://%s:%d' % (host, port) if port else 'unix://' + socket_path, os.getpid()), err=True)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        with thread_streams():
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if port is None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        if os.path.exists(server.token_path):
+            os.unlink(server.token_path)
@@ -0,0 +1,172 @@
+import click
+import glob
+import json
+import os
+import time
+
+from . import benchmark
+from .common import data_dir, get_boto3_clients, get_profile_region_keys, DEFAULT_REGIONS
+from .dependencies import analyze, flagged, REQUIRED
+from .drift import detect, DRIFTED, FAILED, IN_SYNC
+from .validator import validate, load_spec, ValidationError, SPEC_PATH
+
+cf_data_dir = os.path.join(data_dir, 'cloudformation')
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('validate')
+@click.argument('template_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--spec', 'spec_path', type=click.Path(exists=True, dir_okay=False), help="CloudFormation resource specification to check resource properties against, e.g. the full published specification. Defaults to the subset bundled with the package.")
+@click.option('--strict', is_flag=True, help="boolean indicates whether resource types missing from the specification should be reported as problems")
+@click.option('--quiet', '-q', is_flag=True, help="boolean indicates whether only templates with problems should be listed")
+def validate_command(template_files, spec_path=None, strict=False, quiet=False):
+    """Validate CloudFormation templates in memory - checks Ref, GetAtt, Sub, DependsOn and Condition targets, parameter defaults against their constraints, resource properties against the resource specification and dependency cycles. Defaults to the templates shipped in the package data directory."""
+    template_files = template_files or sorted(glob.glob(os.path.join(cf_data_dir, 'log_aggregation', '*.json')))
+    spec = load_spec(spec_path or SPEC_PATH)
+    started = time.time()
+    failed = 0
+    for template_file in template_files:
+        with open(template_file) as f:
+            body = f.read()
+        try:
+            errors = validate(body, spec, strict)
+        except ValueError as e:
+            errors = ['not valid JSON: %s' % e]
+        if errors:
+            failed += 1
+            click.echo('FAILED %s' % template_file)
+            for error in errors:
+                click.echo('    %s' % error)
+        elif not quiet:
+            click.echo('OK     %s' % template_file)
+    click.echo('Validated %d template(s) in %.1f ms' % (len(template_files), (time.time() - started) * 1000))
+    if failed:
+        raise click.ClickException('%d of %d template(s) failed validation' % (failed, len(template_files)))
+
+
+def parse_estimate(ctx, param, value):
+    estimates = {}
+    for item in value:
+        resource_type, _, seconds = item.partition('=')
+        try:
+            estimates[resource_type] = int(seconds)
+        except ValueError:
+            raise click.BadParameter('expected TYPE=SECONDS, got %s' % item)
+    return estimates
+
+
+@cli.command('dependencies')
+@click.argument('template_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option('--estimate', '-e', multiple=True, callback=parse_estimate, help="creation time for a resource type in seconds as TYPE=SECONDS, e.g. AWS::Kinesis::Stream=120, overriding the built in estimate. Can be repeated.")
+@click.option('--strict', is_flag=True, help="boolean indicates whether DependsOn entries that are redundant or have no known ordering requirement should fail the command")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether the analysis should be printed as JSON")
+def dependencies_command(template_files, estimate=None, strict=False, as_json=False):
+    """Analyze the resource dependency graph of CloudFormation templates - estimates the wall-clock deploy time from the critical path of dependent resources and flags DependsOn entries that are already implied by references or serialize creation without a known ordering requirement. Defaults to the templates shipped in the package data directory."""
+    template_files = template_files or sorted(glob.glob(os.path.join(cf_data_dir, 'log_aggregation', '*.json')))
+    analyses = {}
+    for template_file in template_files:
+        with open(template_file) as f:
+            body = f.read()
+        try:
+            analyses[template_file] = analyze(body, estimate)
+        except (ValidationError, ValueError) as e:
+            raise click.ClickException('%s is not a valid template: %s' % (template_file, e))
+
+    if as_json:
+        click.echo(json.dumps(analyses, indent=4, sort_keys=True))
+    else:
+        for template_file in template_files:
+            analysis = analyses[template_file]
+            click.echo(template_file)
+            click.echo('  %d resource(s), %d s of work, estimated deploy %d s (%.2fx parallel)' % (analysis['Resources'], analysis['SerialSeconds'],
+                                                                                               analysis['EstimatedSeconds'], analysis['Parallelism']))
+            click.echo('  Critical path:')
+            for step in analysis['CriticalPath']:
+                click.echo('    %5d s  +%-4d %s (%s)' % (step['Start'], step['Seconds'], step['Resource'], step['Type']))
+            if analysis['DependsOn']:
+                click.echo('  DependsOn:')
+            for edge in analysis['DependsOn']:
+                flag = ' ' if edge['Status'] == REQUIRED else '!'
+                click.echo('  %s %-11s %s -> %s, +%d s: %s' % (flag, edge['Status'], edge['Resource'], edge['DependsOn'], edge['Seconds'], edge['Reason']))
+
+    unneeded = sum(len(flagged(analysis)) for analysis in analyses.values())
+    if strict and unneeded:
+        raise click.ClickException('%d DependsOn entr%s without an ordering requirement' % (unneeded, 'y' if unneeded == 1 else 'ies'))
+
+
+@cli.command('benchmark')
+@click.option('--generator', '-g', 'generators', multiple=True, type=click.Choice(sorted(benchmark.GENERATORS)), help="generator to benchmark. Can be repeated, defaults to all of them.")
+@click.option('--accounts', 'account_counts', multiple=True, type=click.IntRange(1), help="number of child accounts to generate the target template for. Can be repeated, defaults to %s." % ', '.join(str(n) for n in benchmark.ACCOUNT_COUNTS))
+@click.option('--regions', 'region_counts', multiple=True, type=click.IntRange(1, len(benchmark.REGIONS)), help="number of regions to generate the target template for. Can be repeated, defaults to %s." % ', '.join(str(n) for n in benchmark.REGION_COUNTS))
+@click.option('--repeat', default=3, type=click.IntRange(1), help="number of timed runs per case, the best is reported")
+@click.option('--baseline', 'baseline_file', type=click.Path(exists=True, dir_okay=False), help="saved results to compare against - the command fails when a case regresses beyond the thresholds")
+@click.option('--save', 'save_file', type=click.Path(dir_okay=False), help="path to save the results to for use as a baseline")
+@click.option('--threshold', default=benchmark.DEFAULT_THRESHOLD, help="allowed increase in peak memory, memory blocks and output size over the baseline, as a fraction")
+@click.option('--time-threshold', default=benchmark.DEFAULT_TIME_THRESHOLD, help="allowed increase in wall time over the baseline, as a fraction")
+def benchmark_command(generators=None, account_counts=None, region_counts=None, repeat=3, baseline_file=None, save_file=None, threshold=benchmark.DEFAULT_THRESHOLD,
+                      time_threshold=benchmark.DEFAULT_TIME_THRESHOLD):
+    """Benchmark the template generators as the account and region lists grow - records the wall time, peak traced memory, memory blocks held and output size of each generated template, optionally saving them as a baseline or failing when they regress against one."""
+    click.echo('%-9s %8s %7s %9s %9s %12s %9s %12s' % ('generator', 'accounts', 'regions', 'resources', 'seconds', 'peak bytes', 'blocks', 'output bytes'))
+
+    def _report(result):
+        click.echo('%-9s %8d %7d %9d %9.4f %12d %9d %12d' % (result['Generator'], result['Accounts'], result['Regions'], result['Resources'], result['Seconds'],
+                                                           result['PeakBytes'], result['Blocks'], result['OutputBytes']))
+
+    results = benchmark.run(benchmark.cases(generators, account_counts, region_counts), repeat, _report)
+    if save_file:
+        with open(save_file, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        click.echo('Saved %d result(s) to %s' % (len(results['Results']), save_file))
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(results, baseline, threshold, time_threshold)
+        for (generator, accounts, regions), metric, old, new in regressions:
+            click.echo('REGRESSION %s %d account(s) %d region(s): %s %s -> %s (+%.0f%%)' % (generator, accounts, regions, metric, old, new, (float(new) / old - 1) * 100 if old else 100))
+        if regressions:
+            raise click.ClickException('%d regression(s) against %s' % (len(regressions), baseline_file))
+        click.echo('No regressions against %s' % baseline_file)
+
+
+@cli.command('drift')
+@click.argument('template_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--stack', '-s', 'stack_patterns', multiple=True, required=True, help="Glob selecting the stacks deployed from the template, e.g. 'seimLogSource*'. Can be repeated.")
+@click.option('--profile', '-p', 'profile_list', multiple=True, help="AWS profile(s) for the accounts to check. Defaults to every configured profile.")
+@click.option('--region', '-r', 'region_list', multiple=True, help="Region(s) to check in each account. Defaults to %s." % ', '.join(DEFAULT_REGIONS))
+@click.option('--verify', is_flag=True, help="boolean indicates whether every stack's full template should be fetched and hashed rather than trusting the hashes stored in its metadata, which also catches templates edited by hand")
+@click.option('--json', 'as_json', is_flag=True, help="boolean indicates whether the results should be printed as JSON")
+@click.option('--workers', type=int, default=16, help="Number of concurrent AWS API calls.")
+def drift_command(template_file, stack_patterns, profile_list=None, region_list=None, verify=False, as_json=False, workers=16):
+    """Find the deployed stacks whose template differs from TEMPLATE_FILE, as generated by the current generator - compares the template hashes stored in each stack's metadata by root hash, fetching nothing else, and lists the sections and resources that diverged for the stacks that differ. Exits non-zero when any stack drifted or couldn't be checked."""
+    with open(template_file) as f:
+        try:
+            template = json.load(f)
+        except ValueError as e:
+            raise click.ClickException('%s is not a valid template: %s' % (template_file, e))
+    results = detect(get_boto3_clients('cloudformation', get_profile_region_keys(profile_list, region_list)), template, stack_patterns, verify, workers)
+
+    if as_json:
+        click.echo(json.dumps([dict(result, Key=list(result['Key'])) for result in results], indent=4, sort_keys=True))
+    else:
+        click.echo('%-24s %-12s %-40s %-8s %-9s %s' % ('PROFILE', 'REGION', 'STACK', 'STATUS', 'HASHES', 'VERSION'))
+        for result in results:
+            profile, region = result['Key']
+            click.echo('%-24s %-12s %-40s %-8s %-9s %s' % (profile, region, result['Stack'] or '-', result['Status'], result['Source'] or '-', result['Version'] or '-'))
+            if result['Error']:
+                click.echo('    %s' % result['Error'])
+            if result['Diff']:
+                for section in result['Diff']['Sections']:
+                    click.echo('    section %s' % section)
+                for change in ['Add', 'Remove', 'Modify']:
+                    for name in result['Diff'][change]:
+                        click.echo('    %-7s %s' % (change.lower(), name))
+
+    statuses = [result['Status'] for result in results]
+    click.echo('%d stack(s) checked: %d in sync, %d drifted, %d error(s)' % (len([r for r in results if r['Stack']]), statuses.count(IN_SYNC), statuses.count(DRIFTED),
+                                                                          statuses.count(FAILED)), err=as_json)
+    if statuses.count(DRIFTED) or statuses.count(FAILED):
+        raise click.ClickException('%d stack(s) drifted from %s, %d error(s)' % (statuses.count(DRIFTED), template_file, statuses.count(FAILED)))
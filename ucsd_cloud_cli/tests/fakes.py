@@ -0,0 +1,400 @@
+"""Local stand-ins for the boto3 clients used throughout the CLI so the AWS-facing logic can be exercised offline."""
+import base64
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+
+
+class FakePaginator(object):
+    """Mimics a boto3 paginator by handing back pre-built pages from the owning client"""
+    def __init__(self, page_function):
+        self.page_function = page_function
+
+    def paginate(self, **kwargs):
+        return iter(self.page_function(**kwargs))
+
+
+class FakeClient(object):
+    """Base class for fake clients - records every API call and supports get_paginator for any `_pages_<operation>` method defined on the subclass"""
+    def __init__(self):
+        self.calls = []
+
+    def record(self, operation, **kwargs):
+        self.calls.append((operation, kwargs))
+
+    def call_count(self, operation):
+        return len([c for c in self.calls if c[0] == operation])
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(getattr(self, '_pages_' + operation_name))
+
+
+class FakeLogsClient(FakeClient):
+    """CloudWatch Logs stand-in holding a dict of log group name -> list of subscription filters"""
+    def __init__(self, log_groups, page_size=2):
+        super(FakeLogsClient, self).__init__()
+        self.log_groups = log_groups
+        self.page_size = page_size
+
+    def _pages_describe_log_groups(self, **kwargs):
+        self.record('describe_log_groups', **kwargs)
+        names = sorted(self.log_groups)
+        return [{'logGroups': [{'logGroupName': n, 'creationTime': 1518000000000} for n in names[i:i + self.page_size]]}
+                for i in range(0, len(names), self.page_size)]
+
+    def _pages_describe_subscription_filters(self, logGroupName, **kwargs):
+        self.record('describe_subscription_filters', logGroupName=logGroupName)
+        return [{'subscriptionFilters': list(self.log_groups[logGroupName])}]
+
+    def put_subscription_filter(self, logGroupName, filterName, filterPattern, destinationArn, **kwargs):
+        self.record('put_subscription_filter', logGroupName=logGroupName)
+        self.log_groups[logGroupName].append({'filterName': filterName, 'filterPattern': filterPattern, 'destinationArn': destinationArn})
+
+
+class FakeEC2Client(FakeClient):
+    """EC2 stand-in holding instances (each with a VpcId, Tags and NetworkInterfaces carrying Groups) and security groups"""
+    def __init__(self, instances, security_groups=None, page_size=2, multi_volume=True, polls_to_complete=2):
+        super(FakeEC2Client, self).__init__()
+        self.instances = dict((i['InstanceId'], i) for i in instances)
+        self.security_groups = security_groups if security_groups is not None else []
+        self.tags = {}
+        self.page_size = page_size
+        self.snapshots = {}
+        self.multi_volume = multi_volume
+        self.polls_to_complete = polls_to_complete
+
+    def _matches(self, instance, f):
+        if f['Name'] == 'instance-id':
+            return instance['InstanceId'] in f['Values']
+        if f['Name'] == 'instance-state-name':
+            return instance.get('State', {'Name': 'running'})['Name'] in f['Values']
+        if f['Name'] == 'network-interface.network-interface-id':
+            return any(eni['NetworkInterfaceId'] in f['Values'] for eni in instance.get('NetworkInterfaces', []))
+        if f['Name'].startswith('tag:'):
+            return any(t['Key'] == f['Name'][4:] and t['Value'] in f['Values'] for t in instance.get('Tags', []))
+        raise ValueError('Unsupported filter %s' % f['Name'])
+
+    def _pages_describe_instances(self, Filters, **kwargs):
+        self.record('describe_instances', Filters=Filters)
+        matched = [i for _, i in sorted(self.instances.items()) if all(self._matches(i, f) for f in Filters)]
+        return [{'Reservations': [{'Instances': matched[i:i + self.page_size]}]} for i in range(0, len(matched), self.page_size)] or [{'Reservations': []}]
+
+    def describe_security_groups(self, Filters, **kwargs):
+        self.record('describe_security_groups', Filters=Filters)
+        values = dict((f['Name'], f['Values']) for f in Filters)
+        return {'SecurityGroups': [g for g in self.security_groups if g['VpcId'] in values['vpc-id'] and g['GroupName'] in values['group-name']]}
+
+    def create_security_group(self, GroupName, VpcId, Description, **kwargs):
+        self.record('create_security_group', GroupName=GroupName, VpcId=VpcId)
+        group = {'GroupId': 'sg-q%07d' % len(self.security_groups), 'GroupName': GroupName, 'VpcId': VpcId,
+                 'IpPermissions': [], 'IpPermissionsEgress': [{'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
+                                                              {'IpProtocol': '-1', 'Ipv6Ranges': [{'CidrIpv6': '::/0'}]}]}
+        self.security_groups.append(group)
+        return {'GroupId': group['GroupId']}
+
+    def revoke_security_group_egress(self, GroupId, IpPermissions, **kwargs):
+        self.record('revoke_security_group_egress', GroupId=GroupId)
+        group = [g for g in self.security_groups if g['GroupId'] == GroupId][0]
+        group['IpPermissionsEgress'] = [p for p in group['IpPermissionsEgress'] if p not in IpPermissions]
+
+    def modify_network_interface_attribute(self, NetworkInterfaceId, Groups, **kwargs):
+        self.record('modify_network_interface_attribute', NetworkInterfaceId=NetworkInterfaceId, Groups=Groups)
+        for instance in self.instances.values():
+            for eni in instance.get('NetworkInterfaces', []):
+                if eni['NetworkInterfaceId'] == NetworkInterfaceId:
+                    eni['Groups'] = [{'GroupId': g} for g in Groups]
+
+    def create_tags(self, Resources, Tags, **kwargs):
+        self.record('create_tags', Resources=Resources, Tags=Tags)
+        for resource in Resources:
+            self.tags.setdefault(resource, {}).update((t['Key'], t['Value']) for t in Tags)
+
+
+    def _new_snapshot(self, volume_id, tags):
+        snapshot = {'SnapshotId': 'snap-%08d' % len(self.snapshots), 'VolumeId': volume_id, 'VolumeSize': 8, 'State': 'pending', 'Progress': '0%', 'Polls': 0}
+        self.snapshots[snapshot['SnapshotId']] = snapshot
+        self.tags[snapshot['SnapshotId']] = dict((t['Key'], t['Value']) for t in tags)
+        return dict((k, v) for k, v in snapshot.items() if k != 'Polls')
+
+    def create_snapshots(self, InstanceSpecification, TagSpecifications, **kwargs):
+        self.record('create_snapshots', InstanceSpecification=InstanceSpecification)
+        if not self.multi_volume:
+            raise FakeClientError('UnsupportedOperation', 'CreateSnapshots')
+        instance = self.instances[InstanceSpecification['InstanceId']]
+        return {'Snapshots': [self._new_snapshot(m['Ebs']['VolumeId'], TagSpecifications[0]['Tags']) for m in instance.get('BlockDeviceMappings', [])]}
+
+    def create_snapshot(self, VolumeId, TagSpecifications, **kwargs):
+        self.record('create_snapshot', VolumeId=VolumeId)
+        return self._new_snapshot(VolumeId, TagSpecifications[0]['Tags'])
+
+    def _pages_describe_snapshots(self, Filters, **kwargs):
+        """Every poll advances the requested snapshots, which complete after `polls_to_complete` polls"""
+        self.record('describe_snapshots', Filters=Filters)
+        described = []
+        if Filters[0]['Name'].startswith('tag:'):
+            key = Filters[0]['Name'][4:]
+            snapshot_ids = [i for i in sorted(self.snapshots) if self.tags.get(i, {}).get(key) in Filters[0]['Values']]
+        else:
+            snapshot_ids = [i for i in Filters[0]['Values'] if i in self.snapshots]
+        for snapshot_id in snapshot_ids:
+            snapshot = self.snapshots[snapshot_id]
+            if snapshot['State'] == 'pending':
+                snapshot['Polls'] += 1
+                if snapshot['Polls'] >= self.polls_to_complete:
+                    snapshot.update(State='completed', Progress='100%')
+                else:
+                    snapshot['Progress'] = '%d%%' % (100 * snapshot['Polls'] // self.polls_to_complete)
+            described.append(dict((k, v) for k, v in snapshot.items() if k != 'Polls'))
+        return [{'Snapshots': described[i:i + self.page_size]} for i in range(0, len(described), self.page_size)]
+
+    def modify_snapshot_attribute(self, SnapshotId, Attribute, OperationType, UserIds, **kwargs):
+        self.record('modify_snapshot_attribute', SnapshotId=SnapshotId, OperationType=OperationType, UserIds=UserIds)
+        shares = self.snapshots[SnapshotId].setdefault('SharedWith', set())
+        if OperationType == 'add':
+            shares.update(UserIds)
+        else:
+            shares.difference_update(UserIds)
+
+
+class FakeEBSCopyClient(FakeClient):
+    """Security account EC2 stand-in for snapshot copies - `source` is the FakeEC2Client owning the shared snapshots. Like AWS, starting more than
+    `copy_limit` pending copies fails with ResourceLimitExceeded."""
+    def __init__(self, source, account_id='999999999999', copy_limit=20, polls_to_complete=2):
+        super(FakeEBSCopyClient, self).__init__()
+        self.copies = FakeEC2Client([], polls_to_complete=polls_to_complete)
+        self.source = source
+        self.account_id = account_id
+        self.copy_limit = copy_limit
+        self.max_pending = 0
+
+    def copy_snapshot(self, SourceSnapshotId, SourceRegion, Encrypted, KmsKeyId, TagSpecifications, **kwargs):
+        self.record('copy_snapshot', SourceSnapshotId=SourceSnapshotId, KmsKeyId=KmsKeyId)
+        if self.account_id not in self.source.snapshots[SourceSnapshotId].get('SharedWith', ()):
+            raise RuntimeError('InvalidSnapshot.NotFound')
+        pending = len([s for s in self.copies.snapshots.values() if s['State'] == 'pending'])
+        if pending >= self.copy_limit:
+            raise RuntimeError('An error occurred (ResourceLimitExceeded) when calling the CopySnapshot operation')
+        snapshot = self.copies._new_snapshot(self.source.snapshots[SourceSnapshotId]['VolumeId'], TagSpecifications[0]['Tags'])
+        self.copies.snapshots[snapshot['SnapshotId']]['KmsKeyId'] = KmsKeyId
+        self.max_pending = max(self.max_pending, pending + 1)
+        return {'SnapshotId': snapshot['SnapshotId']}
+
+    def get_paginator(self, operation_name):
+        return self.copies.get_paginator(operation_name)
+
+
+class FakeAutoScalingClient(FakeClient):
+    """Auto Scaling stand-in holding a dict of group name -> list of instance IDs"""
+    def __init__(self, groups):
+        super(FakeAutoScalingClient, self).__init__()
+        self.groups = groups
+
+    def _pages_describe_auto_scaling_instances(self, InstanceIds, **kwargs):
+        self.record('describe_auto_scaling_instances', InstanceIds=InstanceIds)
+        return [{'AutoScalingInstances': [{'InstanceId': i, 'AutoScalingGroupName': name}
+                                          for name, members in sorted(self.groups.items()) for i in members if i in InstanceIds]}]
+
+    def detach_instances(self, InstanceIds, AutoScalingGroupName, ShouldDecrementDesiredCapacity, **kwargs):
+        self.record('detach_instances', InstanceIds=InstanceIds, AutoScalingGroupName=AutoScalingGroupName)
+        self.groups[AutoScalingGroupName] = [i for i in self.groups[AutoScalingGroupName] if i not in InstanceIds]
+
+
+class FakeClientError(Exception):
+    """Carries a botocore ClientError style `response` so error code checks work without botocore"""
+    def __init__(self, code, operation):
+        super(FakeClientError, self).__init__('An error occurred (%s) when calling the %s operation' % (code, operation))
+        self.response = {'Error': {'Code': code}}
+
+
+class _Body(object):
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None else self.position + amt
+        chunk, self.position = self.data[self.position:end], min(end, len(self.data))
+        return chunk
+
+
+class FakeEBSClient(FakeClient):
+    """EBS direct API stand-in serving a dict of block index -> block data for a single snapshot. `corrupt` holds block indexes whose first read
+    returns data that doesn't match its checksum. Tracks the most GetSnapshotBlock calls ever outstanding at once."""
+    def __init__(self, blocks, volume_size=1, block_size=512 * 1024, page_size=100, corrupt=(), latency=0.0):
+        super(FakeEBSClient, self).__init__()
+        self.blocks = blocks
+        self.volume_size = volume_size
+        self.block_size = block_size
+        self.page_size = page_size
+        self.corrupt = set(corrupt)
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def list_snapshot_blocks(self, SnapshotId, MaxResults, NextToken=None):
+        self.record('list_snapshot_blocks', NextToken=NextToken)
+        indexes = sorted(self.blocks)
+        start = int(NextToken or 0)
+        page = {'VolumeSize': self.volume_size, 'BlockSize': self.block_size,
+                'Blocks': [{'BlockIndex': i, 'BlockToken': 'token-%d' % i} for i in indexes[start:start + self.page_size]]}
+        if start + self.page_size < len(indexes):
+            page['NextToken'] = str(start + self.page_size)
+        return page
+
+    def get_snapshot_block(self, SnapshotId, BlockIndex, BlockToken):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.calls.append(('get_snapshot_block', {'BlockIndex': BlockIndex}))
+        time.sleep(self.latency)
+        data = self.blocks[BlockIndex]
+        checksum = base64.b64encode(hashlib.sha256(data).digest()).decode('ascii')
+        with self.lock:
+            self.in_flight -= 1
+            if BlockIndex in self.corrupt:
+                self.corrupt.discard(BlockIndex)
+                data = b'\xff' + data[1:]
+        return {'BlockData': _Body(data), 'DataLength': len(data), 'Checksum': checksum, 'ChecksumAlgorithm': 'SHA256'}
+
+
+class FakeS3Client(FakeClient):
+    """S3 stand-in for object reads, listings and multipart uploads - objects live in `objects` as bucket/key -> bytes, with user metadata in
+    `metadata` under the same keys"""
+    def __init__(self, objects=None, metadata=None, page_size=1000):
+        super(FakeS3Client, self).__init__()
+        self.uploads = {}
+        self.objects = objects if objects is not None else {}
+        self.metadata = metadata if metadata is not None else {}
+        self.page_size = page_size
+        self.aborted = []
+
+    def get_object(self, Bucket, Key):
+        self.record('get_object', Bucket=Bucket, Key=Key)
+        path = '%s/%s' % (Bucket, Key)
+        if path not in self.objects:
+            raise FakeClientError('NoSuchKey', 'GetObject')
+        return {'Body': _Body(self.objects[path]), 'ContentLength': len(self.objects[path]), 'Metadata': self.metadata.get(path, {})}
+
+    def _pages_list_objects_v2(self, Bucket, Prefix='', Delimiter=None, StartAfter=''):
+        self.record('list_objects_v2', Prefix=Prefix, Delimiter=Delimiter, StartAfter=StartAfter)
+        keys = sorted(path[len(Bucket) + 1:] for path in self.objects if path.startswith(Bucket + '/'))
+        keys = [key for key in keys if key.startswith(Prefix) and key > StartAfter]
+        if Delimiter:
+            prefixes = sorted(set(Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter for key in keys if Delimiter in key[len(Prefix):]))
+            return [{'CommonPrefixes': [{'Prefix': p} for p in prefixes]}]
+        return [{'Contents': [{'Key': key, 'Size': len(self.objects['%s/%s' % (Bucket, key)])} for key in keys[start:start + self.page_size]]}
+                for start in range(0, len(keys), self.page_size)] or [{}]
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.record('create_multipart_upload', Bucket=Bucket, Key=Key)
+        upload_id = 'upload-%d' % len(self.uploads)
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': '"etag-%d"' % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.record('complete_multipart_upload', Bucket=Bucket, Key=Key, Parts=[p['PartNumber'] for p in MultipartUpload['Parts']])
+        self.objects['%s/%s' % (Bucket, Key)] = b''.join(self.uploads[UploadId][p['PartNumber']] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+class FakeCloudTrailClient(FakeClient):
+    """CloudTrail stand-in serving ListPublicKeys from a list of {Value, Fingerprint} dicts, one key per page"""
+    def __init__(self, keys):
+        super(FakeCloudTrailClient, self).__init__()
+        self.keys = keys
+
+    def list_public_keys(self, StartTime=None, EndTime=None, NextToken=None):
+        self.record('list_public_keys', StartTime=StartTime, EndTime=EndTime)
+        index = int(NextToken or 0)
+        response = {'PublicKeyList': self.keys[index:index + 1]}
+        if index + 1 < len(self.keys):
+            response['NextToken'] = str(index + 1)
+        return response
+
+
+class FakeCloudFormationClient(FakeClient):
+    """CloudFormation stand-in describing stacks from a dict of stack name -> outputs dict, with the deployed template dicts in `templates`"""
+    def __init__(self, stacks=None, templates=None, page_size=2):
+        super(FakeCloudFormationClient, self).__init__()
+        self.stacks = stacks if stacks is not None else {}
+        self.templates = templates if templates is not None else {}
+        self.page_size = page_size
+
+    def _stack(self, name):
+        return {'StackName': name, 'Outputs': [{'OutputKey': k, 'OutputValue': v} for k, v in sorted(self.stacks.get(name, {}).items())]}
+
+    def describe_stacks(self, StackName):
+        self.record('describe_stacks', StackName=StackName)
+        if StackName not in self.stacks:
+            raise FakeClientError('ValidationError', 'DescribeStacks')
+        return {'Stacks': [self._stack(StackName)]}
+
+    def _pages_describe_stacks(self, **kwargs):
+        self.record('describe_stacks')
+        names = sorted(set(self.stacks) | set(self.templates))
+        return [{'Stacks': [self._stack(name) for name in names[i:i + self.page_size]]} for i in range(0, len(names), self.page_size)] or [{'Stacks': []}]
+
+    def get_template_summary(self, StackName):
+        self.record('get_template_summary', StackName=StackName)
+        metadata = self.templates[StackName].get('Metadata')
+        return {'Metadata': json.dumps(metadata)} if metadata else {}
+
+    def get_template(self, StackName, TemplateStage='Original'):
+        self.record('get_template', StackName=StackName)
+        return {'TemplateBody': self.templates[StackName]}
+
+
+class FakeCloudWatchClient(FakeClient):
+    """CloudWatch stand-in serving GetMetricData from `metrics`, a dict of (namespace, metric name, ((dimension, value), ...)) -> list of
+    (datetime, value) samples. Metric stats aggregate the samples per period; expressions support the SUM(SEARCH(...)) form only. Results are
+    paged `page_size` queries at a time."""
+    SEARCH = re.compile(r"SUM\(SEARCH\('\{([^}]*)\} (.*)', '(\w+)', (\d+)\)\)")
+    STATISTICS = {'Sum': sum, 'Maximum': max, 'Minimum': min, 'Average': lambda values: sum(values) / len(values)}
+
+    def __init__(self, metrics, page_size=100):
+        super(FakeCloudWatchClient, self).__init__()
+        self.metrics = metrics
+        self.page_size = page_size
+
+    def _aggregate(self, samples, start, end, period, statistic):
+        buckets = {}
+        for timestamp, value in samples:
+            if start <= timestamp < end:
+                offset = int((timestamp - start).total_seconds()) // period * period
+                buckets.setdefault(offset, []).append(value)
+        return dict((start + datetime.timedelta(seconds=offset), self.STATISTICS[statistic](values)) for offset, values in buckets.items())
+
+    def _evaluate(self, query, start, end):
+        if 'MetricStat' in query:
+            metric = query['MetricStat']['Metric']
+            key = (metric['Namespace'], metric['MetricName'], tuple(sorted((d['Name'], d['Value']) for d in metric['Dimensions'])))
+            return self._aggregate(self.metrics.get(key, []), start, end, query['MetricStat']['Period'], query['MetricStat']['Stat'])
+        schema, terms, statistic, period = self.SEARCH.match(query['Expression']).groups()
+        namespace, dimensions = schema.split(',')[0], set(schema.split(',')[1:])
+        terms = dict(re.findall(r'(\w+)="([^"]*)"', terms))
+        total = {}
+        for (series_namespace, metric_name, series_dimensions), samples in self.metrics.items():
+            values = dict(series_dimensions, MetricName=metric_name)
+            if series_namespace == namespace and set(dict(series_dimensions)) == dimensions and all(values.get(k) == v for k, v in terms.items()):
+                for timestamp, value in self._aggregate(samples, start, end, int(period), statistic).items():
+                    total[timestamp] = total.get(timestamp, 0) + value
+        return total
+
+    def _pages_get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy='TimestampDescending'):
+        assert len(MetricDataQueries) <= 500
+        self.record('get_metric_data', Queries=len(MetricDataQueries))
+        results = []
+        for query in MetricDataQueries:
+            points = sorted(self._evaluate(query, StartTime, EndTime).items(), reverse=ScanBy == 'TimestampDescending')
+            results.append({'Id': query['Id'], 'Timestamps': [t for t, _ in points], 'Values': [v for _, v in points], 'StatusCode': 'Complete'})
+        return [{'MetricDataResults': results[i:i + self.page_size]} for i in range(0, len(results), self.page_size)]
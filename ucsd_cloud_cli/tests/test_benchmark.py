@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.benchmark import cases, measure, compare
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_cases(self):
+        """Test to make sure only the target generator is run across account and region counts"""
+        assert cases(account_counts=[1, 10], region_counts=[2]) == [('flow_log', 1, 1), ('source', 1, 1), ('target', 1, 2), ('target', 10, 2)]
+
+    def test_measure(self):
+        """Test to make sure the target template's memory and output grow with the account list and the other metrics are recorded"""
+        small, large = measure('target', 1, 1, repeat=1), measure('target', 20, 4, repeat=1)
+        assert small['Resources'] == large['Resources'] == 18
+        assert large['OutputBytes'] > small['OutputBytes'] and large['Blocks'] > small['Blocks'] and large['PeakBytes'] > small['PeakBytes']
+        assert small['Seconds'] > 0
+
+    def test_compare(self):
+        """Test to make sure metrics beyond their threshold are regressions, and short timings and unknown cases are ignored"""
+        baseline = {'Results': [{'Generator': 'target', 'Accounts': 10, 'Regions': 1, 'Seconds': 0.1, 'PeakBytes': 1000, 'Blocks': 100, 'OutputBytes': 500},
+                                {'Generator': 'source', 'Accounts': 1, 'Regions': 1, 'Seconds': 0.001, 'PeakBytes': 1000, 'Blocks': 100, 'OutputBytes': 500}]}
+        current = copy.deepcopy(baseline)
+        current['Results'][0].update(Seconds=0.14, PeakBytes=1200, Blocks=105)
+        current['Results'][1].update(Seconds=0.04)
+        current['Results'].append({'Generator': 'target', 'Accounts': 5000, 'Regions': 1, 'Seconds': 9, 'PeakBytes': 9, 'Blocks': 9, 'OutputBytes': 9})
+        assert compare(current, baseline) == [(('target', 10, 1), 'PeakBytes', 1000, 1200)]
+        assert compare(current, baseline, threshold=0.01, time_threshold=0.1) == [(('target', 10, 1), 'Seconds', 0.1, 0.14),
+                                                                                  (('target', 10, 1), 'PeakBytes', 1000, 1200),
+                                                                                  (('target', 10, 1), 'Blocks', 100, 105)]
+
+    def test_benchmark_command(self):
+        """Test to make sure `benchmark` saves a baseline and fails when a later run regresses against it"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        baseline_file = os.path.join(work_dir, 'baseline.json')
+        args = ['benchmark', '-g', 'target', '--accounts', '2', '--regions', '1', '--repeat', '1']
+        result = CliRunner().invoke(cli, args + ['--save', baseline_file])
+        assert result.exit_code == 0, result.output
+        assert 'target           2       1        18' in result.output
+
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        assert CliRunner().invoke(cli, args + ['--baseline', baseline_file]).exit_code == 0
+        baseline['Results'][0]['OutputBytes'] //= 2
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f)
+        result = CliRunner().invoke(cli, args + ['--baseline', baseline_file])
+        assert result.exit_code == 1
+        assert 'REGRESSION target 2 account(s) 1 region(s): OutputBytes' in result.output
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from troposphere import Template, GetAtt, Ref
+import troposphere.sqs as sqs
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.dependencies import analyze, flagged, REDUNDANT, REQUIRED, UNEXPLAINED
+from ucsd_cloud_cli.validator import template_json
+
+TEMPLATE = {'Resources': {'Stream': {'Type': 'AWS::Kinesis::Stream', 'Properties': {'ShardCount': 1}},
+                          'DeadLetterQueue': {'Type': 'AWS::SQS::Queue'},
+                          'Queue': {'Type': 'AWS::SQS::Queue', 'Properties': {'RedrivePolicy': {'deadLetterTargetArn': {'Fn::GetAtt': ['DeadLetterQueue', 'Arn']},
+                                                                                                'maxReceiveCount': 10}}},
+                          'QueuePolicy': {'Type': 'AWS::SQS::QueuePolicy', 'Properties': {'PolicyDocument': {}, 'Queues': [{'Ref': 'Queue'}]}},
+                          'Bucket': {'Type': 'AWS::S3::Bucket', 'DependsOn': ['Stream', 'DeadLetterQueue', 'QueuePolicy'],
+                                     'Properties': {'NotificationConfiguration': {'QueueConfigurations': [
+                                         {'Event': 's3:ObjectCreated:*', 'Queue': {'Fn::GetAtt': ['Queue', 'Arn']}}]}}}}}
+
+
+class TestDependencies(unittest.TestCase):
+
+    def test_analyze(self):
+        """Test to make sure the critical path, deploy estimate and cost of each DependsOn entry come from the per-type creation times"""
+        analysis = analyze(TEMPLATE)
+        assert analysis['Resources'] == 5 and analysis['SerialSeconds'] == 70 + 5 + 5 + 10 + 25
+        assert analysis['EstimatedSeconds'] == 95
+        assert [(step['Resource'], step['Start']) for step in analysis['CriticalPath']] == [('Stream', 0), ('Bucket', 70)]
+        assert [(edge['DependsOn'], edge['Status'], edge['Seconds']) for edge in analysis['DependsOn']] == [('Stream', UNEXPLAINED, 25),
+                                                                                                            ('DeadLetterQueue', REDUNDANT, 0),
+                                                                                                            ('QueuePolicy', REQUIRED, 0)]
+        assert [edge['DependsOn'] for edge in flagged(analysis)] == ['Stream', 'DeadLetterQueue']
+        assert analyze(TEMPLATE, {'AWS::Kinesis::Stream': 5})['EstimatedSeconds'] == 5 + 5 + 10 + 25
+
+    def test_template_json_drops_redundant_edges(self):
+        """Test to make sure generators never write out DependsOn entries CloudFormation already infers from references"""
+        t = Template()
+        dead_letter_queue = t.add_resource(sqs.Queue('DeadLetterQueue'))
+        queue = t.add_resource(sqs.Queue('Queue', RedrivePolicy=sqs.RedrivePolicy(deadLetterTargetArn=GetAtt(dead_letter_queue, 'Arn'), maxReceiveCount=10)))
+        t.add_resource(sqs.QueuePolicy('Policy', DependsOn=[queue.title, dead_letter_queue.title], PolicyDocument={}, Queues=[Ref(queue)]))
+        t.add_resource(sqs.QueuePolicy('Other', DependsOn=queue.title, PolicyDocument={}, Queues=[Ref(queue)]))
+        resources = json.loads(template_json(t))['Resources']
+        assert 'DependsOn' not in resources['Policy'] and 'DependsOn' not in resources['Other']
+
+    def test_generated_templates(self):
+        """Test to make sure every generator's DependsOn entries are needed and the log delivery bucket waits for its queue policy"""
+        runner = CliRunner()
+        target = json.loads(runner.invoke(cli, ['target', 'generate', '--dry-run', '-a', '802640662990', '--glue-catalog', '--firehose-transform', '--flow-logs-to-s3']).output)
+        outputs = [runner.invoke(cli, args).output for args in [['source', 'generate', '--dry-run'],
+                                                                ['source', 'flow_log', '--dry-run', '--destination', 's3'],
+                                                                ['response', 'generate', '--dry-run']]]
+        assert [flagged(analyze(t)) for t in [target] + outputs] == [[], [], [], []]
+        assert target['Resources']['LogDeliveryBucket']['DependsOn'] == ['s3DeliveryQueuePolicy']
+
+    def test_dependencies_command(self):
+        """Test to make sure `dependencies` reports the estimate and only fails under --strict when an entry has no ordering requirement"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        template_file = os.path.join(work_dir, 'template.json')
+        with open(template_file, 'w') as f:
+            json.dump(TEMPLATE, f)
+        result = CliRunner().invoke(cli, ['dependencies', template_file])
+        assert result.exit_code == 0, result.output
+        assert 'estimated deploy 95 s' in result.output and '! unexplained Bucket -> Stream, +25 s' in result.output
+        result = CliRunner().invoke(cli, ['dependencies', template_file, '--strict', '--json', '-e', 'AWS::S3::Bucket=60'])
+        assert result.exit_code == 1
+        assert json.loads(result.output[:result.output.rindex('}') + 1])[template_file]['EstimatedSeconds'] == 130
+        assert CliRunner().invoke(cli, ['dependencies', '--strict']).exit_code == 0
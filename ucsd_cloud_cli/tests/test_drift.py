@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.common import template_hashes, serialize_template, validate_tempalte, TEMPLATE_HASHES
+from ucsd_cloud_cli.drift import detect, compare, IN_SYNC, DRIFTED, FAILED, METADATA, TEMPLATE
+from ucsd_cloud_cli.logs.source import source_template
+from ucsd_cloud_cli.validator import template_json
+from .fakes import FakeCloudFormationClient
+
+KEY = ('dev', 'us-west-2')
+
+
+class TestDrift(unittest.TestCase):
+
+    def setUp(self):
+        self.expected = json.loads(template_json(source_template()))
+        drifted = copy.deepcopy(self.expected)
+        del drifted['Metadata'][TEMPLATE_HASHES]
+        drifted['Parameters']['LogGroupRetentionInDays']['Default'] = 7
+        drifted['Resources']['PrimaryLogStream']['Properties']['LogStreamName'] = 'Other'
+        drifted['Resources']['Extra'] = {'Type': 'AWS::Logs::LogGroup'}
+        del drifted['Resources']['SecurityLogShippingFilter']
+        legacy = copy.deepcopy(self.expected)
+        del legacy['Metadata'][TEMPLATE_HASHES]
+        edited = copy.deepcopy(self.expected)
+        edited['Resources']['SecurityLogShippingGroup']['Properties']['RetentionInDays'] = 30
+        self.cloudformation = FakeCloudFormationClient(templates={'seimLogSource-a': self.expected,
+                                                                  'seimLogSource-b': serialize_template(drifted),
+                                                                  'seimLogSource-c': legacy,
+                                                                  'seimLogSource-d': edited,
+                                                                  'seimLogAggregationStack': {'Resources': {}}})
+
+    def test_template_hashes(self):
+        """Test to make sure a change only reaches the root through the hashes above it and the stored hashes validate the template"""
+        hashes = template_hashes(self.expected)
+        assert hashes == dict((k, v) for k, v in self.expected['Metadata'][TEMPLATE_HASHES].items() if k != 'Version')
+        changed = copy.deepcopy(self.expected)
+        changed['Resources']['PrimaryLogStream']['Properties']['LogStreamName'] = 'Other'
+        changed_hashes = template_hashes(changed)
+        assert changed_hashes['Root'] != hashes['Root'] and changed_hashes['Sections']['Resources'] != hashes['Sections']['Resources']
+        assert [name for name in hashes['Resources'] if hashes['Resources'][name] != changed_hashes['Resources'][name]] == ['PrimaryLogStream']
+        assert dict(changed_hashes['Sections'], Resources=None) == dict(hashes['Sections'], Resources=None)
+
+        assert self.expected['Description'].endswith('|' + hashes['Root']) and validate_tempalte(json.dumps(self.expected))
+        self.assertRaises(ValueError, validate_tempalte, json.dumps(dict(changed, Metadata=self.expected['Metadata'])))
+
+    def test_compare(self):
+        """Test to make sure only the sections and resources that differ are reported"""
+        assert compare(template_hashes(self.expected), template_hashes(self.expected)) is None
+        diff = compare(template_hashes(self.expected), template_hashes(self.cloudformation.templates['seimLogSource-b']))
+        assert diff == {'Sections': ['Parameters'], 'Add': ['SecurityLogShippingFilter'], 'Remove': ['Extra'], 'Modify': ['PrimaryLogStream']}
+
+    def test_detect(self):
+        """Test to make sure only the template summaries are fetched for stacks with stored hashes, and full templates only without them or when verifying"""
+        results = dict((result['Stack'], result) for result in detect({KEY: self.cloudformation}, self.expected, ['seimLogSource-*']))
+        assert sorted(results) == ['seimLogSource-a', 'seimLogSource-b', 'seimLogSource-c', 'seimLogSource-d']
+        assert [(name, results[name]['Status'], results[name]['Source']) for name in sorted(results)] == [('seimLogSource-a', IN_SYNC, METADATA),
+                                                                                                          ('seimLogSource-b', DRIFTED, METADATA),
+                                                                                                          ('seimLogSource-c', IN_SYNC, TEMPLATE),
+                                                                                                          ('seimLogSource-d', IN_SYNC, METADATA)]
+        assert results['seimLogSource-a']['Version'] == '0.1.0' and results['seimLogSource-b']['Diff']['Modify'] == ['PrimaryLogStream']
+        assert [call[1]['StackName'] for call in self.cloudformation.calls if call[0] == 'get_template'] == ['seimLogSource-c']
+        assert self.cloudformation.call_count('get_template_summary') == 4
+
+        results = dict((result['Stack'], result) for result in detect({KEY: self.cloudformation}, self.expected, ['seimLogSource-d'], verify=True))
+        assert results['seimLogSource-d']['Status'] == DRIFTED and results['seimLogSource-d']['Diff']['Modify'] == ['SecurityLogShippingGroup']
+
+        # YAML templates can't be hashed
+        self.cloudformation.templates['seimLogSource-a'] = 'AWSTemplateFormatVersion: 2010-09-09'
+        assert detect({KEY: self.cloudformation}, self.expected, ['seimLogSource-a'], verify=True)[0]['Status'] == FAILED
+
+    def test_drift_command(self):
+        """Test to make sure `drift` lists the diverged resources of the drifted stacks and fails"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        template_file = os.path.join(work_dir, 'log_sources.json')
+        with open(template_file, 'w') as f:
+            json.dump(self.expected, f)
+        with mock.patch('ucsd_cloud_cli.templates.get_boto3_clients', return_value={KEY: self.cloudformation}):
+            result = CliRunner().invoke(cli, ['drift', template_file, '-s', 'seimLogSource-[ab]'])
+            assert result.exit_code == 1
+            assert 'seimLogSource-b' in result.output and '    modify  PrimaryLogStream' in result.output and '    section Parameters' in result.output
+            assert '2 stack(s) checked: 1 in sync, 1 drifted, 0 error(s)' in result.output
+
+            result = CliRunner().invoke(cli, ['drift', template_file, '-s', 'seimLogSource-a', '--json'])
+            assert result.exit_code == 0, result.output
+            assert json.loads(result.output[:result.output.rindex(']') + 1])[0]['Status'] == IN_SYNC
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import datetime
+import json
+import unittest
+from click.testing import CliRunner
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.archive import (cloudtrail_key, flow_log_key, firehose_key, format_projection_date, resolve_location_template,
+                                         render_value)
+
+ACCOUNTS = ['802640662990', '969379222189']
+REFS = {'LogDeliveryBucket': 'central-logs', 'LogS3DeliveryBucket': 'firehose-logs', 'CloudTrailKeyPrefix': '', 'HasCloudTrailKeyPrefix': False}
+WHEN = datetime.datetime(2018, 2, 24, 17, 42, 5)
+
+
+class TestLogArchive(unittest.TestCase):
+
+    def setUp(self):
+        result = CliRunner().invoke(cli, ['target', 'generate', '--dry-run', '--glue-catalog', '--firehose-transform',
+                                          '-a', ACCOUNTS[0], '-a', ACCOUNTS[1], '-r', 'us-west-2', '-r', 'us-east-1'])
+        assert result.exit_code == 0
+        self.resources = json.loads(result.output)['Resources']
+
+    def _resolve(self, table_name, when, refs=REFS, **values):
+        """Resolve a table's projection template the way Athena does for a single partition"""
+        parameters = self.resources[table_name]['Properties']['TableInput']['Parameters']
+        values['dt'] = format_projection_date(parameters['projection.dt.format'], when)
+        return resolve_location_template(render_value(parameters['storage.location.template'], refs), values)
+
+    def _projected(self, table_name, column):
+        return self.resources[table_name]['Properties']['TableInput']['Parameters']['projection.%s.values' % column].split(',')
+
+    def test_cloudtrail_projection_matches_trail_keys(self):
+        """Test to make sure every projected CloudTrail partition resolves to the prefix CloudTrail writes log files under"""
+        for account in self._projected('CloudTrailTable', 'account'):
+            for region in self._projected('CloudTrailTable', 'region'):
+                location = self._resolve('CloudTrailTable', WHEN, account=account, region=region)
+                assert ('s3://central-logs/' + cloudtrail_key(account, region, WHEN)).startswith(location + '/')
+        assert self._projected('CloudTrailTable', 'account') == ACCOUNTS
+
+    def test_cloudtrail_projection_with_key_prefix(self):
+        """Test to make sure a CloudTrailKeyPrefix is separated from the bucket name in the CloudTrail table locations"""
+        refs = dict(REFS, CloudTrailKeyPrefix='trail', HasCloudTrailKeyPrefix=True)
+        location = self._resolve('CloudTrailTable', WHEN, refs, account=ACCOUNTS[0], region='us-west-2')
+        assert ('s3://central-logs/' + cloudtrail_key(ACCOUNTS[0], 'us-west-2', WHEN, prefix='trail')).startswith(location + '/')
+        storage_location = self.resources['CloudTrailTable']['Properties']['TableInput']['StorageDescriptor']['Location']
+        assert render_value(storage_location, refs) == 's3://central-logs/trail/AWSLogs/'
+        assert render_value(storage_location, REFS) == 's3://central-logs/AWSLogs/'
+
+    def test_flow_log_projection_matches_delivery_keys(self):
+        """Test to make sure projected VPC flow log partitions resolve to the S3 flow log delivery prefix"""
+        location = self._resolve('VPCFlowLogTable', WHEN, account=ACCOUNTS[1], region='us-east-1')
+        assert ('s3://central-logs/' + flow_log_key(ACCOUNTS[1], 'us-east-1', WHEN)).startswith(location + '/')
+
+    def test_firehose_projection_matches_delivery_keys(self):
+        """Test to make sure projected Firehose partitions resolve to the hourly prefix Firehose writes batches under"""
+        location = self._resolve('FirehoseLogTable', WHEN)
+        assert location == 's3://firehose-logs/firehose/2018/02/24/17'
+        assert ('s3://firehose-logs/' + firehose_key(WHEN)).startswith(location + '/')
+
+    def test_projection_range_uses_projection_format(self):
+        """Test to make sure the projection range start parses with the projection date format"""
+        for table_name in ['CloudTrailTable', 'VPCFlowLogTable', 'FirehoseLogTable']:
+            parameters = self.resources[table_name]['Properties']['TableInput']['Parameters']
+            start = parameters['projection.dt.range'].split(',')[0]
+            python_format = parameters['projection.dt.format'].replace('yyyy', '%Y').replace('MM', '%m').replace('dd', '%d').replace('HH', '%H')
+            assert datetime.datetime.strptime(start, python_format)
+
+    def test_firehose_table_requires_transform(self):
+        """Test to make sure the Firehose table is only generated when Firehose writes readable newline-delimited events"""
+        result = CliRunner().invoke(cli, ['target', 'generate', '--dry-run', '--glue-catalog'])
+        resources = json.loads(result.output)['Resources']
+        assert 'CloudTrailTable' in resources and 'FirehoseLogTable' not in resources
+        assert resources['CloudTrailTable']['Properties']['TableInput']['Parameters']['projection.account.type'] == 'injected'
@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+
+import binascii
+import datetime
+import gzip
+import hashlib
+import json
+import random
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.archive import cloudtrail_key, cloudtrail_digest_key
+from ucsd_cloud_cli.logs.integrity import parse_public_key, verify_signature, signing_string, list_digests, verify, MISSING, MODIFIED, INVALID_SIGNATURE
+from ucsd_cloud_cli.logs.cloudtrail import find_chains
+from .fakes import FakeS3Client, FakeCloudTrailClient
+
+BUCKET = 'ucsd-log-delivery'
+TRAIL = 'SecurityTrail-us-west-2'
+ACCOUNTS = ['802640662990', '969379222189']
+START = datetime.datetime(2018, 2, 24, 0, 0)
+SMALL_PRIMES = [p for p in range(3, 1000) if all(p % d for d in range(2, int(p ** 0.5) + 1))]
+
+
+def _is_probable_prime(n, rng):
+    if any(n % p == 0 for p in SMALL_PRIMES):
+        return n in SMALL_PRIMES
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(20):
+        x = pow(rng.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits, rng):
+    while True:
+        candidate = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _is_probable_prime(candidate, rng):
+            return candidate
+
+
+def _inverse(a, m):
+    old_r, r, old_s, s = a, m, 1, 0
+    while r:
+        q = old_r // r
+        old_r, r, old_s, s = r, old_r - q * r, s, old_s - q * s
+    return old_s % m
+
+
+def _der_integer(value):
+    body = value.to_bytes(value.bit_length() // 8 + 1, 'big')
+    return _der(0x02, body)
+
+
+def _der(tag, body):
+    length = bytes([len(body)]) if len(body) < 0x80 else bytes([0x82]) + len(body).to_bytes(2, 'big')
+    return bytes([tag]) + length + body
+
+
+def make_key(seed, bits=1024, e=65537):
+    """Fixture RSA key pair - the DER PKCS#1 public key ListPublicKeys would return, and a signing function using the private exponent"""
+    rng = random.Random(seed)
+    while True:
+        p, q = _prime(bits // 2, rng), _prime(bits // 2, rng)
+        if p != q and (p - 1) % e and (q - 1) % e:
+            break
+    n, d = p * q, _inverse(e, (p - 1) * (q - 1))
+    size = (n.bit_length() + 7) // 8
+
+    def _sign(message):
+        suffix = bytes(bytearray.fromhex('3031300d060960864801650304020105000420')) + hashlib.sha256(message).digest()
+        encoded = b'\x00\x01' + b'\xff' * (size - len(suffix) - 3) + b'\x00' + suffix
+        return pow(int.from_bytes(encoded, 'big'), d, n).to_bytes(size, 'big')
+
+    der = _der(0x30, _der_integer(n) + _der_integer(e))
+    return {'Value': der, 'Fingerprint': hashlib.md5(der).hexdigest()}, _sign
+
+
+def write_trail(s3, account_id, region, hours, key, sign, files_per_hour=3, prefix=''):
+    """Write `hours` hours of gzipped CloudTrail log files and the signed, chained digest file for each hour into the fake bucket"""
+    previous = None
+    for hour in range(hours):
+        end = START + datetime.timedelta(hours=hour + 1)
+        log_files = []
+        for index in range(files_per_hour):
+            when = end - datetime.timedelta(minutes=5 * (index + 1))
+            log_key = cloudtrail_key(account_id, region, when, prefix).replace('a1b2c3d4e5f6g7h8', '%016x' % (hour * 100 + index))
+            content = json.dumps({'Records': [{'eventTime': when.isoformat(), 'eventName': 'DescribeInstances', 'n': n} for n in range(200)]}).encode('utf-8')
+            s3.objects['%s/%s' % (BUCKET, log_key)] = gzip.compress(content)
+            log_files.append({'s3Bucket': BUCKET, 's3Object': log_key, 'hashValue': hashlib.sha256(content).hexdigest(), 'hashAlgorithm': 'SHA-256'})
+
+        digest_key = cloudtrail_digest_key(account_id, region, end, TRAIL, 'us-west-2', prefix)
+        digest = {'awsAccountId': account_id,
+                  'digestStartTime': (end - datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                  'digestEndTime': end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                  'digestS3Bucket': BUCKET,
+                  'digestS3Object': digest_key,
+                  'digestPublicKeyFingerprint': key['Fingerprint'],
+                  'digestSignatureAlgorithm': 'SHA256withRSA',
+                  'previousDigestS3Bucket': BUCKET if previous else None,
+                  'previousDigestS3Object': previous[0] if previous else None,
+                  'previousDigestHashValue': hashlib.sha256(previous[1]).hexdigest() if previous else None,
+                  'previousDigestHashAlgorithm': 'SHA-256' if previous else None,
+                  'previousDigestSignature': previous[2] if previous else None,
+                  'logFiles': log_files}
+        raw = json.dumps(digest).encode('utf-8')
+        signature = binascii.hexlify(sign(signing_string(digest, raw))).decode('ascii')
+        s3.objects['%s/%s' % (BUCKET, digest_key)] = gzip.compress(raw)
+        s3.metadata['%s/%s' % (BUCKET, digest_key)] = {'signature': signature, 'signature-algorithm': 'SHA256withRSA'}
+        previous = (digest_key, raw, signature)
+
+
+class TestLogCloudTrail(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key, sign = make_key(0)
+        cls.sign = staticmethod(sign)
+        cls.other_key, _ = make_key(1)
+
+    def setUp(self):
+        self.s3 = FakeS3Client(page_size=7)
+        for account_id in ACCOUNTS:
+            write_trail(self.s3, account_id, 'us-west-2', 6, self.key, self.sign)
+
+    def _verify(self, start=START, end=START + datetime.timedelta(hours=6)):
+        chains = find_chains(self.s3, BUCKET, start=start, end=end)
+        return verify(self.s3, BUCKET, chains, {'us-west-2': {self.key['Fingerprint']: parse_public_key(self.key['Value'])}}, workers=8)
+
+    def _digest_keys(self, account_id=ACCOUNTS[0]):
+        return list_digests(self.s3, BUCKET, '', account_id, 'us-west-2')[TRAIL]
+
+    def test_signature(self):
+        """Test to make sure the pure Python SHA256withRSA check accepts a valid signature and rejects tampering or the wrong key"""
+        public_key = parse_public_key(self.key['Value'])
+        signature = self.sign(b'digest')
+        assert verify_signature(public_key, b'digest', signature)
+        assert not verify_signature(public_key, b'digest!', signature)
+        assert not verify_signature(parse_public_key(self.other_key['Value']), b'digest', signature)
+
+    def test_trail_enables_validation(self):
+        """Test to make sure `source generate` turns on log file validation for the SecurityTrail by default"""
+        template = json.loads(CliRunner().invoke(cli, ['source', 'generate', '--dry-run']).output)
+        assert template['Resources']['SecurityTrail']['Properties']['EnableLogFileValidation'] == {'Ref': 'CloudTrailLogFileValidation'}
+        assert template['Parameters']['CloudTrailLogFileValidation']['Default'] == 'true'
+
+    def test_list_digests_window(self):
+        """Test to make sure digests are listed per trail in order and only within the requested period"""
+        chains = find_chains(self.s3, BUCKET, start=START + datetime.timedelta(hours=2), end=START + datetime.timedelta(hours=4))
+        assert sorted(chains) == [(account_id, 'us-west-2', TRAIL) for account_id in ACCOUNTS]
+        assert [key[-24:-11] for key in chains[(ACCOUNTS[0], 'us-west-2', TRAIL)]] == ['20180224T0200', '20180224T0300', '20180224T0400']
+
+    def test_intact_archive(self):
+        """Test to make sure an untouched archive verifies cleanly with every log file hashed"""
+        result = self._verify()
+        assert result['Problems'] == []
+        assert result['Stats']['Digests'] == 12 and result['Stats']['LogFiles'] == 36
+        assert result['Stats']['BytesHashed'] > result['Stats']['BytesRead'] > 0
+
+    def test_modified_and_missing_log_files(self):
+        """Test to make sure a rewritten log file is reported as modified and a deleted one as missing"""
+        log_keys = sorted(k for k in self.s3.objects if '/CloudTrail/' in k and ACCOUNTS[1] in k)
+        self.s3.objects[log_keys[0]] = gzip.compress(b'{"Records": []}')
+        del self.s3.objects[log_keys[5]]
+        problems = self._verify()['Problems']
+        assert [(p['Kind'], p['Status'], p['Key']) for p in problems] == [('log', MODIFIED, log_keys[0].split('/', 1)[1]), ('log', MISSING, log_keys[5].split('/', 1)[1])]
+
+    def test_deleted_digest_breaks_chain(self):
+        """Test to make sure a digest removed from the middle of the chain is reported missing"""
+        digest_keys = self._digest_keys()
+        del self.s3.objects['%s/%s' % (BUCKET, digest_keys[2])]
+        problems = self._verify()['Problems']
+        assert [(p['Kind'], p['Status'], p['Key']) for p in problems] == [('digest', MISSING, digest_keys[2])]
+
+    def test_tampered_digest(self):
+        """Test to make sure a digest rewritten to cover a tampered log file fails its signature and the chain"""
+        digest_keys = self._digest_keys()
+        path = '%s/%s' % (BUCKET, digest_keys[1])
+        digest = json.loads(gzip.decompress(self.s3.objects[path]).decode('utf-8'))
+        digest['logFiles'] = digest['logFiles'][1:]
+        self.s3.objects[path] = gzip.compress(json.dumps(digest).encode('utf-8'))
+        problems = self._verify()['Problems']
+        assert sorted((p['Status'], p['Key']) for p in problems) == [('broken chain', digest_keys[1]), (INVALID_SIGNATURE, digest_keys[1])]
+
+    def test_verify_command(self):
+        """Test to make sure `cloudtrail verify` fetches the region's public keys, reports throughput and fails when a log file was modified"""
+        cloudtrail = FakeCloudTrailClient([self.other_key, self.key])
+        clients = {'s3': self.s3, 'cloudtrail': cloudtrail}
+        with mock.patch('ucsd_cloud_cli.logs.cloudtrail.get_boto3_client', side_effect=lambda name, *args: clients[name]):
+            result = CliRunner().invoke(cli, ['cloudtrail', 'verify', '-b', BUCKET, '--start-time', '2018-02-24', '--end-time', '2018-02-24T06:00'])
+            assert result.exit_code == 0, result.output
+            assert 'Verified 12 digest(s) and 36 log file(s)' in result.output and 'MB/s' in result.output
+            assert cloudtrail.call_count('list_public_keys') == 2
+
+            log_key = sorted(k for k in self.s3.objects if '/CloudTrail/' in k)[0]
+            self.s3.objects[log_key] = gzip.compress(b'tampered')
+            result = CliRunner().invoke(cli, ['cloudtrail', 'verify', '-b', BUCKET, '-a', ACCOUNTS[0], '--start-time', '2018-02-24', '--end-time', '2018-02-24T06:00', '--json'])
+        assert result.exit_code == 1
+        report = json.loads(result.output[:result.output.rindex('}') + 1])
+        assert [p['Status'] for p in report['Problems']] == [MODIFIED] and len(report['Chains']) == 1
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from ucsd_cloud_cli.logs.coverage import (scan, apply_subscriptions, generate_templates, match_rules, _missing, DEFAULT_INCLUDE_RULES,
+                                          MAX_RESOURCES_PER_TEMPLATE, STATUS_SUBSCRIBED, STATUS_MISSING, STATUS_OTHER)
+from ucsd_cloud_cli.common import read_cache, write_cache
+from .fakes import FakeLogsClient
+
+DESTINATION = 'arn:aws:logs:us-west-2:111111111111:destination:CWLtoKinesisDestination'
+
+
+class TestLogCoverage(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        patcher = mock.patch('ucsd_cloud_cli.common.cache_dir', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.clients = {
+            ('dev', 'us-west-2'): FakeLogsClient({
+                'SecurityLogShippingGroup': [{'destinationArn': DESTINATION}],
+                '/aws/vpc/flowlogs': [],
+                '/aws/lambda/noisy': [],
+                '/var/log/secure': [{'destinationArn': 'arn:aws:lambda:us-west-2:222222222222:function:other'}]}),
+            ('prod', 'us-east-1'): FakeLogsClient({'/aws/cloudtrail/trail': [], 'application': []})}
+
+    def test_match_rules(self):
+        """Test to make sure include rules select and exclude rules veto"""
+        assert match_rules('/aws/vpc/flowlogs', DEFAULT_INCLUDE_RULES)
+        assert not match_rules('/aws/lambda/noisy', DEFAULT_INCLUDE_RULES)
+        assert not match_rules('/aws/vpc/flowlogs', ['/aws/vpc/*'], ['*flowlogs'])
+
+    def test_scan_classifies_groups(self):
+        """Test to make sure every account/region is scanned and groups are classified against the destination"""
+        results = scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        dev = results[('dev', 'us-west-2')]
+        assert dev['total'] == 4
+        assert dev['groups']['SecurityLogShippingGroup']['status'] == STATUS_SUBSCRIBED
+        assert dev['groups']['/aws/vpc/flowlogs']['status'] == STATUS_MISSING
+        assert dev['groups']['/var/log/secure']['status'] == STATUS_OTHER
+        assert '/aws/lambda/noisy' not in dev['groups']
+        assert list(results[('prod', 'us-east-1')]['groups']) == ['/aws/cloudtrail/trail']
+
+    def test_scan_cache_skips_known_groups(self):
+        """Test to make sure a second run only looks up subscription filters for log groups it hasn't seen subscribed before"""
+        scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        dev = self.clients[('dev', 'us-west-2')]
+        assert dev.call_count('describe_subscription_filters') == 3
+
+        dev.log_groups['/aws/guardduty/findings'] = []
+        results = scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        assert dev.call_count('describe_subscription_filters') == 6
+        assert results[('dev', 'us-west-2')]['groups']['/aws/vpc/flowlogs']['status'] == STATUS_MISSING
+
+    def test_scan_cache_keeps_only_subscribed_groups(self):
+        """Test to make sure groups subscribed outside of `apply` (e.g. by a deployed coverage stack) are picked up, and scans with and without a destination don't evict each other's cache"""
+        scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        dev = self.clients[('dev', 'us-west-2')]
+        dev.log_groups['/aws/vpc/flowlogs'] = [{'destinationArn': DESTINATION}]
+        results = scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        assert results[('dev', 'us-west-2')]['groups']['/aws/vpc/flowlogs']['status'] == STATUS_SUBSCRIBED
+        assert dev.call_count('describe_subscription_filters') == 5
+
+        scan(self.clients, DEFAULT_INCLUDE_RULES)
+        assert dev.call_count('describe_subscription_filters') == 8
+        scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        assert dev.call_count('describe_subscription_filters') == 9
+        scan(self.clients, DEFAULT_INCLUDE_RULES)
+        assert dev.call_count('describe_subscription_filters') == 9
+
+    def test_concurrent_cache_writes(self):
+        """Test to make sure concurrent writers, e.g. commands run by `serve`, each replace the cache whole without tripping over each other's temporary file"""
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(lambda n: write_cache('coverage.json', {'writer': n, 'padding': 'x' * 100000}), range(64)))
+        assert read_cache('coverage.json')['writer'] in range(64) and os.listdir(self.cache_dir) == ['coverage.json']
+
+    def test_apply_subscribes_missing_groups(self):
+        """Test to make sure applying subscribes only the missing groups and the next scan finds them subscribed"""
+        missing = _missing(scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION))
+        assert missing == [(('dev', 'us-west-2'), '/aws/vpc/flowlogs'), (('prod', 'us-east-1'), '/aws/cloudtrail/trail')]
+        assert apply_subscriptions(self.clients, missing, DESTINATION) == []
+        assert self.clients[('dev', 'us-west-2')].log_groups['/aws/vpc/flowlogs'][0]['destinationArn'] == DESTINATION
+
+        results = scan(self.clients, DEFAULT_INCLUDE_RULES, destination_arn=DESTINATION)
+        assert _missing(results) == []
+
+    def test_generate_templates_split(self):
+        """Test to make sure generated templates subscribe each group and respect the per-template resource limit"""
+        names = ['/aws/vpc/group-%d' % i for i in range(MAX_RESOURCES_PER_TEMPLATE + 1)]
+        templates = generate_templates(names)
+        assert len(templates) == 2
+        resources = json.loads(templates[0].to_json())['Resources']
+        assert len(resources) == MAX_RESOURCES_PER_TEMPLATE
+        assert all(r['Type'] == 'AWS::Logs::SubscriptionFilter' for r in resources.values())
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+
+import json
+import os
+import tempfile
+import unittest
+from click.testing import CliRunner
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.filters import compile_pattern, evaluate, FilterPatternError, FILTER_PROFILES
+
+FLOW_ACCEPT = '2 123456789010 eni-1235b8ca 172.31.16.139 172.31.16.21 20641 22 6 20 4249 1418530010 1418530070 ACCEPT OK'
+FLOW_REJECT = '2 123456789010 eni-1235b8ca 172.31.9.69 172.31.9.12 49761 3389 6 20 4249 1418530010 1418530070 REJECT OK'
+FLOW_NODATA = '2 123456789010 eni-1235b8ca - - - - - - - 1431280876 1431280934 - NODATA'
+CT_READ = json.dumps({'eventName': 'DescribeInstances', 'readOnly': True, 'userIdentity': {'type': 'IAMUser'}})
+CT_DENIED = json.dumps({'eventName': 'RunInstances', 'readOnly': False, 'errorCode': 'Client.UnauthorizedOperation', 'requestParameters': {'instancesSet': {'items': [{'imageId': 'ami-1'}]}}})
+
+
+class TestLogFilters(unittest.TestCase):
+
+    def test_term_patterns(self):
+        """Test to make sure plain, optional (?), excluded (-) and quoted terms behave like CloudWatch Logs"""
+        assert compile_pattern('ERROR')('2018-02-13 ERROR something broke')
+        assert not compile_pattern('ERROR Exiting')('ERROR something broke')
+        assert compile_pattern('?WARN ?ERROR')('WARN disk at 80%')
+        assert not compile_pattern('ERROR -Retrying')('ERROR Retrying request')
+        assert compile_pattern('"Failed password"')('sshd[1]: Failed password for root')
+        assert compile_pattern('')('anything at all')
+
+    def test_json_patterns(self):
+        """Test to make sure JSON selectors, wildcards, booleans, existence checks and logical operators are evaluated"""
+        assert compile_pattern('{ $.readOnly IS FALSE }')(CT_DENIED)
+        assert not compile_pattern('{ $.readOnly IS FALSE }')(CT_READ)
+        assert compile_pattern('{ ($.errorCode = "*UnauthorizedOperation") || ($.errorCode = "AccessDenied*") }')(CT_DENIED)
+        assert compile_pattern('{ $.requestParameters.instancesSet.items[0].imageId = "ami-1" }')(CT_DENIED)
+        assert compile_pattern('{ $.errorCode NOT EXISTS }')(CT_READ)
+        assert not compile_pattern('{ $.eventName = "Describe*" && $.readOnly IS FALSE }')(CT_READ)
+        assert not compile_pattern('{ $.eventName = "Describe*" }')('not json at all')
+
+    def test_space_delimited_patterns(self):
+        """Test to make sure space-delimited fields bind positionally, honor ... and apply numeric and string conditions"""
+        assert compile_pattern(FILTER_PROFILES['vpc_flow_logs']['reject'])(FLOW_REJECT)
+        assert not compile_pattern(FILTER_PROFILES['vpc_flow_logs']['reject'])(FLOW_ACCEPT)
+        assert not compile_pattern(FILTER_PROFILES['vpc_flow_logs']['no_nodata'])(FLOW_NODATA)
+        assert compile_pattern(FILTER_PROFILES['vpc_flow_logs']['admin_ports'])(FLOW_ACCEPT)
+        assert compile_pattern('[..., bytes > 4000, start, end, action, status]')(FLOW_ACCEPT)
+        assert not compile_pattern('[..., bytes < 4000, start, end, action, status]')(FLOW_ACCEPT)
+        assert compile_pattern('[ip, user, ts, request = "GET *", status_code = 4*, bytes]')('10.0.0.1 - [10/Oct/2000:13:55:36] "GET /a.html HTTP/1.0" 404 2326')
+        assert not compile_pattern('[a, b]')('only one field here')
+
+    def test_library_patterns_parse(self):
+        """Test to make sure every pattern in the profile library compiles"""
+        for profiles in FILTER_PROFILES.values():
+            for pattern in profiles.values():
+                compile_pattern(pattern)
+        with self.assertRaises(FilterPatternError):
+            compile_pattern('{ $.eventName = }')
+
+    def test_evaluate_reports_reduction(self):
+        """Test to make sure evaluation reports match rate and byte reduction"""
+        stats = evaluate(FILTER_PROFILES['vpc_flow_logs']['reject'], [FLOW_ACCEPT, FLOW_REJECT, FLOW_NODATA, FLOW_ACCEPT])
+        assert stats['events'] == 4 and stats['matched'] == 1
+        assert stats['match_rate'] == 0.25
+        assert 0.7 < stats['byte_reduction'] < 0.8
+
+    def test_evaluate_command(self):
+        """Test to make sure the `filter evaluate` command evaluates every profile of a log type over sample files"""
+        fd, path = tempfile.mkstemp(suffix='.log')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join([FLOW_ACCEPT, FLOW_REJECT, FLOW_NODATA]) + '\n')
+        result = CliRunner().invoke(cli, ['filter', 'evaluate', '--log-type', 'vpc_flow_logs', '--json', path])
+        assert result.exit_code == 0
+        stats = dict((r['profile'], r) for r in json.loads(result.output))
+        assert stats['all']['matched'] == 3
+        assert stats['reject']['matched'] == 1
+        assert stats['no_nodata']['matched'] == 2
+
+    def test_source_generate_filter_profile(self):
+        """Test to make sure `source generate` uses the selected filter profile as the subscription filter default"""
+        result = CliRunner().invoke(cli, ['source', 'generate', '--dry-run', '--filter-profile', 'reject'])
+        assert result.exit_code == 0
+        template = json.loads(result.output)
+        assert template['Parameters']['LogShippingFilterPattern']['Default'] == FILTER_PROFILES['vpc_flow_logs']['reject']
+        assert template['Resources']['SecurityLogShippingFilter']['Properties']['FilterPattern'] == {'Ref': 'LogShippingFilterPattern'}
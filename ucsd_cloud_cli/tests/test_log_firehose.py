@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+
+import base64
+import json
+import unittest
+from click.testing import CliRunner
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.common import load_lambda_module, read_lambda_source
+from ucsd_cloud_cli.logs.firehose import build_envelope, build_batch, replay, synthesize_batches, PROCESSOR_LAMBDA
+
+
+class TestLogFirehose(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = load_lambda_module(PROCESSOR_LAMBDA)
+
+    def test_transform_unpacks_and_drops_control_messages(self):
+        """Test to make sure DATA_MESSAGE envelopes become newline-delimited events and CONTROL_MESSAGE records are dropped"""
+        batch = build_batch([build_envelope('group', 'stream', ['first event', 'second event']),
+                             build_envelope('', '', ['CWL CONTROL MESSAGE'], message_type='CONTROL_MESSAGE'),
+                             b'not gzip data'])
+        records = self.processor.handler(batch, None)['records']
+        assert [r['result'] for r in records] == ['Ok', 'Dropped', 'ProcessingFailed']
+        assert base64.b64decode(records[0]['data']) == b'first event\nsecond event\n'
+        assert [r['recordId'] for r in records] == [r['recordId'] for r in batch['records']]
+
+    def test_transform_json_format(self):
+        """Test to make sure the JSON output format keeps the log group and stream metadata"""
+        line = self.processor.transform(build_envelope('group', 'stream', ['event']), json_format=True).decode('utf-8')
+        event = json.loads(line)
+        assert event['logGroup'] == 'group' and event['logStream'] == 'stream' and event['message'] == 'event'
+
+    def test_oversized_batches_are_reingested(self):
+        """Test to make sure records beyond the Lambda response limit are put back on the source stream instead of being returned"""
+        self.processor.MAX_RESPONSE_BYTES = 2000
+        batch = build_batch([build_envelope('group', 'stream', ['x' * 500]) for _ in range(5)])
+        reingested = []
+        records = self.processor.handler(batch, None, reingest=lambda arn, records: reingested.extend(records))['records']
+        assert [r['result'] for r in records] == ['Ok', 'Ok', 'Dropped', 'Dropped', 'Dropped']
+        assert [r['PartitionKey'] for r in reingested] == ['partition-2', 'partition-3', 'partition-4']
+        assert len(read_lambda_source(PROCESSOR_LAMBDA)) < 4096
+
+    def test_oversized_record_is_split(self):
+        """Test to make sure a record too big for any response on its own goes back as two records with half its events each, rather than unchanged"""
+        self.processor.MAX_RESPONSE_BYTES = 2000
+        batch = build_batch([build_envelope('group', 'stream', ['x' * 500] * 4), build_envelope('group', 'stream', ['y' * 2000])])
+        reingested = []
+        records = self.processor.handler(batch, None, reingest=lambda arn, records: reingested.extend(records))['records']
+        assert [r['result'] for r in records] == ['Dropped', 'ProcessingFailed']
+        assert records[1]['data'] == batch['records'][1]['data']
+        assert [r['PartitionKey'] for r in reingested] == ['partition-0', 'partition-0']
+
+        self.processor.MAX_RESPONSE_BYTES = 4000
+        records = self.processor.handler(build_batch([r['Data'] for r in reingested]), None, reingest=None)['records']
+        assert [base64.b64decode(r['data']) for r in records] == [b'x' * 500 + b'\n' + b'x' * 500 + b'\n'] * 2
+
+    def test_failed_records_count_towards_response_limit(self):
+        """Test to make sure the original data returned for ProcessingFailed records counts towards the response limit and is left out once it doesn't fit"""
+        self.processor.MAX_RESPONSE_BYTES = 3000
+        batch = build_batch([b'not gzip data' * 60] * 6 + [build_envelope('group', 'stream', ['x' * 500])])
+        reingested = []
+        response = self.processor.handler(batch, None, reingest=lambda arn, records: reingested.extend(records))
+        assert [r['result'] for r in response['records']] == ['ProcessingFailed'] * 6 + ['Dropped']
+        assert [bool(r.get('data')) for r in response['records']][:6] == [True, True, False, False, False, False]
+        assert len(json.dumps(response)) <= 3000 and [r['PartitionKey'] for r in reingested] == ['partition-6']
+
+    def test_replay_reports_throughput(self):
+        """Test to make sure the local harness reports throughput and byte ratio over synthetic batches"""
+        stats = replay(synthesize_batches(batches=2, records=20, events_per_record=5, control_ratio=0.2))
+        assert stats['records'] == 40
+        assert stats['ok'] + stats['dropped'] == 40 and stats['dropped'] > 0
+        assert stats['records_per_second'] > 0 and stats['output_input_ratio'] > 0
+
+    def test_target_generate_with_transform(self):
+        """Test to make sure `target generate --firehose-transform` wires the bundled Lambda into the delivery stream"""
+        result = CliRunner().invoke(cli, ['target', 'generate', '--dry-run', '--firehose-transform'])
+        assert result.exit_code == 0
+        resources = json.loads(result.output)['Resources']
+        destination = resources['LogToS3DeliveryStream']['Properties']['ExtendedS3DestinationConfiguration']
+        parameters = destination['ProcessingConfiguration']['Processors'][0]['Parameters']
+        assert parameters[0]['ParameterValue'] == {'Fn::GetAtt': ['LogProcessorFunction', 'Arn']}
+        assert 'def handler' in resources['LogProcessorFunction']['Properties']['Code']['ZipFile']
@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+import datetime
+import json
+import unittest
+from click.testing import CliRunner
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.archive import flow_log_key, format_projection_date, resolve_location_template, render_value
+
+ACCOUNTS = ['802640662990', '969379222189']
+REFS = {'LogDeliveryBucket': 'central-logs', 'LogS3DeliveryBucket': 'firehose-logs', 'CloudTrailKeyPrefix': ''}
+WHEN = datetime.datetime(2018, 2, 24, 17, 42, 5)
+
+
+class TestFlowLogToS3(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def _target(self, *args):
+        result = self.runner.invoke(cli, ['target', 'generate', '--dry-run', '--flow-logs-to-s3', '-a', ACCOUNTS[0], '-a', ACCOUNTS[1]] + list(args))
+        assert result.exit_code == 0, result.output
+        return json.loads(result.output)
+
+    def test_source_s3_destination(self):
+        """Test to make sure the S3 destination flow log carries the destination options and custom record format"""
+        result = self.runner.invoke(cli, ['source', 'flow_log', '--dry-run', '--destination', 's3', '--file-format', 'parquet', '--hive-partitions',
+                                          '--per-hour-partition', '--field', 'version', '--field', 'srcaddr', '--field', 'pkt-srcaddr'])
+        assert result.exit_code == 0, result.output
+        template = json.loads(result.output)
+        properties = template['Resources']['VPCFlowLog']['Properties']
+        assert properties['LogDestinationType'] == 's3'
+        assert properties['LogDestination'] == {'Ref': 'LogDestinationArn'}
+        assert properties['LogFormat'] == '${version} ${srcaddr} ${pkt-srcaddr}'
+        assert properties['DestinationOptions'] == {'FileFormat': 'parquet', 'HiveCompatiblePartitions': True, 'PerHourPartition': True}
+        assert 'LogGroupName' not in properties and 'DeliveryLogsPermissionArn' not in template['Parameters']
+
+    def test_source_destination_options_require_s3(self):
+        """Test to make sure S3-only options are rejected for the CloudWatch Logs destination"""
+        result = self.runner.invoke(cli, ['source', 'flow_log', '--dry-run', '--file-format', 'parquet'])
+        assert result.exit_code != 0
+
+    def test_target_bucket_policy(self):
+        """Test to make sure the log delivery service may write flow logs for each child account under both key layouts"""
+        template = self._target()
+        statements = template['Resources']['LogDeliveryBucketPolicy']['Properties']['PolicyDocument']['Statement']
+        delivery = [s for s in statements if s['Principal'] == {'Service': 'delivery.logs.amazonaws.com'}]
+        put = [s for s in delivery if s['Action'] == ['s3:PutObject']][0]
+        assert put['Condition']['StringEquals'] == {'s3:x-amz-acl': 'bucket-owner-full-control', 'aws:SourceAccount': ACCOUNTS}
+        prefixes = [r['Fn::Join'][1][1] + r['Fn::Join'][1][2] for r in put['Resource']]
+        assert prefixes == ['/AWSLogs/' + ACCOUNTS[0], '/AWSLogs/aws-account-id=' + ACCOUNTS[0], '/AWSLogs/' + ACCOUNTS[1], '/AWSLogs/aws-account-id=' + ACCOUNTS[1]]
+        assert any(s['Action'] == ['s3:GetBucketAcl', 's3:ListBucket'] for s in delivery)
+        assert 'LogDeliveryBucketArn' in template['Outputs']
+
+    def test_hourly_hive_parquet_projection(self):
+        """Test to make sure the Glue flow log table projects Hive-compatible hourly partitions onto the keys flow logs deliver Parquet files under"""
+        template = self._target('--glue-catalog', '--flow-log-file-format', 'parquet', '--flow-log-hive-partitions', '--flow-log-per-hour',
+                                '--flow-log-field', 'version', '--flow-log-field', 'account-id')
+        table = template['Resources']['VPCFlowLogTable']['Properties']['TableInput']
+        parameters = table['Parameters']
+        assert parameters['projection.dt.interval.unit'] == 'HOURS'
+        values = {'account': ACCOUNTS[0], 'region': 'us-west-2', 'dt': format_projection_date(parameters['projection.dt.format'], WHEN)}
+        location = resolve_location_template(render_value(parameters['storage.location.template'], REFS), values)
+        key = flow_log_key(ACCOUNTS[0], 'us-west-2', WHEN, file_format='parquet', hive_partitions=True, per_hour_partition=True)
+        assert ('s3://central-logs/' + key).startswith(location + '/')
+        assert key.endswith('.log.parquet')
+        assert 'Parquet' in table['StorageDescriptor']['SerdeInfo']['SerializationLibrary']
+        assert [c['Name'] for c in table['StorageDescriptor']['Columns']] == ['version', 'account_id']
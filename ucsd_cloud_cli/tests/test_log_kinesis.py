@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.common import load_lambda_module, read_lambda_source
+from ucsd_cloud_cli.logs.kinesis import SimulatedStream, simulate, storm_curve, load_curve, SCALER_LAMBDA, SHARD_BYTES_PER_SECOND, _environment
+from ucsd_cloud_cli.logs.target import target_template
+from ucsd_cloud_cli.validator import validate
+
+
+def alarm_event(alarm_name, state='ALARM'):
+    return {'Records': [{'Sns': {'Message': json.dumps({'AlarmName': alarm_name, 'NewStateValue': state})}}]}
+
+
+class TestLogKinesis(unittest.TestCase):
+
+    def setUp(self):
+        self.scaler = load_lambda_module(SCALER_LAMBDA)
+
+    def test_decide(self):
+        """Test to make sure the shard count doubles or halves within the bounds, and not at all while cooling down"""
+        assert self.scaler.decide(4, 'scale-out', None, 0, 1, 16, 600) == 8
+        assert self.scaler.decide(12, 'scale-out', None, 0, 1, 16, 600) == 16
+        assert self.scaler.decide(1, 'scale-in', 0, 600, 1, 16, 600) == 1
+        assert [self.scaler.desired_shards(shards, 'scale-in', 1, 16) for shards in [3, 5, 6]] == [2, 3, 3]
+        assert self.scaler.desired_shards(2, 'scale-out', 8, 16) == 4 and self.scaler.desired_shards(16, 'scale-in', 1, 4) == 8
+        assert self.scaler.decide(4, 'scale-in', 100, 600, 1, 16, 600) is None
+        assert self.scaler.direction('stack-LogStream-throttled-scale-out') == 'scale-out'
+        assert len(read_lambda_source(SCALER_LAMBDA)) < 4096
+
+    def test_handler(self):
+        """Test to make sure an alarm reshards the stream, moves the thresholds and resets the alarms - and only resets the alarm while the stream is cooling down or updating"""
+        stream = SimulatedStream(2, 'stack-LogStream', reshard_minutes=2)
+        for alarm in stream.alarms.values():
+            alarm.update(Threshold=1.0, StateValue='ALARM')
+        environment = {'STREAM_NAME': 'LogStream', 'ALARM_PREFIX': 'stack-LogStream', 'MIN_SHARDS': '1', 'MAX_SHARDS': '16', 'COOLDOWN_SECONDS': '600'}
+        with _environment(environment):
+            assert self.scaler.handler(alarm_event('stack-LogStream-scale-out', 'OK'), None, kinesis=stream, cloudwatch=stream) is None
+            assert self.scaler.handler(alarm_event('stack-LogStream-scale-out'), None, kinesis=stream, cloudwatch=stream, now=lambda: 60.0) == 4
+            assert stream.pending == (4, 2) and stream.tags == {'ccli:last-scaled': '60'}
+            assert stream.alarms['stack-LogStream-scale-out']['Threshold'] == 4 * 0.8 * 60 * SHARD_BYTES_PER_SECOND
+            assert stream.alarms['stack-LogStream-scale-in']['Threshold'] == 4 * 0.3 * 60 * SHARD_BYTES_PER_SECOND
+            assert stream.alarms['stack-LogStream-throttled-scale-out']['Threshold'] == 1.0
+            assert set(alarm['StateValue'] for alarm in stream.alarms.values()) == set(['OK'])
+
+            stream.alarms['stack-LogStream-scale-out']['StateValue'] = 'ALARM'
+            assert self.scaler.handler(alarm_event('stack-LogStream-scale-out'), None, kinesis=stream, cloudwatch=stream, now=lambda: 120.0) is None
+            assert stream.alarms['stack-LogStream-scale-out']['StateValue'] == 'OK'
+            stream.tick(2)
+            stream.alarms['stack-LogStream-scale-out']['StateValue'] = 'ALARM'
+            assert self.scaler.handler(alarm_event('stack-LogStream-scale-out'), None, kinesis=stream, cloudwatch=stream, now=lambda: 300.0) is None
+            assert stream.alarms['stack-LogStream-scale-out']['StateValue'] == 'OK'
+            assert self.scaler.handler(alarm_event('stack-LogStream-scale-in'), None, kinesis=stream, cloudwatch=stream, now=lambda: 660.0) == 2
+        assert stream.reshards == 2 and 'STREAM_NAME' not in os.environ
+        stream.tick(20)
+        self.assertRaises(ValueError, stream.update_shard_count, 'LogStream', 5, 'UNIFORM_SCALING')
+        self.assertRaises(ValueError, stream.update_shard_count, 'LogStream', 0, 'UNIFORM_SCALING')
+
+    def test_template(self):
+        """Test to make sure the autoscaling and on-demand templates pass the validator and only autoscaling adds the alarms and function"""
+        autoscale = target_template(['802640662990'], stream_scaling='autoscale').to_dict()
+        assert validate(autoscale, strict=True) == []
+        alarms = [name for name, resource in autoscale['Resources'].items() if resource['Type'] == 'AWS::CloudWatch::Alarm']
+        assert sorted(alarms) == ['LogStreamScaleInAlarm', 'LogStreamScaleOutAlarm', 'LogStreamThrottledScaleOutAlarm']
+        assert autoscale['Mappings']['LogStreamCapacity']['1'] == {'ScaleOutBytes': 50331648, 'ScaleInBytes': 18874368}
+        assert 'LogStreamScalerFunction' in autoscale['Resources'] and 'LogStreamMaxShardCount' in autoscale['Parameters']
+
+        on_demand = target_template(['802640662990'], stream_scaling='on-demand').to_dict()
+        assert validate(on_demand, strict=True) == []
+        assert on_demand['Resources']['LogStream']['Properties'] == {'RetentionPeriodHours': {'Ref': 'LogStreamRetentionPeriod'}, 'StreamModeDetails': {'StreamMode': 'ON_DEMAND'}}
+        assert 'LogStreamShardCount' not in on_demand['Parameters'] and 'Mappings' not in on_demand
+
+    def test_simulate(self):
+        """Test to make sure scaling cuts the records throttled during a storm and a stream sized for the peak throttles nothing"""
+        curve = storm_curve(minutes=180, baseline=0.5, peak=6.0, start=30, duration=60)
+        fixed, autoscale, on_demand = [simulate(curve, mode) for mode in ['fixed', 'autoscale', 'on-demand']]
+        assert fixed['OfferedRecords'] == autoscale['OfferedRecords'] == on_demand['OfferedRecords']
+        assert fixed['ThrottledRecords'] > autoscale['ThrottledRecords'] > 0 and fixed['ThrottledRecords'] > on_demand['ThrottledRecords']
+        assert fixed['Reshards'] == 0 and autoscale['Reshards'] >= 3 and autoscale['PeakCapacityMBps'] == 8
+        assert on_demand['ShardHours'] is None and fixed['ShardHours'] == 3
+        assert simulate(curve, 'fixed', shards=8)['ThrottledRecords'] == 0
+        # small records hit the 1000 records/s shard limit before the byte limit
+        assert simulate([0.5 * SHARD_BYTES_PER_SECOND], 'fixed', record_bytes=100)['ThrottledRecords'] == int(round((0.5 * SHARD_BYTES_PER_SECOND / 100 - 1000) * 60))
+
+    def test_simulate_command(self):
+        """Test to make sure `kinesis simulate` replays a curve file and rejects values that aren't numbers"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        curve_file = os.path.join(work_dir, 'curve.csv')
+        with open(curve_file, 'w') as f:
+            f.write('# minute,bytes per second\n' + ''.join('%d,%d\n' % (minute, 3 * SHARD_BYTES_PER_SECOND) for minute in range(30)))
+        assert load_curve(curve_file) == [3.0 * SHARD_BYTES_PER_SECOND] * 30
+
+        result = CliRunner().invoke(cli, ['kinesis', 'simulate', '--curve', curve_file, '-m', 'fixed', '--shards', '3', '--json'])
+        assert result.exit_code == 0, result.output
+        assert [(r['Mode'], r['ThrottledRecords'], r['ShardHours']) for r in json.loads(result.output)] == [('fixed', 0, 1.5)]
+
+        result = CliRunner().invoke(cli, ['kinesis', 'simulate', '--minutes', '30', '--storm-start', '5', '--storm-minutes', '5'])
+        assert result.exit_code == 0 and 'autoscale' in result.output and 'on-demand' in result.output
+
+        with open(curve_file, 'a') as f:
+            f.write('30,lots\n')
+        result = CliRunner().invoke(cli, ['kinesis', 'simulate', '--curve', curve_file])
+        assert result.exit_code == 2 and "line 32: '30,lots' is not a number" in result.output
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.archive import render_value
+from ucsd_cloud_cli.logs.notifications import partition, input_settings, splunk_inputs, FILTER_POLICY_MAX_VALUES
+from ucsd_cloud_cli.logs.target import target_template
+from ucsd_cloud_cli.validator import validate
+
+ACCOUNTS = ['969379222189', '802640662990', '169929244869']
+
+
+def key_prefixes(subscription, key_prefix=''):
+    policy = subscription['Properties']['FilterPolicy']
+    if 'Fn::If' in policy:
+        policy = policy['Fn::If'][1 if key_prefix else 2]
+    return [render_value(value['prefix'], {'CloudTrailKeyPrefix': key_prefix}) for value in policy['Records']['s3']['object']['key']]
+
+
+class TestLogNotifications(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = CliRunner()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def test_partition(self):
+        """Test to make sure accounts are sorted and prefixes kept in order before being dealt round robin, and too few values are rejected"""
+        assert partition(2, 'account', ACCOUNTS) == [['169929244869', '969379222189'], ['802640662990']]
+        assert partition(2, 'prefix', prefix_list=['b/', 'a/', 'c/']) == [['b/', 'c/'], ['a/']]
+        self.assertRaises(ValueError, partition, 4, 'account', ACCOUNTS)
+
+    def test_default_queue(self):
+        """Test to make sure the single notification queue long polls and the bucket notifies it directly"""
+        resources = target_template(ACCOUNTS).to_dict()['Resources']
+        assert resources['s3DeliveryQueue']['Properties']['ReceiveMessageWaitTimeSeconds'] == 20
+        assert 'QueueConfigurations' in resources['LogDeliveryBucket']['Properties']['NotificationConfiguration']
+        assert 's3DeliveryTopic' not in resources
+
+    def test_fanout_template(self):
+        """Test to make sure fan-out passes the validator, each queue long polls with a dead letter queue and only gets its accounts' keys"""
+        template = target_template(ACCOUNTS, notification_queues=2, flow_logs_to_s3=True, flow_log_hive_partitions=True).to_dict()
+        assert validate(template, strict=True) == []
+        resources = template['Resources']
+        bucket = resources['LogDeliveryBucket']
+        assert bucket['DependsOn'] == ['s3DeliveryTopicPolicy']
+        assert bucket['Properties']['NotificationConfiguration']['TopicConfigurations'][0]['Topic'] == {'Ref': 's3DeliveryTopic'}
+        for index in range(2):
+            queue = resources['s3DeliveryQueue%d' % index]['Properties']
+            assert queue['QueueName'] == 's3DeliveryQueue-%d' % index and queue['ReceiveMessageWaitTimeSeconds'] == 20
+            assert queue['RedrivePolicy']['deadLetterTargetArn'] == {'Fn::GetAtt': ['deadLetterQueue%d' % index, 'Arn']}
+            assert resources['s3DeliverySubscription%d' % index]['Properties']['RawMessageDelivery'] == 'true'
+        assert key_prefixes(resources['s3DeliverySubscription1']) == ['AWSLogs/802640662990/', 'AWSLogs/aws-account-id%3D802640662990/']
+        prefixes = key_prefixes(resources['s3DeliverySubscription1'], 'trail')
+        assert prefixes == ['AWSLogs/802640662990/', 'AWSLogs/aws-account-id%3D802640662990/', 'trail/AWSLogs/802640662990/']
+        assert template['Conditions']['HasCloudTrailKeyPrefix'] == {'Fn::Not': [{'Fn::Equals': [{'Ref': 'CloudTrailKeyPrefix'}, '']}]}
+        alarm = resources['s3DeliveryUnmatchedAlarm']['Properties']
+        assert alarm['Metrics'][-1]['Expression'] == 'filtered - 1 * published' and alarm['Threshold'] == 0
+        assert set(['SplunkS3DeadLetterQueue0', 'SplunkS3DeadLetterQueue1', 'SplunkS3Queue0', 'SplunkS3Queue1']) <= set(template['Outputs'])
+
+        single = target_template(ACCOUNTS, notification_queues=1).to_dict()['Resources']
+        assert 'FilterPolicy' not in single['s3DeliverySubscription0']['Properties'] and 's3DeliveryUnmatchedAlarm' not in single
+
+        by_prefix = target_template(ACCOUNTS, notification_queues=2, queue_partition='prefix', queue_prefix_list=['cloudtrail/', 'vpc=flow/']).to_dict()['Resources']
+        assert key_prefixes(by_prefix['s3DeliverySubscription1']) == ['vpc%3Dflow/']
+
+        too_many = ['%012d' % account for account in range(FILTER_POLICY_MAX_VALUES + 1)]
+        self.assertRaises(ValueError, target_template, too_many, notification_queues=2)
+
+    def test_splunk_inputs(self):
+        """Test to make sure the batch size covers one long poll and the interval one batch, within the add-on's bounds"""
+        assert input_settings(120, 2) == (10, 30)
+        assert input_settings(6, 1) == (2, 30)
+        assert input_settings(0.5, 1) == (1, 120)
+        assert input_settings(0.01, 1) == (1, 300)
+        inputs = splunk_inputs(2, '123456789012', 'us-west-2', 6, queue_name_prefix='logs', decoder='VPCFlowLogs')
+        assert inputs.count('[aws_sqs_based_s3://') == 2
+        assert 'sqs_queue_url = https://sqs.us-west-2.amazonaws.com/123456789012/logs-1\n' in inputs
+        assert 'sourcetype = aws:cloudwatchlogs:vpcflow\n' in inputs and 'sqs_batch_size = 1\n' in inputs
+
+    def test_generate_command(self):
+        """Test to make sure `target generate` writes the Splunk inputs next to the template and needs the deploy account and region for them"""
+        target_file, inputs_file = os.path.join(self.work_dir, 'log_targets.json'), os.path.join(self.work_dir, 'inputs.conf')
+        args = ['target', 'generate', '-a', ACCOUNTS[0], '-a', ACCOUNTS[1], '-f', target_file, '--notification-queues', '2', '--splunk-inputs', inputs_file]
+        result = self.runner.invoke(cli, args)
+        assert result.exit_code == 2 and '--deploy-account-id' in result.output
+
+        result = self.runner.invoke(cli, args + ['-d', '123456789012', '-n', 'us-west-2', '--objects-per-minute', '120'])
+        assert result.exit_code == 0, result.output
+        with open(inputs_file) as f:
+            assert f.read().count('sqs_batch_size = 10\n') == 2
+        with open(target_file) as f:
+            assert 's3DeliveryQueue1' in json.load(f)['Resources']
+
+        result = self.runner.invoke(cli, ['target', 'generate', '-a', ACCOUNTS[0], '-f', target_file, '--notification-queues', '2'])
+        assert result.exit_code == 2 and 'Invalid value for --notification-queues' in result.output
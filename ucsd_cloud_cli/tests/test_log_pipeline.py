@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.kinesis import FIXED, AUTOSCALE, ON_DEMAND, SHARD_BYTES_PER_SECOND
+from ucsd_cloud_cli.logs.pipeline import topology, route, simulate, percentiles, CLOUDWATCH_LOGS, CLOUDTRAIL
+from ucsd_cloud_cli.logs.target import target_template
+
+ACCOUNTS = ['802640662990', '969379222189']
+
+
+def template(**kwargs):
+    return json.loads(json.dumps(target_template(ACCOUNTS, ['us-west-2'], **kwargs).to_dict()))
+
+
+class TestLogPipeline(unittest.TestCase):
+
+    def test_topology(self):
+        """Test to make sure the stream, Firehose, queues and CloudTrail prefixes are read from the template with the parameter overrides"""
+        pipeline = topology(template())
+        assert (pipeline['Mode'], pipeline['Shards'], pipeline['BufferInterval'], pipeline['BufferSize']) == (FIXED, 1, 300, 50)
+        assert (pipeline['FirehoseBucket'], pipeline['FirehosePrefix'], pipeline['CloudTrailBucket']) == ('LogS3DeliveryBucket', 'firehose/', 'LogDeliveryBucket')
+        assert pipeline['CloudTrailPrefixes'] == ['AWSLogs/802640662990/', 'AWSLogs/969379222189/']
+        queue = pipeline['Queues']['s3DeliveryQueue']
+        assert (queue['VisibilityTimeout'], queue['WaitSeconds'], queue['MaxReceiveCount'], queue['DeadLetterQueue']) == (300, 20, 10, 'deadLetterQueue')
+
+        pipeline = topology(template(), {'LogStreamShardCount': '4', 'CloudTrailKeyPrefix': 'trail'}, buffer_interval=60)
+        assert (pipeline['Shards'], pipeline['BufferInterval'], pipeline['BufferSize']) == (4, 60, 50)
+        assert pipeline['CloudTrailPrefixes'][0] == 'trail/AWSLogs/802640662990/'
+        self.assertRaises(ValueError, topology, template(), {'ShardCount': '4'})
+        self.assertRaises(ValueError, topology, {'Resources': {}})
+
+        pipeline = topology(template(stream_scaling=AUTOSCALE), {'LogStreamMaxShardCount': '8'})
+        assert (pipeline['Mode'], pipeline['MaxShards']) == (AUTOSCALE, 8)
+        assert topology(template(stream_scaling=ON_DEMAND))['Mode'] == ON_DEMAND
+
+    def test_route(self):
+        """Test to make sure objects are routed by the bucket notifications and the fan-out subscriptions' filter policies"""
+        pipeline = topology(template())
+        assert route(pipeline, 'LogDeliveryBucket', 'AWSLogs/802640662990/CloudTrail/us-west-2/1.json.gz') == [('s3DeliveryQueue', 1)]
+        assert route(pipeline, 'LogS3DeliveryBucket', 'firehose/1') is None
+
+        pipeline = topology(template(notification_queues=2))
+        assert route(pipeline, 'LogDeliveryBucket', 'AWSLogs/969379222189/CloudTrail/us-west-2/1.json.gz') == [('s3DeliveryQueue1', 2)]
+        assert route(pipeline, 'LogDeliveryBucket', 'AWSLogs/111111111111/CloudTrail/us-west-2/1.json.gz') == []
+        assert route(pipeline, 'LogDeliveryBucket', 'trail/AWSLogs/969379222189/CloudTrail/us-west-2/1.json.gz') == []
+        pipeline = topology(template(notification_queues=2), {'CloudTrailKeyPrefix': 'trail'})
+        assert route(pipeline, 'LogDeliveryBucket', 'trail/AWSLogs/969379222189/CloudTrail/us-west-2/1.json.gz') == [('s3DeliveryQueue1', 2)]
+
+    def test_percentiles(self):
+        """Test to make sure percentiles are weighted"""
+        assert percentiles([(10, 1), (1, 98), (5, 1)]) == [1, 1, 5]
+        assert percentiles([]) == [None, None, None]
+
+    def test_simulate(self):
+        """Test to make sure throttling backs traffic up in CloudWatch Logs and the buffering hints bound the latency of the Firehose objects"""
+        curve = [0.5 * SHARD_BYTES_PER_SECOND] * 5 + [2.0 * SHARD_BYTES_PER_SECOND] * 5 + [0.5 * SHARD_BYTES_PER_SECOND] * 20
+        throttled = simulate(topology(template()), curve)
+        assert throttled['ThrottledRecords'] > 0 and throttled['MaxPendingBytes'] > 0
+        assert throttled['Timeline'][9]['PendingBytes'] > throttled['Timeline'][5]['PendingBytes']
+
+        result = simulate(topology(template(), {'LogStreamShardCount': '2'}, buffer_interval=60), curve)
+        assert (result['ThrottledRecords'], result['MaxPendingBytes'], result['MaxIteratorAgeSeconds']) == (0, 0, 0)
+        assert result['Latency'][CLOUDWATCH_LOGS]['P99'] <= 60 < throttled['Latency'][CLOUDWATCH_LOGS]['P99']
+        assert result['Latency'][CLOUDWATCH_LOGS]['Delivered'] <= result['Latency'][CLOUDWATCH_LOGS]['Events']
+
+        # one log file per account every five minutes, consumed from the notification queue
+        assert result['Objects'] - result['FirehoseObjects'] == 2 * len(curve) // 5
+        trail = result['Latency'][CLOUDTRAIL]
+        assert 30 <= trail['P50'] <= trail['Max'] <= 300 and result['Queues'][0]['Deleted'] == result['Queues'][0]['Received']
+        assert result['Queues'][0]['Name'] == 's3DeliveryQueue' and result['DeadLettered'] == 0
+
+    def test_redrive(self):
+        """Test to make sure failed messages reappear after the visibility timeout and move to the dead letter queue after the redrive limit"""
+        target = template()
+        target['Resources']['s3DeliveryQueue']['Properties']['VisibilityTimeout'] = 30
+        target['Resources']['s3DeliveryQueue']['Properties']['RedrivePolicy']['maxReceiveCount'] = 2
+        result = simulate(topology(target), [0.1 * SHARD_BYTES_PER_SECOND] * 15, failure_rate=1.0, poll_interval=0)
+        queue = result['Queues'][0]
+        assert result['Latency'][CLOUDTRAIL]['Delivered'] == 0 and queue['Deleted'] == 0
+        assert queue['DeadLettered'] == result['DeadLettered'] > 0 and queue['Failures'] == queue['Received'] >= 2 * queue['DeadLettered']
+
+        result = simulate(topology(target), [0.1 * SHARD_BYTES_PER_SECOND] * 15, object_seconds=45, poll_interval=0)
+        assert result['Queues'][0]['Duplicates'] > 0 and result['Latency'][CLOUDTRAIL]['Delivered'] == result['Latency'][CLOUDTRAIL]['Events']
+
+    def test_simulate_command(self):
+        """Test to make sure `pipeline simulate` runs every combination of templates and overrides"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        template_file = os.path.join(work_dir, 'fan_out.json')
+        with open(template_file, 'w') as f:
+            json.dump(template(notification_queues=2), f)
+
+        args = ['pipeline', 'simulate', template_file, '--minutes', '10', '--storm-start', '2', '--storm-minutes', '2']
+        result = CliRunner().invoke(cli, args + ['-P', 'LogStreamShardCount=1', '-P', 'LogStreamShardCount=8', '--buffer-size', '5', '--json'])
+        assert result.exit_code == 0, result.output
+        results = json.loads(result.output)
+        assert [r['Variant'] for r in results] == ['fan_out.json LogStreamShardCount=1 buffer=300s/5MB', 'fan_out.json LogStreamShardCount=8 buffer=300s/5MB']
+        assert results[0]['ThrottledRecords'] > results[1]['ThrottledRecords'] == 0 and len(results[0]['Queues']) == 2
+
+        result = CliRunner().invoke(cli, args + ['--timeline'])
+        assert result.exit_code == 0 and 'fan_out.json' in result.output and 'iter age' in result.output
+
+        result = CliRunner().invoke(cli, ['pipeline', 'simulate', '--minutes', '1'])
+        assert result.exit_code == 0 and 'log_targets.json' in result.output
+
+        result = CliRunner().invoke(cli, args + ['-P', 'LogStreamShardCount'])
+        assert result.exit_code == 2 and 'Name=Value' in result.output
+        result = CliRunner().invoke(cli, args + ['-P', 'Missing=1'])
+        assert result.exit_code == 2 and 'unknown parameter(s) Missing' in result.output
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.registry import load_registry, save_registry, new_registry, update_accounts, mark_deployed, delta, resource_changes, RegistryError
+
+
+class TestLogRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = CliRunner()
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.registry_file = os.path.join(self.work_dir, 'accounts.yaml')
+
+    def invoke(self, *args):
+        result = self.runner.invoke(cli, list(args))
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def test_round_trip(self):
+        """Test to make sure account IDs YAML would read as numbers, octal ones included, come back as 12 digit strings and bad IDs or states are rejected"""
+        with open(self.registry_file, 'w') as f:
+            f.write('revision: 3\naccounts:\n  012345678901: {state: active, regions: [us-west-2]}\n  169929244869:\n')
+        registry = load_registry(self.registry_file)
+        assert sorted(registry['accounts']) == ['012345678901', '169929244869']
+        assert registry['accounts']['169929244869'] == {'state': 'onboarding', 'regions': []}
+        save_registry(registry, self.registry_file)
+        assert load_registry(self.registry_file) == registry
+        self.assertRaises(RegistryError, update_accounts, registry, ['1234'])
+        self.assertRaises(RegistryError, update_accounts, registry, ['012345678901'], state='gone')
+
+        with open(self.registry_file, 'w') as f:
+            f.write('revision: 4\naccounts:\n  012345670123: {state: active}\n  0777: {}\n')
+        self.assertRaises(RegistryError, load_registry, self.registry_file)
+        with open(self.registry_file, 'w') as f:
+            f.write('revision: 4\naccounts:\n  012345670123: {state: active}\ndeployed: {revision: 4, accounts: [012345670123, 802640662990], regions: []}\n')
+        registry = load_registry(self.registry_file)
+        assert list(registry['accounts']) == ['012345670123'] and registry['revision'] == 4
+        assert registry['deployed']['accounts'] == ['012345670123', '802640662990'] and registry['deployed']['revision'] == 4
+
+    def test_delta(self):
+        """Test to make sure only accounts granted access count towards the delta, and unchanged updates don't bump the revision"""
+        registry = new_registry()
+        assert update_accounts(registry, ['802640662990', '969379222189'], regions=['us-west-2']) == ['802640662990', '969379222189']
+        update_accounts(registry, ['169929244869'], state='pending')
+        mark_deployed(registry)
+        assert update_accounts(registry, ['802640662990'], regions=['us-west-2']) == [] and registry['revision'] == 2
+        update_accounts(registry, ['969379222189'], state='offboarded')
+        update_accounts(registry, ['169929244869'], state='active', regions=['us-east-1'])
+        assert delta(registry) == {'Revision': 4, 'DeployedRevision': 2, 'AddedAccounts': ['169929244869'], 'RemovedAccounts': ['969379222189'],
+                                   'AddedRegions': ['us-east-1'], 'RemovedRegions': []}
+
+    def test_resource_changes(self):
+        """Test to make sure list items are counted as fragments and whole resources are added and removed"""
+        statement = {'Effect': 'Allow', 'Resource': ['arn:a', 'arn:b']}
+        old = {'Resources': {'Policy': {'Properties': {'Statement': [statement]}}, 'Old': {}}}
+        new = {'Resources': {'Policy': {'Properties': {'Statement': [statement, dict(statement, Resource=['arn:a', 'arn:c'])]}}, 'New': {}}}
+        assert resource_changes(old, new) == {'Add': ['New'], 'Remove': ['Old'], 'Modify': [{'Resource': 'Policy', 'Added': 3, 'Removed': 0}]}
+
+    def test_commands(self):
+        """Test to make sure the registry commands maintain the file and report the accounts to add and remove"""
+        self.invoke('registry', 'add', '-f', self.registry_file, '802640662990', '969379222189', '--ou', 'security', '-r', 'us-west-2')
+        self.invoke('registry', 'deployed', '-f', self.registry_file)
+        assert '1 account(s) changed, registry revision 2' in self.invoke('registry', 'add', '-f', self.registry_file, '169929244869', '-n', 'Infra')
+        self.invoke('registry', 'remove', '-f', self.registry_file, '969379222189')
+        output = self.invoke('registry', 'list', '-f', self.registry_file, '--ou', 'security')
+        assert '969379222189 offboarded' in output and '169929244869' not in output
+        output = self.invoke('registry', 'status', '-f', self.registry_file)
+        assert 'Registry revision 3, deployed revision 1' in output
+        assert 'accounts to add    169929244869' in output and 'accounts to remove 969379222189' in output
+        result = self.runner.invoke(cli, ['registry', 'remove', '-f', self.registry_file, '111111111111'])
+        assert result.exit_code == 2 and 'not in the registry: 111111111111' in result.output
+
+    def test_target_generate(self):
+        """Test to make sure onboarding one account only modifies the policies granting accounts access"""
+        target_file = os.path.join(self.work_dir, 'log_targets.json')
+        self.invoke('registry', 'add', '-f', self.registry_file, '969379222189', '802640662990')
+        output = self.invoke('target', 'generate', '--registry', self.registry_file, '-f', target_file)
+        assert 'deployed revision none' in output and 'Expected change set: 15 resource(s) - 15 to add' in output
+        self.invoke('registry', 'deployed', '-f', self.registry_file)
+
+        self.invoke('registry', 'add', '-f', self.registry_file, '169929244869')
+        output = self.invoke('target', 'generate', '--registry', self.registry_file, '-a', '111111111111', '-f', target_file)
+        assert 'Expected change set: 2 resource(s) - 0 to add, 0 to remove, 2 to modify' in output
+        assert 'Modify CWLtoKinesisDestination: +1/-1 fragment(s)' in output and 'Modify LogDeliveryBucketPolicy: +1/-0 fragment(s)' in output
+        with open(target_file) as f:
+            destination = json.dumps(json.load(f)['Resources']['CWLtoKinesisDestination']['Properties']['DestinationPolicy'])
+        assert all(account in destination for account in ['111111111111', '169929244869', '802640662990', '969379222189'])
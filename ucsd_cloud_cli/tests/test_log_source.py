@@ -4,7 +4,7 @@ import unittest
 import json
 from click.testing import CliRunner
 from ucsd_cloud_cli import cli
-from .cfn2py import validate_doc
+from ucsd_cloud_cli.validator import validate
 
 class TestLogSource(unittest.TestCase):
 
@@ -27,6 +27,6 @@ class TestLogSource(unittest.TestCase):
 
 
     def test_cfn_structure(self):
-        """Test to validate that the CFn Template we're generating parses as a valid (enough) CloudFormation template"""
+        """Test to validate that the CFn Template we're generating passes the in-memory CloudFormation validator"""
         result = self.runner.invoke(cli, ['source', 'generate', '--dry-run'])
-        assert validate_doc(result.output)
+        assert validate(result.output) == []
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import datetime
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.logs.status import discover, collect, state, format_rows, MAX_QUERIES_PER_REQUEST, STATE_OK, STATE_LAGGING, STATE_ERRORS, STATE_NO_DATA
+from .fakes import FakeCloudFormationClient, FakeCloudWatchClient
+
+NOW = 1538395200.0  # 2018-10-01 12:00:00 UTC
+TARGET = ('security', 'us-west-2')
+SOURCE = ('dev', 'us-west-2')
+TARGET_OUTPUTS = {'SplunkKinesisLogStream': 'arn:aws:kinesis:us-west-2:111111111111:stream/seim-LogStream-1ABC',
+                  'FirehoseDeliveryStream': 'LogToS3DeliveryStream',
+                  'SplunkS3Queue0': 'arn:aws:sqs:us-west-2:111111111111:s3DeliveryQueue-0',
+                  'SplunkS3Queue1': 'arn:aws:sqs:us-west-2:111111111111:s3DeliveryQueue-1',
+                  'SplunkS3DeadLetterQueue0': 'arn:aws:sqs:us-west-2:111111111111:s3DeliveryQueue-0-dlq',
+                  'SplunkS3DeadLetterQueue1': 'arn:aws:sqs:us-west-2:111111111111:s3DeliveryQueue-1-dlq',
+                  'BucketName': 'logbucket'}
+
+
+def samples(*values):
+    """One sample a minute, the newest last, ending just before NOW"""
+    end = datetime.datetime.utcfromtimestamp(NOW)
+    return [(end - datetime.timedelta(minutes=len(values) - n, seconds=-5), value) for n, value in enumerate(values)]
+
+
+class TestLogStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        patcher = mock.patch('ucsd_cloud_cli.common.cache_dir', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cloudformation = {TARGET: FakeCloudFormationClient({'seim': TARGET_OUTPUTS}),
+                               SOURCE: FakeCloudFormationClient({'seim-source': {'CloudWatchLogGroupName': 'SecurityLogShippingGroup'}}),
+                               ('dev', 'us-east-1'): FakeCloudFormationClient({})}
+        filter_dimensions = (('DestinationType', 'Kinesis'), ('FilterName', 'seim-source-SecurityLogShippingFilter-XYZ'), ('LogGroupName', 'SecurityLogShippingGroup'))
+        self.cloudwatch = {
+            TARGET: FakeCloudWatchClient({
+                ('AWS/Kinesis', 'GetRecords.IteratorAgeMilliseconds', (('StreamName', 'seim-LogStream-1ABC'),)): samples(900000, 2000, 1000),
+                ('AWS/Kinesis', 'IncomingRecords', (('StreamName', 'seim-LogStream-1ABC'),)): samples(100, 200, 300, 400, 500),
+                ('AWS/Firehose', 'DeliveryToS3.DataFreshness', (('DeliveryStreamName', 'LogToS3DeliveryStream'),)): samples(400, 600),
+                ('AWS/SQS', 'ApproximateAgeOfOldestMessage', (('QueueName', 's3DeliveryQueue-0'),)): samples(30),
+                ('AWS/SQS', 'NumberOfMessagesSent', (('QueueName', 's3DeliveryQueue-0'),)): samples(10, 10, 10, 10, 10, 10, 10),
+                ('AWS/SQS', 'ApproximateNumberOfMessagesVisible', (('QueueName', 's3DeliveryQueue-0'),)): samples(12, 3),
+                ('AWS/SQS', 'ApproximateNumberOfMessagesVisible', (('QueueName', 's3DeliveryQueue-1-dlq'),)): samples(0, 2)}),
+            SOURCE: FakeCloudWatchClient({
+                ('AWS/Logs', 'ForwardedLogEvents', filter_dimensions): samples(50, 50),
+                ('AWS/Logs', 'DeliveryThrottling', filter_dimensions): samples(0, 1),
+                ('AWS/Logs', 'DeliveryErrors', filter_dimensions): samples(2),
+                ('AWS/Logs', 'ForwardedLogEvents', (('LogGroupName', 'SecurityLogShippingGroup'),)): samples(1000)}, page_size=2)}
+
+    def discover(self):
+        return discover(self.cloudformation, TARGET, 'seim', [SOURCE, ('dev', 'us-east-1')], 'seim-source')
+
+    def test_discover(self):
+        """Test to make sure every stage is found from the stack outputs and source stacks that aren't deployed are reported"""
+        resources, problems = self.discover()
+        assert [(r['Stage'], r['Resource']) for r in resources] == [('source', 'SecurityLogShippingGroup'), ('stream', 'seim-LogStream-1ABC'),
+                                                                    ('firehose', 'LogToS3DeliveryStream'), ('queue', 's3DeliveryQueue-0'),
+                                                                    ('queue', 's3DeliveryQueue-1'), ('dead-letter', 's3DeliveryQueue-0-dlq'),
+                                                                    ('dead-letter', 's3DeliveryQueue-1-dlq')]
+        assert [(key, stack) for key, stack, _ in problems] == [(('dev', 'us-east-1'), 'seim-source')]
+
+    def test_collect(self):
+        """Test to make sure each account/region takes one GetMetricData request, gauges report the newest datapoint and counts the window total"""
+        resources, _ = self.discover()
+        rows = dict((row['Resource'], row) for row in collect(self.cloudwatch, resources, window_minutes=5, now=lambda: NOW))
+        assert self.cloudwatch[TARGET].calls == [('get_metric_data', {'Queries': 16})]
+        assert self.cloudwatch[SOURCE].call_count('get_metric_data') == 1
+
+        stream = rows['seim-LogStream-1ABC']
+        assert (stream['Lag'], stream['PerMinute'], stream['Errors']) == (1.0, 300.0, None) and state(stream, 300) == STATE_OK
+        assert rows['LogToS3DeliveryStream']['Lag'] == 600 and state(rows['LogToS3DeliveryStream'], 300) == STATE_LAGGING
+        queue = rows['s3DeliveryQueue-0']
+        assert (queue['Lag'], queue['PerMinute'], queue['Backlog']) == (30, 10.0, 3)
+        assert rows['s3DeliveryQueue-1-dlq']['Errors'] == 2 and state(rows['s3DeliveryQueue-1-dlq'], 300) == STATE_ERRORS
+        assert state(rows['s3DeliveryQueue-1'], 300) == STATE_NO_DATA
+        # the search only matches the subscription filter metrics, not the log group's other AWS/Logs metrics
+        source = rows['SecurityLogShippingGroup']
+        assert (source['PerMinute'], source['Errors']) == (20.0, 3) and state(source, 300) == STATE_ERRORS
+        assert 'seim-LogStream-1ABC' in format_rows(list(rows.values()), 300)
+
+    def test_cache(self):
+        """Test to make sure metrics are reused within the TTL, and fetched again once it expires or the resources change"""
+        resources, _ = self.discover()
+        collect(self.cloudwatch, resources, now=lambda: NOW)
+        collect(self.cloudwatch, resources, now=lambda: NOW + 30)
+        assert self.cloudwatch[TARGET].call_count('get_metric_data') == 1
+        collect(self.cloudwatch, resources[:-1], now=lambda: NOW + 30)
+        assert self.cloudwatch[TARGET].call_count('get_metric_data') == 2
+        assert self.cloudwatch[SOURCE].call_count('get_metric_data') == 1
+        collect(self.cloudwatch, resources, now=lambda: NOW + 90)
+        collect(self.cloudwatch, resources, ttl=0, now=lambda: NOW + 90)
+        assert self.cloudwatch[SOURCE].call_count('get_metric_data') == 3
+
+    def test_request_limit(self):
+        """Test to make sure more queries than one request takes are split over the fewest requests"""
+        resources = [dict(Stage='queue', Key=TARGET, Resource='queue-%d' % n) for n in range(MAX_QUERIES_PER_REQUEST // 3 + 1)]
+        rows = collect(self.cloudwatch, resources, ttl=0, now=lambda: NOW)
+        assert self.cloudwatch[TARGET].calls == [('get_metric_data', {'Queries': MAX_QUERIES_PER_REQUEST}), ('get_metric_data', {'Queries': 1})]
+        assert len(rows) == len(resources)
+
+    def test_command(self):
+        """Test to make sure `status` reports every stage and refreshes from the cache while watching"""
+        clients = {'cloudformation': self.cloudformation, 'cloudwatch': self.cloudwatch}
+        with mock.patch('ucsd_cloud_cli.logs.status.get_boto3_clients', side_effect=lambda name, keys: dict((key, clients[name][key]) for key in keys)), \
+                mock.patch('ucsd_cloud_cli.logs.status.time.sleep') as sleep:
+            args = ['status', '--target-stack', 'seim', '--target-profile', 'security', '--source-stack', 'seim-source', '-p', 'dev', '-r', 'us-west-2', '-r', 'us-east-1']
+            result = CliRunner().invoke(cli, args + ['--json'])
+            assert result.exit_code == 0, result.output
+            rows = json.loads(result.output[result.output.index('['):])
+            assert len(rows) == 7 and 'us-east-1 seim-source' in result.output
+
+            result = CliRunner().invoke(cli, args + ['--watch', '10', '--count', '2'])
+            assert result.exit_code == 0 and result.output.count('s3DeliveryQueue-0-dlq') == 2
+            assert sleep.call_count == 1 and self.cloudwatch[TARGET].call_count('get_metric_data') == 1
+
+            result = CliRunner().invoke(cli, ['status', '--target-stack', 'missing', '--target-profile', 'security'])
+            assert result.exit_code == 1 and 'no pipeline resources found' in result.output
@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from botocore.stub import Stubber
+
+from ucsd_cloud_cli import cli, profiling
+from ucsd_cloud_cli.common import get_boto3_client
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.addCleanup(setattr, profiling, '_active', None)
+
+    def test_phase_self_time(self):
+        """Test to make sure a phase nested in another is only counted once and nothing is recorded when profiling is off"""
+        with profiling.phase(profiling.FILE_WRITE):
+            time.sleep(0.01)
+        profiling.start()
+        with profiling.phase(profiling.FILE_WRITE):
+            time.sleep(0.02)
+            with profiling.phase(profiling.TEMPLATE_RENDER):
+                time.sleep(0.05)
+        phases = profiling.stop()['Phases']
+        assert 0.02 <= phases[profiling.FILE_WRITE] < 0.05
+        assert 0.05 <= phases[profiling.TEMPLATE_RENDER] < 0.07
+        assert phases[profiling.IMPORTS] > 0
+
+    def test_api_calls(self):
+        """Test to make sure clients from get_boto3_client count each API call by operation once profiling is on"""
+        for name, body in [('config', '[default]\nregion = us-west-2\n'), ('credentials', '[default]\naws_access_key_id = AKIDEXAMPLE\naws_secret_access_key = secret\n')]:
+            with open(os.path.join(self.work_dir, name), 'w') as f:
+                f.write(body)
+        environ = {'AWS_CONFIG_FILE': os.path.join(self.work_dir, 'config'), 'AWS_SHARED_CREDENTIALS_FILE': os.path.join(self.work_dir, 'credentials')}
+        with mock.patch.dict(os.environ, environ):
+            profiling.start()
+            client = get_boto3_client('sqs')
+            with Stubber(client) as stubber:
+                for _ in range(3):
+                    stubber.add_response('list_queues', {'QueueUrls': []})
+                stubber.add_response('get_queue_url', {'QueueUrl': 'https://queue'})
+                for _ in range(3):
+                    client.list_queues()
+                client.get_queue_url(QueueName='queue')
+            report = profiling.stop()
+        assert report['ApiCalls'] == {'sqs.ListQueues': 3, 'sqs.GetQueueUrl': 1} and report['ApiCallCount'] == 4
+        assert report['Phases'][profiling.BOTO3_SETUP] > 0
+
+    def test_profile_options(self):
+        """Test to make sure the global options write the phase timings, top allocation sites and a cProfile dump for a generator run"""
+        profile_json, profile_cprofile = os.path.join(self.work_dir, 'profile.json'), os.path.join(self.work_dir, 'profile.prof')
+        result = CliRunner().invoke(cli, ['--profile-json', profile_json, '--profile-cprofile', profile_cprofile, '--profile-memory', '3',
+                                          'target', 'generate', '-a', '802640662990', '-f', os.path.join(self.work_dir, 'target.json')])
+        assert result.exit_code == 0, result.output
+        with open(profile_json) as f:
+            report = json.load(f)
+        assert sorted(report['Phases']) == sorted(profiling.PHASES)
+        assert all(report['Phases'][name] > 0 for name in [profiling.TEMPLATE_BUILD, profiling.TEMPLATE_RENDER, profiling.FILE_WRITE])
+        assert report['Command'] == 'target' and report['ApiCallCount'] == 0 and len(report['TopAllocations']) == 3
+        assert pstats.Stats(profile_cprofile).total_calls > 0
+
+        result = CliRunner().invoke(cli, ['--profile', 'source', 'generate', '--dry-run'])
+        assert result.exit_code == 0
+        assert 'template render' in result.output and '0 AWS API call(s)' in result.output
+        assert profiling._active is None
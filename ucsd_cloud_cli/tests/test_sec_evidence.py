@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ucsd_cloud_cli.sec.capture import TAG_PREFIX
+from ucsd_cloud_cli.sec.evidence import EvidenceQueue, Scheduler, start_copy, QUEUED, STARTING, COPYING, COMPLETED, FAILED
+from .fakes import FakeEC2Client, FakeEBSCopyClient
+
+KMS_KEY = 'arn:aws:kms:us-west-2:999999999999:key/evidence'
+SECURITY_ACCOUNT = '999999999999'
+
+
+class TestSecEvidence(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.queue_path = os.path.join(self.work_dir, 'queue', 'evidence.db')
+        self.source = FakeEC2Client([])
+        for i in range(45):
+            self.source._new_snapshot('vol-%04d' % i, [])
+        self.destination = FakeEBSCopyClient(self.source, SECURITY_ACCOUNT, copy_limit=20, polls_to_complete=2)
+        self.queue = EvidenceQueue(self.queue_path)
+        self.addCleanup(self.queue.close)
+        for snapshot_id in sorted(self.source.snapshots):
+            self.queue.enqueue(snapshot_id, 'prod', 'us-east-1', 'us-west-2', KMS_KEY, 'IR-42', 8)
+
+    def _scheduler(self, queue=None, max_concurrent=20):
+        return Scheduler(queue or self.queue, {('prod', 'us-east-1'): self.source}, {'us-west-2': self.destination}, SECURITY_ACCOUNT,
+                         max_concurrent, sleep=lambda seconds: None)
+
+    def test_enqueue_is_idempotent(self):
+        """Test to make sure queueing the same snapshot for the same region twice doesn't create a second job"""
+        assert not self.queue.enqueue('snap-00000000', 'prod', 'us-east-1', 'us-west-2', KMS_KEY)
+        assert self.queue.enqueue('snap-00000000', 'prod', 'us-east-1', 'eu-west-1', KMS_KEY)
+        assert self.queue.counts() == {QUEUED: 46}
+
+    def test_drains_at_concurrency_limit(self):
+        """Test to make sure the scheduler keeps the destination region at the copy limit without ever tripping it"""
+        scheduler = self._scheduler()
+        assert scheduler.run(poll_interval=0)
+        assert self.queue.counts() == {COMPLETED: 45}
+        assert self.destination.max_pending == 20 and scheduler.peak_in_flight['us-west-2'] == 20
+        assert self.destination.call_count('copy_snapshot') == 45
+
+        copies = self.destination.copies
+        assert all(s['KmsKeyId'] == KMS_KEY for s in copies.snapshots.values())
+        assert sorted(copies.tags[i][TAG_PREFIX + 'source-snapshot'] for i in copies.snapshots) == sorted(self.source.snapshots)
+        assert all(not s['SharedWith'] for s in self.source.snapshots.values())
+
+        stats = scheduler.throughput()
+        assert stats['completed'] == 45 and stats['gib'] == 360 and stats['gib_per_hour'] > 0
+
+    def test_limit_errors_are_requeued(self):
+        """Test to make sure a copy refused for the concurrency limit (e.g. copies started outside the scheduler) waits for a free slot"""
+        self.destination.copy_limit = 5
+        scheduler = self._scheduler()
+        assert scheduler.run(poll_interval=0)
+        assert self.queue.counts() == {COMPLETED: 45}
+        assert self.destination.max_pending == 5
+
+    def test_resume_after_crash(self):
+        """Test to make sure a new run picks up copies in flight and reconciles jobs interrupted between starting a copy and recording it"""
+        self._scheduler().step(_InlineExecutor())
+        assert self.queue.counts() == {COPYING: 20, QUEUED: 25}
+
+        # Simulate a crash right after CopySnapshot returned for one job but before its state was saved
+        self.destination.copy_limit = 21
+        job = self.queue.jobs(QUEUED)[0]
+        copy_id = start_copy(self.source, self.destination, job, SECURITY_ACCOUNT)
+        self.queue.update(job, state=STARTING)
+        self.queue.close()
+
+        queue = EvidenceQueue(self.queue_path)
+        self.addCleanup(queue.close)
+        scheduler = self._scheduler(queue)
+        scheduler.recover()
+        assert [j['destination_snapshot_id'] for j in queue.jobs() if j['snapshot_id'] == job['snapshot_id']] == [copy_id]
+        assert scheduler.run(poll_interval=0)
+        assert queue.counts() == {COMPLETED: 45}
+        assert self.destination.call_count('copy_snapshot') == 45
+
+    def test_permanent_failures(self):
+        """Test to make sure jobs that keep failing for non-retryable reasons are marked failed after MAX_ATTEMPTS"""
+        def _denied(**kwargs):
+            raise RuntimeError('An error occurred (UnauthorizedOperation) when calling the ModifySnapshotAttribute operation')
+        self.source.modify_snapshot_attribute = _denied
+        assert self._scheduler().run(poll_interval=0)
+        assert self.queue.counts() == {FAILED: 45}
+        assert all(job['attempts'] == 3 and 'UnauthorizedOperation' in job['error'] for job in self.queue.jobs(FAILED))
+
+
+class _InlineExecutor(object):
+    def map(self, function, items):
+        return [function(item) for item in items]
@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.sec.export import export_snapshot, part_blocks_for, ChecksumError, MAX_PARTS
+from .fakes import FakeEBSClient, FakeS3Client
+
+BLOCK_SIZE = 4096
+# 1 "GiB" volumes become 256 blocks of 4 KiB, to keep the zero padding cheap
+SMALL_GIB = 256 * BLOCK_SIZE
+
+
+class TestSecExport(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('ucsd_cloud_cli.sec.export.GIB', SMALL_GIB)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+        rng = random.Random(0)
+        self.blocks = dict((index, bytes(rng.getrandbits(8) for _ in range(BLOCK_SIZE))) for index in sorted(rng.sample(range(512), 150)))
+        self.image = b''.join(self.blocks.get(index, bytes(BLOCK_SIZE)) for index in range(512))
+        self.ebs = FakeEBSClient(self.blocks, volume_size=2, block_size=BLOCK_SIZE, page_size=40)
+
+    def test_hash_matches_full_image(self):
+        """Test to make sure the digest covers the whole volume, with unwritten blocks hashed as zeros, in block order"""
+        stats = export_snapshot(self.ebs, 'snap-1', max_in_flight=8, workers=4)
+        assert stats['Sha256'] == hashlib.sha256(self.image).hexdigest()
+        assert stats['BlocksRead'] == 150 and stats['VolumeBytes'] == len(self.image)
+        assert stats['ReadMBps'] > 0 and stats['VolumeMBps'] > 0
+        assert self.ebs.call_count('list_snapshot_blocks') == 4
+
+    def test_in_flight_is_bounded(self):
+        """Test to make sure no more than max_in_flight blocks are ever requested ahead of the hash"""
+        self.ebs.latency = 0.001
+        export_snapshot(self.ebs, 'snap-1', max_in_flight=6, workers=16)
+        assert 1 < self.ebs.max_in_flight <= 6
+
+    def test_sparse_image(self):
+        """Test to make sure the local image is byte-identical to the volume while only written blocks take up space"""
+        path = os.path.join(self.work_dir, 'snap-1.img')
+        export_snapshot(self.ebs, 'snap-1', image_path=path)
+        with open(path, 'rb') as f:
+            assert f.read() == self.image
+
+    def test_s3_multipart_upload(self):
+        """Test to make sure the S3 object is assembled from in-order parts of part_blocks blocks"""
+        s3 = FakeS3Client()
+        export_snapshot(self.ebs, 'snap-1', s3=s3, bucket='evidence', key='IR-42/snap-1.img', part_blocks=64)
+        assert s3.objects['evidence/IR-42/snap-1.img'] == self.image
+        assert s3.calls[-1][1]['Parts'] == list(range(1, 9))
+
+    def test_large_volume_part_count(self):
+        """Test to make sure parts grow past part_blocks so large volumes stay within the S3 part limit"""
+        block_size = 512 * 1024
+        for volume_gib in [1, 80, 200, 16 * 1024]:
+            total_blocks = volume_gib * 1024 ** 3 // block_size
+            part_blocks = part_blocks_for(total_blocks, block_size)
+            assert part_blocks >= 16 and -(-total_blocks // part_blocks) <= MAX_PARTS
+        assert part_blocks_for(1024 ** 3 // block_size, block_size) == 16
+        self.assertRaises(ValueError, part_blocks_for, 64 * 1024 ** 4 // block_size, block_size)
+
+        s3 = FakeS3Client()
+        with mock.patch('ucsd_cloud_cli.sec.export.MAX_PARTS', 4):
+            export_snapshot(self.ebs, 'snap-1', s3=s3, bucket='evidence', key='IR-42/snap-1.img', part_blocks=64)
+        assert s3.objects['evidence/IR-42/snap-1.img'] == self.image
+        assert s3.calls[-1][1]['Parts'] == list(range(1, 5))
+
+    def test_checksum_mismatch_is_retried(self):
+        """Test to make sure a block that fails its checksum once is re-read rather than hashed"""
+        self.ebs.corrupt = set(list(self.blocks)[:3])
+        stats = export_snapshot(self.ebs, 'snap-1')
+        assert stats['Sha256'] == hashlib.sha256(self.image).hexdigest()
+        assert self.ebs.call_count('get_snapshot_block') == 153
+
+    def test_failure_aborts_upload(self):
+        """Test to make sure a block that never verifies fails the export and aborts the multipart upload"""
+        s3 = FakeS3Client()
+        with mock.patch('ucsd_cloud_cli.sec.export.MAX_BLOCK_ATTEMPTS', 1):
+            self.ebs.corrupt = set([sorted(self.blocks)[-1]])
+            self.assertRaises(ChecksumError, export_snapshot, self.ebs, 'snap-1', s3=s3, bucket='evidence', key='snap-1.img')
+        assert s3.aborted == ['upload-0'] and s3.objects == {}
+
+    def test_export_command_records_digest(self):
+        """Test to make sure `snapshot export` reports the digest and records it in the evidence manifest"""
+        manifest_path = os.path.join(self.work_dir, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump({'Case': 'IR-42', 'Snapshots': [{'SnapshotId': 'snap-1'}, {'SnapshotId': 'snap-2'}]}, f)
+        with mock.patch('ucsd_cloud_cli.sec.snapshot.get_boto3_client', return_value=self.ebs):
+            result = CliRunner().invoke(cli, ['snapshot', 'export', 'snap-1', '-m', manifest_path, '--image-dir', self.work_dir])
+        assert result.exit_code == 0, result.output
+        assert hashlib.sha256(self.image).hexdigest() in result.output and 'MB/s' in result.output
+        with open(manifest_path) as f:
+            assert [s.get('Sha256') for s in json.load(f)['Snapshots']] == [hashlib.sha256(self.image).hexdigest(), None]
+        assert os.path.exists(os.path.join(self.work_dir, 'snap-1.img'))
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.sec.quarantine import resolve_targets, isolate, parse_tags, TAG_PREFIX, QUARANTINE_GROUP_NAME
+from ucsd_cloud_cli.sec.isolate import run_isolation
+from .fakes import FakeEC2Client, FakeAutoScalingClient
+
+
+def _instance(index, vpc_id='vpc-1', tags=(), enis=1, state='running'):
+    return {'InstanceId': 'i-%04d' % index,
+            'VpcId': vpc_id,
+            'State': {'Name': state},
+            'Tags': [{'Key': k, 'Value': v} for k, v in tags],
+            'NetworkInterfaces': [{'NetworkInterfaceId': 'eni-%04d%d' % (index, n), 'Groups': [{'GroupId': 'sg-web'}]} for n in range(enis)]}
+
+
+class TestSecIsolate(unittest.TestCase):
+
+    def setUp(self):
+        instances = [_instance(i, 'vpc-1' if i % 2 else 'vpc-2', tags=[('app', 'web' if i < 6 else 'db')]) for i in range(10)]
+        instances.append(_instance(10, tags=[('app', 'web')], state='terminated'))
+        instances.append(_instance(11, enis=3))
+        self.ec2 = FakeEC2Client(instances, [{'GroupId': 'sg-existing', 'GroupName': QUARANTINE_GROUP_NAME, 'VpcId': 'vpc-2', 'IpPermissionsEgress': []}])
+        self.autoscaling = FakeAutoScalingClient({'web-asg': ['i-0001', 'i-0002', 'i-0009']})
+
+    def test_parse_tags(self):
+        """Test to make sure Key=Value tags are split on the first equals sign only"""
+        assert parse_tags(['app=web', 'expr=a=b']) == [('app', 'web'), ('expr', 'a=b')]
+        self.assertRaises(ValueError, parse_tags, ['app'])
+
+    def test_resolve_targets(self):
+        """Test to make sure IDs, tags and ENIs are resolved with one batched DescribeInstances filter each and terminated instances are skipped"""
+        instances = resolve_targets(self.ec2, ['i-0007', 'i-0008'], [('app', 'web')], ['eni-00110'])
+        assert sorted(instances) == ['i-0000', 'i-0001', 'i-0002', 'i-0003', 'i-0004', 'i-0005', 'i-0007', 'i-0008', 'i-0011']
+        assert len(set(str(c[1]['Filters']) for c in self.ec2.calls)) == 3
+
+    def test_isolate(self):
+        """Test to make sure every interface ends up on the VPC's quarantine group, ASG members are detached and everything is tagged for audit"""
+        instances = resolve_targets(self.ec2, tags=[('app', 'web')], eni_ids=['eni-00110'])
+        results = isolate(self.ec2, self.autoscaling, instances, case_id='IR-42', operator='tester')
+
+        assert self.ec2.call_count('create_security_group') == 1
+        created = [g for g in self.ec2.security_groups if g['GroupId'] != 'sg-existing'][0]
+        assert created['VpcId'] == 'vpc-1' and created['IpPermissionsEgress'] == []
+
+        by_id = dict((r['InstanceId'], r) for r in results)
+        assert by_id['i-0000']['GroupId'] == 'sg-existing' and by_id['i-0001']['GroupId'] == created['GroupId']
+        assert all(r['Error'] is None and r['Seconds'] >= 0 for r in results)
+        assert len(by_id['i-0011']['NetworkInterfaces']) == 3
+        for instance in instances.values():
+            for eni in instance['NetworkInterfaces']:
+                assert eni['Groups'] == [{'GroupId': by_id[instance['InstanceId']]['GroupId']}]
+                assert self.ec2.tags[eni['NetworkInterfaceId']][TAG_PREFIX + 'previous-groups'] == 'sg-web'
+            assert self.ec2.tags[instance['InstanceId']][TAG_PREFIX + 'case'] == 'IR-42'
+
+        assert by_id['i-0001']['AutoScalingGroupName'] == 'web-asg' and by_id['i-0003']['AutoScalingGroupName'] is None
+        assert self.autoscaling.groups['web-asg'] == ['i-0009']
+        assert self.autoscaling.call_count('detach_instances') == 1
+
+    def test_isolate_reports_failures(self):
+        """Test to make sure an API failure for one instance is reported without stopping the others"""
+        original = self.ec2.modify_network_interface_attribute
+
+        def _modify(NetworkInterfaceId, Groups, **kwargs):
+            if NetworkInterfaceId == 'eni-00030':
+                raise RuntimeError('UnauthorizedOperation')
+            return original(NetworkInterfaceId, Groups)
+        self.ec2.modify_network_interface_attribute = _modify
+
+        results = isolate(self.ec2, self.autoscaling, resolve_targets(self.ec2, ['i-0003', 'i-0005']), detach=False)
+        assert [r['Error'] for r in results] == ['UnauthorizedOperation', None]
+        assert self.autoscaling.calls == []
+
+    def test_isolate_reports_group_and_detach_failures(self):
+        """Test to make sure a quarantine group with rules or a failed Auto Scaling detach is reported against the instances it affects only"""
+        self.ec2.security_groups[0]['IpPermissionsEgress'] = [{'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '10.0.0.0/8'}]}]
+
+        def _detach(**kwargs):
+            raise RuntimeError('Throttling')
+        self.autoscaling.detach_instances = _detach
+
+        results = dict((r['InstanceId'], r) for r in isolate(self.ec2, self.autoscaling, resolve_targets(self.ec2, ['i-0001', 'i-0002', 'i-0003'])))
+        assert 'sg-existing' in results['i-0002']['Error'] and results['i-0002']['NetworkInterfaces'] == []
+        assert results['i-0001']['Error'] == 'Isolated, but not detached from its Auto Scaling group: Throttling'
+        assert results['i-0001']['NetworkInterfaces'] and results['i-0003']['Error'] is None
+        created = [g for g in self.ec2.security_groups if g['GroupId'] != 'sg-existing'][0]
+        assert created['IpPermissionsEgress'] == [] and self.ec2.call_count('revoke_security_group_egress') == 1
+
+    def test_run_isolation_across_accounts(self):
+        """Test to make sure each account/region resolves and isolates its own instances"""
+        other_ec2 = FakeEC2Client([_instance(50, 'vpc-9', tags=[('app', 'web')])])
+        clients = {('dev', 'us-west-2'): (self.ec2, self.autoscaling), ('prod', 'us-east-1'): (other_ec2, FakeAutoScalingClient({}))}
+        results = run_isolation(clients, tags=[('app', 'web')], case_id='IR-42')
+        assert [(key[0], result['InstanceId']) for key, result in results][-1] == ('prod', 'i-0050')
+        assert len(results) == 7
+
+        broken_ec2 = FakeEC2Client([])
+        broken_ec2.get_paginator = mock.Mock(side_effect=RuntimeError('AuthFailure'))
+        clients[('broken', 'us-west-2')] = (broken_ec2, FakeAutoScalingClient({}))
+        results = run_isolation(clients, tags=[('app', 'web')], case_id='IR-42')
+        assert len(results) == 8 and dict(results)[('broken', 'us-west-2')]['Error'] == 'AuthFailure'
+        assert sum(1 for _, result in results if result['InstanceId'] and not result['Error']) == 7
+
+    def test_isolate_command(self):
+        """Test to make sure the isolate command is wired into the top-level cli and reports per-instance results"""
+        clients = {('default', 'us-west-2'): (self.ec2, self.autoscaling)}
+        with mock.patch('ucsd_cloud_cli.sec.isolate.get_boto3_clients', side_effect=lambda name, keys: dict((key, clients[key][name == 'autoscaling']) for key in keys)), \
+                mock.patch('ucsd_cloud_cli.sec.isolate.get_profile_region_keys', return_value=sorted(clients)):
+            result = CliRunner().invoke(cli, ['isolate', '--case', 'IR-42', '-i', 'i-0001', '-e', 'eni-00020'])
+        assert result.exit_code == 0, result.output
+        assert 'i-0001' in result.output and 'i-0002' in result.output and 'web-asg' in result.output
+
+        result = CliRunner().invoke(cli, ['isolate', '--case', 'IR-42'])
+        assert result.exit_code != 0
+
+        broken_ec2 = FakeEC2Client([])
+        broken_ec2.get_paginator = mock.Mock(side_effect=RuntimeError('AuthFailure'))
+        clients[('prod', 'us-east-1')] = (broken_ec2, FakeAutoScalingClient({}))
+        with mock.patch('ucsd_cloud_cli.sec.isolate.get_boto3_clients', side_effect=lambda name, keys: dict((key, clients[key][name == 'autoscaling']) for key in keys)), \
+                mock.patch('ucsd_cloud_cli.sec.isolate.get_profile_region_keys', return_value=sorted(clients)):
+            result = CliRunner().invoke(cli, ['isolate', '--case', 'IR-43', '-i', 'i-0003'])
+        assert result.exit_code == 1 and 'i-0003' in result.output and 'AuthFailure' in result.output
+        assert 'targets could not be resolved or isolated in prod/us-east-1' in result.output
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+
+import io
+import json
+import shlex
+import unittest
+import zipfile
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.common import load_lambda_module
+from ucsd_cloud_cli.sec.response import build_policies, event_pattern, build_package, package_key, generate_template, AUTO, APPROVE, IGNORE
+from ucsd_cloud_cli.sec.replay import replay, sample_event, StandInEC2, StandInAutoScaling, _Context
+
+
+class TestSecResponse(unittest.TestCase):
+
+    def test_policy_order(self):
+        """Test to make sure ignore patterns are evaluated before auto and approve patterns, and defaults apply without any"""
+        policies = build_policies(['Backdoor:EC2/DenialOfService.*'], ['Backdoor:EC2/*'], ['Recon:EC2/*'], 5.0)
+        assert [p['action'] for p in policies] == [IGNORE, AUTO, APPROVE]
+        assert all(p['min_severity'] == 5.0 for p in policies)
+        assert build_policies()[0] == {'pattern': 'Backdoor:EC2/*', 'action': AUTO, 'min_severity': 7.0}
+
+    def test_event_pattern(self):
+        """Test to make sure prefix patterns are pushed into the EventBridge rule and other globs leave type filtering to the function"""
+        pattern = event_pattern(build_policies(['Recon:EC2/Portscan'], ['Backdoor:EC2/*'], ['Trojan:EC2/DNSDataExfiltration']))
+        assert pattern['detail']['type'] == [{'prefix': 'Backdoor:EC2/'}, 'Trojan:EC2/DNSDataExfiltration']
+        assert pattern['detail']['severity'] == [{'numeric': ['>=', 7.0]}]
+        assert 'type' not in event_pattern(build_policies(auto_patterns=['*:EC2/*']))['detail']
+
+    def test_template(self):
+        """Test to make sure the approval topic is only created when a policy needs approval and the function code comes from the package key"""
+        package = build_package()
+        resources = json.loads(generate_template(build_policies(auto_patterns=['Backdoor:EC2/*'])).to_json())['Resources']
+        assert 'ApprovalTopic' not in resources
+        assert set(['AutoIsolationFunction', 'GuardDutyFindingRule', 'AutoIsolationInvokePermission']) <= set(resources)
+
+        template = json.loads(generate_template(build_policies()).to_json())
+        assert 'ApprovalTopic' in template['Resources']
+        assert template['Parameters']['LambdaCodeKey']['Default'] == package_key(package)
+        assert template['Resources']['AutoIsolationFunction']['Properties']['Code'] == {'S3Bucket': {'Ref': 'LambdaCodeBucket'}, 'S3Key': {'Ref': 'LambdaCodeKey'}}
+
+    def test_package(self):
+        """Test to make sure the function package is reproducible and bundles the isolation and capture engines"""
+        package = build_package()
+        assert package == build_package()
+        assert sorted(zipfile.ZipFile(io.BytesIO(package)).namelist()) == ['auto_isolation.py', 'capture.py', 'quarantine.py']
+
+    def test_handler_dispatch(self):
+        """Test to make sure the handler isolates auto findings, asks for approval otherwise and isolates once approved"""
+        handler = load_lambda_module('auto_isolation.py')
+        event = sample_event('Recon:EC2/PortProbeUnprotectedPort', 8.0, asg='web-asg')
+        ec2, autoscaling = StandInEC2(event['detail']), StandInAutoScaling(event['detail'])
+        notified = []
+        policies = json.dumps(build_policies(auto_patterns=['Backdoor:EC2/*'], approve_patterns=['Recon:EC2/*']))
+        with mock.patch.dict('os.environ', {'POLICIES': policies}):
+            result = handler.handler(event, _Context(), clients=lambda *args: (ec2, autoscaling), notify=lambda finding, name: notified.append(name))
+            assert result['action'] == APPROVE and notified == ['AutoIsolationFunction'] and ec2.calls == 0
+
+            result = handler.handler({'source': handler.APPROVAL_SOURCE, 'detail': event['detail']}, _Context(), clients=lambda *args: (ec2, autoscaling))
+        assert result['action'] == AUTO and result['approved'] and not result['errors']
+        assert result['case'] == 'GD-%s' % event['detail']['id'] and len(result['snapshots']) == 1
+        assert all(eni['Groups'] == [{'GroupId': 'sg-quarantine0'}] for eni in ec2.instance['NetworkInterfaces'])
+        assert autoscaling.groups == {}
+
+        finding = dict(event['detail'], title="it's $(rm -rf ~) `id`")
+        command = shlex.split(handler.approval_command(finding, 'AutoIsolationFunction'))
+        assert command[:6] == ['aws', 'lambda', 'invoke', '--function-name', 'AutoIsolationFunction', '--cli-binary-format']
+        assert json.loads(command[command.index('--payload') + 1])['detail'] == finding and command[-1] == '/dev/stdout'
+
+    def test_replay_summary(self):
+        """Test to make sure the replay counts contained and pending findings and reports latency percentiles"""
+        events = [sample_event(t, 8.0, seed=i) for i, t in enumerate(['Backdoor:EC2/Spambot', 'Recon:EC2/Portscan', 'Stealth:IAMUser/CloudTrailLoggingDisabled'])]
+        results, summary = replay(events, build_policies(), api_latency=0, delivery_latency=1.0)
+        assert [r['action'] for r in results] == [AUTO, APPROVE, IGNORE]
+        assert summary['contained'] == 1 and summary['pending_approval'] == 1 and summary['errors'] == 0
+        assert results[0]['quarantined'] and summary['time_to_isolate']['p50'] >= 1.0
+
+        results, summary = replay(events, build_policies(), api_latency=0, approve_all=True, snapshot=False)
+        assert summary['contained'] == 2 and summary['pending_approval'] == 0
+
+    def test_replay_command(self):
+        """Test to make sure `response replay` runs synthetic findings and prints the latency summary"""
+        result = CliRunner().invoke(cli, ['response', 'replay', '--synthetic', '6', '--api-latency-ms', '0'])
+        assert result.exit_code == 0, result.output
+        assert 'events: 6' in result.output and 'time_to_isolate:' in result.output
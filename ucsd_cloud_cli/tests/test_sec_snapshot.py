@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.sec.capture import capture, wait_for_snapshots, snapshot_instance, TAG_PREFIX, MAX_FILTER_VALUES
+from ucsd_cloud_cli.sec.snapshot import run_capture, wait_for_capture
+from .fakes import FakeEC2Client, FakeClientError
+
+
+def _instance(index, volumes=2, tags=()):
+    return {'InstanceId': 'i-%04d' % index,
+            'VpcId': 'vpc-1',
+            'Tags': [{'Key': k, 'Value': v} for k, v in tags],
+            'BlockDeviceMappings': [{'DeviceName': '/dev/xvd%s' % 'abcdefgh'[n], 'Ebs': {'VolumeId': 'vol-%04d%d' % (index, n)}} for n in range(volumes)]}
+
+
+class TestSecSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2 = FakeEC2Client([_instance(i, volumes=1 + i % 3, tags=[('app', 'web')]) for i in range(150)], polls_to_complete=3)
+        self.instances = dict((i, self.ec2.instances[i]) for i in sorted(self.ec2.instances))
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def test_multi_volume_snapshot(self):
+        """Test to make sure one CreateSnapshots call covers every volume of an instance and records the device each came from"""
+        records = snapshot_instance(self.ec2, self.instances['i-0002'], 'IR-42', 'tester')
+        assert self.ec2.call_count('create_snapshots') == 1 and self.ec2.call_count('create_snapshot') == 0
+        assert [(r['VolumeId'], r['DeviceName']) for r in records] == [('vol-00020', '/dev/xvda'), ('vol-00021', '/dev/xvdb'), ('vol-00022', '/dev/xvdc')]
+        assert self.ec2.tags[records[0]['SnapshotId']][TAG_PREFIX + 'case'] == 'IR-42'
+        assert self.ec2.tags[records[0]['SnapshotId']][TAG_PREFIX + 'instance'] == 'i-0002'
+
+    def test_single_volume_fallback(self):
+        """Test to make sure volumes are snapshot one by one where multi-volume snapshots aren't available"""
+        self.ec2.multi_volume = False
+        records = snapshot_instance(self.ec2, self.instances['i-0002'], 'IR-42')
+        assert self.ec2.call_count('create_snapshot') == 3 and len(records) == 3
+
+        self.ec2.create_snapshots = mock.Mock(side_effect=FakeClientError('RequestLimitExceeded', 'CreateSnapshots'))
+        self.assertRaises(FakeClientError, snapshot_instance, self.ec2, self.instances['i-0002'], 'IR-42')
+        assert self.ec2.call_count('create_snapshot') == 3
+
+    def test_batched_progress_polling(self):
+        """Test to make sure progress is tracked with one DescribeSnapshots per 200 snapshots per poll rather than one call per snapshot"""
+        snapshots, errors = capture(self.ec2, self.instances, 'IR-42')
+        assert len(snapshots) == 300 and errors == {}
+
+        progress = []
+        assert wait_for_snapshots(self.ec2, snapshots, on_progress=lambda records: progress.append(sum(r['State'] == 'completed' for r in records)),
+                                  sleep=lambda seconds: None)
+        assert progress == [0, 0, 300]
+        assert self.ec2.call_count('describe_snapshots') == 3 * ((len(snapshots) + MAX_FILTER_VALUES - 1) // MAX_FILTER_VALUES)
+        assert all(r['CompletionTime'] and r['Progress'] == '100%' for r in snapshots)
+
+    def test_wait_timeout(self):
+        """Test to make sure waiting gives up after the timeout"""
+        snapshots, _ = capture(self.ec2, {'i-0001': self.instances['i-0001']}, 'IR-42')
+        assert not wait_for_snapshots(self.ec2, snapshots, timeout=0, sleep=lambda seconds: None)
+        assert snapshots[0]['State'] == 'pending'
+
+    def test_capture_across_accounts(self):
+        """Test to make sure each account/region's snapshots are labelled and polled with that account/region's client"""
+        other = FakeEC2Client([_instance(900, tags=[('app', 'web')])])
+        clients = {('dev', 'us-west-2'): self.ec2, ('prod', 'us-east-1'): other}
+        snapshots, errors = run_capture(clients, tags=[('app', 'web')], case_id='IR-42')
+        assert len(snapshots[('dev', 'us-west-2')]) == 300 and [r['Region'] for r in snapshots[('prod', 'us-east-1')]] == ['us-east-1'] * 2
+        assert wait_for_capture(clients, snapshots, sleep=lambda seconds: None)
+        assert other.call_count('describe_snapshots') == 2
+
+        broken = FakeEC2Client([])
+        broken.get_paginator = mock.Mock(side_effect=RuntimeError('UnauthorizedOperation'))
+        clients[('broken', 'us-west-2')] = broken
+        snapshots, errors = run_capture(clients, tags=[('app', 'web')], case_id='IR-42')
+        assert sorted(snapshots) == [('dev', 'us-west-2'), ('prod', 'us-east-1')] and errors == {'broken/us-west-2': 'UnauthorizedOperation'}
+
+    def test_create_command_writes_manifest(self):
+        """Test to make sure `snapshot create` waits for completion and writes a manifest with start and completion times"""
+        manifest_path = os.path.join(self.work_dir, 'manifest.json')
+        with mock.patch('ucsd_cloud_cli.sec.snapshot.get_boto3_clients', return_value={('default', 'us-west-2'): self.ec2}):
+            result = CliRunner().invoke(cli, ['snapshot', 'create', '--case', 'IR-42', '-i', 'i-0001', '-i', 'i-0002', '-m', manifest_path, '--poll-interval', '0'])
+        assert result.exit_code == 0, result.output
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert manifest['Case'] == 'IR-42' and len(manifest['Snapshots']) == 5
+        assert all(s['StartTime'] and s['CompletionTime'] and s['State'] == 'completed' for s in manifest['Snapshots'])
+
+        broken = FakeEC2Client([])
+        broken.get_paginator = mock.Mock(side_effect=RuntimeError('UnauthorizedOperation'))
+        clients = {('default', 'us-west-2'): self.ec2, ('prod', 'us-east-1'): broken}
+        with mock.patch('ucsd_cloud_cli.sec.snapshot.get_boto3_clients', return_value=clients):
+            result = CliRunner().invoke(cli, ['snapshot', 'create', '--case', 'IR-43', '-i', 'i-0001', '-m', manifest_path, '--no-wait'])
+        assert result.exit_code == 1 and 'FAILED prod/us-east-1: UnauthorizedOperation' in result.output
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert len(manifest['Snapshots']) == 2 and manifest['Errors'] == {'prod/us-east-1': 'UnauthorizedOperation'}
@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from click.testing import CliRunner
+
+from ucsd_cloud_cli import cli, VERSION
+from ucsd_cloud_cli.client import forward, request, connection, environment, forwardable, token_path, TOKEN_HEADER
+from ucsd_cloud_cli.logs.source import source_template
+from ucsd_cloud_cli.server import Daemon, TemplateCache, make_server, run_command
+from ucsd_cloud_cli.validator import template_json
+
+TARGET = {'generator': 'target', 'options': {'account_list': ['802640662990'], 'region_list': ['us-west-2']}}
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.daemon = Daemon()
+
+    def run_body(self, args):
+        return {'args': args, 'cwd': os.getcwd(), 'version': VERSION, 'environment': environment()}
+
+    def template_file(self, name, template):
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'w') as f:
+            json.dump(template, f)
+        return path
+
+    def test_render(self):
+        """Test to make sure templates render as the generators write them and are cached by builder and options"""
+        status, response = self.daemon.handle('POST', '/render', {'generator': 'source'})
+        assert (status, response['Cached'], response['Template']) == (200, False, template_json(source_template()))
+        assert self.daemon.handle('POST', '/render', {'generator': 'source', 'options': {}})[1]['Cached']
+        assert not self.daemon.handle('POST', '/render', TARGET)[1]['Cached']
+
+        assert self.daemon.handle('POST', '/render', {'generator': 'missing'})[0] == 400
+        status, response = self.daemon.handle('POST', '/render', {'generator': 'target', 'options': {'account_lst': []}})
+        assert status == 400 and 'account_lst' in response['Error']
+        assert self.daemon.handle('GET', '/render', None)[0] == 404
+        health = self.daemon.handle('GET', '/health', None)[1]
+        assert health['Requests']['/render'] == 5 and health['Cache']['Hits'] == 1 and health['Version'] == VERSION
+
+        cache = TemplateCache(2)
+        for key in ['a', 'b', 'a', 'c']:
+            cache.put(key, key)
+        assert list(cache.entries) == ['a', 'c']
+
+    def test_validate_diff(self):
+        """Test to make sure templates are validated and diffed whether passed as JSON, objects or render requests"""
+        assert self.daemon.handle('POST', '/validate', {'template': TARGET})[1] == {'Errors': []}
+        broken = json.loads(template_json(source_template()))
+        broken['Resources']['SecurityLogShippingFilter']['Properties']['LogGroupName'] = {'Ref': 'Missing'}
+        assert self.daemon.handle('POST', '/validate', {'template': json.dumps(broken)})[1]['Errors']
+        assert self.daemon.handle('POST', '/validate', {'template': '{'})[0] == 400
+
+        other = dict(TARGET, options=dict(TARGET['options'], account_list=['802640662990', '969379222189']))
+        response = self.daemon.handle('POST', '/diff', {'template': other, 'against': TARGET})[1]
+        assert 'LogDeliveryBucketPolicy' in response['Diff']['Modify'] and response['Changes']['Add'] == []
+        assert self.daemon.handle('POST', '/diff', {'template': TARGET, 'against': TARGET})[1]['Diff'] is None
+        assert self.daemon.handle('POST', '/diff', {'template': TARGET})[0] == 400
+
+    def test_run(self):
+        """Test to make sure commands run with their output captured per thread, and only when they'd do the same as a local run"""
+        files = [self.template_file('template%d.json' % n, json.loads(template_json(source_template()))) for n in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda path: self.daemon.handle('POST', '/run', self.run_body(['validate', path]))[1], files))
+        for path, result in zip(files, results):
+            assert result['ExitCode'] == 0 and result['Stdout'].count('OK') == 1 and path in result['Stdout']
+
+        result = self.daemon.handle('POST', '/run', self.run_body(['validate', '--nope']))[1]
+        assert result['ExitCode'] == 2 and 'no such option' in result['Stderr']
+        assert run_command(['pipeline', 'simulate', '--failure-rate', '2'])[0] == 2
+
+        assert self.daemon.handle('POST', '/run', dict(self.run_body(['validate']), cwd=self.work_dir))[0] == 409
+        assert self.daemon.handle('POST', '/run', dict(self.run_body(['validate']), environment={'AWS_PROFILE': 'prod'}))[0] == 409
+        assert self.daemon.handle('POST', '/run', self.run_body(['serve']))[0] == 409
+        assert self.daemon.handle('POST', '/run', self.run_body('validate'))[0] == 400
+        assert self.daemon.handle('POST', '/run', self.run_body(['response', 'replay', '--events', '1']))[0] == 409
+        assert not forwardable(['--profile', 'validate']) and forwardable(['status', '--profile', 'x']) is True
+        assert not forwardable(['kinesis', 'simulate']) and not forwardable(['firehose', 'bench']) and forwardable(['kinesis', 'policy'])
+        assert self.daemon.handle('POST', '/run', self.run_body(['status', '--target-stack', 'seim', '--watch', '5', '--count', '0']))[0] == 409
+        assert not forwardable(['status', '--watch=5']) and forwardable(['status', '--target-stack', 'seim'])
+
+    def test_client(self):
+        """Test to make sure the thin client forwards commands to a daemon on a Unix socket, and leaves them to run locally when it can't"""
+        socket_path = os.path.join(self.work_dir, 'serve.sock')
+        server = make_server(self.daemon, socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        address = 'unix://' + socket_path
+        assert oct(os.stat(socket_path).st_mode & 0o777) == oct(0o600)
+        self.assertRaises(ValueError, make_server, self.daemon, socket_path)
+
+        template_file = self.template_file('source.json', json.loads(template_json(source_template())))
+        exit_code, stdout, stderr = forward(['validate', template_file], address)
+        assert exit_code == 0 and 'OK     %s' % template_file in stdout
+        assert forward(['validate', '--nope'], address)[0] == 2
+        assert request(address, 'GET', '/health')[1]['Requests']['/run'] == 2
+
+        assert forward(['serve'], address) is None
+        assert forward(['firehose', 'bench', '--synthetic', '1'], address) is None
+        assert forward(['validate'], 'unix://' + os.path.join(self.work_dir, 'missing.sock')) is None
+        with mock.patch('ucsd_cloud_cli.VERSION', '0.0.1'):
+            assert forward(['validate'], address) is None
+        with mock.patch.dict(os.environ, {'CCLI_SERVER': 'off'}):
+            assert forward(['validate']) is None
+
+    def test_token(self):
+        """Test to make sure the daemon only answers requests with its token and a loopback Host, over a Unix socket or TCP"""
+        socket_path = os.path.join(self.work_dir, 'serve.sock')
+        with mock.patch('ucsd_cloud_cli.client.DEFAULT_SOCKET', socket_path):
+            servers = [make_server(self.daemon, socket_path), make_server(self.daemon, port=0)]
+            addresses = ['unix://' + socket_path, 'http://127.0.0.1:%d' % servers[1].server_address[1]]
+            assert [server.token_path for server in servers] == [token_path(address) for address in addresses]
+            assert os.path.dirname(servers[1].token_path) == self.work_dir
+            for server in servers:
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                self.addCleanup(thread.join)
+                self.addCleanup(server.server_close)
+                self.addCleanup(server.shutdown)
+                assert oct(os.stat(server.token_path).st_mode & 0o777) == oct(0o600)
+
+            for server, address in zip(servers, addresses):
+                assert request(address, 'GET', '/health')[0] == 200
+                for headers in [{}, {TOKEN_HEADER: 'guess'}, {TOKEN_HEADER: server.token, 'Host': 'attacker.example:8765'}]:
+                    conn = connection(address)
+                    try:
+                        conn.request('POST', '/run', json.dumps(self.run_body(['validate'])), dict({'Content-Type': 'text/plain'}, **headers))
+                        assert conn.getresponse().status == 403, headers
+                    finally:
+                        conn.close()
+
+            assert forward(['validate', '--nope'], addresses[1])[0] == 2
+            os.unlink(servers[1].token_path)
+            assert forward(['validate', '--nope'], addresses[1]) is None
+
+    def test_serve_command(self):
+        """Test to make sure `serve` replaces a socket left behind, warms the cache and removes its socket when stopped"""
+        self.addCleanup(signal.signal, signal.SIGTERM, signal.getsignal(signal.SIGTERM))
+        socket_path = os.path.join(self.work_dir, 'serve.sock')
+        open(socket_path, 'w').close()
+        with mock.patch('ucsd_cloud_cli.server.ThreadingUnixHTTPServer.serve_forever', side_effect=KeyboardInterrupt) as serve_forever:
+            result = CliRunner().invoke(cli, ['serve', '--socket', socket_path])
+        assert result.exit_code == 0, result.output
+        assert 'Serving ccli %s on unix://%s' % (VERSION, socket_path) in result.output and serve_forever.call_count == 1
+        assert not os.path.exists(socket_path) and not os.path.exists(token_path(socket_path))
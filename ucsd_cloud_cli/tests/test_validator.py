@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from click.testing import CliRunner
+
+from troposphere import Template
+import troposphere.sqs as sqs
+
+from ucsd_cloud_cli import cli
+from ucsd_cloud_cli.common import serialize_template, validate_tempalte
+from ucsd_cloud_cli.logs.target import target_template
+from ucsd_cloud_cli.validator import validate, check, template_json, ValidationError
+
+TEMPLATE = {'AWSTemplateFormatVersion': '2010-09-09',
+            'Parameters': {'AccountId': {'Type': 'String', 'AllowedPattern': '[0-9]{12}', 'Default': '802640662990'},
+                           'Retention': {'Type': 'Number', 'MinValue': 1, 'MaxValue': 14, 'Default': 1},
+                           'Enabled': {'Type': 'String', 'AllowedValues': ['true', 'false'], 'Default': 'true'}},
+            'Conditions': {'IsEnabled': {'Fn::Equals': [{'Ref': 'Enabled'}, 'true']}},
+            'Resources': {'Queue': {'Type': 'AWS::SQS::Queue', 'Properties': {'VisibilityTimeout': 60}},
+                          'Bucket': {'Type': 'AWS::S3::Bucket', 'DependsOn': 'Queue',
+                                     'Properties': {'NotificationConfiguration': {'QueueConfigurations': [
+                                         {'Event': 's3:ObjectCreated:*', 'Queue': {'Fn::GetAtt': ['Queue', 'Arn']}}]}}},
+                          'Group': {'Type': 'AWS::Logs::LogGroup', 'Condition': 'IsEnabled',
+                                    'Properties': {'RetentionInDays': {'Ref': 'Retention'},
+                                                   'LogGroupName': {'Fn::Sub': '${AWS::StackName}-${Bucket}-${Queue.QueueName}'}}}},
+            'Outputs': {'BucketArn': {'Value': {'Fn::GetAtt': ['Bucket', 'Arn']}}}}
+
+
+class TestValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.template = copy.deepcopy(TEMPLATE)
+
+    def test_valid_template(self):
+        """Test to make sure a template using refs, attributes, conditions and Fn::Sub passes cleanly"""
+        assert validate(self.template) == []
+
+    def test_unresolved_targets(self):
+        """Test to make sure Ref, GetAtt, Sub, DependsOn and Condition targets that don't exist are reported"""
+        resources = self.template['Resources']
+        resources['Bucket']['DependsOn'] = ['Queue', 'Missing']
+        resources['Queue']['Properties']['QueueName'] = {'Ref': 'Nope'}
+        resources['Group']['Properties']['LogGroupName'] = {'Fn::Sub': '${Queue.Url}'}
+        resources['Group']['Condition'] = 'IsDisabled'
+        self.template['Outputs']['BucketArn']['Value'] = {'Fn::GetAtt': ['Bucket2', 'Arn']}
+        errors = validate(self.template)
+        assert errors == ['Resources.Bucket.DependsOn: unknown resource Missing',
+                          'Resources.Group: Condition IsDisabled is not defined',
+                          'Resources.Group.Properties.LogGroupName.Fn::Sub: AWS::SQS::Queue has no attribute Url',
+                          'Resources.Queue.Properties.QueueName.Ref: Ref to unknown parameter or resource Nope',
+                          'Outputs.BucketArn.Value.Fn::GetAtt: Fn::GetAtt on unknown resource Bucket2'], errors
+
+    def test_parameter_defaults(self):
+        """Test to make sure defaults are checked against AllowedPattern, AllowedValues and numeric bounds"""
+        parameters = self.template['Parameters']
+        parameters['AccountId']['Default'] = '80264066299'
+        parameters['Retention']['Default'] = 30
+        parameters['Enabled']['Default'] = 'yes'
+        parameters['Bad'] = {'Type': 'Strng'}
+        assert validate(self.template) == ["Parameters.AccountId: Default '80264066299' does not match AllowedPattern [0-9]{12}",
+                                           'Parameters.Bad: invalid Type Strng',
+                                           "Parameters.Enabled: Default 'yes' is not one of the AllowedValues",
+                                           'Parameters.Retention: Default 30 is above MaxValue']
+
+    def test_property_types(self):
+        """Test to make sure unknown, missing and mistyped properties are reported against the resource specification"""
+        resources = self.template['Resources']
+        resources['Queue']['Properties'] = {'VisibilityTimeout': 'sixty', 'Bogus': 1}
+        resources['Bucket']['Properties']['NotificationConfiguration']['QueueConfigurations'][0].pop('Event')
+        resources['Role'] = {'Type': 'AWS::IAM::Role', 'Properties': {'Policies': {'PolicyName': 'x'}}}
+        resources['Thing'] = {'Type': 'AWS::Made::Up'}
+        errors = validate(self.template)
+        assert errors == ['Resources.Bucket.Properties.NotificationConfiguration.QueueConfigurations[0]: missing required property Event',
+                          'Resources.Queue.Properties: unknown property Bogus',
+                          "Resources.Queue.Properties.VisibilityTimeout: expected Integer, got 'sixty'",
+                          'Resources.Role.Properties: missing required property AssumeRolePolicyDocument',
+                          'Resources.Role.Properties.Policies: expected a list'], errors
+        assert validate(self.template, strict=True)[-1] == 'Resources.Thing: resource type AWS::Made::Up is not in the resource specification'
+
+    def test_cycles(self):
+        """Test to make sure dependency cycles through DependsOn and references are found"""
+        self.template['Resources']['Queue']['DependsOn'] = 'Group'
+        assert validate(self.template) == ['Resources: circular dependency Bucket -> Queue -> Group -> Bucket',
+                                           'Resources: circular dependency Queue -> Group -> Queue']
+
+    def test_size_limits(self):
+        """Test to make sure templates and policy documents too large for CloudFormation and the services are reported"""
+        accounts = ['%012d' % (100000000000 + n) for n in range(400)]
+        errors = validate(target_template(accounts))
+        assert [error.split(':')[0] for error in errors] == ['Resources.CWLtoKinesisDestination.Properties.DestinationPolicy',
+                                                             'Resources.LogDeliveryBucketPolicy.Properties.PolicyDocument'], errors
+        assert 'the limit is 20480' in errors[1] and validate(target_template(accounts), limits=False) == []
+        assert validate(target_template(accounts[:100])) == []
+        self.assertRaises(ValidationError, template_json, target_template(accounts))
+        assert template_json(target_template(accounts), limits=False)
+
+        self.template['Resources']['Queue']['Properties']['QueueName'] = 'q' * (1024 * 1024)
+        assert validate(self.template)[0].startswith('Template: 10') and validate(self.template, limits=False) == []
+
+    def test_template_json(self):
+        """Test to make sure generators get the same JSON as to_json() serialized with the template hashes and an exception listing the problems for a broken template"""
+        t = Template()
+        t.add_resource(sqs.Queue('Queue', VisibilityTimeout=60))
+        assert template_json(t) == json.dumps(serialize_template(json.loads(t.to_json())), indent=4, sort_keys=True, separators=(',', ': '))
+        assert validate_tempalte(template_json(t))
+        t.add_resource(sqs.QueuePolicy('Policy', PolicyDocument={}, Queues=['x'], DependsOn='Missing'))
+        with self.assertRaises(ValidationError) as context:
+            check(t)
+        assert context.exception.errors == ['Resources.Policy.DependsOn: unknown resource Missing']
+
+    def test_generated_templates(self):
+        """Test to make sure every generator's output validates, and quickly enough to check thousands per run"""
+        runner = CliRunner()
+        outputs = [runner.invoke(cli, args).output for args in [['target', 'generate', '--dry-run', '-a', '802640662990', '--glue-catalog', '--firehose-transform', '--flow-logs-to-s3'],
+                                                                ['source', 'generate', '--dry-run'],
+                                                                ['source', 'flow_log', '--dry-run', '--destination', 's3'],
+                                                                ['response', 'generate', '--dry-run']]]
+        templates = [json.loads(output) for output in outputs]
+        assert [validate(t, strict=True) for t in templates] == [[], [], [], []]
+        started = time.time()
+        for _ in range(250):
+            for t in templates:
+                validate(t)
+        assert time.time() - started < 10
+
+    def test_validate_command(self):
+        """Test to make sure `validate` lists the problems in each failing template and exits non-zero"""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        self.template['Resources']['Bucket']['DependsOn'] = 'Missing'
+        for name, body in [('good.json', TEMPLATE), ('bad.json', self.template)]:
+            with open(os.path.join(work_dir, name), 'w') as f:
+                json.dump(body, f)
+        result = CliRunner().invoke(cli, ['validate', os.path.join(work_dir, 'good.json'), os.path.join(work_dir, 'bad.json')])
+        assert result.exit_code == 1
+        assert 'OK     %s' % os.path.join(work_dir, 'good.json') in result.output
+        assert 'Resources.Bucket.DependsOn: unknown resource Missing' in result.output
+        assert CliRunner().invoke(cli, ['validate']).exit_code == 0
@@ -0,0 +1,497 @@
+"""In-memory CloudFormation template validator. Checks the template structure, that every Ref, Fn::GetAtt, Fn::Sub, DependsOn and Condition
+points at something that exists, parameter defaults against their constraints, resource properties against the CloudFormation resource
+specification, the template and policy document sizes against the service limits and the resource dependency graph for cycles. Templates are checked as plain dicts in one pass with the specification parsed once
+per process, so thousands of templates can be checked per test run."""
+import json
+import os
+import re
+
+from . import profiling
+from .common import data_dir, serialize_template
+
+SPEC_PATH = os.path.join(data_dir, 'cloudformation', 'spec', 'resource_specification.json')
+
+# Service limits, see https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/cloudformation-limits.html
+MAX_PARAMETERS = 200
+MAX_RESOURCES = 500
+MAX_OUTPUTS = 200
+MAX_MAPPINGS = 200
+MAX_DESCRIPTION_BYTES = 1024
+# template bodies passed by TemplateURL - the limit for TemplateBody is 51,200 bytes
+MAX_TEMPLATE_BYTES = 1024 * 1024
+# (resource type, property) -> most bytes the service accepts in the policy document, see each service's quotas
+MAX_POLICY_BYTES = {('AWS::S3::BucketPolicy', 'PolicyDocument'): 20 * 1024,
+                    ('AWS::Logs::Destination', 'DestinationPolicy'): 5120,
+                    ('AWS::IAM::ManagedPolicy', 'PolicyDocument'): 6144,
+                    ('AWS::IAM::Policy', 'PolicyDocument'): 10240,
+                    ('AWS::SNS::TopicPolicy', 'PolicyDocument'): 30 * 1024,
+                    ('AWS::KMS::Key', 'KeyPolicy'): 32 * 1024}
+
+TOP_LEVEL_KEYS = set(['AWSTemplateFormatVersion', 'Description', 'Metadata', 'Parameters', 'Mappings', 'Conditions', 'Transform', 'Resources', 'Outputs'])
+RESOURCE_KEYS = set(['Type', 'Properties', 'DependsOn', 'Metadata', 'Condition', 'DeletionPolicy', 'UpdatePolicy', 'CreationPolicy', 'UpdateReplacePolicy'])
+PARAMETER_KEYS = set(['Type', 'Default', 'AllowedValues', 'AllowedPattern', 'ConstraintDescription', 'Description', 'MaxLength', 'MinLength',
+                      'MaxValue', 'MinValue', 'NoEcho'])
+OUTPUT_KEYS = set(['Description', 'Value', 'Export', 'Condition'])
+PARAMETER_TYPES = set(['String', 'Number', 'List<Number>', 'CommaDelimitedList'])
+AWS_PARAMETER_TYPE = re.compile(r'^(List<)?AWS::(SSM::Parameter::(Name|Value<.+>)|[A-Za-z0-9]+::[A-Za-z0-9]+::[A-Za-z0-9]+)>?$')
+PSEUDO_PARAMETERS = set(['AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue', 'AWS::Partition', 'AWS::Region', 'AWS::StackId',
+                         'AWS::StackName', 'AWS::URLSuffix'])
+INTRINSIC_FUNCTIONS = set(['Ref', 'Fn::GetAtt', 'Fn::Sub', 'Fn::If', 'Fn::FindInMap', 'Fn::Join', 'Fn::Select', 'Fn::Split', 'Fn::GetAZs',
+                           'Fn::ImportValue', 'Fn::Base64', 'Fn::Cidr', 'Fn::Transform', 'Fn::And', 'Fn::Or', 'Fn::Not', 'Fn::Equals', 'Condition'])
+LOGICAL_ID = re.compile(r'^[A-Za-z0-9]+$')
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+INTEGER = re.compile(r'^-?\d+$')
+
+_specs = {}
+_patterns = {}
+
+
+class ValidationError(Exception):
+    """Raised by check() and template_json() with every problem found in the template"""
+    def __init__(self, errors):
+        super(ValidationError, self).__init__('%d problem(s) found in template:\n  %s' % (len(errors), '\n  '.join(errors)))
+        self.errors = errors
+
+
+def load_spec(path=SPEC_PATH):
+    """The CloudFormation resource specification, parsed once per process. Defaults to the subset bundled with the package, which covers the
+    resource types the generators produce - the full published specification can be used instead, it has the same format."""
+    if path not in _specs:
+        with open(path) as f:
+            _specs[path] = json.load(f)
+    return _specs[path]
+
+
+def _pattern(pattern):
+    if pattern not in _patterns:
+        _patterns[pattern] = re.compile('(?:%s)\\Z' % pattern)
+    return _patterns[pattern]
+
+
+def _intrinsic(value):
+    """Name of the intrinsic function `value` is a call to, or None"""
+    if isinstance(value, dict) and len(value) == 1:
+        key = next(iter(value))
+        if key in INTRINSIC_FUNCTIONS:
+            return key
+    return None
+
+
+def _size(value):
+    """Bytes a property value takes up once deployed - strings as they are, Fn::Join joined and documents as compact JSON. Other intrinsic
+    functions count as their own compact JSON, which is close to the length of the IDs and ARNs they resolve to."""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if _intrinsic(value) == 'Fn::Join' and isinstance(value['Fn::Join'], list) and len(value['Fn::Join']) == 2 and isinstance(value['Fn::Join'][1], list):
+        delimiter, parts = value['Fn::Join']
+        return sum(_size(part) for part in parts) + len(delimiter.encode('utf-8')) * max(0, len(parts) - 1)
+    return len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def _is_number(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class _Validator(object):
+
+    def __init__(self, template, spec, strict, limits=True):
+        self.template = template
+        self.spec = spec
+        self.strict = strict
+        self.limits = limits
+        self.errors = []
+        self.parameters = template.get('Parameters') or {}
+        self.resources = template.get('Resources') or {}
+        self.conditions = template.get('Conditions') or {}
+        self.mappings = template.get('Mappings') or {}
+        self.graph = dict((name, set()) for name in self.resources)
+        self.references = dict((name, set()) for name in self.resources)
+        self.depends_on = dict((name, []) for name in self.resources)
+
+    def error(self, path, message):
+        self.errors.append('%s: %s' % (path, message))
+
+    def run(self):
+        for key in sorted(set(self.template) - TOP_LEVEL_KEYS):
+            self.error(key, 'unknown top level section')
+        if self.template.get('AWSTemplateFormatVersion', '2010-09-09') != '2010-09-09':
+            self.error('AWSTemplateFormatVersion', 'must be 2010-09-09')
+        if len(self.template.get('Description', '').encode('utf-8')) > MAX_DESCRIPTION_BYTES:
+            self.error('Description', 'longer than %d bytes' % MAX_DESCRIPTION_BYTES)
+        if not self.resources:
+            self.error('Resources', 'at least one resource is required')
+        for section, limit in [('Parameters', MAX_PARAMETERS), ('Resources', MAX_RESOURCES), ('Outputs', MAX_OUTPUTS), ('Mappings', MAX_MAPPINGS)]:
+            if len(self.template.get(section) or {}) > limit:
+                self.error(section, '%d entries, the limit is %d' % (len(self.template[section]), limit))
+        template_bytes = _size(self.template) if self.limits else 0
+        if template_bytes > MAX_TEMPLATE_BYTES:
+            self.error('Template', '%d bytes as compact JSON, the limit is %d' % (template_bytes, MAX_TEMPLATE_BYTES))
+        for name in sorted(set(self.parameters) & set(self.resources)):
+            self.error('Resources.%s' % name, 'logical ID is also used by a parameter')
+
+        for name, parameter in sorted(self.parameters.items()):
+            self.check_parameter(name, parameter, 'Parameters.%s' % name)
+        for name, condition in sorted(self.conditions.items()):
+            self.refs(condition, 'Conditions.%s' % name, None)
+        for name, resource in sorted(self.resources.items()):
+            self.check_resource(name, resource, 'Resources.%s' % name)
+        for name, output in sorted((self.template.get('Outputs') or {}).items()):
+            self.check_output(name, output, 'Outputs.%s' % name)
+        self.check_cycles()
+        return self.errors
+
+    def check_parameter(self, name, parameter, path):
+        if not LOGICAL_ID.match(name):
+            self.error(path, 'logical ID must be alphanumeric')
+        for key in sorted(set(parameter) - PARAMETER_KEYS):
+            self.error(path, 'unknown attribute %s' % key)
+        parameter_type = parameter.get('Type')
+        if parameter_type not in PARAMETER_TYPES and not AWS_PARAMETER_TYPE.match(parameter_type or ''):
+            self.error(path, 'invalid Type %s' % parameter_type)
+            return
+        numeric = parameter_type in ('Number', 'List<Number>')
+        for key in ['MinValue', 'MaxValue']:
+            if key in parameter and (not numeric or not _is_number(parameter[key])):
+                self.error(path, '%s requires a Number parameter and a numeric value' % key)
+        for key in ['MinLength', 'MaxLength']:
+            if key in parameter and (parameter_type != 'String' or not INTEGER.match(str(parameter[key]))):
+                self.error(path, '%s requires a String parameter and an integer value' % key)
+        if 'AllowedPattern' in parameter:
+            try:
+                _pattern(parameter['AllowedPattern'])
+            except re.error as e:
+                self.error(path, 'AllowedPattern does not compile: %s' % e)
+                return
+        if 'Default' not in parameter:
+            return
+
+        default = parameter['Default']
+        values = str(default).split(',') if parameter_type.startswith('List<') or parameter_type == 'CommaDelimitedList' else [default]
+        for value in values:
+            text = str(value).lower() if isinstance(value, bool) else str(value)
+            if numeric and not _is_number(text):
+                self.error(path, 'Default %r is not a number' % value)
+                continue
+            if 'AllowedValues' in parameter and text not in [str(v).lower() if isinstance(v, bool) else str(v) for v in parameter['AllowedValues']]:
+                self.error(path, 'Default %r is not one of the AllowedValues' % value)
+            if 'AllowedPattern' in parameter and not _pattern(parameter['AllowedPattern']).match(text):
+                self.error(path, 'Default %r does not match AllowedPattern %s' % (value, parameter['AllowedPattern']))
+            if 'MinLength' in parameter and len(text) < int(parameter['MinLength']):
+                self.error(path, 'Default %r is shorter than MinLength' % value)
+            if 'MaxLength' in parameter and len(text) > int(parameter['MaxLength']):
+                self.error(path, 'Default %r is longer than MaxLength' % value)
+            if numeric and 'MinValue' in parameter and float(text) < float(parameter['MinValue']):
+                self.error(path, 'Default %r is below MinValue' % value)
+            if numeric and 'MaxValue' in parameter and float(text) > float(parameter['MaxValue']):
+                self.error(path, 'Default %r is above MaxValue' % value)
+
+    def check_resource(self, name, resource, path):
+        if not LOGICAL_ID.match(name):
+            self.error(path, 'logical ID must be alphanumeric')
+        if not isinstance(resource, dict) or 'Type' not in resource:
+            self.error(path, 'Type is required')
+            return
+        for key in sorted(set(resource) - RESOURCE_KEYS):
+            self.error(path, 'unknown attribute %s' % key)
+        if 'Condition' in resource and resource['Condition'] not in self.conditions:
+            self.error(path, 'Condition %s is not defined' % resource['Condition'])
+        if resource.get('DeletionPolicy', 'Delete') not in ('Delete', 'Retain', 'Snapshot'):
+            self.error(path, 'invalid DeletionPolicy %s' % resource['DeletionPolicy'])
+
+        depends_on = resource.get('DependsOn', [])
+        for target in [depends_on] if not isinstance(depends_on, list) else depends_on:
+            if target not in self.resources:
+                self.error(path + '.DependsOn', 'unknown resource %s' % target)
+            elif target == name:
+                self.error(path + '.DependsOn', 'resource depends on itself')
+            else:
+                self.graph[name].add(target)
+                self.depends_on[name].append(target)
+
+        properties = resource.get('Properties', {})
+        self.refs(properties, path + '.Properties', name)
+        resource_type = resource['Type']
+        if self.limits and isinstance(properties, dict):
+            for key in sorted(properties):
+                limit = MAX_POLICY_BYTES.get((resource_type, key))
+                if limit is not None and _size(properties[key]) > limit:
+                    self.error('%s.Properties.%s' % (path, key), '%d byte policy, the limit is %d' % (_size(properties[key]), limit))
+        if resource_type.startswith('Custom::') or resource_type == 'AWS::CloudFormation::CustomResource':
+            if 'ServiceToken' not in properties:
+                self.error(path + '.Properties', 'ServiceToken is required')
+            return
+        resource_spec = self.spec['ResourceTypes'].get(resource_type)
+        if resource_spec is None:
+            if self.strict:
+                self.error(path, 'resource type %s is not in the resource specification' % resource_type)
+            return
+        self.check_properties(properties, resource_spec, resource_type, path + '.Properties')
+
+    def check_properties(self, properties, definition, resource_type, path):
+        """Check a Properties block (or a property type's value) against its definition in the specification"""
+        if _intrinsic(properties):
+            return
+        if not isinstance(properties, dict):
+            self.error(path, 'expected an object')
+            return
+        specified = definition.get('Properties', {})
+        for key in sorted(set(properties) - set(specified)):
+            self.error(path, 'unknown property %s' % key)
+        for key, prop in sorted(specified.items()):
+            if key not in properties:
+                if prop.get('Required'):
+                    self.error(path, 'missing required property %s' % key)
+                continue
+            self.check_value(properties[key], prop, resource_type, '%s.%s' % (path, key))
+
+    def check_value(self, value, prop, resource_type, path):
+        if _intrinsic(value):
+            return
+        if 'PrimitiveType' in prop:
+            self.check_primitive(value, prop['PrimitiveType'], path)
+        elif prop.get('Type') in ('List', 'Map'):
+            if prop['Type'] == 'List' and not isinstance(value, list):
+                self.error(path, 'expected a list')
+                return
+            if prop['Type'] == 'Map' and not isinstance(value, dict):
+                self.error(path, 'expected a map')
+                return
+            items = enumerate(value) if isinstance(value, list) else sorted(value.items())
+            for index, item in items:
+                item_path = '%s[%s]' % (path, index)
+                if _intrinsic(item):
+                    continue
+                if 'PrimitiveItemType' in prop:
+                    self.check_primitive(item, prop['PrimitiveItemType'], item_path)
+                else:
+                    self.check_property_type(item, prop['ItemType'], resource_type, item_path)
+        elif 'Type' in prop:
+            self.check_property_type(value, prop['Type'], resource_type, path)
+
+    def check_property_type(self, value, type_name, resource_type, path):
+        definition = self.spec['PropertyTypes'].get('%s.%s' % (resource_type, type_name)) or self.spec['PropertyTypes'].get(type_name)
+        if definition is None:
+            if self.strict:
+                self.error(path, 'property type %s.%s is not in the resource specification' % (resource_type, type_name))
+            return
+        self.check_properties(value, definition, resource_type, path)
+
+    def check_primitive(self, value, primitive_type, path):
+        if primitive_type in ('String', 'Timestamp'):
+            valid = not isinstance(value, (dict, list))
+        elif primitive_type in ('Integer', 'Long'):
+            valid = not isinstance(value, bool) and (isinstance(value, int) or bool(INTEGER.match(str(value))))
+        elif primitive_type == 'Double':
+            valid = _is_number(value)
+        elif primitive_type == 'Boolean':
+            valid = isinstance(value, bool) or str(value).lower() in ('true', 'false')
+        elif primitive_type == 'Json':
+            valid = isinstance(value, (dict, str))
+        else:
+            valid = True
+        if not valid:
+            self.error(path, 'expected %s, got %r' % (primitive_type, value))
+
+    def check_output(self, name, output, path):
+        if not LOGICAL_ID.match(name):
+            self.error(path, 'logical ID must be alphanumeric')
+        for key in sorted(set(output) - OUTPUT_KEYS):
+            self.error(path, 'unknown attribute %s' % key)
+        if 'Value' not in output:
+            self.error(path, 'Value is required')
+        if 'Condition' in output and output['Condition'] not in self.conditions:
+            self.error(path, 'Condition %s is not defined' % output['Condition'])
+        self.refs(output.get('Value'), path + '.Value', None)
+        self.refs(output.get('Export'), path + '.Export', None)
+
+    def ref(self, target, path, owner):
+        if target in PSEUDO_PARAMETERS or target in self.parameters:
+            return
+        if target not in self.resources:
+            self.error(path, 'Ref to unknown parameter or resource %s' % target)
+        elif owner is not None:
+            if target == owner:
+                self.error(path, 'resource refers to itself')
+            else:
+                self.graph[owner].add(target)
+                self.references[owner].add(target)
+
+    def get_att(self, resource_name, attribute, path, owner):
+        if resource_name not in self.resources:
+            self.error(path, 'Fn::GetAtt on unknown resource %s' % resource_name)
+            return
+        if owner is not None:
+            if resource_name == owner:
+                self.error(path, 'resource refers to itself')
+            else:
+                self.graph[owner].add(resource_name)
+                self.references[owner].add(resource_name)
+        resource_spec = self.spec['ResourceTypes'].get(self.resources[resource_name].get('Type'))
+        if resource_spec is None or not isinstance(attribute, str):
+            return
+        attributes = resource_spec.get('Attributes', {})
+        if attribute not in attributes and not any(attribute.startswith(a + '.') for a in attributes):
+            self.error(path, '%s has no attribute %s' % (self.resources[resource_name]['Type'], attribute))
+
+    def refs(self, value, path, owner):
+        """Walk a value, checking the target of every intrinsic function in it and recording resource dependencies of `owner`"""
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                self.refs(item, '%s[%d]' % (path, index), owner)
+            return
+        if not isinstance(value, dict):
+            return
+        function = _intrinsic(value)
+        if function is None:
+            for key, item in value.items():
+                self.refs(item, '%s.%s' % (path, key), owner)
+            return
+
+        args = value[function]
+        path = '%s.%s' % (path, function)
+        if function == 'Ref':
+            if isinstance(args, str):
+                self.ref(args, path, owner)
+            else:
+                self.error(path, 'expected a logical ID')
+        elif function == 'Fn::GetAtt':
+            parts = args.split('.', 1) if isinstance(args, str) else args
+            if not isinstance(parts, list) or len(parts) != 2:
+                self.error(path, 'expected [resource, attribute]')
+            else:
+                self.get_att(parts[0], parts[1], path, owner)
+                self.refs(parts[1], path, owner)
+        elif function == 'Fn::Sub':
+            text, variables = (args, {}) if isinstance(args, str) else (args[0], args[1]) if isinstance(args, list) and len(args) == 2 else (None, None)
+            if not isinstance(text, str) or not isinstance(variables, dict):
+                self.error(path, 'expected a string or [string, variables]')
+                return
+            for variable in SUB_VARIABLE.findall(text):
+                if variable in variables:
+                    continue
+                if '.' in variable and variable not in PSEUDO_PARAMETERS:
+                    self.get_att(variable.split('.', 1)[0], variable.split('.', 1)[1], path, owner)
+                else:
+                    self.ref(variable, path, owner)
+            self.refs(variables, path, owner)
+        elif function in ('Fn::If', 'Condition'):
+            condition = args[0] if function == 'Fn::If' and isinstance(args, list) else args
+            if condition not in self.conditions:
+                self.error(path, 'Condition %s is not defined' % condition)
+            if function == 'Fn::If':
+                if not isinstance(args, list) or len(args) != 3:
+                    self.error(path, 'expected [condition, value if true, value if false]')
+                else:
+                    self.refs(args[1:], path, owner)
+        elif function == 'Fn::FindInMap':
+            if not isinstance(args, list) or len(args) != 3:
+                self.error(path, 'expected [map, top level key, second level key]')
+                return
+            if isinstance(args[0], str) and args[0] not in self.mappings:
+                self.error(path, 'Mapping %s is not defined' % args[0])
+            self.refs(args, path, owner)
+        else:
+            self.refs(args, path, owner)
+
+    def check_cycles(self):
+        """Depth-first search over the resource dependency graph, reporting each cycle found"""
+        state = {}
+        for root in sorted(self.graph):
+            if root in state:
+                continue
+            stack = [(root, iter(sorted(self.graph[root])))]
+            state[root] = 'open'
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    state[node] = 'done'
+                    stack.pop()
+                elif state.get(child) == 'open':
+                    cycle = [n for n, _ in stack][[n for n, _ in stack].index(child):] + [child]
+                    self.error('Resources', 'circular dependency %s' % ' -> '.join(cycle))
+                elif child not in state:
+                    state[child] = 'open'
+                    stack.append((child, iter(sorted(self.graph[child]))))
+
+    def redundant_depends_on(self):
+        """(resource, target) for each DependsOn entry that orders nothing - the target is already referenced by the resource or reachable
+        through its other dependencies. Only meaningful once the graph is known to be acyclic."""
+        descendants = {}
+
+        def reachable(node):
+            if node not in descendants:
+                descendants[node] = set()
+                for child in self.graph[node]:
+                    descendants[node].add(child)
+                    descendants[node].update(reachable(child))
+            return descendants[node]
+
+        redundant = []
+        for name in sorted(self.depends_on):
+            for target in self.depends_on[name]:
+                if target in self.references[name] or any(target in reachable(other) for other in self.graph[name] if other != target):
+                    redundant.append((name, target))
+        return redundant
+
+
+def _as_dict(template):
+    if hasattr(template, 'to_dict'):
+        return template.to_dict()
+    if isinstance(template, str):
+        return json.loads(template)
+    return template
+
+
+def validate(template, spec=None, strict=False, limits=True):
+    """Validate a template - a troposphere Template, a dict or a JSON string - and return the list of problems found, empty when it's valid.
+    Resource types missing from the specification are only reported with `strict`, template and policy sizes only with `limits`."""
+    template = _as_dict(template)
+    if not isinstance(template, dict):
+        return ['template must be a JSON object']
+    return _Validator(template, spec or load_spec(), strict, limits).run()
+
+
+def check(template, spec=None, strict=False):
+    """Validate a template, raising ValidationError with every problem found"""
+    errors = validate(template, spec, strict)
+    if errors:
+        raise ValidationError(errors)
+
+
+def dependency_graph(template, spec=None, limits=True):
+    """Resource dependencies of a valid template as (graph, types, depends_on, redundant) - every resource's dependencies, its type, its
+    DependsOn entries in template order and the DependsOn entries that order nothing. Raises ValidationError if the template has problems."""
+    template = _as_dict(template)
+    validator = _Validator(template, spec or load_spec(), False, limits)
+    errors = validator.run() if isinstance(template, dict) else ['template must be a JSON object']
+    if errors:
+        raise ValidationError(errors)
+    types = dict((name, resource['Type']) for name, resource in validator.resources.items())
+    return validator.graph, types, validator.depends_on, validator.redundant_depends_on()
+
+
+@profiling.timed(profiling.TEMPLATE_RENDER)
+def template_json(template, limits=True):
+    """Validate a troposphere Template and render it as Template.to_json() does, less any DependsOn entries that order nothing - the
+    generators use this in place of to_json() so a template that wouldn't deploy is never written out and stack creation isn't serialized
+    by edges CloudFormation already infers from references. The rendered template is serialized with its hashes (see serialize_template).
+    Without `limits` templates and policies too large to deploy are rendered too."""
+    template = template.to_dict()
+    redundant = dependency_graph(template, limits=limits)[3]
+    for name, target in redundant:
+        resource = template['Resources'][name]
+        if isinstance(resource['DependsOn'], list):
+            resource['DependsOn'].remove(target)
+        if not resource['DependsOn'] or resource['DependsOn'] == target:
+            del resource['DependsOn']
+    template = serialize_template(template)
+    return json.dumps(template, indent=4, sort_keys=True, separators=(',', ': '))